@@ -0,0 +1,87 @@
+"""
+Benchmark of the decimation of oversampled readout data.
+
+Compares the original scipy.signal.decimate call over the flattened stream with the engine in
+marge.marge_utils.utils for typical RARE and PETRA acquisition sizes.
+
+Usage:
+    python benchmarks/decimation.py [--repeat N] [--workers N]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import scipy.signal as sig
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from marge.marge_utils import utils
+
+# name: (number of ADC windows, readout points per window, oversampling factor, option)
+CASES = {
+    'RARE 2D 256x256': (256, 256 + 2 * 5, 5, 'Normal'),
+    'RARE 3D 120x120x30': (120 * 30, 120 + 2 * 5, 5, 'Normal'),
+    'PETRA 3D 20000 spokes': (20000, 60 + 2 * 10, 5, 'PETRA'),
+}
+
+
+def legacy_decimate(data_over, n_adc, option, add_rd_points, oversampling_factor):
+    # Previous implementation: Python loop for PETRA and FIR design on every call
+    if option == 'PETRA':
+        data_over = np.reshape(data_over, (n_adc, -1))
+        for line in range(n_adc):
+            data_over[line, 0:add_rd_points * oversampling_factor] = data_over[line, add_rd_points * oversampling_factor]
+        data_over = np.reshape(data_over, -1)
+    return sig.decimate(data_over[int((oversampling_factor - 1) / 2)::], oversampling_factor, ftype='fir',
+                        zero_phase=True)
+
+
+def timeit(function, repeat):
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - t0)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=3, help='Number of repetitions, the best time is reported')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Threads for the per-window engine')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    for name, (n_adc, n_rd, oversampling_factor, option) in CASES.items():
+        n_points = n_adc * n_rd * oversampling_factor
+        data_over = rng.standard_normal(n_points) + 1j * rng.standard_normal(n_points)
+        add_rd_points = 10 if option == 'PETRA' else 5
+        kwargs = dict(n_adc=n_adc, option=option, remove=False, add_rd_points=add_rd_points,
+                      oversampling_factor=oversampling_factor, decimation_factor=oversampling_factor)
+
+        variants = {
+            'legacy scipy.signal.decimate': lambda: legacy_decimate(data_over.copy(), n_adc, option, add_rd_points,
+                                                                   oversampling_factor),
+            'stream, cached taps': lambda: utils.decimate(data_over.copy(), **kwargs),
+            'per window': lambda: utils.decimate(data_over.copy(), per_window=True, **kwargs),
+            'per window, complex64': lambda: utils.decimate(data_over.copy(), per_window=True, dtype=np.complex64,
+                                                            **kwargs),
+            'per window, %i threads' % args.workers: lambda: utils.decimate(data_over.copy(), per_window=True,
+                                                                          workers=args.workers, **kwargs),
+        }
+
+        print("%s: %i windows x %i points (%.1f M samples)" % (name, n_adc, n_rd * oversampling_factor,
+                                                               n_points / 1e6))
+        reference = None
+        for label, function in variants.items():
+            t = timeit(function, args.repeat)
+            if reference is None:
+                reference = t
+            print("    %-32s %8.3f s  x%.1f" % (label, t, reference / t))
+
+
+if __name__ == '__main__':
+    main()
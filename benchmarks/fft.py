@@ -0,0 +1,81 @@
+"""
+Benchmark of the centered FFTs used by the reconstructions.
+
+Compares the original np.fft call with explicit fftshift/ifftshift copies with the FFT service in
+marge.marge_utils.fft for each available backend, on typical matrix sizes.
+
+Usage:
+    python benchmarks/fft.py [--repeat N] [--workers N] [--complex64]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from marge.configs import sys_config
+from marge.marge_utils import fft
+
+# name: (shape, axes)
+CASES = {
+    'RARE 2D 256x256': ((1, 256, 256), None),
+    'RARE 3D 120x120x30': ((30, 120, 120), None),
+    'GRE 3D 128x128x128': ((128, 128, 128), None),
+    'RARE 3D 256x256x64, 4 echoes': ((4, 64, 256, 256), (1, 2, 3)),
+    'Readout lines 3600x650': ((3600, 650), (1,)),
+}
+
+
+def timeit(function, repeat):
+    function()  # Warm up caches and plans
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - t0)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5, help='Number of repetitions, the best time is reported')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Threads for the multi-threaded backends')
+    parser.add_argument('--complex64', action='store_true', help='Use single precision data')
+    args = parser.parse_args()
+
+    backends = ['numpy', 'scipy'] + (['pyfftw'] if fft.pyfftw is not None else [])
+    dtype = np.complex64 if args.complex64 else np.complex128
+    rng = np.random.default_rng(0)
+    for name, (shape, axes) in CASES.items():
+        data = (rng.standard_normal(shape) + 1j * rng.standard_normal(shape)).astype(dtype)
+
+        variants = {
+            'np.fft with shift copies': lambda: np.fft.ifftshift(np.fft.ifftn(np.fft.fftshift(data, axes=axes),
+                                                                              axes=axes), axes=axes),
+        }
+        for backend in backends:
+            for workers in sorted({1, args.workers}):
+                if backend == 'numpy' and workers > 1:
+                    continue
+
+                def run(backend=backend, workers=workers):
+                    sys_config.fft_backend = backend
+                    return fft.centered_ifftn(data, axes=axes, workers=workers)
+
+                variants['%s, %i threads' % (backend, workers)] = run
+
+        print("%s: %s %s" % (name, 'x'.join(str(n) for n in shape), np.dtype(dtype).name))
+        reference = None
+        for label, function in variants.items():
+            t = timeit(function, args.repeat)
+            if reference is None:
+                reference = t
+            print("    %-32s %8.4f s  x%.1f" % (label, t, reference / t))
+
+
+if __name__ == '__main__':
+    main()
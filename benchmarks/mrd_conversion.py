@@ -0,0 +1,223 @@
+"""
+Throughput of the MRD conversion of the marge_tyger converters.
+
+Writes the k-space lines of a synthetic RARE raw data file to BinaryMrdWriter with the batched acquisitions of
+marge.marge_tyger.mrd_converter, for several batch sizes, and with the per-line generator the converters used before,
+which filled one mrd.Acquisition per line. The MB/s are the bytes of the MRD stream per second, and both streams must be
+identical. The stream is read back to the k-space with read_kspace, the fromMRDtoMAT3D direction, and checked against
+the raw data.
+
+Usage:
+    python benchmarks/mrd_conversion.py [--points RD PH SL] [--batch N [N ...]] [--noise N] [--repeat N] [--file]
+"""
+
+import argparse
+import io
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from marge.marge_tyger import mrd_converter
+
+mrd = mrd_converter.mrd
+
+
+def synthetic_mat(n_points, n_noise, rng):
+    # Values of a RARE raw data file, as scipy.io.loadmat returns them
+    n_rd, n_ph, n_sl = n_points
+    k = np.stack(np.meshgrid(np.arange(n_rd), np.arange(n_ph), np.arange(n_sl), indexing='ij'), -1)
+    k = k.transpose(2, 1, 0, 3).reshape(-1, 3) - np.array(n_points) // 2
+    signal = rng.standard_normal(len(k)) + 1j * rng.standard_normal(len(k))
+    return {
+        'sampledCartesian': np.column_stack([k, signal]),
+        'axesOrientation': np.array([[2, 0, 1]]),
+        'nPoints': np.array([n_points]),
+        'fov': np.array([[12.0, 12.0, 12.0]]),
+        'dfov': np.array([[0.0, 0.0, 0.0]]),
+        'acqTime': np.array([[4.0]]),
+        'bw_MHz': np.array([[0.032]]),
+        'rdGradAmplitude': np.array([[0.3]]),
+        'data_noise': rng.standard_normal((n_noise, n_rd)) + 1j * rng.standard_normal((n_noise, n_rd)),
+        'nNoise': np.array([[n_noise]]),
+    }
+
+
+def per_line_stream(raw, kspace, n_noise):
+    # Acquisitions of the previous converters: full-size trajectory arrays, and one mrd.Acquisition filled and
+    # yielded for every noise acquisition and k-space line
+    n_sl, n_ph, n_rd = kspace.shape
+    n_points, inverse_axes = raw.n_points, raw.inverse_axes
+    k_trajectory = np.real(raw.sampled[:, 0:3]).astype(np.float32)[:, inverse_axes]
+    fov_adq = [int(x) for x in raw.fov[raw.axes].astype(np.float32)]
+    positions = [np.linspace(-fov / 2, fov / 2, n, endpoint=False) for fov, n in zip(fov_adq, n_points)]
+    ph_full, sl_full, rd_full = np.meshgrid(positions[1], positions[2], positions[0])
+    xyz = np.concatenate([rd_full.reshape(-1, 1), ph_full.reshape(-1, 1), sl_full.reshape(-1, 1)], axis=1)
+    xyz = xyz[:, inverse_axes]
+    rd_times = np.linspace(-raw.acq_time / 2, raw.acq_time / 2, num=n_rd).reshape(n_rd)
+    trajectory = [np.reshape(k_trajectory[:, axis], kspace.shape) for axis in range(3)] + [rd_times] + \
+                 [np.reshape(xyz[:, axis], kspace.shape) for axis in range(3)]
+    dwell = raw.dwell
+    data_noise = raw.noise()
+    for n in range(n_noise):
+        noise = mrd.Acquisition()
+        noise.data.resize((1, n_rd))
+        noise.trajectory.resize((0, 0))
+        noise.head.center_sample = round(n_rd / 2)
+        noise.head.scan_counter = n
+        noise.head.sample_time_ns = int(dwell)
+        noise.head.acquisition_time_stamp_ns = int(n * 2.5 * 1e3)
+        noise.head.physiology_time_stamp_ns = [int(2.5 * n * 1e3), 0, 0]
+        noise.head.channel_order = [0]
+        noise.head.flags = mrd.AcquisitionFlags(0)
+        noise.head.flags |= mrd.AcquisitionFlags.IS_NOISE_MEASUREMENT
+        noise.head.idx.kspace_encode_step_1 = n
+        noise.head.idx.kspace_encode_step_2 = 0
+        noise.head.idx.slice = 0
+        noise.head.idx.repetition = 0
+        noise.head.idx.average = 0
+        noise.head.idx.phase = 0
+        noise.head.idx.set = 0
+        noise.head.idx.contrast = 0
+        noise.head.idx.segment = 0
+        noise.data[:] = data_noise[n, :]
+        yield mrd.StreamItem.Acquisition(noise)
+
+    acq = mrd.Acquisition()
+    acq.data.resize((1, n_rd))
+    acq.trajectory.resize((7, n_rd))
+    for s in range(n_sl):
+        for line in range(n_ph):
+            num = line + s * n_ph
+            acq.head.flags = mrd.AcquisitionFlags(0)
+            if line == 0:
+                acq.head.flags |= mrd.AcquisitionFlags.FIRST_IN_ENCODE_STEP_1
+                acq.head.flags |= mrd.AcquisitionFlags.FIRST_IN_SLICE
+                acq.head.flags |= mrd.AcquisitionFlags.FIRST_IN_REPETITION
+            if line == n_ph - 1:
+                acq.head.flags |= mrd.AcquisitionFlags.LAST_IN_ENCODE_STEP_1
+                acq.head.flags |= mrd.AcquisitionFlags.LAST_IN_SLICE
+                acq.head.flags |= mrd.AcquisitionFlags.LAST_IN_REPETITION
+            acq.head.scan_counter = num + n_noise
+            acq.head.acquisition_time_stamp_ns = int(num * 2 * 1e9)
+            acq.head.physiology_time_stamp_ns = [int(2.5 * num * 1e9), 0, 0]
+            acq.head.channel_order = [0]
+            acq.head.discard_pre = 0
+            acq.head.discard_post = 0
+            acq.head.center_sample = round(n_rd / 2)
+            acq.head.sample_time_ns = int(dwell)
+            acq.head.idx.kspace_encode_step_1 = line
+            acq.head.idx.kspace_encode_step_2 = s
+            acq.head.idx.slice = 0
+            acq.head.idx.repetition = 0
+            acq.head.idx.average = 0
+            acq.head.idx.phase = 0
+            acq.head.idx.set = 0
+            acq.head.idx.contrast = 0
+            acq.head.idx.segment = 0
+            acq.data[:] = kspace[s, line]
+            for row, values in enumerate(trajectory):
+                acq.trajectory[row, :] = values if row == 3 else values[s, line]
+            yield mrd.StreamItem.Acquisition(acq)
+
+
+def write_stream(output, header, acquisitions):
+    with mrd.BinaryMrdWriter(output) as writer:
+        writer.write_header(header)
+        writer.write_data(acquisitions)
+
+
+def peak_memory(write):
+    # Peak memory allocated while writing the stream, without the stream itself
+    output = io.BytesIO()
+    tracemalloc.start()
+    write(output)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak - output.getbuffer().nbytes
+
+
+def measure(write, repeat, to_file):
+    # Best time of writing the stream to memory or to a temporary file, and its size
+    times = []
+    for _ in range(repeat):
+        if to_file:
+            with tempfile.TemporaryFile() as output:
+                t0 = time.perf_counter()
+                write(output)
+                output.flush()
+                os.fsync(output.fileno())
+                times.append(time.perf_counter() - t0)
+                size = output.tell()
+        else:
+            output = io.BytesIO()
+            t0 = time.perf_counter()
+            write(output)
+            times.append(time.perf_counter() - t0)
+            size = output.tell()
+    return min(times), size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--points', type=int, nargs=3, default=[256, 256, 32], help='Readout, phase and slice points')
+    parser.add_argument('--batch', type=int, nargs='+', default=[1, 8, 32, 256], help='Acquisitions per batch')
+    parser.add_argument('--noise', type=int, default=64, help='Noise acquisitions written before the k-space')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of repetitions, the best time is reported')
+    parser.add_argument('--file', action='store_true', help='Write to a temporary file instead of memory')
+    args = parser.parse_args()
+
+    mat_data = synthetic_mat(args.points, args.noise, np.random.default_rng(0))
+    raw = mrd_converter.RareRawData(mat_data)
+    kspace = raw.kspace()
+    trajectory = raw.trajectory()
+    data_noise = raw.noise()
+    header = mrd.Header()
+    header.acquisition_system_information = mrd_converter.system_information()
+    header.encoding.append(mrd_converter.encoding(raw.n_xyz, [int(x) for x in raw.fov], limits=raw.n_sig))
+
+    print("RARE %i x %i x %i, %i k-space lines and %i noise acquisitions, written to %s" % (
+        *args.points, kspace.shape[0] * kspace.shape[1], args.noise, 'a file' if args.file else 'memory'))
+
+    def per_line(output):
+        write_stream(output, header, per_line_stream(raw, kspace, args.noise))
+
+    t, size = measure(per_line, args.repeat, args.file)
+    print("    %-22s %8.3f s  %8.1f MB/s  %7.1f MB peak memory" % ('per-line generator', t, size / 1e6 / t,
+                                                                   peak_memory(per_line) / 1e6))
+    reference = io.BytesIO()
+    per_line(reference)
+
+    stream = None
+    for batch_size in args.batch:
+        mrd_converter.BATCH_ACQUISITIONS = batch_size
+
+        def batched(output):
+            mrd_converter.write_mrd(output, header, mrd_converter.noise_batches(data_noise, raw.dwell),
+                                    mrd_converter.rare_batches(kspace, trajectory, dwell=raw.dwell,
+                                                               n_noise=args.noise))
+
+        t, size = measure(batched, args.repeat, args.file)
+        print("    %-22s %8.3f s  %8.1f MB/s  %7.1f MB peak memory" % ('batches of %i' % batch_size, t,
+                                                                       size / 1e6 / t, peak_memory(batched) / 1e6))
+        stream = io.BytesIO()
+        batched(stream)
+        if stream.getvalue() != reference.getvalue():
+            print("ERROR: the stream of batches of %i differs from the per-line stream" % batch_size)
+
+    stream.seek(0)
+    t0 = time.perf_counter()
+    _, kspace_read = mrd_converter.read_kspace(stream)
+    t = time.perf_counter() - t0
+    same = np.array_equal(kspace_read, kspace.astype(np.complex64))
+    print("    %-22s %8.3f s  %8.1f MB/s, k-space %s" % ('read_kspace', t, stream.tell() / 1e6 / t,
+                                                          'matches' if same else 'DIFFERS'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""
+Benchmark of the gradient merge and rotation of MRIBLANKSEQ.rotate_waveforms.
+
+Compares the previous per-event loop, kept as the reference in tests/test_rotate_waveforms.py, with the vectorized
+rotate_waveforms on random oblique gradient waveforms of increasing length, and checks that both give the same
+waveforms.
+
+Usage:
+    python benchmarks/rotate_waveforms.py [--events N [N ...]] [--repeat N]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from marge.seq.mriBlankSeq import MRIBLANKSEQ
+from tests.test_rotate_waveforms import random_waveforms, reference_rotate_waveforms
+
+
+def timeit(function, waveforms, repeat):
+    # Best time over fresh copies of the waveforms, as rotate_waveforms replaces them in place
+    times = []
+    for _ in range(repeat):
+        copy = {key: [t.copy(), g.copy()] for key, (t, g) in waveforms.items()}
+        t0 = time.perf_counter()
+        result = function(copy)
+        times.append(time.perf_counter() - t0)
+    return min(times), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--events', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help='Gradient events per axis')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of repetitions, the best time is reported')
+    args = parser.parse_args()
+
+    sequence = MRIBLANKSEQ.__new__(MRIBLANKSEQ)
+    sequence.plotSeq = False
+    sequence.rotations = [[0.48, 0.6, 0.64, 0.7]]
+    rot = sequence.getRotationMatrix()
+
+    rng = np.random.default_rng(0)
+    for n_events in args.events:
+        waveforms = random_waveforms(rng, n_events)
+        t_loop, expected = timeit(lambda w: reference_rotate_waveforms(w, rot), waveforms, args.repeat)
+        t_new, rotated = timeit(sequence.rotate_waveforms, waveforms, args.repeat)
+        error = max(np.max(np.abs(rotated[key][1] - np.array(expected[key][1])))
+                    for key in ('grad_vx', 'grad_vy', 'grad_vz'))
+        same_times = all(np.array_equal(rotated[key][0], expected[key][0]) for key in ('grad_vx', 'grad_vy', 'grad_vz'))
+        print("%i events per axis, %i merged time points" % (n_events, np.size(rotated['grad_vx'][0])))
+        print("    %-22s %8.4f s" % ('per-event loop', t_loop))
+        print("    %-22s %8.4f s  x%.1f, max difference %.1e, times %s" % (
+            'rotate_waveforms', t_new, t_loop / t_new, error, 'match' if same_times else 'DIFFER'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""
+End-to-end scan throughput against the pure-Python MaRCoS server simulator.
+
+Runs the client path of a real acquisition (Experiment creation, compilation, run_seq transfer and RX decoding)
+for a train of readouts similar to a RARE batch, without a Red Pitaya. The simulator returns as many RX samples as
+the hardware would, with optional reply latency and data loss.
+
+Usage:
+    python benchmarks/scan_throughput.py [--scans N] [--readouts N] [--points N] [--latency S] [--loss P]
+                                         [--binary] [--no-pool] [--no-cache]
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import marge.configs.hw_config as hw
+import marge.marcos.marcos_client.experiment as mex
+import marge.controller.experiment_gui as ex
+from marge.marcos.marcos_simulator import MarcosSimulator
+
+
+def build_sequence(n_readouts, n_points, rx_t, echo_spacing):
+    # Train of RF pulses and readouts with a readout gradient, times in us
+    t0 = 100 + np.arange(n_readouts) * echo_spacing
+    rx_start = t0 + (echo_spacing - n_points * rx_t) / 2
+    return {
+        'tx0': (np.ravel(np.c_[t0, t0 + 50]), np.tile([0.5, 0], n_readouts) + 0j),
+        'tx_gate': (np.ravel(np.c_[t0 - 10, t0 + 50]), np.tile([1, 0], n_readouts)),
+        'grad_vx': (np.ravel(np.c_[rx_start - 100, rx_start + n_points * rx_t]), np.tile([0.3, 0], n_readouts)),
+        'rx0_en': (np.ravel(np.c_[rx_start, rx_start + n_points * rx_t]), np.tile([1, 0], n_readouts)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scans', type=int, default=20, help='Number of scans')
+    parser.add_argument('--readouts', type=int, default=256, help='Readouts per scan')
+    parser.add_argument('--points', type=int, default=256 * 5, help='Oversampled points per readout')
+    parser.add_argument('--rx-t', type=float, default=1 / 122.88 * 100, help='Oversampled sampling period in us')
+    parser.add_argument('--latency', type=float, default=0.0, help='Extra time before every reply, in s')
+    parser.add_argument('--loss', type=float, default=0.0, help='Probability of losing RX data in a scan')
+    parser.add_argument('--binary', action='store_true', help='Send the RX data as binary payloads')
+    parser.add_argument('--no-pool', action='store_true', help='Open a new connection for every scan')
+    parser.add_argument('--no-cache', action='store_true', help='Disable the compiled sequence cache')
+    args = parser.parse_args()
+
+    if not hasattr(hw, 'grad_board'):
+        hw.grad_board = 'gpa-fhdo'
+    hw.rp_ip_address = '127.0.0.1'
+    simulator = MarcosSimulator(port=0, latency=args.latency, loss=args.loss, binary=args.binary, seed=0).start()
+    mex.port = simulator.port
+
+    expected = args.readouts * args.points
+    seq = build_sequence(args.readouts, args.points, args.rx_t, args.points * args.rx_t + 500)
+    times = {'connect': 0.0, 'compile': 0.0, 'run': 0.0}
+    repeats = 0
+    t_start = time.perf_counter()
+    for scan in range(args.scans):
+        t0 = time.perf_counter()
+        expt = ex.Experiment(lo_freq=3, rx_t=args.rx_t, oversampling_factor=1, init_gpa=True,
+                             use_cache=not args.no_cache, use_pool=not args.no_pool, print_infos=False)
+        expt.add_flodict(seq)
+        t1 = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            expt.compile()
+        t2 = time.perf_counter()
+        while True:
+            with contextlib.redirect_stdout(io.StringIO()):
+                rxd, msgs = expt.run()
+            if rxd['rx0'].size == expected:
+                break
+            repeats += 1
+        t3 = time.perf_counter()
+        expt.__del__()
+        times['connect'] += t1 - t0
+        times['compile'] += t2 - t1
+        times['run'] += t3 - t2
+    t_total = time.perf_counter() - t_start
+    simulator.stop()
+
+    mb = simulator.stats['samples'] * 8 / 1e6
+    print("%i scans of %i readouts x %i points, %s RX data, %s" % (
+        args.scans, args.readouts, args.points, 'binary' if args.binary else 'list',
+        'new connection per scan' if args.no_pool else 'connection pool'))
+    for stage, t in times.items():
+        print("    %-8s %8.3f s  %6.1f ms/scan" % (stage, t, 1e3 * t / args.scans))
+    print("    %-8s %8.3f s  %6.1f scans/s, %.1f MB/s of RX data, %i repeated scans, %.3f s simulated" % (
+        'total', t_total, args.scans / t_total, mb / t_total, repeats, simulator.stats['duration']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""
+Import time of the MaRGE modules loaded at startup.
+
+Runs `python -X importtime -c "import <module>"` in a new interpreter for each module and reports the total import
+time and the modules with the largest cumulative time. The heavy optional libraries (bm4d, cupy, ismrmrd, mrd,
+nibabel, pydicom, skimage, matplotlib.pyplot) are deferred with marge.marge_utils.lazy and must not be imported by
+any of these modules.
+
+With --check, the script exits with an error if a deferred library is imported or if an import takes longer than
+--budget, so that it can be used to catch startup regressions.
+
+Usage:
+    python benchmarks/startup_import.py [--module NAME ...] [--top N] [--repeats N] [--cold] [--check]
+                                        [--budget MS]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# MANIFEST_PATH in marge/seq/sequences.py, not imported here to keep the sequences out of this process
+manifest_path = os.path.join('experiments', 'cache', 'sequences.json')
+
+# Modules imported when MaRGE starts or when a sequence is run from a script
+MODULES = ['marge.seq.sequences', 'marge.marge_utils.utils', 'marge.manager.dicommanager',
+           'marge.marge_tyger.tyger_rare']
+
+# Libraries that are only imported on first use
+DEFERRED = ['bm4d', 'cupy', 'ismrmrd', 'mrd', 'nibabel', 'pydicom', 'skimage', 'matplotlib.pyplot']
+
+
+def import_times(module):
+    # Import the module in a new interpreter and parse the "import time: self | cumulative | name" lines
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([os.path.abspath(root)] + [p for p in [env.get('PYTHONPATH')] if p])
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import %s' % module],
+                            cwd=root, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        times.append((name.rstrip(), int(self_us), int(cumulative_us)))
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--module', action='append', help='Module to import, can be repeated')
+    parser.add_argument('--top', type=int, default=10, help='Number of modules to show')
+    parser.add_argument('--repeats', type=int, default=3, help='Number of imports, the fastest one is shown')
+    parser.add_argument('--cold', action='store_true', help='Remove the sequence manifest before the first import')
+    parser.add_argument('--check', action='store_true', help='Fail if a deferred library is imported or if an '
+                                                             'import exceeds the budget')
+    parser.add_argument('--budget', type=float, default=1000.0, help='Maximum import time of each module in ms')
+    args = parser.parse_args()
+
+    manifest = os.path.join(root, manifest_path)
+    if args.cold and os.path.exists(manifest):
+        os.remove(manifest)
+
+    errors = []
+    for module in args.module or MODULES:
+        runs = []
+        for repeat in range(args.repeats):
+            try:
+                times = import_times(module)
+            except RuntimeError as e:
+                errors.append("%s could not be imported: %s" % (module, e))
+                break
+            runs.append((sum(t[1] for t in times), times))
+        if not runs:
+            continue
+        total, times = min(runs, key=lambda run: run[0])
+        names = set(t[0].strip() for t in times)
+        deferred = [name for name in DEFERRED if name in names]
+
+        print("%s: %.1f ms, %i modules (fastest of %i)" % (module, total / 1e3, len(times), len(runs)))
+        print("    %10s %10s  %s" % ('self [ms]', 'cum [ms]', 'module'))
+        for name, self_us, cumulative_us in sorted(times, key=lambda t: -t[2])[:args.top]:
+            print("    %10.1f %10.1f  %s" % (self_us / 1e3, cumulative_us / 1e3, name))
+        print("    deferred libraries imported: %s" % (', '.join(deferred) or 'none'))
+
+        if deferred:
+            errors.append("%s imports %s" % (module, ', '.join(deferred)))
+        if total / 1e3 > args.budget:
+            errors.append("%s takes %.1f ms, budget %.1f ms" % (module, total / 1e3, args.budget))
+
+    if errors:
+        print("\n".join(["Startup issues:"] + ["    " + error for error in errors]))
+        if args.check:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -3,3 +3,33 @@
 side = ["None", "Left", "Right"]
 orientation = ["Feet First Supine (FFS)", "Head First Supine (HFS) - Coming soon", "Feet First Prono (FFP) - Coming soon", "Head First Prono(HFP) - Coming soon"]
 screenshot_folder = "experiments/screenshots"
+
+# FFT backend used by the reconstructions: "auto" (pyFFTW if installed, scipy otherwise), "pyfftw", "scipy" or "numpy"
+fft_backend = "auto"
+# Number of threads used by the FFT backend, -1 uses all the cores
+fft_workers = -1
+
+# Processes used to write and interpret the PyPulseq batches, 0 interprets them serially and -1 uses all the cores
+seq_workers = -1
+# Write the .seq file of every PyPulseq batch, saved with the raw data. If False, the batches are interpreted from
+# temporary files that are removed afterwards
+write_seq_files = True
+
+# Format of the raw data files: "h5" saves a chunked HDF5 file in the 'raw' folder of the session, "mat" saves a
+# MATLAB file in the 'mat' folder
+raw_data_format = "h5"
+# Compression of the large arrays in the .h5 raw data files: None, "lzf" (fast) or "gzip" (smaller files)
+raw_data_compression = None
+# Also save a .mat copy of every .h5 raw data file. Otherwise, .mat files are only exported when a tool needs them
+raw_data_mat = False
+
+# Threads writing the files of every acquisition in the background, 0 writes them before the analysis returns
+writer_workers = 2
+# Maximum number of files waiting to be written. The next acquisition waits when this number is reached
+writer_queue = 8
+# Sync every file to disk once written
+writer_fsync = True
+
+# Size in bytes of the readout lines of an ISMRMRD file loaded in memory when it is opened. Larger files are read from
+# disk one slice at a time
+mrd_memory_limit = 2 ** 30
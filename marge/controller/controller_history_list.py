@@ -22,6 +22,7 @@ except:
     pass
 from marge.widgets.widget_history_list import HistoryListWidget
 from marge.manager.dicommanager import DICOMImage
+from marge.manager import outputmanager
 from marge.marge_utils import utils
 import numpy as np
 import marge.configs.hw_config as hw
@@ -107,7 +108,9 @@ class HistoryListController(HistoryListWidget):
         item_name = self.getCustomItemText(self.clicked_item).split(' | ')[1]
         path = self.main.session['directory']
         self.main.post_gui.showMaximized()
-        self.main.post_gui.toolbar_image.rawDataLoading(file_path=path + "/mat/", file_name=item_name)
+        folder = "/raw/" if item_name.endswith(".h5") else "/mat/"
+        outputmanager.flush([path + folder + item_name])
+        self.main.post_gui.toolbar_image.rawDataLoading(file_path=path + folder, file_name=item_name)
 
     def deleteTask(self, item_number=None):
         """
@@ -139,6 +142,26 @@ class HistoryListController(HistoryListWidget):
         self.labels = []
         self.addFigure()
 
+    @staticmethod
+    def referenceSetter(rotations, shifts, fovs):
+        """
+        Get a function that sets the reference rotations, shifts and fovs of a sequence.
+
+        Args:
+            rotations (list): Rotations of the reference image.
+            shifts (list): Shifts of the reference image.
+            fovs (list): Fovs of the reference image.
+
+        Returns:
+            callable: Function to pass to defaultsequences.apply().
+        """
+        def set_reference(sequence):
+            sequence.rotations = rotations.copy()
+            sequence.dfovs = shifts.copy()
+            sequence.fovs = fovs.copy()
+
+        return set_reference
+
     def addFigure(self):
         """
         Adds a figure to the layout and updates the figures and labels lists.
@@ -177,10 +200,7 @@ class HistoryListController(HistoryListWidget):
         rotations = self.rotations[self.current_output]
         shifts = self.shifts[self.current_output]
         fovs = self.fovs[self.current_output]
-        for sequence in defaultsequences.values():
-            sequence.rotations = rotations.copy()
-            sequence.dfovs = shifts.copy()
-            sequence.fovs = fovs.copy()
+        defaultsequences.apply(self.referenceSetter(rotations, shifts, fovs), key='reference')
 
         # Create label and figure
         # Create image widget
@@ -290,10 +310,7 @@ class HistoryListController(HistoryListWidget):
             rotations = self.rotations[self.current_output]
             shifts = self.shifts[self.current_output]
             fovs = self.fovs[self.current_output]
-            for sequence in defaultsequences.values():
-                sequence.rotations = rotations.copy()
-                sequence.dfovs = shifts.copy()
-                sequence.fovs = fovs.copy()
+            defaultsequences.apply(self.referenceSetter(rotations, shifts, fovs), key='reference')
         except:
             pass
 
@@ -368,10 +385,7 @@ class HistoryListController(HistoryListWidget):
             rotations = self.rotations[self.current_output]
             shifts = self.shifts[self.current_output]
             fovs = self.fovs[self.current_output]
-            for sequence in defaultsequences.values():
-                sequence.rotations = rotations.copy()
-                sequence.dfovs = shifts.copy()
-                sequence.fovs = fovs.copy()
+            defaultsequences.apply(self.referenceSetter(rotations, shifts, fovs), key='reference')
         except:
             pass
 
@@ -844,11 +858,12 @@ class HistoryListControllerPos(HistoryListWidget):
         three output files under the session directory: .dcm, .nii, and .mat.
         """
         # Path to the DICOM file
-        path = self.main.session['directory'] + "/dcm/" + self.main.file_name[0:-4]
+        path = self.main.session['directory'] + "/dcm/" + os.path.splitext(self.main.file_name)[0]
         if not os.path.exists(self.main.session['directory'] + "/dcm/"):
             os.makedirs(self.main.session['directory'] + "/dcm/")
 
-        # Load the DICOM file
+        # Load the DICOM file, once written
+        outputmanager.flush([path + ".dcm"])
         dicom_image = DICOMImage(path=path + ".dcm")
 
         # Get image to save into dicom
@@ -877,7 +892,7 @@ class HistoryListControllerPos(HistoryListWidget):
         print("Dicom image saved")
 
         # Save nifti
-        path = self.main.session['directory'] + "/nii/" + self.main.file_name[0:-4]
+        path = self.main.session['directory'] + "/nii/" + os.path.splitext(self.main.file_name)[0]
         if not os.path.exists(self.main.session['directory'] + "/nii/"):
             os.makedirs(self.main.session['directory'] + "/nii/")
         utils.save_nifti(axes_orientation = self.main.toolbar_image.mat_data['axesOrientation'][0],
@@ -889,7 +904,7 @@ class HistoryListControllerPos(HistoryListWidget):
         print("Nifti image saved")
 
         # Save rawdata
-        path = self.main.session['directory'] + "/mat/" + self.main.file_name[0:-4] + "_processed.mat"
+        path = self.main.session['directory'] + "/mat/" + os.path.splitext(self.main.file_name)[0] + "_processed.mat"
         if not os.path.exists(self.main.session['directory'] + "/mat/"):
             os.makedirs(self.main.session['directory'] + "/mat/")
         mat_data = {}
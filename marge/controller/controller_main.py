@@ -43,9 +43,11 @@ class MainController(MainWindow):
         self.session = session
         self.setWindowTitle("MaRGE " + session["software_version"] + ": " + session['directory'])
         # Add the session to all sequences
-        for sequence in defaultsequences.values():
+        def set_session(sequence):
             sequence.session = session
 
+        defaultsequences.apply(set_session, key='session')
+
     def initializeThread(self):
         # Start the sniffer
         thread = threading.Thread(target=self.history_list.waitingForRun)
@@ -11,6 +11,21 @@ from marge.widgets.widget_plot3d import Plot3DWidget
 import marge.configs.hw_config as hw
 import pyqtgraph as pg
 
+# ROI selected in the images, accumulated by axis so that the views of every orientation add to it
+roi_state = {'fov': {}, 'dfov': {}, 'angle': None, 'rotationAxis': None}
+
+
+def _apply_roi(sequence):
+    # Set the ROI accumulated in roi_state in the parameters of the sequence
+    for key in ('fov', 'dfov'):
+        if key in sequence.mapKeys:
+            for axis, value in roi_state[key].items():
+                sequence.mapVals[key][axis] = value
+    if 'angle' in sequence.mapKeys and roi_state['angle'] is not None:
+        sequence.mapVals['angle'] = roi_state['angle']
+    if 'rotationAxis' in sequence.mapKeys and roi_state['rotationAxis'] is not None:
+        sequence.mapVals['rotationAxis'] = list(roi_state['rotationAxis'])
+
 
 class Plot3DController(Plot3DWidget):
     """
@@ -260,20 +275,14 @@ class Plot3DController(Plot3DWidget):
         self.seq_name = self.main.history_list.inputs[current_output][1][0]
         dfov_0 = self.main.history_list.shifts[current_output][-1]
 
-        # Update sequence parameters
-        for sequence in defaultsequences.values():
-            if 'fov' in sequence.mapKeys:
-                sequence.mapVals['fov'][x_axis] = float(np.round(fov_roi[x_axis], decimals=1))  # cm
-                sequence.mapVals['fov'][y_axis] = float(np.round(fov_roi[y_axis], decimals=1))  # cm
-            if 'dfov' in sequence.mapKeys:
-                sequence.mapVals['dfov'][x_axis] = float(
-                    np.round(dfov_roi[x_axis] + dfov_0[x_axis] * 1e3, decimals=1))  # mm
-                sequence.mapVals['dfov'][y_axis] = float(
-                    np.round(dfov_roi[y_axis] + dfov_0[y_axis] * 1e3, decimals=1))  # mm
-            if 'angle' in sequence.mapKeys:
-                sequence.mapVals['angle'] = float(np.round(rotation[3], decimals=2))  # degrees
-            if 'rotationAxis' in sequence.mapKeys:
-                sequence.mapVals['rotationAxis'] = rotation[0:3]
+        # Update the ROI of the sequences, keeping the axes set from the other views
+        roi_state['fov'][x_axis] = float(np.round(fov_roi[x_axis], decimals=1))  # cm
+        roi_state['fov'][y_axis] = float(np.round(fov_roi[y_axis], decimals=1))  # cm
+        roi_state['dfov'][x_axis] = float(np.round(dfov_roi[x_axis] + dfov_0[x_axis] * 1e3, decimals=1))  # mm
+        roi_state['dfov'][y_axis] = float(np.round(dfov_roi[y_axis] + dfov_0[y_axis] * 1e3, decimals=1))  # mm
+        roi_state['angle'] = float(np.round(rotation[3], decimals=2))  # degrees
+        roi_state['rotationAxis'] = rotation[0:3]
+        defaultsequences.apply(_apply_roi, key='roi')
 
         # Loop over the widgets in the figure_layout to link the roiFOV
         for widget in self.main.figures_layout.findChildren(Plot3DController):
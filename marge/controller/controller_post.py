@@ -1,12 +1,14 @@
 """Controller for the post-processing panel widget."""
 
-import bm4d
 import threading
 import numpy as np
 from scipy.ndimage import gaussian_filter
 from marge.widgets.widget_post import PostProcessingTabWidget
-from skimage.util import view_as_blocks
-from skimage.measure import shannon_entropy
+from marge.marge_utils.lazy import lazy_import
+
+# Imported on first use
+bm4d = lazy_import('bm4d')
+skimage = lazy_import('skimage')
 
 
 class PostProcessingTabController(PostProcessingTabWidget):
@@ -75,8 +77,8 @@ class PostProcessingTabController(PostProcessingTabWidget):
 
             # Divide the image into blocks
             n_multi = (np.array(image_quantized.shape) / 5).astype(int) * 5
-            blocks_q = view_as_blocks(image_quantized[0:n_multi[0], 0:n_multi[1], 0:n_multi[2]], block_shape=(5, 5, 5))
-            blocks_r = view_as_blocks(image_rescaled[0:n_multi[0], 0:n_multi[1], 0:n_multi[2]], block_shape=(5, 5, 5))
+            blocks_q = skimage.util.view_as_blocks(image_quantized[0:n_multi[0], 0:n_multi[1], 0:n_multi[2]], block_shape=(5, 5, 5))
+            blocks_r = skimage.util.view_as_blocks(image_rescaled[0:n_multi[0], 0:n_multi[1], 0:n_multi[2]], block_shape=(5, 5, 5))
 
             # Calculate the standard deviation for each block
             block_std_devs = np.std(blocks_r, axis=(3, 4, 5))
@@ -90,7 +92,7 @@ class PostProcessingTabController(PostProcessingTabWidget):
                 for jj in range(blocks_q.shape[1]):
                     for kk in range(blocks_q.shape[2]):
                         block = blocks_q[ii, jj, kk, :, :, :]
-                        entropy = shannon_entropy(block)
+                        entropy = skimage.measure.shannon_entropy(block)
                         block_entropies[ii, jj, kk] = entropy
 
             # Find the indices of the block with the highest entropy
@@ -5,6 +5,7 @@ from datetime import datetime
 from pathlib import Path
 
 import marge.recon.data_processing as dp
+from marge.configs import sys_config
 
 from reportlab.lib.pagesizes import A4
 from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Image
@@ -53,7 +54,8 @@ class Printer:
         try:
             for root, dirs, files in os.walk(root_path):
                 for directory in dirs:
-                    if directory == "mat":
+                    # The 'mat' folder only holds exported copies when the session has a 'raw' folder
+                    if directory == "raw" or (directory == "mat" and "raw" not in dirs):
                         mat_folders.append(os.path.join(root, directory))
 
             return mat_folders
@@ -86,7 +88,10 @@ class Printer:
             # Check path
             local_story = False
             if path is None:
-                path = self.main.session["directory"] + "/mat"
+                if getattr(sys_config, 'raw_data_format', 'h5') == 'h5':
+                    path = self.main.session["directory"] + "/raw"
+                else:
+                    path = self.main.session["directory"] + "/mat"
                 local_story = True
 
             # Create heading
@@ -123,11 +128,12 @@ class Printer:
 
     @staticmethod
     def get_sorted_mat_files(directory):
-        """Return a list of .mat filenames in 'directory' sorted by creation time, excluding 'temp.mat'."""
+        """Return a list of raw data filenames (.mat or .h5) in 'directory' sorted by creation time, excluding the
+        temporary files."""
         directory = Path(directory)
         mat_files = [
-            f for f in directory.glob("*.mat")
-            if f.name != "temp.mat"
+            f for pattern in ("*.mat", "*.h5") for f in directory.glob(pattern)
+            if f.name not in ("temp.mat", "temp.h5")
         ]
 
         # # Sort by creation time (oldest to newest)
@@ -136,13 +142,13 @@ class Printer:
         # Sort by time and date in the file name
         def extract_dt_from_name(path: Path):
             """
-            Extract a datetime object from a .mat filename timestamp suffix.
+            Extract a datetime object from a raw data filename timestamp suffix.
 
             Expects the filename stem to end with seven dot-separated components
             formatted as YYYY.MM.DD.HH.MM.SS.fff.
 
             Args:
-                path (pathlib.Path): Path to the .mat file.
+                path (pathlib.Path): Path to the raw data file.
 
             Returns:
                 datetime.datetime: Parsed timestamp.
@@ -6,11 +6,11 @@ import threading
 import numpy as np
 from marge.widgets.widget_reconstruction import ReconstructionTabWidget
 from marge.marge_utils import utils
+from marge.marge_utils import art
+from marge.marge_utils import fft
+from marge.marge_utils.lazy import lazy_import, is_available
 
-try:
-    import cupy as cp
-except ImportError:
-    pass
+cp = lazy_import('cupy')  # Imported on first use, if installed
 
 
 def getPath():
@@ -105,6 +105,7 @@ class ReconstructionTabController(ReconstructionTabWidget):
         pocs_button: QPushButton for performing POCS.
         image_fft_button: QPushButton for performing FFT reconstruction.
         image_art_button: QPushButton for performing ART reconstruction.
+        nufft_button: QPushButton for performing NUFFT gridding reconstruction.
     """
 
     def __init__(self, *args, **kwargs):
@@ -123,6 +124,7 @@ class ReconstructionTabController(ReconstructionTabWidget):
         self.ifft_button.clicked.connect(self.ifft)
         self.dfft_button.clicked.connect(self.dfft)
         self.image_art_button.clicked.connect(self.artReconstruction)
+        self.nufft_button.clicked.connect(self.nufftReconstruction)
         self.snr_1_button.clicked.connect(self.snr_1)
         self.snr_2_button.clicked.connect(self.snr_2)
         self.snr_3_button.clicked.connect(self.snr_3)
@@ -211,7 +213,7 @@ class ReconstructionTabController(ReconstructionTabWidget):
 
         Retrieves the mat data from the loaded .mat file in the main toolbar controller.
         Extracts the necessary data from the mat file.
-        Performs the ART reconstruction algorithm.
+        Performs the ART reconstruction algorithm, processing the k-space samples in blocks of the given size.
         Updates the main matrix of the image view widget with the reconstructed image.
         Adds the "ART" operation to the history widget and updates the history dictionary and operations history.
         """
@@ -222,102 +224,37 @@ class ReconstructionTabController(ReconstructionTabWidget):
         sampled = self.main.toolbar_image.k_space_raw
         fov = np.reshape(mat_data['fov'], -1) * 1e-2
         nPoints = np.reshape(mat_data['nPoints'], -1)
-        k = sampled[:, 0:3]
+        k = np.real(sampled[:, 0:3])
         s = sampled[:, 3]
 
         # Points where rho will be estimated
         x = np.linspace(-fov[0] / 2, fov[0] / 2, nPoints[0])
         y = np.linspace(-fov[1] / 2, fov[1] / 2, nPoints[1])
         z = np.linspace(-fov[2] / 2, fov[2] / 2, nPoints[2])
-        y, z, x = np.meshgrid(y, z, x)
-        x = np.reshape(x, (-1, 1))
-        y = np.reshape(y, (-1, 1))
-        z = np.reshape(z, (-1, 1))
-
-        # k-points
-        kx = np.reshape(k[:, 0], (-1, 1))
-        ky = np.reshape(k[:, 1], (-1, 1))
-        kz = np.reshape(k[:, 2], (-1, 1))
 
         # Iterative process
         lbda = float(self.lambda_text_field.text())
         n_iter = int(self.niter_text_field.text())
-        index = np.arange(len(s))
-
-        def iterative_process_gpu(kx, ky, kz, x, y, z, s, rho, lbda, n_iter, index):
-            n = 0
-            n_samples = len(s)
-            m = 0
-            for iteration in range(n_iter):
-                cp.random.shuffle(index)
-                for jj in range(n_samples):
-                    ii = index[jj]
-                    x0 = cp.exp(-1j * 2 * cp.pi * (kx[ii] * x + ky[ii] * y + kz[ii] * z))
-                    x1 = (x0.T @ rho) - s[ii]
-                    x2 = x1 * cp.conj(x0) / (cp.conj(x0.T) @ x0)
-                    d_rho = lbda * x2
-                    rho -= d_rho
-                    n += 1
-                    if n / n_samples > 0.01:
-                        m += 1
-                        n = 0
-                        print("ART iteration %i: %i %%" % (iteration + 1, m))
-
-            return rho
-
-        def iterative_process_cpu(kx, ky, kz, x, y, z, s, rho, lbda, n_iter, index):
-            n = 0
-            n_samples = len(s)
-            m = 0
-            for iteration in range(n_iter):
-                np.random.shuffle(index)
-                for jj in range(n_samples):
-                    ii = index[jj]
-                    x0 = np.exp(-1j * 2 * np.pi * (kx[ii] * x + ky[ii] * y + kz[ii] * z))
-                    x1 = (x0.T @ rho) - s[ii]
-                    x2 = x1 * np.conj(x0) / (np.conj(x0.T) @ x0)
-                    d_rho = lbda * x2
-                    rho -= d_rho
-                    n += 1
-                    if n / n_samples > 0.01:
-                        m += 1
-                        n = 0
-                        print("ART iteration %i: %i %%" % (iteration + 1, m))
-
-            return rho
-
-        # Launch the GPU function
-        rho = np.reshape(np.zeros((nPoints[0] * nPoints[1] * nPoints[2]), dtype=complex), (-1, 1))
-        start = time.time()
+        block_size = int(self.block_text_field.text())
+
+        def progress(iteration, percentage):
+            print("ART iteration %i: %i %%" % (iteration, percentage))
 
-        gpu_ready = False
-        if 'cp' in globals():
+        start = time.time()
+        rho = None
+        if is_available('cupy'):
             try:
                 print('Executing ART in GPU...')
-
-                # Transfer numpy arrays to cupy arrays
-                kx_gpu = cp.asarray(kx)
-                ky_gpu = cp.asarray(ky)
-                kz_gpu = cp.asarray(kz)
-                x_gpu = cp.asarray(x)
-                y_gpu = cp.asarray(y)
-                z_gpu = cp.asarray(z)
-                s_gpu = cp.asarray(s)
-                index = cp.asarray(index)
-                rho_gpu = cp.asarray(rho)
-
-                # Execute ART
-                rho_gpu = iterative_process_gpu(kx_gpu, ky_gpu, kz_gpu, x_gpu, y_gpu, z_gpu, s_gpu, rho_gpu, lbda, n_iter,
-                                                index)
-                rho = cp.asnumpy(rho_gpu)
-                gpu_ready = True
+                rho = art.run_art_reconstruction(k, s, (x, y, z), n_iter=n_iter, lbda=lbda, block_size=block_size,
+                                                 callback=progress, xp=cp)
+                rho = cp.asnumpy(rho)
             except:
                 print("GPU not available...")
-        if not gpu_ready:
+                rho = None
+        if rho is None:
             print('Executing ART in CPU...')
-
-            rho = iterative_process_cpu(kx, ky, kz, x, y, z, s, rho, lbda, n_iter,
-                                            index)
+            rho = art.run_art_reconstruction(k, s, (x, y, z), n_iter=n_iter, lbda=lbda, block_size=block_size,
+                                             workers=os.cpu_count(), callback=progress)
         end = time.time()
         print("Reconstruction time = %0.1f s" % (end - start))
 
@@ -334,12 +271,58 @@ class ReconstructionTabController(ReconstructionTabWidget):
         self.main.history_list.addNewItem(stamp="ART",
                                           image=figure,
                                           orientation=orientation,
-                                          operation="ART n = %i, lambda = %0.3f" % (n_iter, lbda),
+                                          operation="ART n = %i, lambda = %0.3f, block = %i" % (n_iter, lbda,
+                                                                                                 block_size),
                                           space="i",
                                           image_key=self.main.image_view_widget.image_key)
 
         return
 
+    def nufftReconstruction(self):
+        """
+        Perform NUFFT gridding reconstruction in a separate thread.
+        """
+        thread = threading.Thread(target=self.runNufftReconstruction)
+        thread.start()
+
+    def runNufftReconstruction(self):
+        """
+        Perform NUFFT gridding reconstruction.
+
+        Retrieves the non-Cartesian k-space from the loaded .mat file, grids it with a Kaiser-Bessel kernel and density
+        compensation, and adds the resulting image to the history list. The gridding operator is cached, so
+        reconstructing another file acquired with the same trajectory is much faster.
+        """
+        # Get the mat data from the loaded .mat file in the main toolbar controller
+        mat_data = self.main.toolbar_image.mat_data
+
+        # Extract datas data from the loaded .mat file
+        sampled = self.main.toolbar_image.k_space_raw
+        fov = np.reshape(mat_data['fov'], -1) * 1e-2
+        nPoints = np.reshape(mat_data['nPoints'], -1)
+        k = np.real(sampled[:, 0:3])
+        s = sampled[:, 3]
+
+        start = time.time()
+        image = utils.run_nufft_reconstruction(k, s, fov, nPoints)
+        end = time.time()
+        print("Reconstruction time = %0.1f s" % (end - start))
+
+        # Update the main matrix of the image view widget with the image
+        self.main.image_view_widget.main_matrix = image
+
+        figure = image / np.max(np.abs(image)) * 100
+        orientation = None
+        if self.main.toolbar_image.mat_data and 'axesOrientation' in self.main.toolbar_image.mat_data:
+            orientation = self.main.toolbar_image.mat_data['axesOrientation'][0]
+        # Add new item to the history list
+        self.main.history_list.addNewItem(stamp="NUFFT",
+                                          image=figure,
+                                          orientation=orientation,
+                                          operation="NUFFT",
+                                          space="i",
+                                          image_key=self.main.image_view_widget.image_key)
+
     def zeroReconstruction(self):
 
         thread = threading.Thread(target=self.runZeroReconstruction)
@@ -355,7 +338,7 @@ class ReconstructionTabController(ReconstructionTabWidget):
         """
         # Get the k_space data and its shape
         k_space = self.main.image_view_widget.main_matrix.copy()
-        img_ref = np.abs(np.fft.ifftshift(np.fft.ifftn(np.fft.ifftshift(k_space))))
+        img_ref = np.abs(fft.centered_ifftn(k_space, shifts=(fft.IFFTSHIFT, fft.IFFTSHIFT)))
         nPoints = self.main.toolbar_image.nPoints[-1::-1]
 
         # Percentage for partial reconstruction from the text field
@@ -369,7 +352,7 @@ class ReconstructionTabController(ReconstructionTabWidget):
         k_space[:, :, mm[2]::] = 0.0
 
         # Calculate logarithmic scale
-        image = np.abs(np.fft.ifftshift(np.fft.ifftn(np.fft.ifftshift(k_space))))
+        image = np.abs(fft.centered_ifftn(k_space, shifts=(fft.IFFTSHIFT, fft.IFFTSHIFT)))
 
         # Get correlation with reference image
         correlation = np.corrcoef(img_ref.flatten(), image.flatten())[0, 1]
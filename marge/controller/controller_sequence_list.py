@@ -32,9 +32,8 @@ class SequenceListController(SequenceListWidget):
         self.currentTextChanged.connect(self.updateSequence)
         self.currentTextChanged.connect(self.showSequenceInfo)
 
-        # Here the GUI updates the inputs to the last used inputs
-        for key in defaultsequences.keys():
-            defaultsequences[key].loadParams()
+        # Here the GUI updates the inputs to the last used inputs, as each sequence is instantiated
+        defaultsequences.apply(lambda sequence: sequence.loadParams(), key='loadParams')
 
     def getCurrentSequence(self):
         """
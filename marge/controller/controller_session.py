@@ -10,16 +10,18 @@ import os
 import sys
 import subprocess
 
-import pydicom
 import qdarkstyle
 
 import marge.configs.hw_config as hw
+from marge.manager import outputmanager
+from marge.marge_utils.lazy import lazy_import
 from .controller_main import MainController
 from marge.ui.window_session import SessionWindow
 
 
 from marge.controller.controller_console import ConsoleController
 
+pydicom = lazy_import('pydicom')  # Imported on first use
 
 
 class SessionController(SessionWindow):
@@ -349,6 +351,10 @@ class SessionController(SessionWindow):
                     print("ERROR: Could not disable power modules.")
                     print(str(e))
 
+        # Wait for the files that are still being written
+        if not outputmanager.shutdown():
+            print("ERROR: Some files of the last acquisitions could not be saved.")
+
         # Close console logging if exists
         if hasattr(self, 'console'):
             self.console.close_log()
@@ -397,6 +403,10 @@ class SessionController(SessionWindow):
                     print("ERROR: Could not disable power modules.")
                     print(str(e))
 
+        # Wait for the files that are still being written
+        if not outputmanager.shutdown():
+            print("ERROR: Some files of the last acquisitions could not be saved.")
+
         # Close console logging if exists
         if hasattr(self, 'console'):
             self.console.close_log()
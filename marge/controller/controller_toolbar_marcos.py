@@ -15,6 +15,7 @@ import numpy as np
 from marge.widgets.widget_toolbar_marcos import MarcosToolBar
 import marge.marcos.marcos_client.experiment as ex
 import marge.configs.hw_config as hw
+from marge.manager.connectionmanager import connection_pool
 import marge.marge_tyger.tyger_config as tyger
 from marge.autotuning import autotuning
 
@@ -147,6 +148,7 @@ class MarcosController(MarcosToolBar):
 
     def controlMarcosServer(self):
         if not self.main.demo:
+            connection_pool.close_all()  # The persistent connections do not survive a server restart
             if not self.action_server.isChecked():
                 subprocess.run([hw.bash_path, "--", "./communicateRP.sh", hw.rp_ip_address, "killall marcos_server"])
                 self.action_server.setStatusTip('Connect to marcos server')
@@ -181,6 +183,7 @@ class MarcosController(MarcosToolBar):
         Executes copy_bitstream.sh.
         """
         if not self.main.demo:
+            connection_pool.close_all()
             try:
                 subprocess.run([hw.bash_path, "--", "./communicateRP.sh", hw.rp_ip_address, "killall marcos_server"])
                 subprocess.run([hw.bash_path, '--', './copy_bitstream.sh', hw.rp_ip_address, 'rp-122'], timeout=10)
@@ -3,23 +3,79 @@
 import copy
 import os
 import sys
-import ctypes
-import scipy as sp
 import numpy as np
-from PyQt5.QtWidgets import QFileDialog, QLabel, QApplication, QMainWindow, QTableWidget, QTableWidgetItem, QVBoxLayout, \
-    QWidget, QTabWidget
+from PyQt5.QtWidgets import QFileDialog, QLabel, QApplication, QMainWindow, QTableView, QVBoxLayout, QWidget, \
+    QTabWidget
 from scipy.interpolate import griddata
 
 from marge.marge_utils import utils
+from marge.manager import ismrmrdmanager, rawdatamanager
 from marge.widgets.widget_toolbar_post import ToolBarWidgetPost
 from marge.controller.controller_plot3d import Plot3DController as Spectrum3DPlot
 from PyQt5 import QtCore
-from scipy.io import loadmat
 import h5py
-import ismrmrd
+from marge.marge_utils.lazy import lazy_import
 import pyqtgraph as pg
 import marge.configs.hw_config as hw # Import the scanner hardware config
 
+ismrmrd = lazy_import('ismrmrd')  # Imported on first use
+
+
+def _complex_lines(lines, add_rd_points):
+    # Readout lines with interleaved real and imaginary parts to complex, without the first add_rd_points samples
+    n_readout = (lines.shape[-1] - 2 * add_rd_points) // 2
+    lines = lines[..., 2 * add_rd_points:2 * (add_rd_points + n_readout)]
+    return lines[..., 0::2] + 1j * lines[..., 1::2]
+
+
+class HeaderTableModel(QtCore.QAbstractTableModel):
+    """
+    Read-only table of MRD headers, one row per header with its fields and its data in the last column.
+
+    The cells are formatted only when the view shows them, so the readout lines of an AcquisitionReader that is not
+    loaded are read from the file for the rows on screen, one block of CHUNK_ACQUISITIONS rows at a time.
+    """
+
+    def __init__(self, headers, data, fields, parent=None):
+        """
+        Args:
+            headers (array-like): The header information to display.
+            data (array-like): The data corresponding to the headers (data from k-space and from image).
+            fields (list): List of field names for the headers.
+            parent (QObject, optional): Parent of the model.
+        """
+        super().__init__(parent)
+        self.headers = headers
+        self.lines = data
+        self.fields = list(fields) + ['Data']
+        self._block = (None, None)  # First row and lines of the last block read
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self.headers)
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self.fields)
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if role != QtCore.Qt.DisplayRole or not index.isValid():
+            return None
+        row, col = index.row(), index.column()
+        if col < len(self.fields) - 1:
+            return str(self.headers[row][col])
+        return str(self._line(row))
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        if role == QtCore.Qt.DisplayRole and orientation == QtCore.Qt.Horizontal:
+            return self.fields[section]
+        return super().headerData(section, orientation, role)
+
+    def _line(self, row):
+        # Data of a row, from the block of rows that contains it
+        start = row - row % ismrmrdmanager.CHUNK_ACQUISITIONS
+        if self._block[0] != start:
+            self._block = (start, self.lines[start:start + ismrmrdmanager.CHUNK_ACQUISITIONS])
+        return self._block[1][row - start]
+
 
 class ToolBarControllerPost(ToolBarWidgetPost):
     """
@@ -57,15 +113,12 @@ class ToolBarControllerPost(ToolBarWidgetPost):
         self.action_loadrmd.triggered.connect(self.mrdDataLoading)
         self.action_printrmd.triggered.connect(self.mrdDataShow) 
         self.action_convert.triggered.connect(self.convert)
-        self.acq = ismrmrd.Acquisition()
-        self.img = ismrmrd.Image()
-        self.header= ismrmrd.xsd.ismrmrdHeader() 
         self.current_slice = 0
         
         
     def rawDataLoading(self, file_path=None, file_name=None):
         """
-        Load raw data from a .mat file and update the image view widget.
+        Load raw data from a .h5 or .mat file and update the image view widget.
         """
         # self.clearCurrentImage()
         # Prompt the user to select a .mat file
@@ -77,7 +130,7 @@ class ToolBarControllerPost(ToolBarWidgetPost):
         self.main.file_name = file_name
         self.main.file_path = file_path
         self.main.tyger_denoising = ''
-        self.mat_data = sp.io.loadmat(file_path)
+        self.mat_data = rawdatamanager.load_mat_data(file_path)
         self.nPoints = np.reshape(self.mat_data['nPoints'], -1)
         self.main.seq_name = self.mat_data['seqName']
         if self.mat_data['seqName'] == 'PETRA':
@@ -159,18 +212,18 @@ class ToolBarControllerPost(ToolBarWidgetPost):
 
     def loadmatFile(self):
         """
-        Open a file dialog to select a .mat file and return its path.
+        Open a file dialog to select a raw data file (.h5 or .mat) and return its path.
 
         Returns:
-            str: The path of the selected .mat file.
+            str: The path of the selected file.
         """
         options = QFileDialog.Options()
         options |= QFileDialog.ReadOnly
         default_dir = "C:/Users/Portatil PC 6/PycharmProjects/pythonProject1/Results"
 
         # Open the file dialog and prompt the user to select a .mat file
-        file_name, _ = QFileDialog.getOpenFileName(self, "Select a .mat file", default_dir, "MAT Files (*.mat)",
-                                                   options=options)
+        file_name, _ = QFileDialog.getOpenFileName(self, "Select a raw data file", default_dir,
+                                                   "Raw data files (*.h5 *.mat);;MAT Files (*.mat)", options=options)
 
         return file_name
     
@@ -214,7 +267,8 @@ class ToolBarControllerPost(ToolBarWidgetPost):
         self.load_data(file_path_rmd)
         self.load_image_data(file_path_rmd)
         
-        self.main_window.tableWidget2.cellClicked.connect(self.main_window.display_image)
+        self.main_window.tableWidget2.clicked.connect(
+            lambda index: self.main_window.display_image(index.row(), index.column()))
          
     def mrdDataLoading(self, file_path_rmd=None, file_name_rmd=None):
         """
@@ -237,60 +291,37 @@ class ToolBarControllerPost(ToolBarWidgetPost):
         if "from_mat" in file_name_rmd : # file created after a conversion
             nPhases=self.ntotPhases
             nSlices=self.ntotSlices
-            data3d=np.zeros((nSlices, nPhases, data[0].shape[0]))
-            count=0
-            while count<data.shape[0]:
-                for slice in range(nSlices):
-                    for phase in range(nPhases):
-                        data3d[slice, phase, :]=data[count]
-                        count+=1
-                            
+            data3d=data[:].reshape(nSlices, nPhases, -1).astype(float)
+
             self.data3draw=data3d
-            nReadout = data3d.shape[2]
-            complex_data3d=np.zeros((nSlices, nPhases, nReadout//2), dtype=complex)
-            
-            for slice in range(nSlices):
-                for phase in range(nPhases):
-                    for readout in range(nReadout // 2):
-                        real_part = data3d[slice, phase, 2 * readout]
-                        imag_part = data3d[slice, phase, 2 * readout + 1]
-                        complex_data3d[slice, phase, readout] = complex(real_part, imag_part)
-            self.data3d = complex_data3d             
-            self.data3dabs = np.abs(complex_data3d)    
-                       
-                            
+            complex_data3d=data3d[:, :, 0::2] + 1j * data3d[:, :, 1::2]
+            self.data3d = complex_data3d
+            self.data3dabs = np.abs(complex_data3d)
+
+
         else : #file created after an acquisition
             nPhases=self.ntotPhases
             nSlices=self.ntotSlices
             nScans=self.ntotScans
-            
-            data4d=np.zeros((nScans, nSlices, nPhases, data[0].shape[0]))
-            count=0
-            while count<data.shape[0]:
-                for scan in range (nScans):
-                    for slice in range(nSlices):
-                        for phase in range(nPhases):
-                            data4d[scan, slice, phase, :]=data[count]
-                            count+=1
-                            
-            self.data4d=data4d
-            nReadout = data4d.shape[3]
             addRdPoints = hw.addRdPoints
-            complex_data4d=np.zeros((nScans, nSlices, nPhases, (nReadout-2*addRdPoints)//2), dtype=complex)
-            ## Delete addRdPoints before and after
-            for scan in range(nScans):
+
+            if data.loaded:
+                data4d=data[:].reshape(nScans, nSlices, nPhases, -1).astype(float)
+                self.data4d=data4d
+                complex_data4d=_complex_lines(data4d, addRdPoints)
+                self.complex_data4d=complex_data4d
+                self.data3d=np.mean(complex_data4d, axis=0) #mean over scans
+            else:
+                # File larger than mrd_memory_limit: average the scans of one slice at a time
+                self.data4d=None
+                self.complex_data4d=None
+                self.data3d=np.zeros((nSlices, nPhases, (data.n_values-2*addRdPoints)//2), dtype=complex)
                 for slice in range(nSlices):
-                    for phase in range(nPhases):
-                        for readout in range((nReadout-2*addRdPoints) // 2):
-                            real_part = data4d[scan, slice, phase, 2 * (readout + addRdPoints)]
-                            imag_part = data4d[scan, slice, phase, 2 * (readout + addRdPoints) + 1]
-                            complex_data4d[scan, slice, phase, readout] = complex(real_part, imag_part)
-            
-            self.complex_data4d=complex_data4d
-            self.data3d=np.mean(complex_data4d, axis=0) #mean over scans
+                    lines=np.stack([data.read_slice(scan, slice) for scan in range(nScans)]).astype(float)
+                    self.data3d[slice]=np.mean(_complex_lines(lines, addRdPoints), axis=0)
             self.data3dabs = np.abs(self.data3d) #abs value
-            
-            
+
+
         self.main.image_view_widget.main_matrix = self.data3d ## not abs
         
         image2show, x_label, y_label, title = self.fixImage(self.data3dabs) #abs
@@ -330,77 +361,23 @@ class ToolBarControllerPost(ToolBarWidgetPost):
         None
         """
         
-        f = h5py.File(file_name, 'r')
-        group = f['dataset']  
-        
-        header_data = group['data']['head'][()]
-        data = group['data']['data'][()]
-        
-        
-        if "from_mat" in file_name : 
-            phase_ind = np.zeros(len(header_data), dtype=int)
-            nSlices = np.zeros(len(header_data), dtype=int)
-            for i in range(len(header_data)):
-                phase_ind[i] = header_data[i][21][0]
-                nSlices[i] = header_data[i][21][3]
-            
-            ntotSlices = max(nSlices)
-            ntotPhases = max(phase_ind) 
-            
-            self.ntotSlices = ntotSlices
-            self.ntotPhases = ntotPhases
-            
-            self.data = data
-            self.header_data = header_data
-              
+        if "from_mat" in file_name :
             # No need to rearrange data because kSpace3D is already rearranged
+            data = ismrmrdmanager.load_acquisitions(file_name, sort=False)
+        else :
+            # Sort the acquisitions by scan, slice and phase
+            data = ismrmrdmanager.load_acquisitions(file_name)
+            self.ntotScans = data.shape[0]
+        self.ntotSlices = data.shape[1]
+        self.ntotPhases = data.shape[2]
+
+        self.data = data
+        self.header_data = data.headers
 
-        
-        else : 
-            phase_ind = np.zeros(len(header_data), dtype=int)
-            nSlices = np.zeros(len(header_data), dtype=int)
-            nScans = np.zeros(len(header_data), dtype=int)
-            for i in range(len(header_data)):
-                phase_ind[i] = header_data[i][21][0]
-                nSlices[i] = header_data[i][21][3]
-                nScans[i] = header_data[i][21][2]
-            
-            ntotSlices = max(nSlices)
-            ntotScans = max(nScans)
-            ntotPhases = max(phase_ind) 
-            
-            self.ntotSlices = ntotSlices
-            self.ntotScans = ntotScans
-            self.ntotPhases = ntotPhases
-            
-            # Rearrange data if necessary
-            
-            data_rearranged = np.zeros_like(data)
-            header_rearranged = np.zeros_like(header_data)
-            phase_counters = [0] * ntotPhases*ntotSlices*ntotScans
-            
-            for scan in range(ntotScans):
-                for slice in range(ntotSlices):
-                    for phase in range(ntotPhases):
-                        ## suppr les addrdpoints premiers et derniers
-                        index = phase + ntotPhases * (slice + ntotSlices * scan)
-                        phase_index = phase_ind[phase]-1
-                        position = phase_index + ntotPhases * (slice + ntotSlices * scan)
-                        data_rearranged[position] = data[index]
-                        header_rearranged[position] = header_data[index]
-                        phase_counters[position] += 1
-            
-            
-            self.data = data_rearranged
-            self.header_data = header_rearranged
-            
-        
         fields = [field[0] for field in ismrmrd.AcquisitionHeader._fields_]
-        
-        f.close()
-        
+
         self.populate_table(self.main_window.tableWidget1, self.header_data, self.data, fields)
-        
+
     def load_image_data(self, file_name): 
 
         """
@@ -411,38 +388,27 @@ class ToolBarControllerPost(ToolBarWidgetPost):
         None
         """
         
-        f = h5py.File(file_name, 'r')
-        group = f['dataset']  
-        header_image = group['image_raw']['header'][()]
-        image = group['image_raw']['data'][()]
-        
-        
-        
-        ntotSlices = image.shape[0]
-        ntotPhases = image.shape[3]
-        ntotReadouts = image.shape[4]
-        
-        image_reshaped = np.reshape(image, (ntotSlices, ntotPhases, ntotReadouts))
-        image_data = np.zeros_like(image_reshaped)
-        
-        for slice in range(ntotSlices):
-            image_data[slice, : , :] = image_reshaped[slice, :,:]
-            
-        
+        with h5py.File(file_name, 'r') as f:
+            group = f['dataset']['image_raw']
+            header_image = group['header'][()]
+            image = group['data'][()]
+
+        # (slices, 1, 1, phases, readouts) to (slices, phases, readouts)
+        image_data = image.reshape(image.shape[0], image.shape[3], image.shape[4])
+
         self.image_data=image_data
         self.main_window.initialize(self.image_data)
-                   
+
         fields = [field[0] for field in ismrmrd.ImageHeader._fields_]
-        f.close()
-        
+
         self.populate_table(self.main_window.tableWidget2, header_image, image_data, fields)
-    
-    def populate_table(self, tableWidget, headers, data, fields):
+
+    def populate_table(self, tableView, headers, data, fields):
         """
-        Populate a QTableWidget with MRI header and data information.
+        Show MRI header and data information in a QTableView.
     
-        This method sets up the table widget to display MRI header information and corresponding data.
-        Each row represents a header entry and its associated data.
+        This method sets up the table view to display MRI header information and corresponding data.
+        Each row represents a header entry and its associated data, formatted when the row is shown.
     
         Parameters:
         - headers (array-like): The header information to display.
@@ -452,18 +418,7 @@ class ToolBarControllerPost(ToolBarWidgetPost):
         Returns:
         None
         """
-        
-        tableWidget.setRowCount(len(headers))
-        tableWidget.setColumnCount(len(headers[0]) + 1)  # +1 for data
-    
-        
-        tableWidget.setHorizontalHeaderLabels(list(fields) + ['Data'])
-        
-        
-        for row in range(len(headers)):
-            for col in range(len(headers[row])):
-                tableWidget.setItem(row, col, QTableWidgetItem(str(headers[row][col])))
-            tableWidget.setItem(row, len(headers[row]), QTableWidgetItem(str(data[row])))
+        tableView.setModel(HeaderTableModel(headers, data, fields, tableView))
     
     def fixImage(self, matrix3d, orientation=None):
         matrix = copy.copy(matrix3d)
@@ -538,14 +493,18 @@ class ToolBarControllerPost(ToolBarWidgetPost):
         else:
             file_path = file_path+ file_name
         
-        mat = loadmat(file_path)
+        mat = rawdatamanager.load_mat_data(file_path)
         mat = {k: np.squeeze(v) for k, v in mat.items()}
         
         mat_dir = os.path.dirname(file_path)
+        if file_path.endswith('.h5'):
+            # Keep the ISMRMRD files out of the raw data folder
+            mat_dir = os.path.join(os.path.dirname(mat_dir), 'ismrmrd')
+            os.makedirs(mat_dir, exist_ok=True)
         base_name = os.path.splitext(os.path.basename(file_path))[0]
         file_parts = file_name.split('.')
         file_parts.insert(1, 'from_mat')
-        file_parts.remove('mat')
+        file_parts.pop()  # Extension
         new_file_name = '.'.join(file_parts)
         
         h5_file_path = os.path.join(mat_dir, new_file_name + '.h5')
@@ -554,8 +513,6 @@ class ToolBarControllerPost(ToolBarWidgetPost):
         if os.path.exists(h5_file_path):
             os.remove(h5_file_path)
         
-        dset = ismrmrd.Dataset(h5_file_path, f'/dataset', True)  # Créer le dataset
-        
         nRD, nPH, nSL = mat['nPoints'][0], mat['nPoints'][1], mat['nPoints'][2]
         nScans = int(mat['nScans'])
         bw =float(mat['bw'])
@@ -565,172 +522,69 @@ class ToolBarControllerPost(ToolBarWidgetPost):
             ind = self.getIndex(etl, nPH, int(mat['sweepMode']))
             nRep = (nPH // etl) * nSL
             
-        axesOrientation = mat['axesOrientation']
-        axesOrientation_list = axesOrientation.tolist()
-
-        read_dir = [0, 0, 0]
-        phase_dir = [0, 0, 0]
-        slice_dir = [0, 0, 0]
-
-        read_dir[axesOrientation_list.index(0)] = 1
-        phase_dir[axesOrientation_list.index(1)] = 1
-        slice_dir[axesOrientation_list.index(2)] = 1
-        
-        # Experimental Conditions field
-        exp = ismrmrd.xsd.experimentalConditionsType() 
-        magneticFieldStrength = hw.larmorFreq*1e6/hw.gammaB
-        exp.H1resonanceFrequency_Hz = hw.larmorFreq
-
-        self.header.experimentalConditions = exp 
+        axes_directions = ismrmrdmanager.directions(mat['axesOrientation'])
+        self.header = ismrmrdmanager.create_header(hw.larmorFreq)
 
-        # Acquisition System Information field
-        sys = ismrmrd.xsd.acquisitionSystemInformationType() 
-        sys.receiverChannels = 1 
-        self.header.acquisitionSystemInformation = sys
-
-
-        # Encoding field can be filled if needed
-        encoding = ismrmrd.xsd.encodingType()  
-        encoding.trajectory = ismrmrd.xsd.trajectoryType.CARTESIAN
-              
-        
-        dset.write_xml_header(self.header.toXML()) # Write the header to the dataset
         addRdPoints = int(mat['addRdPoints'])       
         
+        data = None
+        headers = None
         if sequence_type == 'RARE':
-            new_data = np.zeros((nPH * nSL, nRD)) 
-            new_data = np.reshape(mat['kSpace3D'], (nSL, nPH, nRD))
-        
-            counter=0  
-            
-            for slice_idx in range(nSL):
-                for phase_idx in range(nPH):
-                    
-                    line = new_data[slice_idx, phase_idx, :]
-                    line2d = np.reshape(line, (1, nRD))
-                    acq = ismrmrd.Acquisition.from_array(line2d, None)
-                    
-                    index_in_repetition = phase_idx % etl
-                    current_repetition = (phase_idx // etl) + (slice_idx * (nPH // etl))
-                    
-                    acq.clearAllFlags()
-                    
-                    if index_in_repetition == 0: 
-                        acq.setFlag(ismrmrd.ACQ_FIRST_IN_CONTRAST)
-                    elif index_in_repetition == etl - 1:
-                        acq.setFlag(ismrmrd.ACQ_LAST_IN_CONTRAST)
-                    
-                    if phase_idx== 0:
-                        acq.setFlag(ismrmrd.ACQ_FIRST_IN_PHASE)
-                    elif phase_idx == nPH - 1:
-                        acq.setFlag(ismrmrd.ACQ_LAST_IN_PHASE)
-                    
-                    if slice_idx == 0:
-                        acq.setFlag(ismrmrd.ACQ_FIRST_IN_SLICE)
-                    elif slice_idx == nSL - 1:
-                        acq.setFlag(ismrmrd.ACQ_LAST_IN_SLICE)
-                        
-                    if int(current_repetition) == 0:
-                        acq.setFlag(ismrmrd.ACQ_FIRST_IN_REPETITION)
-                    elif int(current_repetition) == nRep - 1:
-                        acq.setFlag(ismrmrd.ACQ_LAST_IN_REPETITION)
-                    
-                    
-                    counter += 1 
-                    
-                    # +1 to start at 1 instead of 0
-                    acq.idx.repetition = int(current_repetition + 1)
-                    acq.idx.kspace_encode_step_1 = phase_idx+1 # phase
-                    acq.idx.slice = slice_idx + 1
-                    acq.idx.contrast = index_in_repetition + 1
-                    
-                    acq.scan_counter = counter
-                    # acq.discard_pre = addRdPoints
-                    # acq.discard_post = addRdPoints #######""
-                    acq.sample_time_us = 1/bw
-                    acq.position=(ctypes.c_float * 3)(*mat['dfov']) 
-                    
-                    acq.read_dir = (ctypes.c_float * 3)(*read_dir)
-                    acq.phase_dir = (ctypes.c_float * 3)(*phase_dir)
-                    acq.slice_dir = (ctypes.c_float * 3)(*slice_dir)
-                    
-                    dset.append_acquisition(acq) # Append the acquisition to the dataset   
-                
+            data = np.reshape(mat['kSpace3D'], (nSL * nPH, nRD))
+            slice_idx, phase_idx = [index.ravel() for index in np.indices((nSL, nPH))]
+            index_in_repetition = phase_idx % etl
+            current_repetition = (phase_idx // etl) + (slice_idx * (nPH // etl))
+
+            headers = ismrmrdmanager.acquisition_headers(len(data), nRD,
+                                                         scan_counter=np.arange(1, len(data) + 1),
+                                                         sample_time_us=1/bw,
+                                                         position=mat['dfov'],
+                                                         **axes_directions)
+            ismrmrdmanager.set_first_last(headers, ismrmrd.ACQ_FIRST_IN_CONTRAST, ismrmrd.ACQ_LAST_IN_CONTRAST,
+                                          index_in_repetition, etl - 1)
+            ismrmrdmanager.set_first_last(headers, ismrmrd.ACQ_FIRST_IN_PHASE, ismrmrd.ACQ_LAST_IN_PHASE,
+                                          phase_idx, nPH - 1)
+            ismrmrdmanager.set_first_last(headers, ismrmrd.ACQ_FIRST_IN_SLICE, ismrmrd.ACQ_LAST_IN_SLICE,
+                                          slice_idx, nSL - 1)
+            ismrmrdmanager.set_first_last(headers, ismrmrd.ACQ_FIRST_IN_REPETITION, ismrmrd.ACQ_LAST_IN_REPETITION,
+                                          current_repetition, nRep - 1)
+
+            # +1 to start at 1 instead of 0
+            headers['idx']['repetition'] = current_repetition + 1
+            headers['idx']['kspace_encode_step_1'] = phase_idx + 1 # phase
+            headers['idx']['slice'] = slice_idx + 1
+            headers['idx']['contrast'] = index_in_repetition + 1
+
         elif sequence_type == 'GRE3D':
-            new_data = np.reshape(mat['kSpace3D'], (nSL, nPH, nRD)) 
-            counter = 0
-        
-            for slice_idx in range(nSL):
-                for phase_idx in range(nPH):
-                        line = new_data[slice_idx, phase_idx, :]
-                        line2d = np.reshape(line, (1, nRD))
-                        acq = ismrmrd.Acquisition.from_array(line2d, None)
-                        
-                        counter += 1
-                    
-                        acq.idx.repetition = counter
-                        acq.idx.kspace_encode_step_1 = phase_idx + 1
-                        acq.idx.slice = slice_idx + 1
-                
-                        
-                        acq.clearAllFlags()
-                        
-                        if phase_idx == 0:
-                            acq.setFlag(ismrmrd.ACQ_FIRST_IN_PHASE)
-                        elif phase_idx == nPH - 1:
-                            acq.setFlag(ismrmrd.ACQ_LAST_IN_PHASE)
-                        
-                        if slice_idx == 0:
-                            acq.setFlag(ismrmrd.ACQ_FIRST_IN_SLICE)
-                        elif slice_idx == nSL - 1:
-                            acq.setFlag(ismrmrd.ACQ_LAST_IN_SLICE)
-                        
-                        if counter == 1:
-                            acq.setFlag(ismrmrd.ACQ_FIRST_IN_AVERAGE)
-                        elif counter == nPH*nSL:
-                            acq.setFlag(ismrmrd.ACQ_LAST_IN_AVERAGE)
-                        
-                        
-                        acq.scan_counter = counter
-                        # acq.discard_pre = hw.addRdPoints
-                        # acq.discard_post = hw.addRdPoints
-                        acq.sample_time_us = 1/bw
-                        acq.position=(ctypes.c_float * 3)(*mat['dfov'])  
-                        acq.read_dir = (ctypes.c_float * 3)(*read_dir) 
-                        acq.phase_dir = (ctypes.c_float * 3)(*phase_dir)
-                        acq.slice_dir = (ctypes.c_float * 3)(*slice_dir)
-                        
-                        
-                        # Ajouter l'acquisition au dataset
-                        dset.append_acquisition(acq)
+            data = np.reshape(mat['kSpace3D'], (nSL * nPH, nRD))
+            slice_idx, phase_idx = [index.ravel() for index in np.indices((nSL, nPH))]
+            counter = np.arange(1, len(data) + 1)
+
+            headers = ismrmrdmanager.acquisition_headers(len(data), nRD,
+                                                         scan_counter=counter,
+                                                         sample_time_us=1/bw,
+                                                         position=mat['dfov'],
+                                                         **axes_directions)
+            headers['idx']['repetition'] = counter
+            headers['idx']['kspace_encode_step_1'] = phase_idx + 1
+            headers['idx']['slice'] = slice_idx + 1
+
+            ismrmrdmanager.set_first_last(headers, ismrmrd.ACQ_FIRST_IN_PHASE, ismrmrd.ACQ_LAST_IN_PHASE,
+                                          phase_idx, nPH - 1)
+            ismrmrdmanager.set_first_last(headers, ismrmrd.ACQ_FIRST_IN_SLICE, ismrmrd.ACQ_LAST_IN_SLICE,
+                                          slice_idx, nSL - 1)
+            ismrmrdmanager.set_first_last(headers, ismrmrd.ACQ_FIRST_IN_AVERAGE, ismrmrd.ACQ_LAST_IN_AVERAGE,
+                                          counter - 1, nPH*nSL - 1)
         
         image=mat['image3D']
-        image_reshaped = np.reshape(image, (nSL, nPH, nRD))
-        
-        #for scan in range (nScans): ## image3d does not have scan dimension
-        for slice_idx in range (nSL):
-            
-            image_slice = image_reshaped[slice_idx, :, :]
-            img = ismrmrd.Image.from_array(image_slice)
-            
-            
-            img.field_of_view = (ctypes.c_float * 3)(*(mat['fov'])*10) # mm
-            img.position = (ctypes.c_float * 3)(*mat['dfov'])
-            img.sample_time_us = 1/bw
-            img.image_type = 5 ## COMPLEX
-            
-            
-            
-            img.read_dir = (ctypes.c_float * 3)(*read_dir)
-            img.phase_dir = (ctypes.c_float * 3)(*phase_dir)
-            img.slice_dir = (ctypes.c_float * 3)(*slice_dir)
+        images = np.reshape(image, (nSL, nPH, nRD))
+        images_headers = ismrmrdmanager.image_headers(images,
+                                                      field_of_view=mat['fov']*10, # mm
+                                                      position=mat['dfov'],
+                                                      image_type=ismrmrd.IMTYPE_COMPLEX,
+                                                      **axes_directions)
 
-
-            
-            dset.append_image(f"image_raw", img)
-            
-        
-        dset.close()       
+        ismrmrdmanager.write_ismrmrd(h5_file_path, self.header.toXML(), data, headers, images, images_headers)
         
         
         
@@ -807,8 +661,8 @@ class MainWindow_toolbar(QMainWindow):
         self.tabWidget = QTabWidget()
         self.setCentralWidget(self.tabWidget)
         
-        self.tableWidget1 = QTableWidget()
-        self.tableWidget2 = QTableWidget()
+        self.tableWidget1 = QTableView()
+        self.tableWidget2 = QTableView()
         
         self.tabWidget.addTab(self.tableWidget1, "k-Space data")
         self.tabWidget.addTab(self.tableWidget2, "Image data")
@@ -851,23 +705,11 @@ class MainWindow_toolbar(QMainWindow):
             """
             
             data= self.image_data[row]
-            nReadout = data.shape[1]
-            ntotPhases = data.shape[0]
-            
-            real_parts = np.zeros((ntotPhases, nReadout))
-            imag_parts = np.zeros((ntotPhases, nReadout))
-            image = np.zeros((ntotPhases, nReadout))
-            
             # Re and Im parts
-            for i in range(ntotPhases):
-                for j in range(nReadout):
-                    real_parts[i, j] = data[i, j][0]
-                    imag_parts[i, j] = data[i, j][1]
-            
-            for i in range(ntotPhases):
-                for j in range(nReadout):
-                    image[i, j] = np.abs(complex(real_parts[i,j], imag_parts[i,j]))
-            
+            real_parts = data[data.dtype.names[0]].astype(float)
+            imag_parts = data[data.dtype.names[1]].astype(float)
+            image = np.abs(real_parts + 1j * imag_parts)
+
             # Display the image
             self.imagePlot.setImage(image)
             self.annotationLabel.setText(f'Slice {row + 1}')
@@ -6,10 +6,6 @@ import numpy as np
 from PyQt5.QtWidgets import QApplication
 
 from marge.widgets.widget_tyger_recon import TygerTabWidget
-try:
-    import cupy as cp
-except ImportError:
-    pass
 from marge.marge_tyger import tyger_rare
 from marge.marge_tyger import tyger_denoising_tep
 from marge.marge_tyger import tyger_denoising_double_tep
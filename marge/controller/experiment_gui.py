@@ -7,7 +7,10 @@ import time
 
 import marge.marcos.marcos_client.experiment as ex
 import marge.marcos.marcos_client.server_comms as sc
+from marge.marcos.marcos_client.marmachine import IDATA, MARGA_BUFS, DDS0_PHASE_LSB
 import marge.configs.hw_config as hw
+from marge.manager.cachemanager import compile_cache
+from marge.manager.connectionmanager import connection_pool
 import numpy as np
 
 class Experiment(ex.Experiment):
@@ -27,12 +30,15 @@ class Experiment(ex.Experiment):
         init_gpa (bool): Flag to initialize the GPA (Gradient Pulse Amplitude) when the Experiment object is created.
         initial_wait (float): Initial pause before the experiment begins, in microseconds. Required to configure the LOs (Local Oscillators) and RX rate.
         auto_leds (bool): Flag to automatically scan the LED (Light-Emitting Diode) pattern from 0 to 255 as the sequence runs.
-        prev_socket (socket): Previously-opened socket to maintain status.
+        prev_socket (socket): Previously-opened socket to maintain status. If None, the persistent connection to the server is borrowed from the connection pool.
         fix_cic_scale (bool): Flag to scale the RX (Receiver) data precisely based on the rate being used.
         set_cic_shift (bool): Flag to program the CIC (Cascaded Integrator-Comb) internal bit shift to maintain the gain within a factor of 2 independent of the rate.
         allow_user_init_cfg (bool): Flag to allow user-defined alteration of flocra (Field-Programmable Logic Controller for Real-Time Acquisition) configuration set by init.
         halt_and_reset (bool): Flag to halt any existing sequences that may be running upon connecting to the server.
         flush_old_rx (bool): Flag to read out and clear the old RX (Receiver) FIFOs before running a sequence.
+        oversampling_factor (int): Oversampling applied to the sampling rate.
+        use_cache (bool): Flag to reuse machine code from the compiled sequence cache.
+        use_pool (bool): Flag to borrow the persistent connection to the server from the connection pool instead of opening a new socket. The GPA is only initialised once per connection.
 
     Summary:
         The Experiment class extends the base Experiment class from the 'ex' module and provides additional functionality and customization for experiments.
@@ -58,29 +64,135 @@ class Experiment(ex.Experiment):
                  halt_and_reset=False,  # upon connecting to the server, halt any existing sequences that may be running
                  flush_old_rx=False, # when debugging or developing new code, you may accidentally fill up the RX FIFOs - they will not automatically be cleared in case there is important data inside. Setting this true will always read them out and clear them before running a sequence. More advanced manual code can read RX from existing sequences.
                  oversampling_factor=hw.oversamplingFactor,  # Oversampling applied to the sampling rate
+                 use_cache=True,  # Reuse machine code from the compiled sequence cache
+                 use_pool=True,  # Borrow the persistent connection to the server from the connection pool
                  ):
         """
         Initialize the Experiment object with the specified parameters.
         """
-        super(Experiment, self).__init__(lo_freq,
-                                         rx_t / oversampling_factor,
-                                         seq_dict,
-                                         seq_csv,
-                                         rx_lo,
-                                         grad_max_update_rate,
-                                         gpa_fhdo_offset_time,
-                                         print_infos,
-                                         assert_errors,
-                                         init_gpa,
-                                         initial_wait,
-                                         auto_leds,
-                                         prev_socket,
-                                         fix_cic_scale,
-                                         set_cic_shift,
-                                         allow_user_init_cfg,
-                                         halt_and_reset,
-                                         flush_old_rx,)
+        # Borrow the connection to the server, it is returned to the pool when the experiment is deleted
+        self._session = None
+        self._session_failed = False
+        if prev_socket is None and use_pool:
+            self._session = connection_pool.borrow((hw.rp_ip_address, ex.port))
+            if self._session is not None:
+                prev_socket = self._session.socket
+                init_gpa = init_gpa and not self._session.gpa_ready
+
+        try:
+            super(Experiment, self).__init__(lo_freq,
+                                             rx_t / oversampling_factor,
+                                             seq_dict,
+                                             seq_csv,
+                                             rx_lo,
+                                             grad_max_update_rate,
+                                             gpa_fhdo_offset_time,
+                                             print_infos,
+                                             assert_errors,
+                                             init_gpa,
+                                             initial_wait,
+                                             auto_leds,
+                                             prev_socket,
+                                             fix_cic_scale,
+                                             set_cic_shift,
+                                             allow_user_init_cfg,
+                                             halt_and_reset,
+                                             flush_old_rx,)
+        except Exception:
+            self._session_failed = True
+            self.release()
+            raise
+        if self._session is not None and init_gpa:
+            self._session.gpa_ready = True
         self.oversampling_factor = oversampling_factor
+        self.use_cache = use_cache
+
+    def __del__(self):
+        """
+        Return the connection to the pool, or close it if it is not shared.
+        """
+        self.release()
+        if hasattr(self, '_s'):
+            super().__del__()
+
+    def release(self):
+        """
+        Return the borrowed connection to the pool. The experiment can not communicate with the server afterwards.
+        """
+        session = getattr(self, '_session', None)
+        if session is not None:
+            self._session = None
+            connection_pool.release(session, failed=self._session_failed)
+
+    def add_intdict(self, seq_intdict, append=True):
+        """
+        Add an integer-format dictionary to the sequence, forcing a new compilation.
+
+        Args:
+            seq_intdict (dict): Integer dictionary in the form {name: (times, values)}.
+            append (bool): If True, the values are appended to those already in the sequence.
+        """
+        super().add_intdict(seq_intdict, append)
+        self._seq_compiled = False
+
+    def seq2bin(self):
+        """
+        Compile the sequence dictionary into machine code, reusing the compiled sequence cache when possible.
+
+        The LO frequency words are left out of the cache key, so sequences that only differ in the Larmor frequency
+        share the same entry. On a hit, the data field of the instructions that program the DDS phase buffers is
+        replaced by the new frequency words.
+
+        Returns:
+            np.ndarray: Machine code as an uint32 array.
+        """
+        if not self.use_cache:
+            return super().seq2bin()
+
+        # Replace the LO frequencies by the only information that changes the instruction layout
+        seq = dict(self._seq)
+        lo_words = np.full(3, -1, dtype=np.int64)
+        for lo in range(3):
+            key = 'lo%i_freq' % lo
+            if key in seq and np.size(seq[key][1]) == 1:
+                lo_words[lo] = int(seq[key][1][0])
+                seq[key] = (seq[key][0], np.array([lo_words[lo] & 0xffff != 0, lo_words[lo] >> 16 != 0]))
+
+        key = compile_cache.make_key(seq,
+                                     self.gradb.bin_config['initial_bufs'],
+                                     self.gradb.bin_config['latencies'],
+                                     hw.grad_board)
+        entry = compile_cache.get(key)
+        if entry is None:
+            machine_code = super().seq2bin()
+            compile_cache.put(key, machine_code=machine_code, lo_words=lo_words)
+        else:
+            machine_code = entry['machine_code'].copy()
+            self.patch_lo_words(machine_code, entry['lo_words'], lo_words)
+
+        return machine_code
+
+    @staticmethod
+    def patch_lo_words(machine_code, old_words, new_words):
+        """
+        Replace in place the LO frequency words of a compiled sequence.
+
+        Args:
+            machine_code (np.ndarray): Machine code as an uint32 array.
+            old_words (np.ndarray): LO frequency words the machine code was compiled with (-1 if not set).
+            new_words (np.ndarray): New LO frequency words (-1 if not set).
+        """
+        # Skip the instructions that program the initial buffer values
+        code = machine_code[MARGA_BUFS:]
+        target = code >> 24
+        for lo in range(3):
+            if old_words[lo] == new_words[lo] or new_words[lo] < 0:
+                continue
+            lsb = (IDATA | (DDS0_PHASE_LSB + 2 * lo)) == target
+            msb = (IDATA | (DDS0_PHASE_LSB + 2 * lo + 1)) == target
+            code[lsb] = (code[lsb] & 0xffff0000) | (new_words[lo] & 0xffff)
+            # Keep the phase reset bit of the MSB buffer
+            code[msb] = (code[msb] & 0xffff8000) | ((new_words[lo] >> 16) & 0x7fff)
 
     def getSamplingRate(self):
         """
@@ -124,8 +236,15 @@ class Experiment(ex.Experiment):
             rx_data_old, _ = sc.command({'read_rx': 0}, self._s)
             # TODO: do something with RX data previously collected by the server
 
-        rx_data, msgs = sc.command({'run_seq': self._machine_code.tobytes()}, self._s)
+        rx_stats = {}
+        try:
+            rx_data, msgs = sc.command({'run_seq': self._machine_code.tobytes()}, self._s, stats=rx_stats)
+        except Exception:
+            # The connection is left in an unknown state, do not return it to the pool
+            self._session_failed = True
+            raise
 
+        t0 = time.perf_counter()
         rxd = rx_data[4]['run_seq']
         rxd_iq = {}
 
@@ -134,15 +253,20 @@ class Experiment(ex.Experiment):
         rx1_norm_factor = self._rx0_cic_factor / (1 << 24)
 
         try: # Signal in millivolts with phase as it should be
-            rxd_iq['rx0'] = hw.adcFactor * rx0_norm_factor * (np.array(rxd['rx0_i']).astype(np.int32).astype(float) -
-                                               1j * np.array(rxd['rx0_q']).astype(np.int32).astype(float))
+            rxd_iq['rx0'] = sc.decode_rx(rxd['rx0_i'], rxd['rx0_q'], hw.adcFactor * rx0_norm_factor, sign=-1)
         except (KeyError, TypeError):
             pass
 
         try: # Signal in millivolts with phase as it should be
-            rxd_iq['rx1'] = hw.adcFactor * rx1_norm_factor * (np.array(rxd['rx1_i']).astype(np.int32).astype(float) -
-                                               1j * np.array(rxd['rx1_q']).astype(np.int32).astype(float))
+            rxd_iq['rx1'] = sc.decode_rx(rxd['rx1_i'], rxd['rx1_q'], hw.adcFactor * rx1_norm_factor, sign=-1)
         except (KeyError, TypeError):
             pass
 
+        # Transfer and decoding times of this scan
+        rx_stats['decode_time'] = time.perf_counter() - t0
+        self.rx_stats = rx_stats
+        if 'bytes' in rx_stats:
+            print(f"RX data: {rx_stats['bytes'] / 1e6:.1f} MB, transfer: {rx_stats['transfer_time']:.3f} s, "
+                  f"decoding: {rx_stats['decode_time']:.3f} s")
+
         return rxd_iq, msgs
@@ -0,0 +1,176 @@
+"""Content-addressed cache of compiled MaRCoS machine code with an on-disk LRU store."""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+class CompileCache:
+    """
+    Cache of compiled machine code keyed by a hash of the integer sequence dictionary and the gradient-board
+    configuration.
+
+    Entries are kept in a small in-memory LRU and persisted to disk as .npz files. The least recently used files are
+    removed when the size of the disk store exceeds `max_size`.
+
+    Attributes:
+        directory (str): Folder of the on-disk store.
+        max_size (int): Maximum size of the on-disk store in bytes.
+        max_items (int): Maximum number of entries kept in memory.
+        enabled (bool): If False, every lookup is a miss and nothing is stored.
+        hits (int): Number of lookups served from the cache.
+        misses (int): Number of lookups that required a compilation.
+    """
+
+    def __init__(self, directory='experiments/cache/compiled', max_size=256 * 2 ** 20, max_items=16):
+        self.directory = directory
+        self.max_size = max_size
+        self.max_items = max_items
+        self.enabled = True
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(seq, *configs):
+        """
+        Get the hash of an integer sequence dictionary and any additional configuration.
+
+        Args:
+            seq (dict): Integer dictionary in the form {name: (times, values)}.
+            *configs: Arrays or strings describing the hardware configuration (initial buffers, latencies, board...).
+
+        Returns:
+            str: Hexadecimal digest identifying the compiled sequence.
+        """
+        digest = hashlib.sha256()
+
+        def update(item):
+            if isinstance(item, str):
+                digest.update(item.encode())
+            else:
+                item = np.ascontiguousarray(item)
+                digest.update(item.dtype.str.encode())
+                digest.update(str(item.shape).encode())
+                digest.update(item.tobytes())
+
+        for name in sorted(seq.keys()):
+            update(name)
+            update(seq[name][0])
+            update(seq[name][1])
+        for config in configs:
+            update(config)
+
+        return digest.hexdigest()
+
+    def get(self, key):
+        """
+        Look for a compiled sequence in memory and then on disk.
+
+        Args:
+            key (str): Key returned by `make_key`.
+
+        Returns:
+            dict or None: Dictionary with the stored arrays, or None if the key is not in the cache.
+        """
+        with self._lock:
+            if not self.enabled:
+                self.misses += 1
+                return None
+
+            # Memory
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return self._memory[key]
+
+            # Disk
+            file_path = os.path.join(self.directory, "%s.npz" % key)
+            try:
+                with np.load(file_path) as data:
+                    entry = {name: data[name] for name in data.files}
+                os.utime(file_path)  # Mark as recently used
+            except (OSError, ValueError):
+                self.misses += 1
+                return None
+
+            self._remember(key, entry)
+            self.hits += 1
+            return entry
+
+    def put(self, key, **arrays):
+        """
+        Store a compiled sequence in memory and on disk.
+
+        Args:
+            key (str): Key returned by `make_key`.
+            **arrays: Arrays to store (e.g. the machine code).
+        """
+        with self._lock:
+            if not self.enabled:
+                return
+            self._remember(key, arrays)
+
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+                file_path = os.path.join(self.directory, "%s.npz" % key)
+                temp_path = os.path.join(self.directory, "%s.%i.tmp.npz" % (key, threading.get_ident()))
+                np.savez(temp_path, **arrays)
+                os.replace(temp_path, file_path)
+                self._prune()
+            except OSError as e:
+                print("WARNING: compiled sequence could not be cached: %s" % e)
+
+    def clear(self):
+        """
+        Remove every entry from memory and disk and reset the counters.
+        """
+        with self._lock:
+            self._memory.clear()
+            self.hits = 0
+            self.misses = 0
+            if os.path.isdir(self.directory):
+                for file_name in os.listdir(self.directory):
+                    if file_name.endswith('.npz'):
+                        os.remove(os.path.join(self.directory, file_name))
+
+    def stats(self):
+        """
+        Get a summary of the cache usage.
+
+        Returns:
+            str: Number of hits and misses.
+        """
+        return "Compiled sequence cache: %i hits, %i misses" % (self.hits, self.misses)
+
+    def _remember(self, key, entry):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_items:
+            self._memory.popitem(last=False)
+
+    def _prune(self):
+        # Remove the least recently used files until the store fits into max_size
+        files = []
+        for file_name in os.listdir(self.directory):
+            if file_name.endswith('.npz') and not file_name.endswith('.tmp.npz'):
+                stat = os.stat(os.path.join(self.directory, file_name))
+                files.append((stat.st_mtime, stat.st_size, file_name))
+        files.sort()
+        total_size = sum(size for _, size, _ in files)
+        for _, size, file_name in files:
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(os.path.join(self.directory, file_name))
+            except OSError:
+                pass
+            total_size -= size
+
+
+# Cache shared by every experiment
+compile_cache = CompileCache()
@@ -0,0 +1,205 @@
+"""Pool of persistent connections to the MaRCoS server shared by consecutive experiments."""
+
+import select
+import socket
+import threading
+import time
+
+import marge.marcos.marcos_client.server_comms as sc
+
+
+class MarcosSession:
+    """
+    Persistent connection to one MaRCoS server.
+
+    The session keeps the socket open between experiments and remembers the hardware state that survives them, so
+    that the GPA is only initialised once per connection. Only one experiment can borrow the session at a time.
+
+    Attributes:
+        address (tuple): Server address as (ip, port).
+        socket (socket.socket or None): Connected socket, None until the first borrow.
+        gpa_ready (bool): True once the GPA has been initialised through this connection.
+        busy (bool): True while the session is borrowed.
+        connections (int): Number of times the socket has been opened.
+        last_used (float): Time of the last release.
+    """
+
+    def __init__(self, address, timeout=5.0):
+        self.address = address
+        self.timeout = timeout
+        self.socket = None
+        self.gpa_ready = False
+        self.busy = False
+        self.connections = 0
+        self.last_used = 0.0
+
+    def connect(self):
+        """
+        Open a new socket to the server, closing the previous one if any.
+        """
+        self.close()
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        s.settimeout(self.timeout)
+        try:
+            s.connect(self.address)
+        except OSError:
+            s.close()
+            raise
+        s.settimeout(None)  # Sequences can run for minutes before the reply arrives
+        s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.socket = s
+        self.gpa_ready = False
+        self.connections += 1
+
+    def close(self):
+        """
+        Close the socket of the session.
+        """
+        if self.socket is not None:
+            try:
+                self.socket.close()
+            except OSError:
+                pass
+        self.socket = None
+        self.gpa_ready = False
+
+    def is_alive(self, ping=False):
+        """
+        Check whether the connection is still usable.
+
+        A closed connection or unexpected pending data are detected without any round trip. With `ping`, the server
+        is also asked to answer a cheap command.
+
+        Args:
+            ping (bool): Send an 'are_you_real' command and wait for the reply.
+
+        Returns:
+            bool: True if the connection is healthy.
+        """
+        if self.socket is None:
+            return False
+        try:
+            readable, _, _ = select.select([self.socket], [], [], 0)
+            if readable:
+                # Either the server closed the connection or a previous reply was left unread
+                return False
+            if ping:
+                self.socket.settimeout(self.timeout)
+                try:
+                    reply, _ = sc.command({'are_you_real': 0}, self.socket)
+                finally:
+                    self.socket.settimeout(None)
+                return reply is not None and 'are_you_real' in reply[4]
+        except (OSError, ValueError, IndexError, TypeError):
+            return False
+        return True
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool holding one persistent MaRCoS session per server.
+
+    Experiments borrow the session of their server when they are created and return it when they are deleted, so
+    consecutive batches and scans reuse the same socket instead of reconnecting. A borrowed session is checked before
+    it is handed out, pinging the server if it has been idle for more than `ping_interval` seconds, and reconnected if
+    the check fails.
+
+    Attributes:
+        enabled (bool): If False, borrow() returns None and every experiment opens its own socket.
+        ping_interval (float): Idle time in seconds after which the server is pinged before reusing the connection.
+        max_retries (int): Number of connection attempts before giving up.
+        retry_delay (float): Delay in seconds between connection attempts.
+    """
+
+    def __init__(self, ping_interval=30.0, max_retries=3, retry_delay=0.5):
+        self.enabled = True
+        self.ping_interval = ping_interval
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self._sessions = {}
+        self._condition = threading.Condition()
+
+    def borrow(self, address, timeout=0.0):
+        """
+        Get the session of a server, connecting or reconnecting it if required.
+
+        Args:
+            address (tuple): Server address as (ip, port).
+            timeout (float): Time in seconds to wait if the session is borrowed by another experiment.
+
+        Returns:
+            MarcosSession or None: Connected session, or None if the pool is disabled or the session is still busy
+            after `timeout`.
+        """
+        if not self.enabled:
+            return None
+        with self._condition:
+            session = self._sessions.get(address)
+            if session is None:
+                session = MarcosSession(address)
+                self._sessions[address] = session
+            if not self._condition.wait_for(lambda: not session.busy, timeout):
+                return None
+            session.busy = True
+
+        try:
+            ping = time.time() - session.last_used > self.ping_interval
+            if not session.is_alive(ping=ping):
+                self._reconnect(session)
+        except Exception:
+            self.release(session, failed=True)
+            raise
+        return session
+
+    def release(self, session, failed=False):
+        """
+        Return a borrowed session to the pool.
+
+        Args:
+            session (MarcosSession): Session returned by borrow().
+            failed (bool): If True, the connection is in an unknown state and is closed, so the next borrow opens a
+                new one.
+        """
+        with self._condition:
+            if failed:
+                session.close()
+            session.last_used = time.time()
+            session.busy = False
+            self._condition.notify_all()
+
+    def close_all(self):
+        """
+        Close the connection of every session that is not borrowed, e.g. before the server is restarted. Borrowed
+        sessions are reconnected on their next borrow.
+        """
+        with self._condition:
+            for session in self._sessions.values():
+                if session.busy:
+                    session.last_used = 0.0  # Force a ping on the next borrow
+                else:
+                    session.close()
+
+    def stats(self):
+        """
+        Get a summary of the pool usage.
+
+        Returns:
+            str: Number of connections opened per server.
+        """
+        with self._condition:
+            return ", ".join("%s:%i: %i connections" % (session.address + (session.connections,))
+                             for session in self._sessions.values())
+
+    def _reconnect(self, session):
+        for attempt in range(self.max_retries):
+            try:
+                session.connect()
+                return
+            except OSError:
+                if attempt + 1 == self.max_retries:
+                    raise
+                time.sleep(self.retry_delay)
+
+
+# Pool shared by every experiment
+connection_pool = ConnectionPool()
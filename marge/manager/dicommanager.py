@@ -1,29 +1,30 @@
 """DICOM file management utilities for reading and writing MRI data."""
 
 import numpy as np
-from pydicom import dcmread
-from pydicom.data import get_testdata_file
-from pydicom.uid import generate_uid, ExplicitVRLittleEndian, PYDICOM_IMPLEMENTATION_UID
 import datetime
 
+from marge.marge_utils.lazy import lazy_import
+
+pydicom = lazy_import('pydicom')  # Imported on first use
+
 
 class DICOMImage:
     def __init__(self, path=None):
         # Cargar el archivo de prueba de DICOM
         self.meta_data = {}
         if path is None:
-            path = get_testdata_file("MR_small.dcm")
+            path = pydicom.data.get_testdata_file("MR_small.dcm")
         try:
-            self.ds = dcmread(path)
+            self.ds = pydicom.dcmread(path)
         except:
-            self.ds = dcmread(get_testdata_file("MR_small.dcm"))
+            self.ds = pydicom.dcmread(pydicom.data.get_testdata_file("MR_small.dcm"))
 
     def image2Dicom(self):
         # File meta must match dataset
         self.ds.file_meta.MediaStorageSOPClassUID = self.ds.SOPClassUID
         self.ds.file_meta.MediaStorageSOPInstanceUID = self.ds.SOPInstanceUID
-        self.ds.file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
-        self.ds.file_meta.ImplementationClassUID = PYDICOM_IMPLEMENTATION_UID
+        self.ds.file_meta.TransferSyntaxUID = pydicom.uid.ExplicitVRLittleEndian
+        self.ds.file_meta.ImplementationClassUID = pydicom.uid.PYDICOM_IMPLEMENTATION_UID
 
         for keyword, value in self.meta_data.items():
             try:
@@ -0,0 +1,401 @@
+"""
+Bulk writing and reading of ISMRMRD files.
+
+The sequences used to create an ismrmrd.Acquisition for every readout line, set its flags one by one and append it
+to an ismrmrd.Dataset, which resizes the HDF5 datasets at every line. Here the headers of all the acquisitions are a
+NumPy structured array with the layout of ismrmrd.hdf5.acquisition_header_dtype, filled with vectorized operations,
+and `write_ismrmrd` writes them with the readout lines in chunks of CHUNK_ACQUISITIONS. The file has the same
+datasets as the ones written by ismrmrd.Dataset, and the head records hold the same values, so it is read by ismrmrd
+and controller_toolbar_post as before. It is not byte-for-byte identical: the HDF5 chunking and layout differ.
+
+The sequences build their files with `output_path`, `create_header`, `directions`, `echo_train_headers` and
+`submit_ismrmrd`.
+
+`AcquisitionReader` reads the acquisitions back sorted by average, slice and phase. The order is computed from the
+encoding counters of the headers, and the readout lines are only read from the file when they are requested, so files
+larger than `mrd_memory_limit` (sys_config) are shown one slice at a time.
+"""
+
+import datetime
+
+import h5py
+import numpy as np
+
+from marge.configs import sys_config
+from marge.manager import outputmanager
+from marge.marge_utils.lazy import lazy_import
+
+ismrmrd = lazy_import('ismrmrd')  # Imported on first use
+
+# Acquisitions written at once, and chunk size of the acquisition dataset
+CHUNK_ACQUISITIONS = 1024
+
+
+def flag_bit(flag):
+    """
+    Get the bit of an ISMRMRD flag in the 'flags' field of the headers.
+
+    Args:
+        flag (int): ISMRMRD flag, e.g. ismrmrd.ACQ_FIRST_IN_SLICE.
+
+    Returns:
+        np.uint64: Bit of the flag.
+    """
+    return np.uint64(1 << (flag - 1))
+
+
+def set_first_last(headers, first_flag, last_flag, index, last):
+    """
+    Set the first and last flags of a loop in every header.
+
+    The first flag is set where index is 0, and the last flag where index is `last` and not 0, as
+    acq.setFlag(first_flag) if index == 0 elif index == last: acq.setFlag(last_flag).
+
+    Args:
+        headers (np.ndarray): Acquisition headers.
+        first_flag (int): ISMRMRD flag of the first acquisition, e.g. ismrmrd.ACQ_FIRST_IN_SLICE.
+        last_flag (int): ISMRMRD flag of the last acquisition, e.g. ismrmrd.ACQ_LAST_IN_SLICE.
+        index (np.ndarray): Index of every acquisition in the loop.
+        last (int): Index of the last acquisition of the loop.
+    """
+    index = np.asarray(index)
+    headers['flags'][index == 0] |= flag_bit(first_flag)
+    headers['flags'][(index == last) & (index != 0)] |= flag_bit(last_flag)
+
+
+def acquisition_headers(n_acquisitions, n_samples, **fields):
+    """
+    Create the headers of single channel acquisitions without trajectory.
+
+    Args:
+        n_acquisitions (int): Number of acquisitions.
+        n_samples (int): Number of samples of every acquisition.
+        **fields: Values of other header fields, e.g. discard_pre=10 or position=dfov. Arrays with one value per
+            acquisition are also accepted. The encoding counters are set afterwards in headers['idx'].
+
+    Returns:
+        np.ndarray: Headers with dtype ismrmrd.hdf5.acquisition_header_dtype.
+    """
+    headers = np.zeros(n_acquisitions, dtype=ismrmrd.hdf5.acquisition_header_dtype)
+    headers['version'] = 1
+    headers['number_of_samples'] = n_samples
+    headers['active_channels'] = 1
+    headers['available_channels'] = 1
+    for field, value in fields.items():
+        headers[field] = value
+    return headers
+
+
+def image_headers(images, **fields):
+    """
+    Create the headers of single channel 2D images.
+
+    Args:
+        images (np.ndarray): Images with shape (n_images, y, x).
+        **fields: Values of other header fields, e.g. image_type=ismrmrd.IMTYPE_COMPLEX.
+
+    Returns:
+        np.ndarray: Headers with dtype ismrmrd.hdf5.image_header_dtype.
+    """
+    n_images, n_y, n_x = images.shape
+    headers = np.zeros(n_images, dtype=ismrmrd.hdf5.image_header_dtype)
+    headers['version'] = 1
+    headers['data_type'] = ismrmrd.image.get_data_type_from_dtype(images.dtype)
+    headers['channels'] = 1
+    headers['matrix_size'] = (n_x, n_y, 1)
+    for field, value in fields.items():
+        headers[field] = value
+    return headers
+
+
+def output_path(sequence):
+    """
+    Get the path of a new ISMRMRD file of a sequence.
+
+    The file is in the `directory_rmd` folder of the sequence, named after its raw data and the current time. The time
+    is stored in mapVals['name_string'].
+
+    Args:
+        sequence (MRIBLANKSEQ): Sequence whose raw data has been saved.
+
+    Returns:
+        str: Path of the .h5 file.
+    """
+    name_string = datetime.datetime.now().strftime("%Y.%m.%d.%H.%M.%S.%f")[:-3]
+    sequence.mapVals['name_string'] = name_string
+    if not hasattr(sequence, 'raw_data_name'):
+        sequence.raw_data_name = sequence.mapVals['seqName']
+    return "%s/%s.%s.h5" % (sequence.directory_rmd, sequence.raw_data_name, name_string)
+
+
+def create_header(larmor_freq):
+    """
+    Create the ISMRMRD xml header of a single channel acquisition.
+
+    Args:
+        larmor_freq (float): Larmor frequency, stored as the H1 resonance frequency.
+
+    Returns:
+        ismrmrd.xsd.ismrmrdHeader: Header, written with toXML().
+    """
+    return ismrmrd.xsd.ismrmrdHeader(
+        experimentalConditions=ismrmrd.xsd.experimentalConditionsType(H1resonanceFrequency_Hz=larmor_freq),
+        acquisitionSystemInformation=ismrmrd.xsd.acquisitionSystemInformationType(receiverChannels=1))
+
+
+def directions(axes_orientation):
+    """
+    Get the read, phase and slice directions of the headers.
+
+    Args:
+        axes_orientation (np.ndarray): Axes orientation of the sequence, the x, y and z axis of the readout, phase and
+            slice directions.
+
+    Returns:
+        dict: 'read_dir', 'phase_dir' and 'slice_dir' unit vectors, to pass as header fields.
+    """
+    axes = np.asarray(axes_orientation).tolist()
+    fields = {}
+    for axis, field in enumerate(('read_dir', 'phase_dir', 'slice_dir')):
+        direction = [0, 0, 0]
+        direction[axes.index(axis)] = 1
+        fields[field] = direction
+    return fields
+
+
+def echo_train_headers(n_scans, n_slices, n_phases, etl, index, n_samples, **fields):
+    """
+    Create the headers of the acquisitions of an echo train sequence, in acquisition order (scan, slice, phase).
+
+    Each repetition acquires `etl` echoes, the contrasts. The counters start at 1, and the phase counter is the
+    k-space line of the echo given by `index`.
+
+    Args:
+        n_scans (int): Number of scans.
+        n_slices (int): Number of slices.
+        n_phases (int): Number of phase encoding steps.
+        etl (int): Echo train length.
+        index (np.ndarray): k-space line of each phase encoding step, e.g. from getIndex.
+        n_samples (int): Number of samples of every acquisition.
+        **fields: Values of other header fields, see `acquisition_headers`.
+
+    Returns:
+        np.ndarray: Headers with dtype ismrmrd.hdf5.acquisition_header_dtype.
+    """
+    scan, slice_idx, phase_idx = [index_.ravel() for index_ in np.indices((n_scans, n_slices, n_phases))]
+    line = np.asarray(index)[phase_idx]
+    index_in_repetition = phase_idx % etl
+    current_repetition = (phase_idx // etl) + (slice_idx * (n_phases // etl))
+    n_repetitions = (n_phases // etl) * n_slices
+
+    headers = acquisition_headers(len(scan), n_samples, scan_counter=np.arange(1, len(scan) + 1), **fields)
+    set_first_last(headers, ismrmrd.ACQ_FIRST_IN_CONTRAST, ismrmrd.ACQ_LAST_IN_CONTRAST, index_in_repetition,
+                   etl - 1)
+    set_first_last(headers, ismrmrd.ACQ_FIRST_IN_PHASE, ismrmrd.ACQ_LAST_IN_PHASE, line, n_phases - 1)
+    set_first_last(headers, ismrmrd.ACQ_FIRST_IN_SLICE, ismrmrd.ACQ_LAST_IN_SLICE, slice_idx, n_slices - 1)
+    set_first_last(headers, ismrmrd.ACQ_FIRST_IN_REPETITION, ismrmrd.ACQ_LAST_IN_REPETITION, current_repetition,
+                   n_repetitions - 1)
+    set_first_last(headers, ismrmrd.ACQ_FIRST_IN_AVERAGE, ismrmrd.ACQ_LAST_IN_AVERAGE, scan, n_scans - 1)
+
+    headers['idx']['repetition'] = current_repetition + 1
+    headers['idx']['kspace_encode_step_1'] = line + 1
+    headers['idx']['slice'] = slice_idx + 1
+    headers['idx']['contrast'] = index_in_repetition + 1
+    headers['idx']['average'] = scan + 1
+    return headers
+
+
+def _write_acquisitions(group, data, headers):
+    # Write the readout lines as the 'data' dataset of ismrmrd.Dataset, CHUNK_ACQUISITIONS lines at a time
+    n_acquisitions = len(headers)
+    samples = np.ascontiguousarray(data, dtype=np.complex64).reshape(n_acquisitions, -1).view(np.float32)
+    no_trajectory = np.zeros(0, dtype=np.float32)
+    acquisitions = group.create_dataset('data', shape=(n_acquisitions,), maxshape=(None,),
+                                        chunks=(max(min(n_acquisitions, CHUNK_ACQUISITIONS), 1),),
+                                        dtype=ismrmrd.hdf5.acquisition_dtype)
+    for start in range(0, n_acquisitions, CHUNK_ACQUISITIONS):
+        stop = min(start + CHUNK_ACQUISITIONS, n_acquisitions)
+        block = np.empty(stop - start, dtype=ismrmrd.hdf5.acquisition_dtype)
+        block['head'] = headers[start:stop]
+        for row, line in enumerate(samples[start:stop]):
+            block['data'][row] = line
+            block['traj'][row] = no_trajectory
+        acquisitions[start:stop] = block
+
+
+def write_ismrmrd(file_path, xml_header, data=None, headers=None, images=None, images_headers=None,
+                  image_name='image_raw'):
+    """
+    Write an ISMRMRD file with the acquisitions and, optionally, the images of a sequence.
+
+    Args:
+        file_path (str): Path of the .h5 file. It is overwritten if it exists.
+        xml_header (str): ISMRMRD xml header, e.g. create_header(larmor_freq).toXML().
+        data (np.ndarray, optional): Readout lines, one row per acquisition.
+        headers (np.ndarray, optional): Acquisition headers, see `acquisition_headers`.
+        images (np.ndarray, optional): Images with shape (n_images, y, x).
+        images_headers (np.ndarray, optional): Image headers, see `image_headers`.
+        image_name (str, optional): Name of the image group. Defaults to 'image_raw'.
+    """
+    with h5py.File(file_path, 'w') as file:
+        group = file.create_group('dataset')
+        xml = group.create_dataset('xml', shape=(1,), dtype=h5py.special_dtype(vlen=bytes))
+        xml[0] = xml_header
+
+        if headers is not None:
+            _write_acquisitions(group, data, headers)
+
+        if images is not None:
+            n_images, n_y, n_x = images.shape
+            image_group = group.create_group(image_name)
+            image_group.create_dataset('header', data=images_headers, maxshape=(None,))
+            attributes = image_group.create_dataset('attributes', shape=(n_images,), maxshape=(None,),
+                                                    dtype=h5py.special_dtype(vlen=str))
+            attributes[:] = [''] * n_images
+            image_dtype = ismrmrd.hdf5.get_arrayhdf5type(images.dtype)
+            image_data = np.ascontiguousarray(images).reshape(n_images, 1, 1, n_y, n_x).view(image_dtype)
+            image_group.create_dataset('data', data=image_data, maxshape=(None, 1, 1, n_y, n_x))
+
+
+def submit_ismrmrd(path, header, data, headers, images, fov, dfov, axes_directions):
+    """
+    Write the ISMRMRD file of a sequence in the background, from copies of the data.
+
+    Args:
+        path (str): Path of the .h5 file, see `output_path`.
+        header (ismrmrd.xsd.ismrmrdHeader): xml header, see `create_header`.
+        data (np.ndarray): Readout lines, one row per acquisition.
+        headers (np.ndarray): Acquisition headers.
+        images (np.ndarray): Complex images with shape (n_images, y, x).
+        fov (list): Field of view in cm.
+        dfov (list): Position of the field of view.
+        axes_directions (dict): Read, phase and slice directions, see `directions`.
+    """
+    images_headers = image_headers(images,
+                                   field_of_view=np.array(fov) * 10,  # mm
+                                   position=np.array(dfov).flatten(),
+                                   image_type=ismrmrd.IMTYPE_COMPLEX,
+                                   **axes_directions)
+    outputmanager.get_writer().submit(path, write_ismrmrd, path, header.toXML(), data.astype(np.complex64), headers,
+                                      outputmanager.snapshot(images), images_headers)
+
+
+class AcquisitionReader:
+    """
+    Read the acquisitions of an ISMRMRD file sorted by average, slice and phase.
+
+    The headers are read when the reader is created. The readout lines are read from the file when they are
+    requested, unless `load` kept all of them in memory. Rows are numbered in the sorted order.
+
+    Attributes:
+        file_path (str): Path of the .h5 file.
+        headers (np.ndarray): Sorted acquisition headers.
+        order (np.ndarray): Row of the file of every sorted acquisition.
+        shape (tuple): Number of averages, slices and phases, the largest encoding counters since they start at 1.
+        n_values (int): Number of float32 values of every readout line, real and imaginary parts interleaved.
+    """
+
+    def __init__(self, file_path, sort=True):
+        """
+        Read the headers of an ISMRMRD file.
+
+        Args:
+            file_path (str): Path of the .h5 file.
+            sort (bool, optional): Sort the acquisitions by their encoding counters. If False, they keep the order of
+                the file. Defaults to True.
+        """
+        self.file_path = file_path
+        with h5py.File(file_path, 'r') as file:
+            # Only the 'head' member of the compound dataset is read, not the readout lines
+            headers = file['dataset']['data'].fields('head')[()]
+        idx = headers['idx']
+        phase, slice_index, average = idx['kspace_encode_step_1'], idx['slice'], idx['average']
+        if sort:
+            self.order = np.lexsort((phase, slice_index, average))
+        else:
+            self.order = np.arange(len(headers))
+        self.headers = headers[self.order]
+        self.shape = tuple(int(counter.max(initial=0)) for counter in (average, slice_index, phase))
+        self.n_values = int(2 * headers['number_of_samples'].max(initial=0) * headers['active_channels'].max(initial=1))
+        self._lines = None
+
+    def __len__(self):
+        return len(self.headers)
+
+    def __getitem__(self, rows):
+        if isinstance(rows, slice):
+            return self._read(np.arange(len(self))[rows])
+        return self._read(np.array([rows]))[0]
+
+    @property
+    def nbytes(self):
+        """int: Size of the readout lines in memory."""
+        return len(self) * self.n_values * np.dtype(np.float32).itemsize
+
+    @property
+    def loaded(self):
+        """bool: True if the readout lines are kept in memory."""
+        return self._lines is not None
+
+    def load(self):
+        """
+        Read all the readout lines and keep them in memory.
+
+        Returns:
+            np.ndarray: Sorted readout lines with shape (acquisitions, n_values).
+        """
+        if self._lines is None:
+            self._lines = self._read(np.arange(len(self)))
+        return self._lines
+
+    def read_slice(self, average, slice_index):
+        """
+        Read the phase lines of one slice.
+
+        The file must have one acquisition for every average, slice and phase.
+
+        Args:
+            average (int): Average, starting at 0.
+            slice_index (int): Slice, starting at 0.
+
+        Returns:
+            np.ndarray: Readout lines with shape (phases, n_values).
+        """
+        n_averages, n_slices, n_phases = self.shape
+        start = (average * n_slices + slice_index) * n_phases
+        return self[start:start + n_phases]
+
+    def _read(self, rows):
+        if self._lines is not None:
+            return self._lines[rows]
+        if len(rows) == 0:
+            return np.zeros((0, self.n_values), dtype=np.float32)
+        file_rows = self.order[rows]
+        start, stop = file_rows.min(), file_rows.max() + 1
+        with h5py.File(self.file_path, 'r') as file:
+            data = file['dataset']['data'].fields('data')
+            if stop - start <= 2 * len(rows):
+                # Rows close together, e.g. one slice of an acquisition: read the whole range
+                lines = data[start:stop][file_rows - start]
+            else:
+                # h5py reads scattered rows in increasing order
+                unique_rows, inverse = np.unique(file_rows, return_inverse=True)
+                lines = data[unique_rows][inverse]
+        return np.stack(lines).astype(np.float32, copy=False)
+
+
+def load_acquisitions(file_path, sort=True):
+    """
+    Open the acquisitions of an ISMRMRD file, loading the readout lines if they fit in `mrd_memory_limit` (sys_config).
+
+    Args:
+        file_path (str): Path of the .h5 file.
+        sort (bool, optional): Sort the acquisitions by average, slice and phase. Defaults to True.
+
+    Returns:
+        AcquisitionReader: Reader of the acquisitions.
+    """
+    reader = AcquisitionReader(file_path, sort)
+    if reader.nbytes <= getattr(sys_config, 'mrd_memory_limit', 2 ** 30):
+        reader.load()
+    return reader
@@ -0,0 +1,221 @@
+"""
+Background writing of the files saved after every acquisition.
+
+saveRawData used to write the raw data, .csv, .dcm and .nii files before returning, so the next run waited for the
+disk. The OutputWriter writes them in a pool of threads instead: the sequence submits the function writing each file
+together with a snapshot of the values it needs, and goes on while the files are written in parallel.
+
+At most `writer_queue` files (sys_config) are waiting to be written. Submitting another one blocks until a write
+finishes, so a slow disk does not accumulate the data of many acquisitions in memory. `flush` waits for the pending
+files, e.g. before reading one of them back, and tells whether they were written and synced to disk.
+"""
+
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+
+import numpy as np
+
+from marge.configs import sys_config
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def snapshot(value):
+    """
+    Copy the arrays, lists and dictionaries of a value, so that later changes do not reach the files being written.
+
+    Args:
+        value: Value to copy, e.g. the mapVals of a sequence.
+
+    Returns:
+        Copy of the value. Other objects are not copied.
+    """
+    if isinstance(value, np.ndarray):
+        return value.copy()
+    if isinstance(value, dict):
+        return {key: snapshot(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [snapshot(item) for item in value]
+    if isinstance(value, tuple):
+        return tuple(snapshot(item) for item in value)
+    return value
+
+
+class OutputWriter:
+    """
+    Write files in a pool of threads.
+
+    Writes of the same file are done in the order they were submitted. Failed writes are printed and reported by the
+    next flush.
+
+    Attributes:
+        workers (int): Number of writing threads, 0 to write the files in the calling thread.
+        max_pending (int): Maximum number of files waiting to be written.
+        fsync (bool): Sync every file to disk once written.
+    """
+
+    def __init__(self, workers=None, max_pending=None, fsync=None):
+        if workers is None:
+            workers = getattr(sys_config, 'writer_workers', 2)
+        if max_pending is None:
+            max_pending = getattr(sys_config, 'writer_queue', 8)
+        if fsync is None:
+            fsync = getattr(sys_config, 'writer_fsync', True)
+        self.workers = workers
+        self.max_pending = max(max_pending, 1)
+        self.fsync = fsync
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='marge_writer') \
+            if workers > 0 else None
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._lock = threading.RLock()
+        self._pending = {}  # Last write of every file that is not finished
+        self._errors = {}  # Failed writes not reported by flush yet
+
+    def submit(self, file_path, function, /, *args, after=(), **kwargs):
+        """
+        Write a file in the background.
+
+        Blocks while `max_pending` files are waiting to be written.
+
+        Args:
+            file_path (str): Path of the file written by the function.
+            function (callable): Function writing the file, called as function(*args, **kwargs). The arguments must
+                not be changed afterwards, see `snapshot`.
+            after (iterable, optional): Paths of other files that must be written before this one.
+
+        Returns:
+            Future: Result of the write.
+        """
+        self._slots.acquire()
+        with self._lock:
+            previous = [self._pending[path] for path in [file_path, *after] if path in self._pending]
+            if self._executor is None:
+                future = Future()
+                try:
+                    self._write(file_path, previous, function, args, kwargs)
+                    future.set_result(None)
+                except Exception as e:
+                    future.set_exception(e)
+            else:
+                try:
+                    future = self._executor.submit(self._write, file_path, previous, function, args, kwargs)
+                except RuntimeError:
+                    self._slots.release()
+                    raise
+            self._pending[file_path] = future
+        future.add_done_callback(lambda done: self._done(file_path, done))
+        return future
+
+    def _write(self, file_path, previous, function, args, kwargs):
+        wait(previous)
+        function(*args, **kwargs)
+        if self.fsync and os.path.isfile(file_path):
+            with open(file_path, 'r+b') as file:
+                os.fsync(file.fileno())
+
+    def _done(self, file_path, future):
+        self._slots.release()
+        error = future.exception()
+        with self._lock:
+            if self._pending.get(file_path) is future:
+                del self._pending[file_path]
+            if error is not None:
+                self._errors[file_path] = error
+        if error is not None:
+            print(f"ERROR: {file_path} could not be saved: {error}")
+
+    def pending(self):
+        """
+        Get the files that are being written or waiting to be written.
+
+        Returns:
+            list: Paths of the files.
+        """
+        with self._lock:
+            return list(self._pending)
+
+    def flush(self, file_paths=None, timeout=None):
+        """
+        Wait until the pending files are written.
+
+        Args:
+            file_paths (iterable, optional): Paths of the files to wait for. Defaults to all the pending files.
+            timeout (float, optional): Maximum waiting time in seconds. Defaults to no limit.
+
+        Returns:
+            bool: True if the files were written, False if a write failed or the timeout expired.
+        """
+        with self._lock:
+            if file_paths is None:
+                file_paths = list(self._pending) + list(self._errors)
+            file_paths = list(file_paths)
+            futures = [self._pending[path] for path in file_paths if path in self._pending]
+        done, not_done = wait(futures, timeout)
+        failed = [future for future in done if future.exception() is not None]
+        with self._lock:
+            for path in file_paths:
+                if path in self._errors:
+                    failed.append(self._errors.pop(path))
+        return not not_done and not failed
+
+    def shutdown(self):
+        """
+        Write the pending files and stop the threads.
+
+        Returns:
+            bool: True if the files were written.
+        """
+        written = self.flush()
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+        return written
+
+
+def get_writer():
+    """
+    Get the writer shared by all the sequences, created with the settings in sys_config.
+
+    Returns:
+        OutputWriter: Shared writer.
+    """
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = OutputWriter()
+        return _writer
+
+
+def flush(file_paths=None, timeout=None):
+    """
+    Wait until the pending files of the shared writer are written.
+
+    Args:
+        file_paths (iterable, optional): Paths of the files to wait for. Defaults to all the pending files.
+        timeout (float, optional): Maximum waiting time in seconds. Defaults to no limit.
+
+    Returns:
+        bool: True if the files were written, False if a write failed or the timeout expired.
+    """
+    with _writer_lock:
+        writer = _writer
+    if writer is None:
+        return True
+    return writer.flush(file_paths, timeout)
+
+
+def shutdown():
+    """
+    Write the pending files of the shared writer and stop its threads.
+
+    Returns:
+        bool: True if the files were written.
+    """
+    global _writer
+    with _writer_lock:
+        writer = _writer
+        _writer = None
+    if writer is None:
+        return True
+    return writer.shutdown()
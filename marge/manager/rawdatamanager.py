@@ -0,0 +1,290 @@
+"""
+HDF5 store of the raw data of the MaRGE acquisitions.
+
+The outputs of a sequence (mapVals) used to be saved with `scipy.io.savemat`, which rewrites every array of the
+acquisition into a single .mat file that has to be read entirely to get any value. In the HDF5 store every array is
+a dataset, chunked and optionally compressed when it is large, and the scalar parameters are attributes. Lists,
+tuples and dictionaries are groups holding their items in the same way.
+
+The files are read lazily: `RawData` only reads the values that are requested, and `RawData.read` returns part of a
+dataset. `load_mat_data` returns the values as `scipy.io.loadmat` would, so the reconstruction functions read both
+.h5 and .mat files in the same way, and `export_mat` writes a .mat copy of a raw data file on demand.
+"""
+
+import io
+import os
+from collections.abc import Mapping
+
+import h5py
+import numpy as np
+import scipy.io as sio
+
+# Arrays larger than this are chunked and compressed
+MIN_CHUNKED_BYTES = 2 ** 16
+
+# Attribute with the Python type of lists, tuples, dictionaries and object arrays
+TYPE_ATTR = '.type'
+
+
+def _encode_key(key):
+    # HDF5 names cannot contain '/', and names starting with '.' are used for the type attributes
+    key = str(key).replace('%', '%25').replace('/', '%2F')
+    return '%2E' + key[1:] if key.startswith('.') else key
+
+
+def _decode_key(name):
+    return name.replace('%2F', '/').replace('%2E', '.').replace('%25', '%')
+
+
+def _is_number(value):
+    return isinstance(value, (bool, int, float, complex, np.bool_, np.number)) and not isinstance(value, np.ndarray)
+
+
+def _write_value(group, key, value, compression):
+    # Store a value as an attribute, a dataset or a group of the given group
+    key = _encode_key(key)
+    if isinstance(value, np.ndarray) and value.dtype.kind in 'biufc':
+        if value.nbytes >= MIN_CHUNKED_BYTES and value.ndim > 0:
+            group.create_dataset(key, data=value, chunks=True, compression=compression,
+                                 shuffle=compression is not None)
+        else:
+            group.create_dataset(key, data=value)
+    elif value is None:
+        group.attrs[key] = h5py.Empty('f')
+    elif isinstance(value, str):
+        group.attrs[key] = str(value)
+    elif _is_number(value) or isinstance(value, bytes):
+        group.attrs[key] = value
+    elif isinstance(value, (list, tuple)) and len(value) > 0 and all(_is_number(item) for item in value):
+        dataset = group.create_dataset(key, data=np.asarray(value))
+        dataset.attrs[TYPE_ATTR] = type(value).__name__
+    elif isinstance(value, (list, tuple)) and len(value) > 0 and all(isinstance(item, str) for item in value):
+        dataset = group.create_dataset(key, data=[str(item) for item in value], dtype=h5py.string_dtype())
+        dataset.attrs[TYPE_ATTR] = type(value).__name__
+    elif isinstance(value, (list, tuple, dict, np.ndarray)):
+        subgroup = group.create_group(key, track_order=True)
+        if isinstance(value, np.ndarray):
+            subgroup.attrs[TYPE_ATTR] = 'ndarray'
+            subgroup.attrs['.shape'] = value.shape
+            subgroup.attrs['.dtype'] = value.dtype.str
+            value = list(value.ravel())
+        else:
+            subgroup.attrs[TYPE_ATTR] = type(value).__name__
+        items = value.items() if isinstance(value, dict) else enumerate(value)
+        for item_key, item in items:
+            _write_value(subgroup, item_key, item, compression)
+    else:
+        group.attrs[key] = str(value)
+
+
+def _read_attr(value):
+    if isinstance(value, h5py.Empty):
+        return None
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def _read_node(node):
+    # Rebuild the value of a dataset or a group written by _write_value
+    kind = node.attrs.get(TYPE_ATTR)
+    if isinstance(node, h5py.Dataset):
+        value = node.asstr()[()] if h5py.check_string_dtype(node.dtype) else node[()]
+        if kind == 'list':
+            return value.tolist()
+        if kind == 'tuple':
+            return tuple(value.tolist())
+        return value
+    items = {}
+    for key, attr in node.attrs.items():
+        if not key.startswith('.'):
+            items[_decode_key(key)] = _read_attr(attr)
+    for key, child in node.items():
+        items[_decode_key(key)] = _read_node(child)
+    if kind == 'dict':
+        return items
+    values = [items[str(index)] for index in range(len(items))]
+    if kind == 'tuple':
+        return tuple(values)
+    if kind == 'ndarray':
+        array = np.empty(len(values), dtype=np.dtype(node.attrs['.dtype']))
+        array[:] = values
+        return array.reshape(node.attrs['.shape'])
+    return values
+
+
+def save_raw_data(file_path, map_vals, compression=None):
+    """
+    Save the outputs of a sequence in an HDF5 raw data file.
+
+    Args:
+        file_path (str): Path of the .h5 file. It is overwritten if it exists.
+        map_vals (dict): Values to save, usually the mapVals of the sequence.
+        compression (str, optional): Compression of the large arrays, 'lzf' or 'gzip'. Defaults to None.
+    """
+    with h5py.File(file_path, 'w', track_order=True) as file:
+        for key, value in map_vals.items():
+            _write_value(file, key, value, compression)
+
+
+def update_raw_data(file_path, values):
+    """
+    Add or replace values in an HDF5 raw data file, leaving the rest of the file unchanged.
+
+    Args:
+        file_path (str): Path of the .h5 file.
+        values (dict): Values to write.
+    """
+    with h5py.File(file_path, 'a') as file:
+        for key, value in values.items():
+            name = _encode_key(key)
+            if name in file.attrs:
+                del file.attrs[name]
+            if name in file:
+                del file[name]
+            _write_value(file, key, value, None)
+
+
+class RawData(Mapping):
+    """
+    Read-only dictionary of the values in an HDF5 raw data file.
+
+    Values are read from the file when they are requested, and the file is only kept open while reading, so it can
+    be overwritten while a RawData is in use.
+
+    Attributes:
+        file_path (str): Path of the .h5 file.
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        with h5py.File(file_path, 'r') as file:
+            # The scalar parameters are small and read at once, the arrays are read when requested
+            self._attrs = {name: _read_attr(value) for name, value in file.attrs.items() if not name.startswith('.')}
+            self._names = {_decode_key(name): name for name in list(self._attrs) + list(file.keys())}
+
+    def __getitem__(self, key):
+        if key not in self._names:
+            raise KeyError(key)
+        name = self._names[key]
+        if name in self._attrs:
+            return self._attrs[name]
+        with h5py.File(self.file_path, 'r') as file:
+            return _read_node(file[name])
+
+    def __iter__(self):
+        return iter(self._names)
+
+    def __len__(self):
+        return len(self._names)
+
+    def read(self, key, selection=()):
+        """
+        Read part of an array without loading the rest of it.
+
+        Args:
+            key (str): Key of the array.
+            selection (tuple or slice, optional): Numpy-like selection, e.g. np.s_[0, :, 10:20]. Defaults to the
+                whole array.
+
+        Returns:
+            np.ndarray: Selected part of the array.
+        """
+        with h5py.File(self.file_path, 'r') as file:
+            dataset = file[self._names[key]]
+            if not isinstance(dataset, h5py.Dataset):
+                raise TypeError(f"'{key}' is not an array")
+            return dataset[selection]
+
+    def shape(self, key):
+        """
+        Get the shape of an array without reading it.
+
+        Args:
+            key (str): Key of the array.
+
+        Returns:
+            tuple: Shape of the array.
+        """
+        with h5py.File(self.file_path, 'r') as file:
+            return file[self._names[key]].shape
+
+
+def _to_mat(value):
+    # Convert a value to what scipy.io.loadmat returns after saving it with scipy.io.savemat
+    if value is None:
+        return np.empty((0, 0))  # savemat does not accept None
+    if isinstance(value, np.ndarray) and value.dtype.kind in 'iufc' and value.nbytes >= MIN_CHUNKED_BYTES:
+        return np.atleast_2d(value)
+    buffer = io.BytesIO()
+    sio.savemat(buffer, {'value': value})
+    buffer.seek(0)
+    return sio.loadmat(buffer)['value']
+
+
+class MatData(Mapping):
+    """
+    Dictionary of the values in an HDF5 raw data file in the format returned by scipy.io.loadmat.
+
+    Values are read and converted when they are requested.
+    """
+
+    def __init__(self, raw_data):
+        self.raw_data = raw_data
+        self._cache = {}
+
+    def __getitem__(self, key):
+        if key not in self._cache:
+            self._cache[key] = _to_mat(self.raw_data[key])
+        return self._cache[key]
+
+    def __iter__(self):
+        return iter(self.raw_data)
+
+    def __len__(self):
+        return len(self.raw_data)
+
+
+def load_raw_data(file_path):
+    """
+    Open a raw data file.
+
+    Args:
+        file_path (str): Path of the .h5 file.
+
+    Returns:
+        RawData: Lazy dictionary with the saved values.
+    """
+    return RawData(file_path)
+
+
+def load_mat_data(file_path):
+    """
+    Load a raw data file in the format of scipy.io.loadmat, from either an .h5 or a .mat file.
+
+    Args:
+        file_path (str): Path of the .h5 or .mat file.
+
+    Returns:
+        Mapping: Values of the file. For .h5 files they are read when they are requested.
+    """
+    if os.path.splitext(file_path)[1].lower() == '.mat':
+        return sio.loadmat(file_path)
+    return MatData(RawData(file_path))
+
+
+def export_mat(file_path, mat_path=None):
+    """
+    Write a .mat copy of an HDF5 raw data file.
+
+    Args:
+        file_path (str): Path of the .h5 file.
+        mat_path (str, optional): Path of the .mat file. Defaults to the path of the .h5 file with .mat extension.
+
+    Returns:
+        str: Path of the .mat file.
+    """
+    if mat_path is None:
+        mat_path = os.path.splitext(file_path)[0] + '.mat'
+    sio.savemat(mat_path, {key: value for key, value in RawData(file_path).items() if value is not None})
+    return mat_path
@@ -323,13 +323,17 @@ class Experiment:
         # do not clear relevant dictionary values if user-defined configuration of init parameters at runtime is allowed
         self.add_intdict(initial_cfg, append=self._allow_user_init_cfg)
 
-        self._machine_code = np.array( fc.dict2bin(self._seq,
-                                             self.gradb.bin_config['initial_bufs'],
-                                             self.gradb.bin_config['latencies'], # TODO: can add extra manipulation here, e.g. add to another array etc
-                                             ), dtype=np.uint32 )
+        self._machine_code = self.seq2bin()
 
         self._seq_compiled = True
 
+    def seq2bin(self):
+        """ Compile the current sequence dictionary into machine code; subclasses can override this, e.g. to cache the result """
+        return np.array( fc.dict2bin(self._seq,
+                                     self.gradb.bin_config['initial_bufs'],
+                                     self.gradb.bin_config['latencies'], # TODO: can add extra manipulation here, e.g. add to another array etc
+                                     ), dtype=np.uint32 )
+
     def get_flodict(self, intd=None):
         """Calculate floating-point dictionaries based on the data inside the
         Experiment class so far -- useful for plotting or testing the sequence"""
@@ -455,14 +459,12 @@ class Experiment:
         rx1_norm_factor = self._rx0_cic_factor / (1 << 24)
 
         try:
-            rxd_iq['rx0'] = rx0_norm_factor * ( np.array(rxd['rx0_i']).astype(np.int32).astype(float) + \
-                             1j * np.array(rxd['rx0_q']).astype(np.int32).astype(float) )
+            rxd_iq['rx0'] = sc.decode_rx(rxd['rx0_i'], rxd['rx0_q'], rx0_norm_factor)
         except (KeyError, TypeError):
             pass
 
         try:
-            rxd_iq['rx1'] = rx1_norm_factor * ( np.array(rxd['rx1_i']).astype(np.int32).astype(float) + \
-                             1j * np.array(rxd['rx1_q']).astype(np.int32).astype(float) )
+            rxd_iq['rx1'] = sc.decode_rx(rxd['rx1_i'], rxd['rx1_q'], rx1_norm_factor)
         except (KeyError, TypeError):
             pass
 
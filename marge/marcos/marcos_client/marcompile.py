@@ -10,6 +10,9 @@ grad_data_bufs = (1, 2)
 
 max_removed_instructions = 1000
 
+# One change of a buffer output: (time, buffer, value, value mask)
+CHANGE_DTYPE = np.dtype([('time', np.int64), ('buf', np.uint16), ('val', np.uint16), ('mask', np.uint16)])
+
 def debug_print(*args, **kwargs):
     # print(*args, **kwargs)
     pass
@@ -130,6 +133,16 @@ def csv2bin(path, quick_start=False, initial_bufs=np.zeros(MARGA_BUFS, dtype=np.
 
     return cl2bin(changelist, changelist_grad, initial_bufs)
 
+def changes_array(times, buf, values, mask):
+    """ Changelist array of the given times and values for a single buffer """
+    n = min(len(times), len(values))
+    changes = np.empty(n, dtype=CHANGE_DTYPE)
+    changes['time'] = times[:n]
+    changes['buf'] = buf
+    changes['val'] = values[:n]
+    changes['mask'] = mask
+    return changes
+
 def dict2bin(sd, initial_bufs=np.zeros(MARGA_BUFS, dtype=np.uint16), latencies = np.zeros(MARGA_BUFS, dtype=np.int32)):
     """sd: sequence dictionary, consisting of something in the form of:
 
@@ -161,20 +174,97 @@ def dict2bin(sd, initial_bufs=np.zeros(MARGA_BUFS, dtype=np.uint16), latencies =
         buf_idces, values, masks = col2buf(col_idx, vals[1]) # single element or array of values
         t_corr = vals[0] - latencies[buf_idces[0]]
         for bi, vv, m in zip(buf_idces, values, masks):
-            for t, v in zip(t_corr, vv):
-                change = t, bi, v, m
-                if bi in grad_data_bufs:
-                    changelist_grad_local.append(change)
-                else:
-                    changelist.append(change)
+            changes = changes_array(t_corr, bi, vv, m)
+            if bi in grad_data_bufs:
+                changelist_grad_local.append(changes)
+            else:
+                changelist.append(changes)
 
         # needed to keep coupled LSB/MSB pairs together in case
         # multiple events occur on different channels simultaneously
         if len(changelist_grad_local) != 0:
-            changelist_grad_local.sort(key=lambda change: change[0])
-            changelist_grad += changelist_grad_local
+            changelist_grad_local = np.concatenate(changelist_grad_local)
+            changelist_grad.append(changelist_grad_local[np.argsort(changelist_grad_local['time'], kind='stable')])
 
-    return cl2bin(changelist, changelist_grad, initial_bufs)
+    return cl2bin(np.concatenate(changelist or [np.empty(0, dtype=CHANGE_DTYPE)]),
+                  np.concatenate(changelist_grad or [np.empty(0, dtype=CHANGE_DTYPE)]),
+                  initial_bufs)
+
+def grad_shift(changes_grad, initial_bufs):
+    """ Sort the gradient changes and move simultaneous updates of the
+    same buffer back in time, depending on what GPA is being used.
+    changes_grad: CHANGE_DTYPE array of LSB/MSB pairs, with the MSB
+    update first in each pair. Returns the shifted changes."""
+
+    # Sort in pairs of changes, because otherwise channels can get mixed up
+    n_pairs = changes_grad.size // 2
+    pairs = changes_grad[:2 * n_pairs].reshape(n_pairs, 2)
+    changes_grad = pairs[np.argsort(pairs[:, 0]['time'], kind='stable')].reshape(-1)
+
+    spi_div = (initial_bufs[0] & 0xfc) >> 2
+    t = changes_grad['time']
+    msb = changes_grad['buf'] == GRAD_MSB
+
+    # time of the last update of the same buffer; no updates have previously happened at the start
+    t_last = np.zeros_like(t)
+    for sel in (~msb, msb):
+        t_last[sel] = np.concatenate([[0], t[sel]])[:-1]
+    same = t == t_last
+
+    if np.any(~same & (t - t_last < 24 * (1 + spi_div) + 2)):
+        warnings.warn("Gradient updates are too frequent for selected SPI divider. Missed samples are likely!", MarGradWarning)
+
+    if not np.any(same):
+        return changes_grad
+
+    # number of earlier updates of the same buffer on this timestep,
+    # counted since the last update at a new time on either buffer
+    new_time = np.cumsum(~same)
+    num_chgs = np.zeros(t.size, dtype=np.int64)
+    for sel in (~msb, msb):
+        idces = np.flatnonzero(sel & same)
+        group = new_time[idces]
+        k = np.arange(idces.size)
+        num_chgs[idces] = k - np.maximum.accumulate(np.where(np.r_[True, group[1:] != group[:-1]], k, 0))
+
+    if hw.grad_board == "ocra1": # simultaneous with another grad update
+        # move non-broadcast events back in time, so that synchronisation will be done in ocra1_iface core
+        changes_grad['time'][same] -= 2 * num_chgs[same] + 1
+        # turn broadcast off if this isn't the first grad event on this timestep
+        changes_grad['val'][same & msb] &= ~np.uint16(0x0100)
+    elif hw.grad_board != "gpa-fhdo":
+        changes_grad = changes_grad[~same]
+    # for GPA-FHDO, don't do anything; currently will cause an error
+    # later since multiple events can't happen at the same time
+
+    return changes_grad
+
+def buf_values(changes, initial_bufs):
+    """ Value of each changed buffer after every change, for a
+    CHANGE_DTYPE array sorted by time """
+    after = np.empty(changes.size, dtype=np.uint16)
+    for buf in np.unique(changes['buf']):
+        idces = np.flatnonzero(changes['buf'] == buf)
+        vals, masks = changes['val'][idces], changes['mask'][idces]
+        current = np.full(idces.size, initial_bufs[buf], dtype=np.uint16)
+
+        # bits that are always written together take their value from the same last change
+        bit_groups = {}
+        unique_masks = np.unique(masks)
+        for bit in range(16):
+            used = tuple((unique_masks >> bit) & 1)
+            if any(used):
+                bit_groups[used] = bit_groups.get(used, 0) | (1 << bit)
+
+        k = np.arange(idces.size)
+        for group_mask in bit_groups.values():
+            group_mask = np.uint16(group_mask)
+            last = np.maximum.accumulate(np.where(masks & group_mask, k, -1))
+            group_vals = np.where(last >= 0, vals[last], initial_bufs[buf]) & group_mask
+            current = (current & ~group_mask) | group_vals
+
+        after[idces] = current
+    return after
 
 def cl2bin(changelist, changelist_grad,
            initial_bufs=np.zeros(MARGA_BUFS, dtype=np.uint16)):
@@ -184,219 +274,122 @@ def cl2bin(changelist, changelist_grad,
     parameters, etc) and the other, changelist_grad, for the outputs used
     to control hardware with non-trivial internal timing behaviour
     (currently only the gradient boards). Also accepts non-default initial
-    values to program the buffers to."""
+    values to program the buffers to.
 
-    # Process the grad changelist, depending on what GPA is being used etc
-    # Sort in pairs of changes, because otherwise channels can get mixed up
-    changelist_grad_paired = [ [k, m] for k, m in zip(changelist_grad[::2], changelist_grad[1::2]) ]
-    sortfn = lambda change: change[0]
-    # changelist_grad.sort(key=sortfn) # sort by time
-    sortfn_paired = lambda change: change[0][0]
-    changelist_grad_paired.sort(key=sortfn_paired) # sort by time
-    changelist_grad = [k for sl in changelist_grad_paired for k in sl] # https://stackabuse.com/python-how-to-flatten-list-of-lists/
-
-    t_last = [0, 0] # no updates have previously happened; [LSB, MSB]
-    spi_div = (initial_bufs[0] & 0xfc) >> 2
-    changelist_grad_shifted = []
-    num_chgs = [0, 0] # [LSB, MSB]
-    grad_vals = [initial_bufs[1], initial_bufs[2]] # [LSB, MSB] current output data
-    grad_vals_old = [0, 0] # [LSB, MSB] previous output data
-
-    for c in changelist_grad:
-        t = c[0]
-        debug_print("t: ", t, " t_last: ", t_last, "num_chgs: ", num_chgs, " c: ", c)
-        idx = c[1] - 1 # 0 for LSB, 1 for MSB
-        msb = idx == 1
-        data = c[2]
-        # if data == grad_vals[idx]: # no actual change to buffer output
-        #     continue # skip this change
-        # else:
-        #     grad_vals_old[idx] = grad_vals[idx]
-        #     grad_vals[idx] = data # update the last known buffer value
-
-        if t == t_last[idx]:
-            num_chgs[idx] += 1
-            # assume the changes in changelist_grad are paired with LSBs/MSBs matching each other's grad channels stored sequentially,
-            # and that for each event, the MSB update is first
-            if hw.grad_board == "ocra1": # simultaneous with another grad update
-                if msb:
-                    if num_chgs[1]: # MSB buffer and not the first grad event on this timestep
-                        # turn broadcast off if this isn't the first grad event on this timestep
-                        data = data & ~np.uint16(0x0100)
-                        # return LSB back to old values, since this one is now done in the past
-                        grad_vals[:] = grad_vals_old # revert the last known buffer values
-                # else:
-                #     if data == grad_vals[idx]: # no actual change to buffer output compared to earlier LSB at this timestep
-                #         continue # skip this change
-
-                # move non-broadcast events back in time, so that synchronisation will be done in ocra1_iface core
-                changelist_grad_shifted.append( (c[0]-num_chgs[idx], c[1], data, c[3]) )
-                num_chgs[idx] += 1
-            elif hw.grad_board == "gpa-fhdo":
-                # don't do anything; currently will cause an error
-                # later since multiple events can't happen at the same
-                # time for GPA-FHDO
-                changelist_grad_shifted.append(c)
-        else:
-            if t - t_last[idx] < 24 * (1 + spi_div) + 2: #
-                warnings.warn("Gradient updates are too frequent for selected SPI divider. Missed samples are likely!", MarGradWarning)
+    Changelists are CHANGE_DTYPE arrays or lists of (time, buffer,
+    value, mask) tuples; returns the machine code as a uint32 array."""
 
-            # if data == grad_vals[idx]: # no actual change to buffer output
-            #     continue # skip this change
+    changes = np.concatenate([np.asarray(changelist, dtype=CHANGE_DTYPE),
+                              grad_shift(np.asarray(changelist_grad, dtype=CHANGE_DTYPE), initial_bufs)])
 
-            t_last[idx] = t
-            grad_vals[idx] = data # update the last known buffer value
-            changelist_grad_shifted.append(c)
-            num_chgs = [0, 0]
-
-    changelist += changelist_grad_shifted
-    changelist.sort(key=sortfn) # sort by time
-
-    # Track removed instruction events, but only warn when the number exceeds a minimum
-    removed_instruction_warnings = []
+    # sort by time, then by buffer; changes to a buffer at the same time keep their order
+    order = np.lexsort((changes['buf'], changes['time']))
+    changes = changes[order]
+    t, bufs, vals, masks = changes['time'], changes['buf'], changes['val'], changes['mask']
 
     # Process and combine the change list into discrete sets of operations at each time, i.e. an output list
-    def cl2ol(changelist):
-        current_bufs = initial_bufs.copy()
-        current_time = changelist[0][0]
-        unique_times = []
-        unique_changes = []
-        change_masks = np.zeros(MARGA_BUFS, dtype=np.uint16)
-        changed = np.zeros(MARGA_BUFS, dtype=bool)
-
-        def close_timestep(time):
-            ch_idces = np.where(changed)[0]
-            # buf_time_offsets = np.zeros(MARGA_BUFS, dtype=int32)
-            buf_time_offsets = 0
-            unique_changes.append( [time, ch_idces, current_bufs[ch_idces], buf_time_offsets] )
-            change_masks[:] = np.zeros(MARGA_BUFS, dtype=np.uint16)
-            changed[:] = np.zeros(MARGA_BUFS, dtype=bool)
-
-        for time, buf, val, mask in changelist:
-            if time != current_time:
-                close_timestep(current_time)
-                current_time = time
-            buf_diff = (current_bufs[buf] ^ val) & mask
-            assert buf_diff & change_masks[buf] == 0, "Tried to set a buffer to two values at once"
-            if buf_diff == 0:
-                if buf not in (1, 2):
-                    # gradient buffers will have unneeded instructions
-                    # all the time, so not worth warning the user for
-                    # those
-                    removed_instruction_warnings.append( "Instruction at tick {:d}, buffer {:d}, value 0x{:04x}, mask 0x{:04x} will have no effect. Skipping...".format(time, buf, val, mask) )
-                continue
-            val_masked = val & mask
-            old_val_unmasked = current_bufs[buf] & ~mask
-            new_val = old_val_unmasked | val_masked
-            change_masks[buf] |= mask
-            current_bufs[buf] = new_val
-            changed[buf] = True
-
-        close_timestep(current_time)
-
-        return unique_changes
-
-    changes = cl2ol(changelist)
-
-    # warn about all the removed instructions if there are more than a maximum number
-    if len(removed_instruction_warnings) > max_removed_instructions:
-        for riw in removed_instruction_warnings:
+    after = buf_values(changes, initial_bufs)
+    before = np.empty_like(after)
+    for buf in np.unique(bufs):
+        idces = np.flatnonzero(bufs == buf)
+        before[idces] = np.concatenate([[initial_bufs[buf]], after[idces[:-1]]])
+    buf_diff = (before ^ vals) & masks
+    effective = buf_diff != 0
+
+    new_step = np.r_[True, t[1:] != t[:-1]]
+    new_group = new_step | np.r_[True, bufs[1:] != bufs[:-1]] # same time and buffer
+    group = np.cumsum(new_group) - 1
+    group_starts = np.flatnonzero(new_group)
+
+    # check changes to the same buffer at the same time against the bits already changed on this timestep
+    multiple = np.flatnonzero(np.diff(np.r_[group_starts, t.size]) > 1)
+    if multiple.size:
+        idces = np.flatnonzero(np.isin(group, multiple))
+        starts = group_starts[group[idces]]
+        for bit in range(16):
+            changed = effective & ((masks >> bit) & 1 == 1)
+            count = np.cumsum(changed) - changed
+            earlier = count[idces] - count[starts]
+            assert not np.any(((buf_diff[idces] >> bit) & 1 == 1) & (earlier > 0)), "Tried to set a buffer to two values at once"
+
+    # warn about all the removed instructions if there are more than a maximum number;
+    # gradient buffers will have unneeded instructions all the time, so not worth warning the user for those
+    removed = np.flatnonzero(~effective & (bufs != GRAD_LSB) & (bufs != GRAD_MSB))
+    if removed.size > max_removed_instructions:
+        removed = removed[np.lexsort((order[removed], t[removed]))]
+        for time, buf, val, mask in zip(t[removed], bufs[removed], vals[removed], masks[removed]):
+            riw = "Instruction at tick {:d}, buffer {:d}, value 0x{:04x}, mask 0x{:04x} will have no effect. Skipping...".format(time, buf, val, mask)
             warnings.warn(riw, MarRemovedInstructionWarning)
         warnings.warn("NOTE: Fewer than {:d} removed-instruction warnings will not be printed -- keep this in mind when searching for the root cause.".format(max_removed_instructions))
 
-    # Process time offsets
-    for ch, ch_prev in zip( reversed(changes[1:]), reversed(changes[:-1]) ):
-        # does the current timestep need to output more data than can
-        # fit into the time gap since the previous timestep?
-        timestep = np.int32(ch[0] - ch_prev[0])
-        timediff = np.int32(ch[1].size - timestep)
-        # if timestep < ch[1].size: # not enough time
-
-        if timediff > 0:
-            ch_prev[0] -= timediff # move prev. event into the past
-            ch_prev[3] = timediff # make prev. event's buffers output in its future
+    # buffers output on each timestep, with their final values
+    step = np.cumsum(new_step) - 1
+    times = t[new_step]
+    last = np.r_[group_starts[1:] - 1, t.size - 1]
+    last = last[np.bincount(group, weights=effective, minlength=group_starts.size) > 0]
+    instr_step, instr_buf, instr_val = step[last], bufs[last], after[last]
+    b_instrs = np.bincount(instr_step, minlength=times.size)
+
+    # Process time offsets: move events into the past if the
+    # following timestep needs to output more data than can fit into
+    # the time gap since the previous timestep
+    instrs_after = b_instrs[::-1].cumsum()[::-1] - b_instrs
+    event_times = np.minimum.accumulate((times + instrs_after)[::-1])[::-1] - instrs_after
+    time_offsets = times - event_times # the delay until the buffers will output their values
 
     # convert to differential timesteps
-    last_time = 0
-    for ch in changes:
-        ch0 = ch[0]
-        ch[0] = ch0 - last_time
-        last_time = ch0
-
-    # Interpretation of each element of changes list:
-    # [time when all instructions for this change will have completed,
-    #  buffers that need to be changed,
-    #  values to set the buffers to,
-    #  the delay until the buffers will output their values]
+    dtimes = np.diff(np.r_[0, event_times])
+
+    # soak up any extra time which is in excess of what the instructions need to execute synchronously
+    excess_dtime = dtimes - b_instrs
+    wait_max = COUNTER_MAX + 3
+    long_waits = np.where(excess_dtime > 2, excess_dtime // wait_max, 0)
+    excess_left = np.where(excess_dtime > 2, excess_dtime - long_waits * wait_max, excess_dtime)
+    short_waits = (excess_left > 2).astype(np.int64)
+    # final delay of 1 or 2 cycles (nops for the whole excess, matching the original instruction loop)
+    nops = np.where((excess_dtime > 0) & (excess_left > 0) & (excess_left <= 2), excess_dtime, 0)
 
     ### Write out instructions
+    n_initial = MARGA_BUFS
+    sizes = long_waits + short_waits + nops + b_instrs
+    starts = n_initial + np.cumsum(sizes) - sizes
+    bdata = np.zeros(n_initial + sizes.sum() + 1, dtype=np.uint32) # nops are zero
 
     # Write out initial buffer values
-    bdata = []
-    addr = 0
-    states = initial_bufs
     # reversed order, so that grad board is enabled last of all (to avoid spurious initial transfer)
-    for k, ib in enumerate(reversed(initial_bufs)):
-        bdata.append(instb(MARGA_BUFS-1-k, k, ib))
-
-    last_buf_time_left = np.zeros(MARGA_BUFS, dtype=np.int32)
-    buf_time_left = np.zeros(MARGA_BUFS, dtype=np.int32)
-    # buf_empty_time = np.zeros(MARGA_BUFS, dtype=np.int32)
-    debug_print("changes:")
-    for k in changes:
-        debug_print(k)
-
-    for event in changes:
-        b_instrs = event[1].size
-        dtime = event[0]
-
-        # soak up any extra time which is in excess of what the instructions need to execute synchronously
-        excess_dtime = dtime - b_instrs
-        excess_dtime_tmp = excess_dtime
-        while excess_dtime_tmp > 2: # delay of 3 or more cycles needed
-            wait_time = min(excess_dtime_tmp, COUNTER_MAX + 3) # delay for the time instruction
-            bdata.append(insta(IWAIT, wait_time - 3))
-            excess_dtime_tmp -= wait_time
-            debug_print("i wait ", wait_time - 3)
-        if excess_dtime_tmp: # final delay of 1 or 2 cycles
-            for k in range(dtime - b_instrs):
-                debug_print("i nop")
-                bdata.append(insta(INOP, 0))
-
-        # time left after delays from nops or waits
-        # dtime_eff could be increased later with a more advanced
-        # compiler, to make the buffers bear more of the internal
-        # delays
-        # dtime_eff = b_instrs
-
-        # count down the times until each channel buffer will be empty
-        buf_time_left -= excess_dtime
-        buf_time_left[buf_time_left < 0] = 0
-        this_time_offset = event[3]
-        debug_print("--- dtime {:2d}, this_time_offset: {:2d}, b_instrs: {:2d}, lbtl: ".format(dtime, this_time_offset, b_instrs), last_buf_time_left[5:9])
-        for m, (ind, dat) in enumerate(zip(event[1], event[2])):
-            execution_delay = b_instrs - m - 1 #+ time - 2
-            btli = buf_time_left[ind]
-            buf_empty = btli <= m
-            if buf_empty: # buffer empty for this instruction; need an appropriate delay only for sync
-                # (check against m since with successive cycles, remaining buffers will empty out)
-                extra_delay = execution_delay + this_time_offset
-                buf_time_left[ind] = this_time_offset + b_instrs
-            else:
-                # buffer already not empty on this cycle
-                extra_delay = this_time_offset - btli + b_instrs - 1
-                buf_time_left[ind] += extra_delay + 1
-
-            debug_print("bti={:d} btli={:d} m={:d} empty={:d} edel={:d} instb i {:d} del {:d} dat {:d}".format(
-                buf_time_left[ind], btli, m, buf_empty, execution_delay, ind, extra_delay, dat))
-            bdata.append(instb(ind, extra_delay, dat))
-
-        buf_time_left -= b_instrs # take into account execution time of this timestep
+    targets = np.arange(MARGA_BUFS - 1, -1, -1)
+    bdata[:n_initial] = instb_array(targets, np.arange(MARGA_BUFS), initial_bufs[targets])
+
+    # delays for the time instruction
+    idces = np.repeat(starts, long_waits) + np.arange(long_waits.sum()) - np.repeat(np.cumsum(long_waits) - long_waits, long_waits)
+    bdata[idces] = (IWAIT << 24) | (COUNTER_MAX & 0xffffff)
+    short = short_waits > 0
+    bdata[starts[short] + long_waits[short]] = (IWAIT << 24) | (excess_left[short] - 3)
+
+    # The delay of each buffered instruction depends on the time left
+    # until its buffer is empty, which is only non-zero for a few
+    # cycles after the buffer was last written
+    m = np.arange(instr_step.size) - (np.cumsum(b_instrs) - b_instrs)[instr_step]
+    by_buf = np.lexsort((instr_step, instr_buf))
+    prev_step = np.full(instr_step.size, -1)
+    same_buf = instr_buf[by_buf][1:] == instr_buf[by_buf][:-1]
+    prev_step[by_buf[1:][same_buf]] = instr_step[by_buf][:-1][same_buf]
+    prev_offset = np.where(prev_step >= 0, time_offsets[prev_step], 0)
+    prev_time = np.where(prev_step >= 0, event_times[prev_step], 0)
+    b = b_instrs[instr_step]
+    buf_time_left = np.maximum(prev_offset + b - (event_times[instr_step] - prev_time), 0)
+    extra_delay = time_offsets[instr_step] + b - 1 - np.maximum(m, buf_time_left)
+    assert np.all((0 <= extra_delay) & (extra_delay <= 255)), "Delay out of range"
+    bdata[starts[instr_step] + long_waits[instr_step] + short_waits[instr_step] + nops[instr_step] + m] = instb_array(instr_buf, extra_delay, instr_val)
 
     # Finish sequence
-    bdata.append(insta(IFINISH, 0))
+    bdata[-1] = insta(IFINISH, 0)
     return bdata
 
+def instb_array(tgt, delay, data):
+    """ Vectorised instb(), for arrays of targets, delays and data """
+    return (np.uint32(IDATA) << 24) | ((np.asarray(tgt, dtype=np.uint32) & 0x7f) << 24) | (np.asarray(delay, dtype=np.uint32) << 16) | np.asarray(data, dtype=np.uint32)
+
 CIC_SLOWEST_RATE_NEAREST_POW2 = 1 << np.ceil(np.log2(CIC_SLOWEST_RATE)).astype(int)
 
 def cic_words(rate, set_cic_shift=False):
@@ -1,6 +1,8 @@
 #!/usr/bin/env python3
 
+import time
 import msgpack, warnings
+import numpy as np
 
 from marge.marcos.marcos_client.marmachine import MarServerWarning
 
@@ -14,6 +16,8 @@ emergency_stop_pkt = 1
 close_server_pkt = 2
 reply_pkt = 128
 
+recv_size = 1 << 20 # bytes requested from the socket per read
+
 def construct_packet(data, packet_idx=0, command=request_pkt, version=(version_major, version_minor, version_debug)):
     vma, vmi, vd = version
     assert vma < 256 and vmi < 256 and vd < 256, "Version is too high for a byte!"
@@ -58,20 +62,76 @@ def construct_packet(data, packet_idx=0, command=request_pkt, version=(version_m
 #         print("Reply data: ")
 #         print(reply_data)
 
-def send_packet(packet, socket):
-    socket.sendall(msgpack.packb(packet))
+def send_packet(packet, socket, stats=None):
+    """
+    Send a packet to the MaRCoS server and return the first reply.
 
-    unpacker = msgpack.Unpacker()
-    packet_done = False
-    while not packet_done:
-        buf = socket.recv(1024)
-        if not buf:
+    The reply is received with large recv_into reads into a reusable buffer; the unpacker keeps the partial reply
+    between reads, so its size is not limited by a fixed buffer.
+
+    Args:
+        packet (list): Packet built with construct_packet().
+        socket: Connected TCP socket to the MaRCoS server.
+        stats (dict, optional): Filled with the received 'bytes', the 'wait_time' until the first byte arrives (it
+            includes the sequence run time) and the 'transfer_time' of the reply, in seconds.
+
+    Returns:
+        list: Unpacked reply, or None if the connection was closed.
+    """
+    socket.sendall(msgpack.packb(packet))
+    t0 = time.perf_counter()
+    t_first = None
+    n_bytes = 0
+
+    unpacker = msgpack.Unpacker(max_buffer_size=0)
+    view = memoryview(bytearray(recv_size))
+    while True:
+        n = socket.recv_into(view)
+        if not n:
             break
-        unpacker.feed(buf)
+        if t_first is None:
+            t_first = time.perf_counter()
+        n_bytes += n
+        unpacker.feed(view[:n])
         for o in unpacker: # ugly way of doing it
+            if stats is not None:
+                stats.update({'bytes': n_bytes, 'wait_time': t_first - t0, 'transfer_time': time.perf_counter() - t_first})
             return o # quit function after 1st reply (could make this a thread in the future)
 
-def command(server_dict, socket, print_infos=False, assert_errors=False):
+def decode_rx(rx_i, rx_q, scale, sign=1, dtype=np.complex64):
+    """
+    Decode the I and Q words of an RX channel into a complex array in a single pass.
+
+    The server sends each channel as a list of unsigned 32-bit words, or as msgpack binary or ext payloads of
+    little-endian words, which are read in place with np.frombuffer. The words are interpreted as signed integers.
+
+    Args:
+        rx_i: I words of the channel.
+        rx_q: Q words of the channel.
+        scale (float): Factor applied to both components.
+        sign (int, optional): Sign applied to the Q component. Defaults to 1.
+        dtype (numpy.dtype, optional): Complex output type. Defaults to np.complex64.
+
+    Returns:
+        numpy.ndarray: scale * (I + sign * 1j * Q).
+    """
+    def words(data):
+        if isinstance(data, msgpack.ExtType):
+            data = data.data
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            return np.frombuffer(data, dtype='<i4')
+        try:
+            return np.fromiter(data, dtype=np.uint32, count=len(data)).view(np.int32)
+        except OverflowError: # signed words
+            return np.array(data).astype(np.int32)
+
+    i, q = words(rx_i), words(rx_q)
+    out = np.empty(np.broadcast_shapes(i.shape, q.shape), dtype=dtype)
+    np.multiply(i, scale, out=out.real, casting='unsafe')
+    np.multiply(q, sign * scale, out=out.imag, casting='unsafe')
+    return out
+
+def command(server_dict, socket, print_infos=False, assert_errors=False, stats=None):
     """
     Send a command dictionary to the MaRCoS server and return the reply status.
 
@@ -80,12 +140,13 @@ def command(server_dict, socket, print_infos=False, assert_errors=False):
         socket: Connected TCP socket to the MaRCoS server.
         print_infos (bool, optional): Print server info messages if present. Defaults to False.
         assert_errors (bool, optional): Raise an exception on server errors. Defaults to False.
+        stats (dict, optional): Filled with the transfer statistics of the reply, see send_packet().
 
     Returns:
         dict: Parsed reply status from the server.
     """
     packet = construct_packet(server_dict)
-    reply = send_packet(packet, socket)
+    reply = send_packet(packet, socket, stats)
     return_status = reply[5]
 
     if print_infos and 'infos' in return_status:
@@ -0,0 +1,311 @@
+"""
+Pure-Python MaRCoS server simulator.
+
+Speaks the msgpack protocol of marcos_server over TCP, so the whole client path (Experiment.compile, server_comms and
+the transfer of the RX data) can be exercised and benchmarked without a Red Pitaya. The machine code received with
+run_seq is decoded with the marmachine definitions to find the sequence duration and the RX windows, and the reply
+contains synthetic RX streams with the number of samples the hardware would acquire.
+
+Usage:
+    python -m marge.marcos.marcos_simulator [--port PORT] [--latency S] [--loss P] [--time-scale F]
+"""
+
+import argparse
+import asyncio
+import threading
+
+import msgpack
+import numpy as np
+
+import marge.marcos.marcos_client.server_comms as sc
+from marge.marcos.marcos_client.local_config import fpga_clk_freq_MHz, port
+from marge.marcos.marcos_client.marmachine import (IDATA, IFINISH, IWAIT, RX0_RATE, RX1_RATE, RX_CTRL,
+                                                   CIC_RATE_DATAWIDTH)
+
+c_ok = 0
+c_err = -1
+
+# RX_CTRL bits enabling the RX channels, see marcompile.col2buf
+RX_EN_BITS = (8, 9)
+
+
+def decode_machine_code(machine_code):
+    """
+    Decode the timing of a marga program and count the RX samples acquired by each channel.
+
+    Each instruction takes one clock cycle, except the waits, which take their count plus three cycles. A buffered
+    instruction outputs its value `delay` cycles after it reaches the head of its buffer, that is, after it is issued
+    and the previous value of the same buffer has been output.
+
+    Args:
+        machine_code (bytes or numpy.ndarray): Little-endian 32-bit instruction words.
+
+    Returns:
+        tuple: Duration of the sequence in clock cycles and number of samples of RX0 and RX1.
+    """
+    words = np.frombuffer(machine_code, dtype='<u4') if isinstance(machine_code, (bytes, bytearray, memoryview)) \
+        else np.asarray(machine_code, dtype=np.uint32)
+    op = words >> 24
+    finish = np.flatnonzero(op == IFINISH)
+    if finish.size:
+        words, op = words[:finish[0] + 1], op[:finish[0] + 1]
+    cost = np.where(op == IWAIT, (words & 0xffffff).astype(np.int64) + 3, 1)
+    issue = np.cumsum(cost) - cost
+    duration = int(cost.sum())
+
+    # Output times of the RX configuration buffers
+    buffered = np.flatnonzero(op & IDATA)
+    targets = op[buffered] & 0x7f
+    delays = (words[buffered] >> 16) & 0xff
+    head = {}
+    events = []
+    for idx, tgt, delay in zip(buffered, targets, delays):
+        t = max(int(issue[idx]), head.get(tgt, 0)) + int(delay)
+        head[tgt] = t + 1
+        if tgt in (RX0_RATE, RX1_RATE, RX_CTRL):
+            events.append((t, int(tgt), int(words[idx] & 0xffff)))
+    events.sort(key=lambda event: event[0])
+
+    # Accumulate the enabled time of each channel at its CIC decimation rate
+    rates = [1, 1]
+    enabled = [None, None]
+    samples = [0, 0]
+    for t, tgt, value in events:
+        if tgt in (RX0_RATE, RX1_RATE):
+            if not value >> CIC_RATE_DATAWIDTH:  # Rate word, the other words set the CIC shift
+                rates[tgt - RX0_RATE] = value & ((1 << CIC_RATE_DATAWIDTH) - 1)
+            continue
+        for ch, bit in enumerate(RX_EN_BITS):
+            en = (value >> bit) & 1
+            if en and enabled[ch] is None:
+                enabled[ch] = t
+            elif not en and enabled[ch] is not None:
+                samples[ch] += int(round((t - enabled[ch]) / rates[ch]))
+                enabled[ch] = None
+    for ch in range(2):
+        if enabled[ch] is not None:
+            samples[ch] += int(round((duration - enabled[ch]) / rates[ch]))
+
+    return duration, samples[0], samples[1]
+
+
+class MarcosSimulator:
+    """
+    asyncio TCP server answering MaRCoS requests.
+
+    Register reads return zero, so the GPA and gradient boards always look idle. Sequences return synthetic RX data:
+    complex Gaussian noise plus a constant offset, in the unsigned 32-bit words sent by the real server.
+
+    Attributes:
+        host (str): Interface the server listens on.
+        port (int): TCP port, 0 picks a free one (updated once the server is listening).
+        latency (float): Extra time in seconds before every reply.
+        loss (float): Probability that a run_seq loses RX data: the last samples of the reply are dropped and a RX
+            FIFO warning is returned, as on the hardware.
+        time_scale (float): Fraction of the sequence duration to wait before replying to run_seq, 1 for real time.
+        noise (float): Standard deviation of the synthetic RX data, in ADC units.
+        offset (float): Constant added to the I component of the synthetic RX data, in ADC units.
+        binary (bool): Send the RX words as msgpack binary payloads instead of integer arrays.
+        stats (dict): Number of 'requests', 'sequences' and RX 'samples' served, and the simulated 'duration' in s.
+    """
+
+    def __init__(self, host='127.0.0.1', port=port, latency=0.0, loss=0.0, time_scale=0.0,
+                 noise=1000.0, offset=0.0, binary=False, seed=None):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.loss = loss
+        self.time_scale = time_scale
+        self.noise = noise
+        self.offset = offset
+        self.binary = binary
+        self.stats = {'requests': 0, 'sequences': 0, 'samples': 0, 'duration': 0.0}
+        self._rng = np.random.default_rng(seed)
+        self._server = None
+        self._loop = None
+        self._thread = None
+        self._writers = set()
+        self._ready = threading.Event()
+
+    async def serve(self):
+        """
+        Listen for clients until the server is closed.
+        """
+        self._loop = asyncio.get_running_loop()
+        self._server = await asyncio.start_server(self._handle_client, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._ready.set()
+        async with self._server:
+            try:
+                await self._server.serve_forever()
+            except asyncio.CancelledError:
+                pass
+
+    def start(self):
+        """
+        Run the server in a background thread.
+
+        Returns:
+            MarcosSimulator: The simulator, listening on `port`.
+        """
+        self._ready.clear()
+        self._thread = threading.Thread(target=asyncio.run, args=(self.serve(),), daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        return self
+
+    def stop(self):
+        """
+        Close the server started with start().
+        """
+        if self._server is not None and self._loop is not None and self._loop.is_running():
+            self._loop.call_soon_threadsafe(self._close)
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def _close(self):
+        # Stop listening and drop the clients, which would otherwise keep the server open
+        self._server.close()
+        for writer in list(self._writers):
+            writer.close()
+
+    async def _handle_client(self, reader, writer):
+        self._writers.add(writer)
+        unpacker = msgpack.Unpacker(max_buffer_size=0)
+        close = False
+        try:
+            while not close:
+                data = await reader.read(sc.recv_size)
+                if not data:
+                    break
+                unpacker.feed(data)
+                for packet in unpacker:
+                    reply, delay, close = self.process(packet)
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                    writer.write(msgpack.packb(reply))
+                    await writer.drain()
+                    if close:
+                        break
+        except ConnectionError:
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+        if close:
+            self._close()
+
+    def process(self, packet):
+        """
+        Answer one request packet.
+
+        Args:
+            packet (list): Unpacked request [command, index, 0, version, data].
+
+        Returns:
+            tuple: Reply packet, time to wait before sending it in seconds, and whether the server has to shut down.
+        """
+        command, index, _, version, data = packet[:5]
+        self.stats['requests'] += 1
+        status = {}
+        reply = {}
+        delay = self.latency
+        close = False
+
+        if version >> 16 != sc.version_major:
+            status.setdefault('errors', []).append("Client version %i.%i.%i significantly different from server "
+                                                   "version" % (version >> 16, (version >> 8) & 0xff, version & 0xff))
+        if command == sc.emergency_stop_pkt:
+            status.setdefault('errors', []).append("Emergency stop not yet implemented!")
+            status.setdefault('warnings', []).append("Tried to carry out emergency stop!")
+        elif command == sc.close_server_pkt:
+            status.setdefault('infos', []).append("Shutting down server.")
+            close = True
+        elif not data:
+            status.setdefault('errors', []).append("no commands present or incorrectly formatted request")
+        else:
+            for name, value in data.items():
+                if name == 'run_seq':
+                    reply[name], duration = self._run_seq(value, status)
+                    delay += duration * self.time_scale
+                elif name == 'halt_and_reset':
+                    reply[name] = True
+                elif name in ('direct', 'ctrl', 'fpga_clk', 'read_mem', 'mar_mem', 'acq_rlim'):
+                    reply[name] = c_ok
+                elif name == 'regrd':
+                    reply[name] = 0
+                elif name == 'regstatus':
+                    reply[name] = [0] * 7
+                elif name == 'read_rx':
+                    reply[name] = c_ok
+                    status.setdefault('warnings', []).append("no RX data received")
+                elif name == 'test_net':
+                    reply[name] = {'array1': [1.01 * k for k in range(value)],
+                                   'array2': [1.01 * (k + 10) for k in range(value)]}
+                elif name == 'are_you_real':
+                    reply[name] = "simulation"
+                else:
+                    reply[name] = c_err
+                    status.setdefault('errors', []).append("not all client commands were understood")
+
+        reply_type = sc.reply_pkt + 1 if command == sc.emergency_stop_pkt else sc.reply_pkt
+        return [reply_type, index + 1, 0, sc.version_full, reply, status], delay, close
+
+    def _run_seq(self, machine_code, status):
+        duration, *n_samples = decode_machine_code(machine_code)
+        duration /= fpga_clk_freq_MHz * 1e6
+        self.stats['sequences'] += 1
+        self.stats['duration'] += duration
+
+        if self.loss > 0 and any(n_samples) and self._rng.random() < self.loss:
+            lost = int(self._rng.integers(1, max(n_samples) + 1))
+            n_samples = [max(n - lost, 0) for n in n_samples]
+            status.setdefault('warnings', []).append("RX FIFO/s full during sequence around byte address 0x%0x"
+                                                     % (len(machine_code) // 2))
+
+        rx = {}
+        for ch, n in enumerate(n_samples):
+            if n == 0:
+                continue
+            self.stats['samples'] += n
+            for component, offset in (('i', self.offset), ('q', 0.0)):
+                words = np.round(self._rng.normal(offset, self.noise, n)).astype('<i4')
+                rx['rx%i_%s' % (ch, component)] = words.tobytes() if self.binary else words.view(np.uint32).tolist()
+        if not rx:
+            status.setdefault('warnings', []).append("no RX data received")
+            return c_ok, duration
+        return rx, duration
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1', help='Interface to listen on')
+    parser.add_argument('--port', type=int, default=port, help='TCP port')
+    parser.add_argument('--latency', type=float, default=0.0, help='Extra time before every reply, in s')
+    parser.add_argument('--loss', type=float, default=0.0, help='Probability of losing RX data in a sequence')
+    parser.add_argument('--time-scale', type=float, default=0.0,
+                        help='Fraction of the sequence duration to wait before replying, 1 for real time')
+    parser.add_argument('--noise', type=float, default=1000.0, help='Standard deviation of the RX data')
+    parser.add_argument('--binary', action='store_true', help='Send the RX data as binary payloads')
+    parser.add_argument('--seed', type=int, default=None, help='Seed of the synthetic RX data')
+    args = parser.parse_args()
+
+    simulator = MarcosSimulator(args.host, args.port, latency=args.latency, loss=args.loss,
+                                time_scale=args.time_scale, noise=args.noise, binary=args.binary, seed=args.seed)
+    print("MaRCoS simulator listening on %s:%i" % (args.host, args.port))
+    try:
+        asyncio.run(simulator.serve())
+    except KeyboardInterrupt:
+        pass
+    print("%(requests)i requests, %(sequences)i sequences, %(samples)i RX samples" % simulator.stats)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,22 +1,32 @@
-import sys
 import argparse
+
 import numpy as np
-from typing import Generator
-import mrd
-import scipy.io as sio
-import sys
+
+from marge.marge_tyger import mrd_converter
+from marge.marge_utils.lazy import lazy_import
+
+mrd = lazy_import('mrd')  # Imported on first use
+
+# Radial samples of every acquisition
+BATCH_SAMPLES = 1000
+
 
 def matToMRD(input, output_file):
+    """
+    Convert a PETRA .mat file to an MRD binary stream.
+
+    The radial samples of kSpaceRaw are written in acquisitions of up to BATCH_SAMPLES samples.
+
+    Args:
+        input (str): Path to the input .mat file.
+        output_file (str | file-like | None): Destination MRD file path or writable
+            binary stream. If None, writes to stdout.
+    """
     print('From MAT to MRD...')
-    
-    # OUTPUT - write .mrd
-    output = sys.stdout.buffer
-    if output_file is not None:
-        output = output_file
-        
+
     # INPUT - Read .mat
-    mat_data = sio.loadmat(input)
-    
+    mat_data = mrd_converter.load_mat(input)
+
     # Head info
     nPoints = mat_data['nPoints'][0]    # x,y,z (?)
     nPoints_recon  = np.sort(nPoints)
@@ -28,99 +38,38 @@ def matToMRD(input, output_file):
     # print('nPoints',  nPoints)
     # print('fov:,', fov)
     
-    # Signal vector
+    # Signal vector and k vectors, x,y,z (?)
     sampledCartesian = mat_data['kSpaceRaw']
     lenT = len(sampledCartesian)
-    signal = sampledCartesian[:,3]         
-    kSpace = np.reshape(signal, (1,lenT,1,1)) # Expand to MRD requisites
-
-    # k vectors
-    kTrajec = np.real(sampledCartesian[:,0:3]).astype(np.float32)    # x,y,z (?)
-    
-    kx = kTrajec[:,0]
-    kx = np.reshape(kx, (1,lenT,1,1))
-
-    ky = kTrajec[:,1]
-    ky = np.reshape(ky, (1,lenT,1,1))
-    
-    kz = kTrajec[:,2]
-    kz = np.reshape(kz, (1,lenT,1,1))
+    signal = sampledCartesian[:,3]
+    kTrajec = np.real(sampledCartesian[:,0:3])
     
     # OUTPUT - write .mrd
     # MRD Format
     h = mrd.Header()
-
-    sys_info = mrd.AcquisitionSystemInformationType()
-    sys_info.receiver_channels = 1
-    h.acquisition_system_information = sys_info
-
-    e = mrd.EncodingSpaceType()
-    e.matrix_size = mrd.MatrixSizeType(x=nPoints_recon[0], y=nPoints_recon[1], z=nPoints_recon[2])
-    e.field_of_view_mm = mrd.FieldOfViewMm(x=fov[0], y=fov[1], z=fov[2])
-
-    r = mrd.EncodingSpaceType()
-    r.matrix_size = mrd.MatrixSizeType(x=nPoints[0], y=nPoints[1], z=nPoints[2])
-    r.field_of_view_mm = mrd.FieldOfViewMm(x=fov[0], y=fov[1], z=fov[2])
-
-    enc = mrd.EncodingType()
-    enc.trajectory = mrd.Trajectory.RADIAL
-    enc.encoded_space = e
-    enc.recon_space = r
-    h.encoding.append(enc)
-
-    def generate_data() -> Generator[mrd.StreamItem, None, None]:
-        acq = mrd.Acquisition()
-
-        acq.data.resize((1, nPoints[0]))
-        acq.trajectory.resize((7, nPoints[0]))
-        acq.head.center_sample = round(nPoints[0] / 2)
-
-        for s in range(lenT):
-            acq.head.idx.kspace_encode_step_1 = 1
-            acq.head.idx.kspace_encode_step_2 = s
-            acq.head.idx.slice = s
-            acq.head.idx.repetition = 0
-            acq.data[:] = kSpace[:, s, :, :]
-            acq.trajectory[0,:] = kx[:, s, :, :]
-            acq.trajectory[1,:] = ky[:, s, :, :]
-            acq.trajectory[2,:] = kz[:, s, :, :]
-            
-            yield mrd.StreamItem.Acquisition(acq)
-    
-    def generate_data_batches(batch_size: int) -> Generator[mrd.StreamItem, None, None]:
-        acq = mrd.Acquisition()
-
-        for batch_start in range(0, lenT, batch_size):
-            batch_end = min(batch_start + batch_size, lenT)
-            batch_len = batch_end - batch_start
-
-            data_batch = kSpace[:, batch_start:batch_end, :, :]  
-            kx_batch = kx[:, batch_start:batch_end, :, :]
-            ky_batch = ky[:, batch_start:batch_end, :, :]
-            kz_batch = kz[:, batch_start:batch_end, :, :]
-
-            n_points_batch = np.prod(data_batch.shape)
-            
-            acq.data.resize((1, n_points_batch))
-            acq.trajectory.resize((7, n_points_batch))
-            acq.head.center_sample = round(n_points_batch / 2)
-            
-            acq.data[:] = data_batch.reshape(-1)
-            acq.trajectory[0,:] = kx_batch.reshape(-1)
-            acq.trajectory[1,:] = ky_batch.reshape(-1)
-            acq.trajectory[2,:] = kz_batch.reshape(-1)
-            
-            acq.head.idx.kspace_encode_step_1 = 1
-            acq.head.idx.kspace_encode_step_2 = batch_start  
-            acq.head.idx.slice = batch_start
-            acq.head.idx.repetition = 0
-
-            yield mrd.StreamItem.Acquisition(acq)
-
-    with mrd.BinaryMrdWriter(output) as w:
-        w.write_header(h)
-        # w.write_data(generate_data())
-        w.write_data(generate_data_batches(1000))
+    h.acquisition_system_information = mrd_converter.system_information()
+    h.encoding.append(mrd_converter.encoding(nPoints_recon, fov, trajectory=mrd.Trajectory.RADIAL,
+                                             recon_matrix=nPoints))
+
+    def batches(start, stop, batch_size):
+        # Acquisitions of batch_size samples from start to stop, with the trajectory in the first three rows
+        n_batches = (stop - start) // batch_size
+        data = signal[start:stop].reshape(n_batches, batch_size)
+        trajectory = [kTrajec[start:stop, axis].reshape(n_batches, batch_size) for axis in range(3)]
+        trajectory += [np.zeros(1, dtype=np.float32)] * 4
+        batch_start = start + batch_size * np.arange(n_batches)
+        return mrd_converter.acquisition_batches(
+            data, trajectory, head=dict(center_sample=round(batch_size / 2)),
+            idx=dict(kspace_encode_step_1=1, kspace_encode_step_2=batch_start, slice=batch_start, repetition=0))
+
+    # Full batches, and the remaining samples in a shorter one
+    n_full = lenT // BATCH_SAMPLES * BATCH_SAMPLES
+    streams = [batches(0, n_full, BATCH_SAMPLES)] if n_full else []
+    if n_full < lenT:
+        streams.append(batches(n_full, lenT, lenT - n_full))
+
+    with mrd_converter.open_output(output_file, stdout=True) as output:
+        mrd_converter.write_mrd(output, h, *streams)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Convert mat to MRD")
@@ -2,9 +2,8 @@
 
 import sys
 import argparse
-import mrd
-import scipy.io as sio
-import numpy as np
+
+from marge.marge_tyger import mrd_converter
 
 
 def export(input, output, out_field):
@@ -23,19 +22,9 @@ def export(input, output, out_field):
     Returns:
         np.ndarray: Reordered image with shape (ch, sl, ph, rd).
     """
-    with mrd.BinaryMrdReader(input) as r:
-        header = r.read_header()
-
-        for item in r.read_data():
-            if not isinstance(item, mrd.StreamItem.ImageFloat):
-                raise RuntimeError("Stream must contain only floating point images")
-
-            img = item.value
-            imgRecon = np.asarray(img.data)
-
-    rawData = sio.loadmat(output)
-    rawData[out_field] = imgRecon
-    sio.savemat(output, rawData)
+    header, images = mrd_converter.read_images(input, only_images=True)
+    imgRecon = images[-1]
+    mrd_converter.save_mat(output, {out_field: imgRecon})
     return imgRecon
             
 if __name__ == "__main__":
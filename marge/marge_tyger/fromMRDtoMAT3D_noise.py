@@ -2,9 +2,9 @@
 
 import sys
 import argparse
-import mrd
-import scipy.io as sio
-import numpy as np
+
+from marge.marge_tyger import mrd_converter
+
 
 def export(input, output, out_field, out_field_k):
     """
@@ -22,21 +22,12 @@ def export(input, output, out_field, out_field_k):
     Returns:
         np.ndarray: Raw image data from the MRD stream (before removing the channel dimension).
     """
-    images = []
-    with mrd.BinaryMrdReader(input) as reader:
-        header = reader.read_header()
-        assert header is not None, "No header found in reconstructed file"
-
-        for item in reader.read_data():
-            if isinstance(item, mrd.StreamItem.ImageFloat):
-                images.append(item.value)
-    
-    imgRecon = images[0].data        
-    rawData = sio.loadmat(output)
-    rawData[out_field] = imgRecon[0]
-    kSpace3D_den = np.fft.fftshift(np.fft.fftn(np.fft.fftshift(imgRecon[0])))
-    rawData[out_field_k] = kSpace3D_den
-    sio.savemat(output, rawData)
+    header, images = mrd_converter.read_images(input)
+    assert header is not None, "No header found in reconstructed file"
+
+    imgRecon = images[0]
+    mrd_converter.save_mat(output, {out_field: imgRecon[0],
+                                    out_field_k: mrd_converter.image_kspace(imgRecon[0])})
     return imgRecon
             
 if __name__ == "__main__":
@@ -0,0 +1,594 @@
+"""
+Conversion between MaRGE raw data files and MRD streams, shared by the marge_tyger converters.
+
+The fromMATtoMRD3D_* scripts convert a raw data file to the MRD stream sent to a Tyger pipeline, and the
+fromMRDtoMAT3D_* scripts save the images returned by the pipeline back in the .mat file. The scripts used to repeat the
+loading and reshaping of the raw data, and each one filled an mrd.Acquisition per readout line in its own generator.
+
+Here the readout lines, the trajectory and the header fields of a set of acquisitions are given as arrays, most of them
+views of the raw data reshaped without copies, and `acquisition_batches` fills them in batches of BATCH_ACQUISITIONS
+acquisitions. Every batch reuses the same preallocated acquisitions and buffers, so the trajectory is never expanded
+to the size of the k-space, and `write_mrd` streams all the batches through a single BinaryMrdWriter.write_data call.
+Each script is an adapter that builds the MRD header of its sequence and the arrays of its acquisitions.
+"""
+
+import os
+import sys
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+import scipy.io as sio
+
+from marge.manager import rawdatamanager
+from marge.marge_utils.lazy import lazy_import
+
+mrd = lazy_import('mrd')  # Imported on first use
+
+# Acquisitions filled at once, small enough for their buffers to stay in cache (see benchmarks/mrd_conversion.py)
+BATCH_ACQUISITIONS = 32
+
+
+@contextmanager
+def open_output(output_file, stdout=False):
+    """
+    Open the destination of an MRD stream.
+
+    Args:
+        output_file (str | os.PathLike | file-like | None): Path of the output file, created with its folder if needed,
+            or a writable binary stream, e.g. io.BytesIO.
+        stdout (bool, optional): Write to stdout when output_file is None. Otherwise, output_file is required.
+            Defaults to False.
+
+    Yields:
+        file-like: Binary stream. It is closed afterwards only if it was opened here.
+    """
+    if output_file is None:
+        if not stdout:
+            raise ValueError("'output_file' needed.")
+        yield sys.stdout.buffer
+    elif isinstance(output_file, (str, os.PathLike)):
+        Path(output_file).parent.mkdir(parents=True, exist_ok=True)
+        with open(output_file, 'wb') as output:
+            yield output
+    else:
+        yield output_file
+
+
+def load_mat(file_path):
+    """
+    Load a raw data file, either .mat or .h5, in the format of scipy.io.loadmat.
+
+    Args:
+        file_path (str): Path of the raw data file.
+
+    Returns:
+        Mapping: Values of the file.
+    """
+    return rawdatamanager.load_mat_data(file_path)
+
+
+class RareRawData:
+    """
+    Geometry and arrays of a RARE raw data file, in the layout used by the converters.
+
+    The k-space and the trajectory are views of the arrays of the file, reshaped to (slices, phases, readouts).
+
+    Attributes:
+        mat_data (Mapping): Values of the raw data file.
+        sampled (np.ndarray): Sampled points, with columns k_rd, k_ph, k_sl and signal in acquisition order.
+        axes (list): axesOrientation, the x, y or z axis of the readout, phase and slice directions.
+        inverse_axes (np.ndarray): Direction of the x, y and z axes, 0 for readout, 1 for phase and 2 for slice.
+        n_points (list): Number of readout, phase and slice points.
+        n_sig (list): Number of slice, phase and readout points, the shape of the k-space.
+        n_xyz (list): Number of points in the x, y and z axes.
+        fov (np.ndarray): Field of view in mm, in x, y, z order.
+        dfov (np.ndarray): Displacement of the field of view (float32), in x, y, z order.
+        acq_time (np.ndarray): Acquisition time of a readout in s, with shape (1,).
+        rd_grad_amplitude (float): Amplitude of the readout gradient.
+    """
+
+    def __init__(self, mat_data, sampled_field='sampledCartesian'):
+        self.mat_data = mat_data
+        self.sampled = mat_data[sampled_field]
+        self.axes = [int(x) for x in mat_data['axesOrientation'][0]]
+        self.inverse_axes = np.argsort(self.axes)
+        n_points = mat_data['nPoints'][0]
+        self.n_points = [int(x) for x in n_points]
+        self.n_sig = [int(x) for x in n_points[[2, 1, 0]]]
+        self.n_xyz = [int(x) for x in n_points[self.inverse_axes]]
+        self.fov = mat_data['fov'][0] * 1e1
+        self.dfov = (mat_data['dfov'][0] * 1e-3).astype(np.float32)
+        self.acq_time = mat_data['acqTime'][0] * 1e-3
+        try:  # RAREpp and RARE_double_image
+            rd_grad_amplitude = mat_data['rd_grad_amplitude']
+        except KeyError:  # RAREprotocols
+            rd_grad_amplitude = mat_data['rdGradAmplitude']
+        self.rd_grad_amplitude = float(np.squeeze(rd_grad_amplitude).item())
+
+    @property
+    def dwell(self):
+        """float: Dwell time in ns."""
+        return 1 / (self.mat_data['bw_MHz'][0][0] * 1e6) * 1e9
+
+    def kspace(self, field=None):
+        """
+        Get the k-space.
+
+        Args:
+            field (str, optional): Key of a k-space array with shape (slices, phases, readouts), e.g. 'kSpace3D_den'.
+                Defaults to the signal of the sampled points.
+
+        Returns:
+            np.ndarray: k-space with shape (slices, phases, readouts).
+        """
+        if field:
+            kspace = np.asarray(self.mat_data[field])
+            return kspace.reshape(kspace.shape[-3:])
+        return self.sampled[:, 3].reshape(self.n_sig)
+
+    def trajectory(self, physical=True):
+        """
+        Get the rows of the trajectory of the k-space lines.
+
+        The rows are the k-space coordinates, the readout times and the positions of the voxels, which are views or
+        arrays that broadcast to the shape of the k-space instead of full copies.
+
+        Args:
+            physical (bool, optional): Give the coordinates and positions in x, y, z order, with the field of view in
+                whole mm. Otherwise, they are given in readout, phase, slice order. Defaults to True.
+
+        Returns:
+            list: k_0, k_1, k_2, readout times, position_0, position_1, position_2.
+        """
+        n_rd, n_ph, n_sl = self.n_points
+        k = np.real(self.sampled[:, 0:3])
+        if physical:
+            fov_adq = [int(x) for x in self.fov[self.axes].astype(np.float32)]
+        else:
+            fov_adq = [self.fov[self.axes[axis]] for axis in range(3)]
+        rd_pos = np.linspace(-fov_adq[0] / 2, fov_adq[0] / 2, n_rd, endpoint=False)
+        ph_pos = np.linspace(-fov_adq[1] / 2, fov_adq[1] / 2, n_ph, endpoint=False)
+        sl_pos = np.linspace(-fov_adq[2] / 2, fov_adq[2] / 2, n_sl, endpoint=False)
+        k_lines = [k[:, axis].reshape(self.n_sig) for axis in range(3)]
+        positions = [rd_pos, ph_pos[:, np.newaxis], sl_pos[:, np.newaxis, np.newaxis]]
+        if physical:
+            k_lines = [k_lines[axis] for axis in self.inverse_axes]
+            positions = [positions[axis] for axis in self.inverse_axes]
+        rd_times = np.linspace(-self.acq_time / 2, self.acq_time / 2, num=n_rd).reshape(n_rd)
+        return k_lines + [rd_times] + positions
+
+    def noise(self, crop=None):
+        """
+        Get the noise acquisitions.
+
+        Args:
+            crop (int, optional): Number of points to remove at both ends of every noise acquisition, which then have
+                n_points[0] + 2 * crop points. Defaults to None, for noise acquisitions with n_points[0] points.
+
+        Returns:
+            np.ndarray: Noise acquisitions with shape (acquisitions, readouts).
+        """
+        data_noise = self.mat_data['data_noise']
+        if crop is None:
+            return data_noise[:int(self.mat_data['nNoise'][0][0].item())]
+        data_noise = np.reshape(data_noise, (-1, self.n_points[0] + crop * 2))
+        return data_noise[:, crop:-crop]
+
+
+def system_information(**values):
+    """
+    Create the acquisition system information of a single channel receiver.
+
+    Args:
+        **values: Other fields, e.g. system_vendor="PhysioMRI".
+
+    Returns:
+        mrd.AcquisitionSystemInformationType: System information.
+    """
+    sys_info = mrd.AcquisitionSystemInformationType()
+    sys_info.receiver_channels = 1
+    for name, value in values.items():
+        setattr(sys_info, name, value)
+    return sys_info
+
+
+def encoding(matrix, fov, trajectory=None, recon_matrix=None, limits=None):
+    """
+    Create an encoding with the same encoded and recon spaces.
+
+    Args:
+        matrix (sequence): Matrix size, x, y, z.
+        fov (sequence): Field of view in mm, x, y, z.
+        trajectory (mrd.Trajectory, optional): Defaults to mrd.Trajectory.CARTESIAN.
+        recon_matrix (sequence, optional): Matrix size of the recon space. Defaults to matrix.
+        limits (sequence, optional): Number of points of kspace_encoding_step_0, 1 and 2, see `encoding_limits`.
+
+    Returns:
+        mrd.EncodingType: Encoding.
+    """
+    if recon_matrix is None:
+        recon_matrix = matrix
+    enc = mrd.EncodingType()
+    enc.trajectory = mrd.Trajectory.CARTESIAN if trajectory is None else trajectory
+    for name, size in [('encoded_space', matrix), ('recon_space', recon_matrix)]:
+        space = mrd.EncodingSpaceType()
+        space.matrix_size = mrd.MatrixSizeType(x=size[0], y=size[1], z=size[2])
+        space.field_of_view_mm = mrd.FieldOfViewMm(x=fov[0], y=fov[1], z=fov[2])
+        setattr(enc, name, space)
+    if limits is not None:
+        enc.encoding_limits = encoding_limits(*limits)
+    return enc
+
+
+def encoding_limits(*steps):
+    """
+    Create the encoding limits of a single average, slice, contrast, phase, repetition, set and segment.
+
+    Args:
+        *steps (int or mrd.LimitType): Limits of kspace_encoding_step_0, 1 and 2. A number of points n is the limit
+            from 0 to n - 1 with the center at n // 2.
+
+    Returns:
+        mrd.EncodingLimitsType: Encoding limits.
+    """
+    limits = mrd.EncodingLimitsType()
+    for step, limit in enumerate(steps):
+        if not isinstance(limit, mrd.LimitType):
+            limit = mrd.LimitType(minimum=0, maximum=limit - 1, center=limit // 2)
+        setattr(limits, 'kspace_encoding_step_%i' % step, limit)
+    for name in ['average', 'slice', 'contrast', 'phase', 'repetition', 'set', 'segment']:
+        setattr(limits, name, mrd.LimitType(minimum=0, maximum=0, center=0))
+    return limits
+
+
+def add_user_parameters(header, doubles=(), strings=()):
+    """
+    Add user parameters to an MRD header.
+
+    Args:
+        header (mrd.Header): Header.
+        doubles (iterable, optional): Pairs of name and float value.
+        strings (iterable, optional): Pairs of name and value. Sequences are joined with commas, e.g. "2,1,0".
+    """
+    if header.user_parameters is None:
+        header.user_parameters = mrd.UserParametersType()
+    for name, value in doubles:
+        parameter = mrd.UserParameterDoubleType()
+        parameter.name = name
+        parameter.value = value
+        header.user_parameters.user_parameter_double.append(parameter)
+    for name, value in strings:
+        parameter = mrd.UserParameterStringType()
+        parameter.name = name
+        parameter.value = value if isinstance(value, str) else ",".join(map(str, value))
+        header.user_parameters.user_parameter_string.append(parameter)
+
+
+def _line_view(array, n_lines):
+    # View of an array as (lines, samples), or None if it needs a copy (e.g. broadcast or Fortran ordered arrays)
+    view = array.view()
+    try:
+        view.shape = (n_lines, array.shape[-1])
+    except AttributeError:
+        return None
+    return view
+
+
+def _per_line(value, grid):
+    # Values with one entry per line, flattened to (lines, ...)
+    return isinstance(value, np.ndarray) and value.shape[:len(grid)] == grid and value.ndim >= len(grid) > 0
+
+
+def acquisition_batches(data, trajectory=(), head=None, idx=None, batch_size=None):
+    """
+    Generate single channel acquisitions in batches.
+
+    Every batch reuses the acquisitions and the data and trajectory buffers of the previous one, so each batch must be
+    written before the next one is requested, as `write_mrd` does.
+
+    Args:
+        data (np.ndarray): Readout lines with shape (..., samples), e.g. (slices, phases, readouts). The acquisitions
+            follow the C order of the leading dimensions.
+        trajectory (sequence, optional): Rows of the trajectory, arrays that broadcast to the shape of data, e.g. the
+            readout times with shape (samples,). Defaults to no trajectory.
+        head (dict, optional): Values of the acquisition header fields. Arrays whose leading dimensions are those of
+            the lines give one value per acquisition, e.g. the flags with shape (slices, phases). Other values are
+            common to all the acquisitions.
+        idx (dict, optional): Values of the encoding counters, in the same way.
+        batch_size (int, optional): Acquisitions per batch. Defaults to BATCH_ACQUISITIONS.
+
+    Yields:
+        list: Batch of mrd.StreamItem.Acquisition.
+    """
+    if batch_size is None:
+        batch_size = BATCH_ACQUISITIONS
+    grid = data.shape[:-1]
+    n_samples = data.shape[-1]
+    n_lines = int(np.prod(grid))
+    batch_size = max(min(batch_size, n_lines), 1)
+    head = dict(head or {})
+    idx = dict(idx or {})
+
+    # Lines read as slices of (lines, samples) views when possible, gathered with their indices otherwise
+    data_lines = _line_view(data, n_lines)
+    trajectory = [np.broadcast_to(row, data.shape) for row in trajectory]
+    trajectory_lines = [_line_view(row, n_lines) for row in trajectory]
+    zero_copy = data_lines is not None and data_lines.dtype == np.complex64
+
+    data_buffer = np.zeros((batch_size, 1, n_samples), dtype=np.complex64)
+    trajectory_buffer = np.zeros((batch_size, len(trajectory), n_samples), dtype=np.float32)
+    no_trajectory = np.zeros((0, 0), dtype=np.float32)
+
+    # Values per line, and preallocated acquisitions with the common values
+    line_head = {name: value.reshape((n_lines,) + value.shape[len(grid):]) for name, value in head.items()
+                 if _per_line(value, grid)}
+    line_idx = {name: value.reshape((n_lines,) + value.shape[len(grid):]) for name, value in idx.items()
+                if _per_line(value, grid)}
+    flags = {}
+    items = []
+    for row in range(batch_size):
+        acq = mrd.Acquisition()
+        acq.data = data_buffer[row]
+        acq.trajectory = trajectory_buffer[row] if trajectory else no_trajectory
+        for name, value in head.items():
+            if name not in line_head:
+                setattr(acq.head, name, value)
+        for name, value in idx.items():
+            if name not in line_idx:
+                setattr(acq.head.idx, name, value)
+        items.append(mrd.StreamItem.Acquisition(acq))
+
+    for start in range(0, n_lines, batch_size):
+        stop = min(start + batch_size, n_lines)
+        n_batch = stop - start
+        lines = None
+        if data_lines is None or any(values_lines is None for values_lines in trajectory_lines):
+            lines = np.unravel_index(np.arange(start, stop), grid)
+        if zero_copy:
+            for row in range(n_batch):
+                items[row].value.data = data_lines[start + row:start + row + 1]
+        elif data_lines is not None:
+            data_buffer[:n_batch, 0] = data_lines[start:stop]
+        else:
+            data_buffer[:n_batch, 0] = data[lines]
+        for row, (values, values_lines) in enumerate(zip(trajectory, trajectory_lines)):
+            trajectory_buffer[:n_batch, row] = values_lines[start:stop] if values_lines is not None else values[lines]
+
+        head_values = [(name, value[start:stop].tolist()) for name, value in line_head.items()]
+        idx_values = [(name, value[start:stop].tolist()) for name, value in line_idx.items()]
+        for row in range(n_batch):
+            acq_head = items[row].value.head
+            for name, values in head_values:
+                value = values[row]
+                if name == 'flags':
+                    if value not in flags:
+                        flags[value] = mrd.AcquisitionFlags(value)
+                    value = flags[value]
+                setattr(acq_head, name, value)
+            for name, values in idx_values:
+                setattr(acq_head.idx, name, values[row])
+        yield items[:n_batch]
+
+
+def flag_values(*names):
+    """
+    Get the value of a combination of acquisition flags.
+
+    Args:
+        *names (str): Names of mrd.AcquisitionFlags, e.g. 'FIRST_IN_SLICE'.
+
+    Returns:
+        int: Value of the flags.
+    """
+    value = 0
+    for name in names:
+        value |= mrd.AcquisitionFlags[name].value
+    return value
+
+
+def rare_flags(n_sl, n_ph):
+    """
+    Get the flags of the k-space lines of a RARE acquisition.
+
+    The first phase line of every slice is the first in encode step 1, slice and repetition, and the last one is the
+    last in them.
+
+    Args:
+        n_sl (int): Number of slices.
+        n_ph (int): Number of phase lines.
+
+    Returns:
+        np.ndarray: Flags with shape (slices, phases).
+    """
+    flags = np.zeros((n_sl, n_ph), dtype=np.uint64)
+    flags[:, 0] |= np.uint64(flag_values('FIRST_IN_ENCODE_STEP_1', 'FIRST_IN_SLICE', 'FIRST_IN_REPETITION'))
+    flags[:, -1] |= np.uint64(flag_values('LAST_IN_ENCODE_STEP_1', 'LAST_IN_SLICE', 'LAST_IN_REPETITION'))
+    return flags
+
+
+def noise_batches(data_noise, dwell):
+    """
+    Generate the noise acquisitions written before the k-space lines.
+
+    Args:
+        data_noise (np.ndarray): Noise acquisitions with shape (acquisitions, readouts).
+        dwell (float): Dwell time in ns.
+
+    Yields:
+        list: Batch of mrd.StreamItem.Acquisition, see `acquisition_batches`.
+    """
+    n_noise, n_rd = data_noise.shape
+    n = np.arange(n_noise)
+    physiology = np.zeros((n_noise, 3), dtype=np.int64)
+    physiology[:, 0] = (2.5 * n * 1e3).astype(np.int64)
+    head = dict(center_sample=round(n_rd / 2), scan_counter=n, sample_time_ns=int(dwell),
+                acquisition_time_stamp_ns=(n * 2.5 * 1e3).astype(np.int64), physiology_time_stamp_ns=physiology,
+                channel_order=[0], flags=mrd.AcquisitionFlags.IS_NOISE_MEASUREMENT)
+    idx = dict(kspace_encode_step_1=n, kspace_encode_step_2=0, slice=0, repetition=0, average=0, phase=0, set=0,
+               contrast=0, segment=0)
+    return acquisition_batches(data_noise, head=head, idx=idx)
+
+
+def rare_batches(kspace, trajectory, dwell=None, n_noise=0):
+    """
+    Generate the k-space lines of a RARE acquisition, slice by slice.
+
+    Args:
+        kspace (np.ndarray): k-space with shape (slices, phases, readouts).
+        trajectory (sequence): Rows of the trajectory, see `RareRawData.trajectory`.
+        dwell (float, optional): Dwell time in ns. If given, the headers also have the scan counters after n_noise
+            noise acquisitions, the time stamps, the channel and the sample time, and the slice counter is 0.
+            Otherwise, the headers only have the flags and the encoding counters, and the slice counter is the slice.
+        n_noise (int, optional): Number of noise acquisitions written before the k-space lines. Defaults to 0.
+
+    Yields:
+        list: Batch of mrd.StreamItem.Acquisition, see `acquisition_batches`.
+    """
+    n_sl, n_ph, n_rd = kspace.shape
+    slices, lines = np.indices((n_sl, n_ph))
+    head = dict(flags=rare_flags(n_sl, n_ph))
+    idx = dict(kspace_encode_step_1=lines, kspace_encode_step_2=slices, slice=slices, repetition=0)
+    if dwell is not None:
+        num = lines + slices * n_ph
+        physiology = np.zeros((n_sl, n_ph, 3), dtype=np.int64)
+        physiology[:, :, 0] = (2.5 * num * 1e9).astype(np.int64)
+        head.update(scan_counter=num + n_noise, acquisition_time_stamp_ns=(num * 2 * 1e9).astype(np.int64),
+                    physiology_time_stamp_ns=physiology, channel_order=[0], discard_pre=0, discard_post=0,
+                    center_sample=round(n_rd / 2), sample_time_ns=int(dwell))
+        idx.update(slice=0, average=0, phase=0, set=0, contrast=0, segment=0)
+    return acquisition_batches(kspace, trajectory, head=head, idx=idx)
+
+
+def write_mrd(output, header, *acquisitions):
+    """
+    Write an MRD stream.
+
+    The batches are written in a single call of BinaryMrdWriter.write_data, which builds the serializers of the
+    stream items once, and every acquisition is serialized before the next one is requested.
+
+    Args:
+        output (file-like): Writable binary stream, see `open_output`.
+        header (mrd.Header): MRD header.
+        *acquisitions: Generators of batches of acquisitions, e.g. `noise_batches` and `rare_batches`, written in
+            order.
+    """
+    with mrd.BinaryMrdWriter(output) as writer:
+        writer.write_header(header)
+        writer.write_data(item for batches in acquisitions for batch in batches for item in batch)
+
+
+def read_images(mrd_input, only_images=False):
+    """
+    Read the floating point images of an MRD stream, e.g. the output of a Tyger pipeline.
+
+    Args:
+        mrd_input (file-like | str): Binary MRD stream or path of the MRD file.
+        only_images (bool, optional): Raise a RuntimeError if the stream has other items. Defaults to False.
+
+    Returns:
+        tuple: MRD header and list with the data of the images, arrays with shape (channels, x, y, z).
+    """
+    images = []
+    with mrd.BinaryMrdReader(mrd_input) as reader:
+        header = reader.read_header()
+        for item in reader.read_data():
+            if isinstance(item, mrd.StreamItem.ImageFloat):
+                images.append(np.asarray(item.value.data))
+            elif only_images:
+                raise RuntimeError("Stream must contain only floating point images")
+    return header, images
+
+
+def read_kspace(mrd_input):
+    """
+    Read the k-space written by the RARE converters from an MRD stream, the inverse of `rare_batches`.
+
+    The noise acquisitions are skipped, and every k-space line is placed by its encoding steps 1 and 2.
+
+    Args:
+        mrd_input (file-like | str): Binary MRD stream or path of the MRD file.
+
+    Returns:
+        tuple: MRD header and k-space with shape (slices, phases, readouts), complex64.
+    """
+    noise = mrd.AcquisitionFlags.IS_NOISE_MEASUREMENT
+    lines = []
+    steps = []
+    with mrd.BinaryMrdReader(mrd_input) as reader:
+        header = reader.read_header()
+        for item in reader.read_data():
+            if not isinstance(item, mrd.StreamItem.Acquisition) or item.value.head.flags & noise:
+                continue
+            acq = item.value
+            lines.append(acq.data[0])
+            steps.append((acq.head.idx.kspace_encode_step_2 or 0, acq.head.idx.kspace_encode_step_1 or 0))
+    if not lines:
+        return header, np.zeros((0, 0, 0), dtype=np.complex64)
+    steps = np.array(steps)
+    n_sl, n_ph = steps.max(axis=0) + 1
+    kspace = np.zeros((n_sl, n_ph, len(lines[0])), dtype=np.complex64)
+    kspace[steps[:, 0], steps[:, 1]] = np.stack(lines)
+    return header, kspace
+
+
+def axes_orientation(header):
+    """
+    Get the axesOrientation user parameter of an MRD header.
+
+    Args:
+        header (mrd.Header): MRD header.
+
+    Returns:
+        list: x, y or z axis of the readout, phase and slice directions. Defaults to [0, 1, 2].
+    """
+    if header is not None and header.user_parameters:
+        for parameter in header.user_parameters.user_parameter_string:
+            if parameter.name == 'axesOrientation':
+                return [int(value) for value in parameter.value.split(',')]
+    return [0, 1, 2]
+
+
+def to_marge_axes(image, axes):
+    """
+    Reorder an image from physical space (ch, x, y, z) to MaRGE format (ch, sl, ph, rd).
+
+    Args:
+        image (np.ndarray): Image with shape (ch, x, y, z).
+        axes (sequence): axesOrientation, see `axes_orientation`.
+
+    Returns:
+        np.ndarray: View of the image with shape (ch, sl, ph, rd).
+    """
+    return np.transpose(image, (0, 1 + axes[2], 1 + axes[1], 1 + axes[0]))
+
+
+def image_kspace(image):
+    """
+    Get the k-space of an image, as the reconstructions of MaRGE expect it.
+
+    Args:
+        image (np.ndarray): Image with shape (sl, ph, rd).
+
+    Returns:
+        np.ndarray: fftshift(fftn(fftshift(image))).
+    """
+    return np.fft.fftshift(np.fft.fftn(np.fft.fftshift(image)))
+
+
+def save_mat(mat_path, values, mat_in_path=None):
+    """
+    Add values to a .mat file, keeping the values it already has.
+
+    Args:
+        mat_path (str): Path of the .mat file written.
+        values (dict): Values to add or replace.
+        mat_in_path (str, optional): Path of the .mat file with the other values. Defaults to mat_path.
+
+    Returns:
+        dict: All the values of the file.
+    """
+    mat = sio.loadmat(mat_path if mat_in_path is None else mat_in_path)
+    mat.update(values)
+    sio.savemat(mat_path, mat)
+    return mat
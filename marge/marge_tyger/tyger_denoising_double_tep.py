@@ -14,7 +14,6 @@ from marge.marge_tyger.fromMATtoMRD3D_RAREdouble_old import matToMRD_old
 from marge.marge_tyger.fromMRDtoMAT3D_noise import export
 from pathlib import Path
 from os import stat
-import mrd
 import scipy.io as sio
 import numpy as np
 
@@ -14,7 +14,6 @@ from marge.marge_tyger.fromMATtoMRD3D_RARE_old import matToMRD_old
 from marge.marge_tyger.fromMRDtoMAT3D_noise import export
 from pathlib import Path
 from os import stat
-import mrd
 
 def denoisingTyger(rawData_path, output_field, output_field_k):
     """
@@ -0,0 +1,96 @@
+"""Algebraic reconstruction (ART/SART) of non-Cartesian k-space data."""
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+def run_art_reconstruction(k, signal, positions, n_iter=1, lbda=1.0, block_size=1, dtype=np.complex128, workers=1,
+                           shuffle=True, callback=None, xp=np):
+    """
+    Reconstruct an image from arbitrary k-space samples with the algebraic reconstruction technique.
+
+    The signal model is s = sum(rho * exp(-i 2 pi k r)) over the voxels of a Cartesian grid. Because the grid is
+    separable, the encoding row of each sample is the outer product of three 1D exponentials along x, y and z, so the
+    full rows are never formed: the samples are processed in blocks and the forward and back projections are computed
+    as dense products with the per-axis exponentials.
+
+    With `block_size` = 1 the method is the classic ART (Kaczmarz) iteration. With larger blocks, the corrections of
+    the samples in a block are averaged before updating the image (SART). Each update is much cheaper per sample, but
+    larger blocks take smaller steps and may need more iterations or a larger relaxation factor.
+
+    Args:
+        k (numpy.ndarray): k-space coordinates with dimensions [n_samples, 3], in 1/m.
+        signal (numpy.ndarray): Sampled signal with n_samples elements.
+        positions (tuple): Voxel coordinates (x, y, z) along each axis as 1D arrays, in m.
+        n_iter (int): Number of passes over all the samples. Defaults to 1.
+        lbda (float): Relaxation factor. Defaults to 1.
+        block_size (int): Number of k-space samples processed together. Defaults to 1 (ART).
+        dtype (numpy.dtype): Complex data type of the computation, np.complex128 or np.complex64.
+        workers (int): Number of threads sharing the z slices of the image. Only used with numpy.
+        shuffle (bool): If True, the samples are processed in random order in each pass. Defaults to True.
+        callback (callable, optional): Function called as callback(iteration, percentage) every time the completed
+            percentage of the current pass increases.
+        xp (module): Array module used for the computation, numpy or cupy. Defaults to numpy.
+
+    Returns:
+        numpy.ndarray: Reconstructed image with dimensions [nz, ny, nx], as an array of the `xp` module.
+    """
+    real = np.empty(0, dtype=dtype).real.dtype
+    k = xp.asarray(k, dtype=real)
+    signal = xp.reshape(xp.asarray(signal, dtype=dtype), -1)
+    x, y, z = [xp.reshape(xp.asarray(position, dtype=real), -1) for position in positions]
+    n_samples = signal.shape[0]
+    rho = xp.zeros((z.shape[0], y.shape[0], x.shape[0]), dtype=dtype)
+    norm = rho.size  # Squared norm of every encoding row
+    block_size = max(1, int(block_size))
+
+    # Each thread works on a slab of z slices
+    pool = None
+    slabs = [slice(0, z.shape[0])]
+    if workers > 1 and xp is np and z.shape[0] > 1:
+        slabs = [slice(int(s[0]), int(s[-1]) + 1) for s in np.array_split(np.arange(z.shape[0]), workers)]
+        pool = ThreadPoolExecutor(max_workers=len(slabs))
+
+    def forward(ex, ey, ez, slab):
+        # Prediction of the block samples from a slab of the image
+        t = rho[slab] @ ex.T  # [z, y, block]
+        t = xp.sum(t * ey.T[xp.newaxis], axis=1)  # [z, block]
+        return xp.sum(t * ez[:, slab].T, axis=0)
+
+    def backward(ex, ey, ez, residual, slab):
+        # Add the back projection of the block residuals to a slab of the image
+        w = xp.conj(ez[:, slab]) * residual[:, xp.newaxis]  # [block, z]
+        g = w.T[:, xp.newaxis, :] * xp.conj(ey).T[xp.newaxis]  # [z, y, block]
+        rho[slab] += g @ xp.conj(ex)
+
+    def run(function, *args):
+        if pool is None:
+            return [function(*args, slab) for slab in slabs]
+        return list(pool.map(lambda slab: function(*args, slab), slabs))
+
+    try:
+        for iteration in range(n_iter):
+            index = xp.random.permutation(n_samples) if shuffle else xp.arange(n_samples)
+            percentage = 0
+            for n0 in range(0, n_samples, block_size):
+                block = index[n0:n0 + block_size]
+                kb = k[block]
+                ex = xp.exp(-2j * np.pi * kb[:, 0:1] * x[xp.newaxis]).astype(dtype)
+                ey = xp.exp(-2j * np.pi * kb[:, 1:2] * y[xp.newaxis]).astype(dtype)
+                ez = xp.exp(-2j * np.pi * kb[:, 2:3] * z[xp.newaxis]).astype(dtype)
+
+                residual = signal[block] - sum(run(forward, ex, ey, ez))
+                residual *= lbda / (norm * block.shape[0])
+                run(backward, ex, ey, ez, residual)
+
+                if callback is not None:
+                    n = 100 * min(n0 + block_size, n_samples) // n_samples
+                    if n > percentage:
+                        percentage = n
+                        callback(iteration + 1, percentage)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    return rho
@@ -0,0 +1,175 @@
+"""
+Parallel writing and interpretation of PyPulseq batches.
+
+Sequences split in several batches (rare_pp, rare_t2prep_pp, mse_pp) used to write and interpret every batch before
+starting the next one. Once a batch is complete it does not depend on the others, so the BatchBuilder sends it to a
+process pool as soon as it is created: the interpretation of the finished batches overlaps the generation of the next
+ones. The waveforms are returned in the order the batches were submitted. Sequences that fit in a single batch are
+interpreted in the calling process, without starting the pool.
+
+The number of processes is given by `seq_workers` in sys_config and the .seq files are only kept if
+`write_seq_files` is True.
+"""
+
+import multiprocessing
+import os
+import pickle
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from marge.configs import sys_config
+
+_executor = None
+_executor_workers = 0
+_executor_lock = threading.Lock()
+
+
+def interpret_batch(interpreter, batch, file_name=None):
+    """
+    Write a PyPulseq batch and interpret it into waveforms.
+
+    Args:
+        interpreter (PSInterpreter or None): Interpreter converting the .seq file into scanner waveforms. If None,
+            the batch is only written.
+        batch (pp.Sequence): Batch to interpret.
+        file_name (str, optional): Path of the .seq file to keep. If None, a temporary file is used and removed.
+
+    Returns:
+        dict or None: Waveforms of the batch, as returned by the interpreter.
+    """
+    if file_name is not None:
+        batch.write(file_name)
+        if interpreter is None:
+            return None
+        waveforms, _ = interpreter.interpret(file_name)
+        return waveforms
+    if interpreter is None:
+        return None
+    with tempfile.TemporaryDirectory() as folder:
+        file_name = os.path.join(folder, 'batch.seq')
+        batch.write(file_name)
+        waveforms, _ = interpreter.interpret(file_name)
+    return waveforms
+
+
+def get_workers(workers=None):
+    """
+    Resolve the number of processes used to interpret the batches.
+
+    Args:
+        workers (int, optional): Requested number of processes. Defaults to `seq_workers` in sys_config.
+
+    Returns:
+        int: Number of processes, 0 to interpret the batches serially.
+    """
+    if workers is None:
+        workers = getattr(sys_config, 'seq_workers', -1)
+    if workers < 0:
+        workers = os.cpu_count() or 1
+    return workers
+
+
+def _get_context():
+    # Forking the GUI, which runs acquisition threads, is not safe. Where available, the workers are forked from a
+    # server process that imports pypulseq and the interpreter once; otherwise they are spawned.
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('forkserver')
+        context.set_forkserver_preload(['pypulseq', 'marga_pulseq.interpreter'])
+        return context
+    return multiprocessing.get_context('spawn')
+
+
+def _get_executor(workers):
+    # The pool is kept between runs so that the worker processes are only started once
+    global _executor, _executor_workers
+    with _executor_lock:
+        if _executor is None or _executor_workers != workers:
+            if _executor is not None:
+                _executor.shutdown(wait=False)
+            _executor = ProcessPoolExecutor(max_workers=workers, mp_context=_get_context())
+            _executor_workers = workers
+        return _executor
+
+
+def shutdown():
+    """
+    Stop the worker processes of the shared pool.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=True)
+        _executor = None
+
+
+class BatchBuilder:
+    """
+    Write and interpret the batches of a sequence in parallel.
+
+    Batches are submitted in order while the sequence is built. The first batch is held until a second one is
+    submitted, so a sequence with a single batch never starts the pool. With one or no worker, or if a batch cannot be
+    sent to the pool, the batch is interpreted in the calling process.
+
+    Attributes:
+        interpreter (PSInterpreter or None): Interpreter converting the batches into waveforms. If None, the batches
+            are only written, e.g. when the waveforms are obtained from templates.
+        workers (int): Number of processes of the pool, 0 to interpret the batches serially.
+        write_seq (bool): Keep a batch_N.seq file of every batch in the working directory.
+    """
+
+    def __init__(self, interpreter, workers=None, write_seq=None):
+        self.interpreter = interpreter
+        self.workers = get_workers(workers)
+        if write_seq is None:
+            write_seq = getattr(sys_config, 'write_seq_files', True)
+        self.write_seq = write_seq
+        self._batches = {}
+        self._futures = {}
+
+    def submit(self, batch_num, batch):
+        """
+        Start the interpretation of a complete batch.
+
+        Args:
+            batch_num (str): Name of the batch, e.g. 'batch_1'.
+            batch (pp.Sequence): Batch to interpret. It must not be modified afterwards.
+        """
+        file_name = os.path.abspath(batch_num + ".seq") if self.write_seq else None
+        self._batches[batch_num] = (batch, file_name)
+        if self.workers < 2 or len(self._batches) < 2:
+            return
+        try:
+            executor = _get_executor(self.workers)
+            for key, (batch, file_name) in self._batches.items():
+                if key not in self._futures:
+                    self._futures[key] = executor.submit(interpret_batch, self.interpreter, batch, file_name)
+        except (BrokenProcessPool, RuntimeError):
+            shutdown()
+
+    def waveforms(self):
+        """
+        Wait for every submitted batch.
+
+        Returns:
+            dict: Waveforms of each batch, in the order the batches were submitted.
+        """
+        waveforms = {}
+        for batch_num, (batch, file_name) in self._batches.items():
+            future = self._futures.get(batch_num)
+            done = False
+            if future is not None:
+                try:
+                    waveforms[batch_num] = future.result()
+                    done = True
+                except BrokenProcessPool:
+                    shutdown()
+                except (pickle.PicklingError, AttributeError, TypeError):
+                    pass  # The batch or the interpreter could not be sent to the pool
+            if not done:
+                waveforms[batch_num] = interpret_batch(self.interpreter, batch, file_name)
+            print(f"{batch_num}.seq ready!")
+        self._batches = {}
+        self._futures = {}
+        return waveforms
@@ -0,0 +1,218 @@
+"""
+Central FFT service used by the reconstructions.
+
+The backend is selected with `fft_backend` in sys_config: "pyfftw" (if installed), "scipy" or "numpy", or "auto" to
+use pyFFTW when available and scipy.fft otherwise. The number of threads is given by `fft_workers` (-1 uses all the
+cores). pyFFTW plans are cached per shape, dtype, axes and direction; scipy.fft keeps its own cache of twiddle factors.
+
+Centered transforms (the fftshift/ifftshift combinations used across MaRGE) are computed without the shift copies:
+each circular shift is replaced by a linear phase ramp along the transformed axes, applied in place.
+"""
+
+import os
+import threading
+
+import numpy as np
+import scipy.fft
+
+from marge.configs import sys_config
+
+try:
+    import pyfftw
+except ImportError:
+    pyfftw = None
+
+FFTSHIFT = 'fftshift'
+IFFTSHIFT = 'ifftshift'
+
+
+def get_backend():
+    """
+    Get the name of the backend in use.
+
+    Returns:
+        str: "pyfftw", "scipy" or "numpy".
+    """
+    backend = getattr(sys_config, 'fft_backend', 'auto')
+    if backend == 'auto':
+        return 'pyfftw' if pyfftw is not None else 'scipy'
+    if backend == 'pyfftw' and pyfftw is None:
+        return 'scipy'
+    return backend
+
+
+def get_workers(workers=None):
+    """
+    Get the number of threads used by the FFT backend.
+
+    Args:
+        workers (int, optional): Requested number of threads. Defaults to `fft_workers` in sys_config.
+
+    Returns:
+        int: Number of threads.
+    """
+    if workers is None:
+        workers = getattr(sys_config, 'fft_workers', -1)
+    if workers is None or workers < 1:
+        return os.cpu_count() or 1
+    return workers
+
+
+def fftn(x, axes=None, overwrite=False, workers=None):
+    """
+    N-dimensional forward FFT.
+
+    Args:
+        x (numpy.ndarray): Input array.
+        axes (tuple, optional): Axes to transform. Defaults to all the axes.
+        overwrite (bool): If True, the input may be overwritten.
+        workers (int, optional): Number of threads. Defaults to `fft_workers` in sys_config.
+
+    Returns:
+        numpy.ndarray: Transformed array.
+    """
+    return _transform(x, axes, False, overwrite, workers)
+
+
+def ifftn(x, axes=None, overwrite=False, workers=None):
+    """
+    N-dimensional inverse FFT.
+
+    Args:
+        x (numpy.ndarray): Input array.
+        axes (tuple, optional): Axes to transform. Defaults to all the axes.
+        overwrite (bool): If True, the input may be overwritten.
+        workers (int, optional): Number of threads. Defaults to `fft_workers` in sys_config.
+
+    Returns:
+        numpy.ndarray: Transformed array.
+    """
+    return _transform(x, axes, True, overwrite, workers)
+
+
+def centered_fftn(x, axes=None, overwrite=False, shifts=(IFFTSHIFT, FFTSHIFT), workers=None):
+    """
+    Forward FFT of data centered on the array, equal to fftshift(fftn(ifftshift(x))) with the default shifts.
+
+    Args:
+        x (numpy.ndarray): Input array.
+        axes (tuple, optional): Axes to transform. Defaults to all the axes.
+        overwrite (bool): If True, the input may be overwritten.
+        shifts (tuple): Shifts applied before and after the transform, FFTSHIFT or IFFTSHIFT. They only differ for
+            axes with an odd number of points.
+        workers (int, optional): Number of threads. Defaults to `fft_workers` in sys_config.
+
+    Returns:
+        numpy.ndarray: Transformed array.
+    """
+    return _centered(x, axes, False, overwrite, shifts, workers)
+
+
+def centered_ifftn(x, axes=None, overwrite=False, shifts=(FFTSHIFT, IFFTSHIFT), workers=None):
+    """
+    Inverse FFT of data centered on the array, equal to ifftshift(ifftn(fftshift(x))) with the default shifts.
+
+    Args:
+        x (numpy.ndarray): Input array.
+        axes (tuple, optional): Axes to transform. Defaults to all the axes.
+        overwrite (bool): If True, the input may be overwritten.
+        shifts (tuple): Shifts applied before and after the transform, FFTSHIFT or IFFTSHIFT. They only differ for
+            axes with an odd number of points.
+        workers (int, optional): Number of threads. Defaults to `fft_workers` in sys_config.
+
+    Returns:
+        numpy.ndarray: Transformed array.
+    """
+    return _centered(x, axes, True, overwrite, shifts, workers)
+
+
+def clear_plans():
+    """
+    Remove every cached pyFFTW plan.
+    """
+    with _lock:
+        _plans.clear()
+
+
+# pyFFTW plans and phase ramps of the centered transforms
+_plans = {}
+_ramps = {}
+_lock = threading.Lock()
+
+
+def _normalize_axes(ndim, axes):
+    if axes is None:
+        return tuple(range(ndim))
+    return tuple(axis % ndim for axis in axes)
+
+
+def _transform(x, axes, inverse, overwrite, workers=None):
+    x = np.asarray(x)
+    axes = _normalize_axes(x.ndim, axes)
+    backend = get_backend()
+
+    if backend == 'pyfftw':
+        x = np.asarray(x, dtype=np.result_type(x.dtype, np.complex64))
+        threads = get_workers(workers)
+        key = (x.shape, x.dtype.str, axes, inverse, threads)
+        with _lock:
+            plan = _plans.get(key)
+            if plan is None:
+                builder = pyfftw.builders.ifftn if inverse else pyfftw.builders.fftn
+                plan = (builder(pyfftw.empty_aligned(x.shape, dtype=x.dtype), axes=axes, threads=threads,
+                                planner_effort='FFTW_MEASURE'), threading.Lock())
+                _plans[key] = plan
+        with plan[1]:
+            return plan[0](x).copy()  # The output array of the plan is reused by the next call
+
+    if backend == 'numpy':
+        return np.fft.ifftn(x, axes=axes) if inverse else np.fft.fftn(x, axes=axes)
+
+    function = scipy.fft.ifftn if inverse else scipy.fft.fftn
+    return function(x, axes=axes, workers=get_workers(workers), overwrite_x=overwrite)
+
+
+def _ramp(n, shift, offset, sign, dtype):
+    # Phase ramp exp(sign * 2 pi i * shift * (m - offset) / n) along an axis of n points. For an even n and a shift of
+    # n / 2 it is a real checkerboard of +-1.
+    key = (n, shift, offset, sign, dtype)
+    ramp = _ramps.get(key)
+    if ramp is None:
+        ramp = np.exp(sign * 2j * np.pi * shift * (np.arange(n) - offset) / n)
+        if n % 2 == 0:
+            ramp = np.round(ramp.real).astype(np.empty(0, dtype=dtype).real.dtype)
+        else:
+            ramp = ramp.astype(dtype)
+        ramp.setflags(write=False)
+        _ramps[key] = ramp
+    return ramp
+
+
+def _centered(x, axes, inverse, overwrite, shifts, workers=None):
+    # A circular shift by a of the input and by b of the output of an FFT along an axis of n points are equivalent to
+    # multiplying the input by exp(-s 2 pi i b m / n) and the output by exp(s 2 pi i a (k - b) / n), with s = -1 for
+    # the forward and s = 1 for the inverse transform.
+    x = np.asarray(x)
+    axes = _normalize_axes(x.ndim, axes)
+    sign = 1 if inverse else -1
+    if not overwrite or not np.iscomplexobj(x):
+        x = np.array(x, dtype=np.result_type(x.dtype, np.complex64))
+    pre = []
+    post = []
+    for axis in axes:
+        n = x.shape[axis]
+        if n == 1:
+            continue
+        a = n // 2 if shifts[0] == FFTSHIFT else -(n // 2)
+        b = n // 2 if shifts[1] == FFTSHIFT else -(n // 2)
+        shape = [1] * x.ndim
+        shape[axis] = n
+        pre.append(np.reshape(_ramp(n, b, 0, -sign, x.dtype), shape))
+        post.append(np.reshape(_ramp(n, a, b, sign, x.dtype), shape))
+
+    for ramp in pre:
+        x *= ramp
+    x = _transform(x, axes, inverse, True, workers)
+    for ramp in post:
+        x *= ramp
+    return x
@@ -0,0 +1,92 @@
+"""
+Deferred import of optional and heavy dependencies.
+
+Libraries such as bm4d, cupy, ismrmrd, mrd, nibabel, pydicom or skimage take a noticeable time to import and are only
+needed by a few functions. Modules import them with `lazy_import`, which returns a placeholder module that imports the
+library the first time one of its attributes is used:
+
+    bm4d = lazy_import('bm4d')
+    ...
+    bm4d.bm4d(image, sigma_psd=std)  # bm4d is imported here
+
+A missing library raises the usual ImportError at that point instead of when MaRGE starts. `is_available` tells
+whether a library is installed without importing it.
+"""
+
+import importlib
+import importlib.util
+import sys
+import types
+
+
+class LazyModule(types.ModuleType):
+    """
+    Placeholder of a module that is imported on first attribute access.
+
+    Submodules that the package does not import itself (e.g. ismrmrd.xsd) are imported when they are accessed.
+    """
+
+    def __init__(self, name):
+        super().__init__(name)
+        self.__dict__['_lazy_module'] = None
+
+    def _load(self):
+        module = self.__dict__['_lazy_module']
+        if module is None:
+            module = importlib.import_module(self.__name__)
+            self.__dict__['_lazy_module'] = module
+            self.__dict__.update({key: value for key, value in module.__dict__.items() if not key.startswith('__')})
+        return module
+
+    def __getattr__(self, attr):
+        if attr.startswith('__'):
+            raise AttributeError(attr)
+        module = self._load()
+        try:
+            return getattr(module, attr)
+        except AttributeError:
+            try:
+                return importlib.import_module(f"{self.__name__}.{attr}")
+            except ModuleNotFoundError:
+                raise AttributeError(f"module '{self.__name__}' has no attribute '{attr}'") from None
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __repr__(self):
+        state = 'loaded' if self.__dict__['_lazy_module'] is not None else 'not loaded'
+        return f"<lazy module '{self.__name__}' ({state})>"
+
+
+def lazy_import(name):
+    """
+    Get a module that is imported the first time it is used.
+
+    Args:
+        name (str): Full name of the module, e.g. 'pydicom' or 'ismrmrd.xsd'.
+
+    Returns:
+        module: The module itself if it has already been imported, a LazyModule otherwise.
+    """
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    return LazyModule(name)
+
+
+def is_available(name):
+    """
+    Check whether a module can be imported, without importing it.
+
+    Args:
+        name (str): Full name of the module.
+
+    Returns:
+        bool: True if the module is installed.
+    """
+    if name in sys.modules:
+        return sys.modules[name] is not None
+    try:
+        return importlib.util.find_spec(name) is not None
+    except (ImportError, ValueError):
+        return False
@@ -1,18 +1,25 @@
 """General-purpose utility functions shared across MaRGE modules."""
 
 import copy
+import functools
+import hashlib
 import os
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
-import bm4d
 import numpy as np
-import nibabel as nib
-import pydicom
-from pydicom.errors import InvalidDicomError
-from skimage.util import view_as_blocks
 import scipy as sp
 from marge.manager.dicommanager import DICOMImage
 from datetime import date, datetime
 from marge.configs import hw_config as hw
+from marge.marge_utils import fft
+from marge.marge_utils.lazy import lazy_import
+
+# Imported on first use
+bm4d = lazy_import('bm4d')
+nib = lazy_import('nibabel')
+pydicom = lazy_import('pydicom')
+skimage = lazy_import('skimage')
 
 
 def fix_image_orientation(image, axes, orientation='FFS', rd_direction=1):
@@ -355,7 +362,7 @@ def get_next_series_number(study_id: str, dicom_dir: str) -> int:
                 series_num = getattr(ds, "SeriesNumber", None)
                 if series_num is not None:
                     series_numbers.append(int(series_num))
-        except (InvalidDicomError, ValueError, OSError):
+        except (pydicom.errors.InvalidDicomError, ValueError, OSError):
             continue  # Skip invalid files
 
     return max(series_numbers, default=0) + 1
@@ -425,7 +432,7 @@ def run_bm4d_filter(image_data, std=0):
 
         # Divide the image into blocks
         n_multi = (np.array(image_quantized.shape) / 5).astype(int) * 5
-        blocks_r = view_as_blocks(image_rescaled[0:n_multi[0], 0:n_multi[1], 0:n_multi[2]], block_shape=(5, 5, 5))
+        blocks_r = skimage.util.view_as_blocks(image_rescaled[0:n_multi[0], 0:n_multi[1], 0:n_multi[2]], block_shape=(5, 5, 5))
 
         # Calculate the standard deviation for each block
         block_std_devs = np.std(blocks_r, axis=(3, 4, 5))
@@ -468,7 +475,7 @@ def run_dfft(image):
         ndarray: The k-space data.
 
     """
-    k_space = np.fft.fftshift(np.fft.fftn(np.fft.ifftshift(image)))
+    k_space = fft.centered_fftn(image)
     return k_space
 
 def run_ifft(k_space):
@@ -485,7 +492,7 @@ def run_ifft(k_space):
         ndarray: The reconstructed image in the spatial domain.
 
     """
-    image = np.fft.ifftshift(np.fft.ifftn(np.fft.fftshift(k_space)))
+    image = fft.centered_ifftn(k_space)
     return image
 
 def run_zero_padding(k_space, new_size):
@@ -560,7 +567,7 @@ def hanning_filter(kSpace, mm, nb_point):
     Apply a Hanning filter to the k-space data.
 
     Args:
-        kSpace (ndarray): K-space data.
+        kSpace (ndarray): K-space data (sl, ph, rd), optionally with leading batch dimensions.
         n (int): Number of zero-filled points in k-space.
         m (int): Number of acquired points in k-space.
         nb_point (int): Number of points before m+n where reconstruction begins to go to zero.
@@ -569,151 +576,131 @@ def hanning_filter(kSpace, mm, nb_point):
         ndarray: K-space data with the Hanning filter applied.
     """
     kSpace_hanning = np.copy(kSpace)
-    kSpace_hanning[mm[0]::, :, :] = 0.0
-    kSpace_hanning[:, mm[1]::, :] = 0.0
-    kSpace_hanning[:, :, mm[2]::] = 0.0
+    kSpace_hanning[..., mm[0]::, :, :] = 0.0
+    kSpace_hanning[..., :, mm[1]::, :] = 0.0
+    kSpace_hanning[..., :, :, mm[2]::] = 0.0
 
     # Calculate the Hanning window
     hanning_window = np.hanning(nb_point * 2)
     hanning_window = hanning_window[int(len(hanning_window)/2)::]
 
-    if not mm[0] == np.size(kSpace, 0):
+    if not mm[0] == kSpace.shape[-3]:
         for ii in range(nb_point):
-            kSpace_hanning[mm[0]-nb_point+ii+1, :, :] *= hanning_window[ii]
-    if not mm[1] == np.size(kSpace, 1):
+            kSpace_hanning[..., mm[0]-nb_point+ii+1, :, :] *= hanning_window[ii]
+    if not mm[1] == kSpace.shape[-2]:
         for ii in range(nb_point):
-            kSpace_hanning[:, mm[1]-nb_point+ii+1, :] *= hanning_window[ii]
-    if not mm[2] == np.size(kSpace, 2):
+            kSpace_hanning[..., :, mm[1]-nb_point+ii+1, :] *= hanning_window[ii]
+    if not mm[2] == kSpace.shape[-1]:
         for ii in range(nb_point):
-            kSpace_hanning[:, :, mm[2]-nb_point+ii+1] *= hanning_window[ii]
+            kSpace_hanning[..., :, :, mm[2]-nb_point+ii+1] *= hanning_window[ii]
 
     return kSpace_hanning
 
-def run_pocs_reconstruction(n_points, factors, k_space_ref, test=False):
-    """
-    Perform POCS reconstruction.
-
-    Retrieves the number of points before m+n where reconstruction begins to go to zero.
-    Retrieves the correlation threshold for stopping the iterations.
-    Computes the partial image and full image for POCS reconstruction.
-    Applies the iterative reconstruction with phase correction.
-    Updates the main matrix of the image view widget with the interpolated image.
-    Adds the "POCS" operation to the history widget and updates the history dictionary and operations history.
+def run_pocs_reconstruction(n_points, factors, k_space_ref, test=False, threshold=1e-6, max_iterations=100,
+                            workers=None):
     """
-    print("Running POCS...")
-    def getCenterKSpace(k_space, m_vec):
-        """
-        Extract the central region of a 3D k-space array, zeroing out the periphery.
+    Perform POCS reconstruction of partial Fourier k-space data.
 
-        Args:
-            k_space (np.ndarray): 3D complex k-space array with shape (sl, ph, rd).
-            m_vec (np.ndarray): Half-widths of the central region to keep along each axis.
+    The phase of the image is estimated from the symmetric center of k-space. Starting from the Hanning filtered
+    image, the magnitude of the image is combined with that phase and transformed to k-space, where the acquired
+    region is restored, until the image stops changing. Only the current image and k-space are kept, so the memory
+    does not grow with the number of iterations.
 
-        Returns:
-            np.ndarray: Array of same shape as k_space, with only the central
-                [n//2 - m : n//2 + m] region preserved; all other values are zero.
-        """
-        # fix n_vec
-        output = np.zeros(np.shape(k_space), dtype=complex)
-        n_vec = np.array(np.shape(k_space))
+    Args:
+        n_points (array_like): Number of points (sl, ph, rd).
+        factors (array_like): Acquired fraction of k-space along (sl, ph, rd).
+        k_space_ref (np.ndarray): Partial k-space with dimensions (sl, ph, rd), or (n, sl, ph, rd) to reconstruct
+            several echoes or contrasts in one call.
+        test (bool): If True, plot the intermediate images and compare the result with the reference image.
+        threshold (float): Iterations stop when the relative squared change of every image, computed in k-space,
+            is below this value.
+        max_iterations (int): Maximum number of iterations.
+        workers (int, optional): Number of FFT threads. Defaults to `fft_workers` in sys_config.
+
+    Returns:
+        np.ndarray: Reconstructed k-space with the same dimensions as `k_space_ref`.
+    """
+    print("Running POCS...")
+    axes = (-3, -2, -1)
 
-        # fill with zeros
-        idx0 = n_vec // 2 - m_vec
-        idx1 = n_vec // 2 + m_vec
-        output[idx0[0]:idx1[0], idx0[1]:idx1[1], idx0[2]:idx1[2]] = \
-            k_space[idx0[0]:idx1[0], idx0[1]:idx1[1], idx0[2]:idx1[2]]
+    def ifft(k_space):
+        return fft.centered_ifftn(k_space, axes=axes, overwrite=True, workers=workers)
 
-        return output
+    def dfft(image):
+        return fft.centered_fftn(image, axes=axes, overwrite=True, workers=workers)
 
     # Get n and m
     factors = [float(num) for num in factors]
     mm = np.array([int(num) for num in (n_points * factors)])
     m = np.array([int(num) for num in (n_points * factors - n_points / 2)])
-
-    # Get the reference image
-    img_ref = np.abs(run_ifft(k_space_ref))
-
-    if test:
-        n_sl, n_ph, n_rd = np.shape(img_ref)
-        plt.figure()
-        plt.imshow(img_ref[n_sl // 2, :, :], cmap="gray")
-        plt.title("Reference image")
-
-    # Create a copy with the center of k-space
-    k_space_center = getCenterKSpace(k_space_ref, m)
+    acquired = (Ellipsis, slice(0, mm[0]), slice(0, mm[1]), slice(0, mm[2]))
+    sum_axes = tuple(range(k_space_ref.ndim - 3, k_space_ref.ndim))
+
+    # Get image phase from the center of k-space
+    n_vec = np.array(k_space_ref.shape[-3:])
+    idx0 = n_vec // 2 - m
+    idx1 = n_vec // 2 + m
+    center = (Ellipsis, slice(idx0[0], idx1[0]), slice(idx0[1], idx1[1]), slice(idx0[2], idx1[2]))
+    k_space_center = np.zeros(k_space_ref.shape, dtype=complex)
+    k_space_center[center] = k_space_ref[center]
+    phase = np.exp(1j * np.angle(ifft(k_space_center)))
+    del k_space_center
 
     # Number of points before m+n where we begin to go to zero
     nb_point = 2
 
-    # Set the correlation threshold for stopping the iterations
-    threshold = 1e-6
-
-    # Get image phase
-    img_center = run_ifft(k_space_center)
-    phase = img_center / abs(img_center)
-    if test:
-        plt.figure()
-        plt.imshow(np.abs(img_center[n_sl // 2, :, :]), cmap='gray')
-        plt.title("Center image")
-
-    # Generate zero padding image for comparison
-    k_space_zp = np.zeros_like(k_space_ref, dtype=complex)
-    k_space_zp[0:mm[0], 0:mm[1], 0:mm[2]] = k_space_ref[0:mm[0], 0:mm[1], 0:mm[2]]
-    img_zp = np.abs(run_ifft(k_space_zp))
-    if test:
-        plt.figure()
-        plt.imshow(np.abs(img_zp[n_sl // 2, :, :]), cmap='gray')
-        plt.title("ZP")
-
-    # Generate the corresponding image with the Hanning filter
-    k_space_hanning = hanning_filter(k_space_ref, mm, nb_point)
-    img_hanning = run_ifft(k_space_hanning)
+    # Start from the image with the Hanning filter
+    k_space = hanning_filter(k_space_ref, mm, nb_point)
+    image = ifft(k_space.copy())
 
     num_iterations = 0  # Initialize the iteration counter
-    img_reconstructed = [img_hanning]
     while True:
-        # Iterative reconstruction
-        img_iterative = np.abs(img_reconstructed[-1]) * phase
-        k_space_new = run_dfft(img_iterative)
+        # Iterative reconstruction: keep the magnitude and impose the phase
+        image = np.abs(image) * phase
+        k_space_new = dfft(image)
 
-        # Apply constraint: Keep the region of k-space from n+m onwards and restore the rest
-        k_space_new[0:mm[0], 0:mm[1], 0:mm[2]] = k_space_ref[0:mm[0], 0:mm[1], 0:mm[2]]
+        # Apply constraint: restore the acquired region of k-space
+        k_space_new[acquired] = k_space_ref[acquired]
 
-        # Reconstruct the image from the modified k-space
-        img_reconstructed.append(run_ifft(k_space_new))
-
-        if test:
-            plt.figure()
-            plt.imshow(np.abs(np.abs(img_reconstructed[-1][n_sl // 2, :, :]) - np.abs(img_reconstructed[-2][n_sl // 2, :, :])),
-                       vmin=0, vmax=1e-5)
-            plt.title(f"Iteration {num_iterations+1}")
+        # Relative squared change of the image, equal to the change in k-space (Parseval)
+        change = np.sum(np.abs(k_space_new - k_space) ** 2, axis=sum_axes) / \
+            np.maximum(np.sum(np.abs(k_space_new) ** 2, axis=sum_axes), 1e-30)
+        convergence = np.max(change)
+        k_space = k_space_new
+        del k_space_new
 
-        # Compute correlation between consecutive reconstructed images
-        correlation = np.corrcoef(np.abs(img_reconstructed[-2].flatten()), np.abs(img_reconstructed[-1].flatten()))[0, 1]
+        # Reconstruct the image from the modified k-space
+        image = ifft(k_space.copy())
 
-        # Display correlation and current iteration number
-        print("Iteration: %i, Convergence: %0.2e" % (num_iterations, (1 - correlation)))
+        # Display convergence and current iteration number
+        print("Iteration: %i, Convergence: %0.2e" % (num_iterations, convergence))
 
-        # Check if correlation reaches the desired threshold
-        if (1-correlation) <= threshold or num_iterations >= 100:
+        # Check if the change reaches the desired threshold
+        if convergence <= threshold or num_iterations >= max_iterations:
             break
 
         # Increment the iteration counter
         num_iterations += 1
 
     if test:
-        plt.figure()
-        plt.imshow(np.abs(img_reconstructed[-1][n_sl // 2, :, :]), cmap='gray')
-        plt.title(f"POCS")
+        from matplotlib import pyplot as plt
+        n_sl = k_space_ref.shape[-3]
+        img_ref = np.abs(ifft(k_space_ref.copy()))
+        k_space_zp = np.zeros_like(k_space_ref, dtype=complex)
+        k_space_zp[acquired] = k_space_ref[acquired]
+        img_zp = np.abs(ifft(k_space_zp))
+        for img, title in ((img_ref, "Reference image"), (img_zp, "ZP"), (np.abs(image), "POCS")):
+            plt.figure()
+            plt.imshow(np.reshape(img, (-1,) + img.shape[-3:])[0, n_sl // 2, :, :], cmap="gray")
+            plt.title(title)
         plt.show()
 
-
         # Get correlation with reference image
-        correlation_1 = np.corrcoef(np.abs(img_ref.flatten()), np.abs(img_reconstructed[-1].flatten()))[0, 1]
+        correlation_1 = np.corrcoef(np.abs(img_ref.flatten()), np.abs(image.flatten()))[0, 1]
         print("POCS compared to reference image:")
         print("Convergence: %0.2e" % (1 - correlation_1))
 
-    return k_space_new
+    return k_space
 
 def run_zero_padding_reconstruction(n_points, factors, k_space_ref):
     """
@@ -744,6 +731,213 @@ def run_zero_padding_reconstruction(n_points, factors, k_space_ref):
 
     return np.abs(image)
 
+def run_nufft_reconstruction(k, signal, fov, n_points, oversampling=2.0, kernel_width=4, dcf_iterations=10):
+    """
+    Reconstruct an image from non-Cartesian k-space samples by gridding (adjoint NUFFT).
+
+    The samples are weighted with an iterative (Pipe-Menon) density compensation, interpolated onto an oversampled
+    Cartesian grid with a Kaiser-Bessel kernel, transformed with an inverse FFT, cropped to the field of view and
+    deapodized. The interpolation matrix and the density compensation are cached per trajectory, so reconstructing new
+    data acquired with the same trajectory only costs a sparse product and an FFT.
+
+    Args:
+        k (numpy.ndarray): k-space coordinates with dimensions [n_samples, 3], in 1/m.
+        signal (numpy.ndarray): Sampled signal with n_samples elements.
+        fov (array_like): Field of view (x, y, z) in m.
+        n_points (array_like): Image matrix size (nx, ny, nz).
+        oversampling (float): Grid oversampling factor. Defaults to 2.
+        kernel_width (int): Width of the Kaiser-Bessel kernel in grid points. Defaults to 4.
+        dcf_iterations (int): Number of iterations of the density compensation. Defaults to 10.
+
+    Returns:
+        numpy.ndarray: Reconstructed image with dimensions [nz, ny, nx].
+    """
+    operator = get_nufft_operator(k, fov, n_points, oversampling=oversampling, kernel_width=kernel_width)
+    dcf = operator.density_compensation(dcf_iterations)
+    return operator.adjoint(np.reshape(signal, -1) * dcf)
+
+
+def get_nufft_operator(k, fov, n_points, oversampling=2.0, kernel_width=4):
+    """
+    Get the gridding operator of a trajectory, reusing it if it was already built.
+
+    Args:
+        k (numpy.ndarray): k-space coordinates with dimensions [n_samples, 3], in 1/m.
+        fov (array_like): Field of view (x, y, z) in m.
+        n_points (array_like): Image matrix size (nx, ny, nz).
+        oversampling (float): Grid oversampling factor.
+        kernel_width (int): Width of the Kaiser-Bessel kernel in grid points.
+
+    Returns:
+        NufftOperator: Operator for the given trajectory.
+    """
+    k = np.ascontiguousarray(np.real(k), dtype=np.float64)
+    fov = np.reshape(np.asarray(fov, dtype=np.float64), -1)
+    n_points = np.reshape(np.asarray(n_points, dtype=int), -1)
+    digest = hashlib.sha256()
+    for item in (k, fov, n_points, np.array([oversampling, kernel_width], dtype=np.float64)):
+        digest.update(str(item.shape).encode())
+        digest.update(item.tobytes())
+    key = digest.hexdigest()
+
+    if key in _nufft_operators:
+        _nufft_operators.move_to_end(key)
+        return _nufft_operators[key]
+    operator = NufftOperator(k, fov, n_points, oversampling=oversampling, kernel_width=kernel_width)
+    _nufft_operators[key] = operator
+    while len(_nufft_operators) > 4:
+        _nufft_operators.popitem(last=False)
+    return operator
+
+
+class NufftOperator:
+    """
+    Gridding operator between non-Cartesian k-space samples and a Cartesian image.
+
+    Attributes:
+        n_points (numpy.ndarray): Image matrix size (nx, ny, nz).
+        grid_shape (tuple): Shape of the oversampled grid (gz, gy, gx).
+        interpolation (scipy.sparse.csr_matrix): Kaiser-Bessel interpolation from the grid to the samples.
+        deapodization (numpy.ndarray): Kernel apodization of the image with dimensions [nz, ny, nx].
+    """
+
+    def __init__(self, k, fov, n_points, oversampling=2.0, kernel_width=4):
+        self.n_points = np.asarray(n_points, dtype=int)
+        grid_points = np.ceil(oversampling * self.n_points).astype(int)
+        grid_points += grid_points % 2
+        grid_points[self.n_points == 1] = 1
+        self.grid_shape = tuple(grid_points[::-1])
+        table, beta = _kaiser_bessel_table(kernel_width, float(oversampling))
+        self._dcf = {}
+
+        # Neighbour indices and kernel weights along each axis
+        n_samples = k.shape[0]
+        indices = []
+        weights = []
+        deapodization = []
+        for axis in range(3):
+            n, g = self.n_points[axis], grid_points[axis]
+            if n == 1:
+                indices.append(np.zeros((n_samples, 1), dtype=np.int64))
+                weights.append(np.ones((n_samples, 1), dtype=np.float32))
+                deapodization.append(np.ones(1))
+                continue
+            u = k[:, axis] * fov[axis] * g / n + g // 2  # Position in grid points
+            j = np.ceil(u - kernel_width / 2)[:, np.newaxis] + np.arange(kernel_width)
+            distance = np.abs(u[:, np.newaxis] - j)
+            index = np.minimum(np.round(distance * _KB_TABLE_DENSITY).astype(int), table.shape[0] - 1)
+            indices.append(np.mod(j.astype(np.int64), g))
+            weights.append(table[index].astype(np.float32))
+
+            # Fourier transform of the kernel at the image positions
+            x = (np.arange(n) - n // 2) / g
+            argument = np.emath.sqrt((np.pi * kernel_width * x) ** 2 - beta ** 2)
+            apodization = np.real(np.sin(argument) / argument)
+            deapodization.append(apodization / np.max(apodization))
+        self.deapodization = (deapodization[2][:, np.newaxis, np.newaxis] *
+                              deapodization[1][np.newaxis, :, np.newaxis] *
+                              deapodization[0][np.newaxis, np.newaxis, :])
+
+        # Sparse interpolation matrix from the flattened grid [gz, gy, gx] to the samples
+        gz, gy, gx = self.grid_shape
+        columns = ((indices[2][:, :, np.newaxis, np.newaxis] * gy +
+                    indices[1][:, np.newaxis, :, np.newaxis]) * gx +
+                   indices[0][:, np.newaxis, np.newaxis, :])
+        values = (weights[2][:, :, np.newaxis, np.newaxis] *
+                  weights[1][:, np.newaxis, :, np.newaxis] *
+                  weights[0][:, np.newaxis, np.newaxis, :])
+        n_neighbours = columns[0].size
+        self.interpolation = sp.sparse.csr_matrix((np.reshape(values, -1),
+                                                   np.reshape(columns, -1).astype(np.int32),
+                                                   np.arange(n_samples + 1) * n_neighbours),
+                                                  shape=(n_samples, gz * gy * gx))
+
+    def density_compensation(self, n_iter=10):
+        """
+        Get the density compensation weights of the trajectory with the Pipe-Menon iteration.
+
+        Args:
+            n_iter (int): Number of iterations.
+
+        Returns:
+            numpy.ndarray: Weight of each sample.
+        """
+        if n_iter not in self._dcf:
+            dcf = np.ones(self.interpolation.shape[0])
+            for _ in range(n_iter):
+                dcf /= np.maximum(self.interpolation @ (self.interpolation.T @ dcf), 1e-12)
+            self._dcf[n_iter] = dcf
+        return self._dcf[n_iter]
+
+    def adjoint(self, data):
+        """
+        Grid k-space samples and transform them to the image domain.
+
+        Args:
+            data (numpy.ndarray): Density compensated samples.
+
+        Returns:
+            numpy.ndarray: Image with dimensions [nz, ny, nx].
+        """
+        grid = np.reshape(self.interpolation.T @ np.reshape(data, -1), self.grid_shape)
+        image = fft.centered_ifftn(grid, overwrite=True, shifts=(fft.IFFTSHIFT, fft.FFTSHIFT))
+        crop = tuple(slice(g // 2 - n // 2, g // 2 - n // 2 + n) for g, n in zip(self.grid_shape, self.n_points[::-1]))
+        return image[crop] / self.deapodization
+
+    def forward(self, image):
+        """
+        Get the k-space samples of an image.
+
+        Args:
+            image (numpy.ndarray): Image with dimensions [nz, ny, nx].
+
+        Returns:
+            numpy.ndarray: Signal at each k-space sample.
+        """
+        grid = np.zeros(self.grid_shape, dtype=complex)
+        crop = tuple(slice(g // 2 - n // 2, g // 2 - n // 2 + n) for g, n in zip(self.grid_shape, self.n_points[::-1]))
+        grid[crop] = image / self.deapodization
+        grid = fft.centered_fftn(grid, overwrite=True)
+        return self.interpolation @ np.reshape(grid, -1)
+
+
+# Gridding operators of the last trajectories and samples per grid point of the Kaiser-Bessel lookup table
+_nufft_operators = OrderedDict()
+_KB_TABLE_DENSITY = 1000
+
+
+@functools.lru_cache(maxsize=None)
+def _kaiser_bessel_table(kernel_width, oversampling):
+    # Kaiser-Bessel kernel from 0 to kernel_width / 2 with the shape parameter of Beatty et al. (2005)
+    beta = np.pi * np.sqrt((kernel_width / oversampling) ** 2 * (oversampling - 0.5) ** 2 - 0.8)
+    u = np.arange(int(kernel_width / 2 * _KB_TABLE_DENSITY) + 1) / _KB_TABLE_DENSITY
+    table = np.i0(beta * np.sqrt(np.maximum(0, 1 - (2 * u / kernel_width) ** 2))) / np.i0(beta)
+    table.setflags(write=False)
+    return table, beta
+
+
+def allocate_acquisition_buffer(n_points, dtype=np.complex128, file_path=None):
+    """
+    Allocate a one-dimensional buffer to be filled in place with acquired data.
+
+    Args:
+        n_points (int): Total number of points, e.g. n_readouts * oversampling_factor * n_scans.
+        dtype (numpy.dtype): Data type of the buffer, complex128 by default or complex64 to halve the memory.
+        file_path (str, optional): If given, the buffer is backed by a np.memmap file at this path so that large raw
+            datasets do not need to fit in RAM.
+
+    Returns:
+        numpy.ndarray: Buffer with `n_points` elements, or a np.memmap if `file_path` is given.
+    """
+    if file_path is None:
+        return np.zeros(n_points, dtype=dtype)
+
+    directory = os.path.dirname(file_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    return np.memmap(file_path, dtype=dtype, mode='w+', shape=(max(n_points, 1),))[0:n_points]
+
+
 def fix_echo_position(data_oversampled, dummy_pulses, etl, n_rd, n_batches, n_readouts, n_scans, add_rd_points, oversampling_factor):
     """
     Adjust the position of k=0 in the echo data to the center of the acquisition window.
@@ -759,24 +953,22 @@ def fix_echo_position(data_oversampled, dummy_pulses, etl, n_rd, n_batches, n_re
         numpy.ndarray: The adjusted data array with k=0 positioned at the center of each acquisition window.
 
     """
-    # Get relevant data
-    data_noise = []
-    data_dummy = []
-    data_signal = []
+    # Get the dummy echoes of every scan into a preallocated buffer
     points_per_rd = n_rd * oversampling_factor
     points_per_train = points_per_rd * etl
+    n_trains = n_batches * n_scans if dummy_pulses > 0 else 0
+    data_dummy = np.zeros(n_trains * points_per_train, dtype=data_oversampled.dtype)
     idx_0 = 0
     idx_1 = 0
+    idx_dummy = 0
     for batch in range(n_batches):
         n_rds = n_readouts[batch] * oversampling_factor
         for scan in range(n_scans):
             idx_1 += n_rds
-            data_prov = data_oversampled[idx_0:idx_1]
-            data_noise = np.concatenate((data_noise, data_prov[0:points_per_rd]), axis=0)
             if dummy_pulses > 0:
-                data_dummy = np.concatenate((data_dummy, data_prov[points_per_rd:points_per_rd + points_per_train]),
-                                            axis=0)
-            data_signal = np.concatenate((data_signal, data_prov[points_per_rd + points_per_train::]), axis=0)
+                data_dummy[idx_dummy:idx_dummy + points_per_train] = \
+                    data_oversampled[idx_0 + points_per_rd:idx_0 + points_per_rd + points_per_train]
+                idx_dummy += points_per_train
             idx_0 = idx_1
 
     # Get echo position
@@ -823,7 +1015,8 @@ def fix_echo_position(data_oversampled, dummy_pulses, etl, n_rd, n_batches, n_re
 
     return data_decimated
 
-def decimate(data_over, n_adc, option='PETRA', remove=True, add_rd_points=10, oversampling_factor=5, decimation_factor=5):
+def decimate(data_over, n_adc, option='PETRA', remove=True, add_rd_points=10, oversampling_factor=5, decimation_factor=5,
+             per_window=False, dtype=None, workers=1):
     """
     Decimate oversampled MRI readout data using a two-stage approach:
     FIR decimation followed by optional frequency-domain downsampling.
@@ -861,6 +1054,16 @@ def decimate(data_over, n_adc, option='PETRA', remove=True, add_rd_points=10, ov
         FIR decimation factor applied with anti-alias filtering. Must divide
         `oversampling_factor`. Any remaining factor is applied by
         frequency-domain downsampling. Default is 5.
+    per_window : bool, optional
+        If True, the FIR filter is applied to each ADC window independently
+        so that it does not smear samples across readout lines. If False,
+        the filter runs over the continuous stream. Default is False.
+    dtype : numpy.dtype, optional
+        Data type used by the FIR stage, e.g. np.complex64 to halve the
+        memory traffic. Default keeps the input precision.
+    workers : int, optional
+        Number of threads sharing the ADC windows in the FIR stage when
+        `per_window` is True. Default is 1.
 
     Returns
     -------
@@ -875,8 +1078,10 @@ def decimate(data_over, n_adc, option='PETRA', remove=True, add_rd_points=10, ov
     Notes
     -----
     - Total effective decimation equals `oversampling_factor`.
-    - FIR decimation uses `scipy.signal.decimate` with an FIR filter and
-      zero-phase compensation.
+    - FIR decimation uses the same zero-phase FIR filter as
+      `scipy.signal.decimate`, with the taps designed once per
+      decimation factor. Per-window filtering computes only the output
+      samples of all the windows at once (see `fir_decimate`).
     - A half-filter-length sample offset is applied before FIR decimation
       to align output samples.
     - When additional downsampling is required, each ADC window is
@@ -901,36 +1106,28 @@ def decimate(data_over, n_adc, option='PETRA', remove=True, add_rd_points=10, ov
     # Preprocess the signal to avoid oscillations due to decimation
     if option == 'PETRA':
         data_over = np.reshape(data_over, (n_adc, -1))
-        for line in range(n_adc):
-            data_over[line, 0:add_rd_points * oversampling_factor] = data_over[
-                line, add_rd_points * oversampling_factor]
+        _flatten_line_start(data_over, add_rd_points * oversampling_factor)
         data_over = np.reshape(data_over, -1)
     elif option == 'Normal':
         pass
 
     # Decimate the signal after 'fir' filter
     if decimation_factor > 1:
-        data_decimated = sp.signal.decimate(data_over[int((decimation_factor - 1) / 2)::],
-                                            decimation_factor,
-                                            ftype='fir',
-                                            zero_phase=True)
+        if per_window:
+            data_decimated = np.reshape(fir_decimate(np.reshape(data_over, (n_adc, -1)), decimation_factor,
+                                                     dtype=dtype, workers=workers), -1)
+        else:
+            data_over = data_over[int((decimation_factor - 1) / 2)::]
+            if dtype is not None:
+                data_over = data_over.astype(dtype, copy=False)
+            data_decimated = sp.signal.resample_poly(data_over, 1, decimation_factor,
+                                                     window=_fir_taps(decimation_factor, 20 * decimation_factor + 1))
     else:
         data_decimated = data_over
 
     # Remaining decimation by averaging
     if avg_factor > 1:
-        data_decimated = data_decimated.reshape(n_adc, -1)
-        n = (data_decimated.shape[1] // avg_factor) * avg_factor
-        data_decimated = data_decimated[:, :n]
-
-        # FFT Method
-        data_decimated = np.fft.fftshift(np.fft.ifft(np.fft.ifftshift(data_decimated, axes=1), axis=1), axes=1)
-        nr_in = np.size(data_decimated, 1)
-        nr_out = nr_in // avg_factor
-        n0 = nr_in // 2 - nr_out // 2
-        n1 = nr_in // 2 + nr_out // 2
-        data_decimated = data_decimated[:, n0:n1]
-        data_decimated = np.fft.ifftshift(np.fft.fft(np.fft.fftshift(data_decimated, axes=1), axis=1), axes=1)
+        data_decimated = _fft_downsample(data_decimated.reshape(n_adc, -1), avg_factor)
 
         # # AVG Method
         # data_decimated = data_decimated.reshape(n_adc, -1, avg_factor).mean(axis=2)
@@ -947,6 +1144,324 @@ def decimate(data_over, n_adc, option='PETRA', remove=True, add_rd_points=10, ov
 
     return data_decimated
 
+
+def fir_decimate(lines, decimation_factor, n_taps=None, dtype=None, workers=1):
+    """
+    Apply zero-phase FIR decimation to every line of a 2D array in a single vectorized call.
+
+    Each line is processed as `scipy.signal.decimate(line[(decimation_factor - 1) // 2:], decimation_factor,
+    ftype='fir', zero_phase=True)` would do, but the filter taps are designed only once per
+    (decimation_factor, n_taps) and only the output samples are computed, as a polyphase product of the taps with a
+    strided view of the zero-padded lines.
+
+    Args:
+        lines (numpy.ndarray): Oversampled data with dimensions [n_lines, n_samples].
+        decimation_factor (int): Decimation factor.
+        n_taps (int, optional): Number of filter taps. Defaults to 20 * decimation_factor + 1.
+        dtype (numpy.dtype, optional): Complex data type used for the filtering, e.g. np.complex64. Defaults to the
+            input precision.
+        workers (int, optional): Number of threads sharing the lines. Defaults to 1.
+
+    Returns:
+        numpy.ndarray: Decimated data with dimensions [n_lines, ceil((n_samples - offset) / decimation_factor)].
+    """
+    q = decimation_factor
+    if n_taps is None:
+        n_taps = 20 * q + 1
+    lines = np.asarray(lines)[:, int((q - 1) / 2)::]
+    dtype = np.result_type(lines.dtype if dtype is None else dtype, np.complex64)
+    n_lines, n_in = lines.shape
+    n_out = -(-n_in // q)
+    half_len = (n_taps - 1) // 2
+
+    # Zero-pad the lines so that output k is the product of the taps with samples q * k - half_len ... + half_len
+    n_padded = max(q * (n_out - 1) + n_taps, half_len + n_in)
+    padded = np.zeros((n_lines, n_padded), dtype=dtype)
+    padded[:, half_len:half_len + n_in] = lines
+    padded = padded.view(padded.real.dtype).reshape(n_lines, n_padded, 2)  # Real and imaginary parts
+    taps = _fir_taps(q, n_taps)[::-1].astype(padded.dtype)
+    output = np.empty((n_lines, n_out, 2), dtype=padded.dtype)
+
+    def run(line_0, line_1):
+        segments = np.lib.stride_tricks.sliding_window_view(padded[line_0:line_1], n_taps, axis=1)
+        output[line_0:line_1] = segments[:, ::q][:, 0:n_out] @ taps
+
+    # Process blocks of lines to bound the size of the temporary arrays
+    block = max(1, 2 ** 22 // max(1, n_out * n_taps))
+    blocks = [(line, min(line + block, n_lines)) for line in range(0, n_lines, block)]
+    if workers > 1 and len(blocks) > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(lambda b: run(*b), blocks))
+    else:
+        for b in blocks:
+            run(*b)
+
+    return output.view(dtype)[..., 0]
+
+
+@functools.lru_cache(maxsize=None)
+def _fir_taps(decimation_factor, n_taps):
+    # Hamming-window low-pass filter of scipy.signal.decimate, designed once per configuration
+    taps = sp.signal.firwin(n_taps, 1. / decimation_factor, window='hamming')
+    taps.setflags(write=False)
+    return taps
+
+
+def _flatten_line_start(lines, n_points):
+    # Set the first n_points of each line to the value of the following point (in place)
+    lines[:, 0:n_points] = lines[:, n_points:n_points + 1]
+
+
+def _fft_downsample(lines, avg_factor):
+    # Downsample each line by cropping the center of its spectrum
+    n = (lines.shape[1] // avg_factor) * avg_factor
+    lines = lines[:, :n]
+    lines = fft.centered_ifftn(lines, axes=(1,), shifts=(fft.IFFTSHIFT, fft.FFTSHIFT))
+    nr_in = np.size(lines, 1)
+    nr_out = nr_in // avg_factor
+    n0 = nr_in // 2 - nr_out // 2
+    n1 = nr_in // 2 + nr_out // 2
+    lines = lines[:, n0:n1]
+    return fft.centered_fftn(lines, axes=(1,), overwrite=True, shifts=(fft.FFTSHIFT, fft.IFFTSHIFT))
+
+
+class StreamingDecimator:
+    """
+    Decimate oversampled readout data chunk by chunk as it is acquired.
+
+    The result matches `decimate` applied to the concatenation of all the chunks. The FIR stage runs on the continuous
+    stream and only keeps the few samples required by the filter between chunks. The PETRA preprocessing, the
+    frequency-domain downsampling and the removal of extra points are applied to each ADC window once it is complete.
+
+    Example:
+        decimator = StreamingDecimator(n_points=n_rd * oversampling_factor, option='Normal')
+        for scan in range(n_scans):
+            decimator.push(rxd['rx0'])
+        data_decimated = decimator.finish()
+
+    Args:
+        n_points (int): Number of oversampled points in each ADC window.
+        option (str): Preprocessing mode, 'PETRA' or 'Normal' (see `decimate`).
+        remove (bool): If True, removes `add_rd_points` samples from both ends of each window after decimation.
+        add_rd_points (int): Number of additional readout points acquired at both ends of each window.
+        oversampling_factor (int): Oversampling factor used during acquisition.
+        decimation_factor (int): FIR decimation factor. Any remaining factor is applied in the frequency domain.
+        per_window (bool): If True, the FIR filter is applied to each ADC window independently (see `decimate`).
+    """
+
+    def __init__(self, n_points, option='PETRA', remove=True, add_rd_points=10, oversampling_factor=5,
+                 decimation_factor=5, per_window=False):
+        if oversampling_factor % decimation_factor != 0:
+            raise ValueError("oversampling_factor must be a multiple of decimation_factor")
+        if n_points % decimation_factor != 0:
+            raise ValueError("n_points must be a multiple of decimation_factor")
+        self.n_points = n_points
+        self.option = option
+        self.remove = remove
+        self.add_rd_points = add_rd_points
+        self.oversampling_factor = oversampling_factor
+        self.decimation_factor = decimation_factor
+        self.per_window = per_window
+        self.avg_factor = oversampling_factor // decimation_factor
+
+        # Same FIR filter and alignment as scipy.signal.decimate(ftype='fir', zero_phase=True)
+        q = decimation_factor
+        self._offset = int((q - 1) / 2)
+        if q > 1:
+            self._half_len = 10 * q
+            self._taps = _fir_taps(q, 2 * self._half_len + 1)
+            self._pre_pad = (-2 * self._half_len) % q
+        else:
+            self._half_len = 0
+            self._taps = None
+            self._pre_pad = 0
+
+        self._pending = np.zeros(0, dtype=complex)  # Samples of an incomplete ADC window
+        self._stream = np.zeros(0, dtype=complex)  # Preprocessed samples still needed by the FIR filter
+        self._stream_start = 0  # Index of the first sample of self._stream in the full data
+        self._stream_end = 0  # Number of samples received so far
+        self._next_output = 0  # Index of the next FIR output sample
+        self._fir_output = np.zeros(0, dtype=complex)  # FIR output of an incomplete ADC window
+        self._output = []
+
+    def push(self, data):
+        """
+        Add a chunk of oversampled data and decimate every ADC window that is ready.
+
+        Args:
+            data (numpy.ndarray): Oversampled data as a 1D array. It does not need to contain complete windows.
+        """
+        # Preprocess the complete ADC windows
+        data = np.concatenate((self._pending, np.reshape(data, -1)))
+        n_windows = data.shape[0] // self.n_points
+        windows = np.reshape(data[0:n_windows * self.n_points], (n_windows, self.n_points))
+        self._pending = data[n_windows * self.n_points::]
+        if self.option == 'PETRA' and n_windows > 0:
+            _flatten_line_start(windows, self.add_rd_points * self.oversampling_factor)
+
+        # Windows filtered independently do not need to carry the filter state
+        if self.per_window:
+            if n_windows > 0:
+                if self._taps is not None:
+                    windows = fir_decimate(windows, self.decimation_factor)
+                self._downsample(windows)
+            return
+
+        self._stream = np.concatenate((self._stream, np.reshape(windows, -1)))
+        self._stream_end += n_windows * self.n_points
+
+        # Get the FIR output whose filter support is already available
+        n_ready = (self._stream_end - 1 - self._offset - self._half_len) // self.decimation_factor + 1
+        self._filter(max(n_ready, self._next_output))
+
+    def finish(self):
+        """
+        Decimate the remaining samples and get the full decimated data.
+
+        Returns:
+            numpy.ndarray: Decimated data as a flattened 1D array, as returned by `decimate`.
+        """
+        if self._pending.shape[0] > 0:
+            raise ValueError("The data does not contain an integer number of ADC windows")
+        if not self.per_window:
+            q = self.decimation_factor
+            self._filter(-(-(self._stream_end - self._offset) // q))
+        if len(self._output) == 0:
+            return np.zeros(0, dtype=complex)
+        return np.concatenate(self._output)
+
+    def _filter(self, n_output):
+        # Compute the FIR output samples from self._next_output to n_output
+        q = self.decimation_factor
+        k0 = self._next_output
+        if n_output <= k0:
+            return
+        start = self._offset + q * k0 - self._half_len - self._pre_pad
+        stop = self._offset + q * (n_output - 1) + self._half_len + 1
+
+        if self._taps is None:
+            output = self._stream[start - self._stream_start:stop - self._stream_start]
+        else:
+            # Get the input segment, padding with zeros before the offset sample and after the last sample
+            segment = np.zeros(stop - start, dtype=self._stream.dtype)
+            i0 = max(start, self._stream_start, self._offset)
+            i1 = min(stop, self._stream_end)
+            segment[i0 - start:i1 - start] = self._stream[i0 - self._stream_start:i1 - self._stream_start]
+            i_first = (2 * self._half_len + self._pre_pad) // q
+            output = sp.signal.upfirdn(self._taps, segment, 1, q)[i_first:i_first + n_output - k0]
+        self._next_output = n_output
+
+        # Drop the samples that are not needed anymore
+        next_start = self._offset + q * n_output - self._half_len - self._pre_pad
+        if next_start > self._stream_start:
+            self._stream = self._stream[next_start - self._stream_start::]
+            self._stream_start = next_start
+
+        # Downsample the complete ADC windows
+        output = np.concatenate((self._fir_output, output))
+        n_points = self.n_points // q
+        n_windows = output.shape[0] // n_points
+        self._fir_output = output[n_windows * n_points::]
+        if n_windows > 0:
+            self._downsample(np.reshape(output[0:n_windows * n_points], (n_windows, n_points)))
+
+    def _downsample(self, lines):
+        # Apply the frequency-domain downsampling and remove the extra points of complete ADC windows
+        if self.avg_factor > 1:
+            lines = _fft_downsample(lines, self.avg_factor)
+        if self.remove:
+            lines = lines[:, self.add_rd_points:lines.shape[1] - self.add_rd_points]
+        self._output.append(np.reshape(lines, -1))
+
+
+class ScanAverager:
+    """
+    Running average of repeated scans, accumulated in a worker thread as each scan arrives.
+
+    Only one complex sum per batch is kept in memory, so the memory does not grow with the number of scans.
+    The individual scans can optionally be stored as well. If a file path is given, they are stored in a np.memmap.
+    The running mean can be read at any time, e.g. for a live preview.
+
+    Example:
+        averager = ScanAverager({'batch_0': n_points_0, 'batch_1': n_points_1}, n_scans=4)
+        averager.add('batch_0', scan, rxd['rx0'])
+        data_mean = averager.finish()
+
+    Args:
+        n_points (dict): Number of oversampled points of one scan of each batch, in acquisition order.
+        n_scans (int): Number of scans of each batch.
+        dtype (numpy.dtype): Data type of the sums and of the stored scans.
+        keep_scans (bool): If True, every scan is also stored, batch by batch, as `runBatches` does without
+            averaging.
+        file_path (str, optional): Path of the np.memmap file used for the individual scans.
+    """
+
+    def __init__(self, n_points, n_scans, dtype=np.complex128, keep_scans=False, file_path=None):
+        self.n_scans = n_scans
+        self.counts = {batch: 0 for batch in n_points}
+        self._slices = {}
+        self._scan_offsets = {}
+        start = 0
+        for batch, n in n_points.items():
+            self._slices[batch] = slice(start, start + n)
+            self._scan_offsets[batch] = start * n_scans
+            start += n
+        self._sum = np.zeros(start, dtype=dtype)
+        self.scans = allocate_acquisition_buffer(start * n_scans, dtype=dtype, file_path=file_path) \
+            if keep_scans else None
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._futures = []
+
+    def add(self, batch, scan, data):
+        """
+        Queue a scan to be added to the running sum of its batch. Scans can arrive in any order.
+
+        Args:
+            batch (str): Batch of the scan.
+            scan (int): Index of the scan within the batch, used to store the individual scan.
+            data (numpy.ndarray): Oversampled data of the scan.
+        """
+        self._futures.append(self._executor.submit(self._accumulate, batch, scan, data))
+
+    def mean(self, batch=None):
+        """
+        Get the running mean of the scans received so far.
+
+        Args:
+            batch (str, optional): Batch to get. Defaults to all the batches, concatenated in acquisition order.
+
+        Returns:
+            numpy.ndarray: Mean of the accumulated scans, zero for batches without any scan.
+        """
+        batches = [batch] if batch is not None else list(self._slices)
+        means = [self._sum[self._slices[b]] / max(self.counts[b], 1) for b in batches]
+        return np.concatenate(means) if len(means) > 1 else means[0]
+
+    def finish(self):
+        """
+        Wait for the queued scans and get the final mean.
+
+        Returns:
+            numpy.ndarray: Mean of the scans of every batch, concatenated in acquisition order.
+        """
+        for future in self._futures:
+            future.result()
+        self._futures = []
+        self._executor.shutdown()
+        if isinstance(self.scans, np.memmap):
+            self.scans.flush()
+        return self.mean()
+
+    def _accumulate(self, batch, scan, data):
+        data = np.reshape(data, -1)
+        self._sum[self._slices[batch]] += data
+        self.counts[batch] += 1
+        if self.scans is not None:
+            n = data.shape[0]
+            start = self._scan_offsets[batch] + scan * n
+            self.scans[start:start + n] = data
+
+
 def get_snr_histogram(image, roi_size=4):
     """
     Compute a pixel-wise SNR map for a 3D image.
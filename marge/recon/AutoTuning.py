@@ -1,7 +1,7 @@
 """Reconstruction module for auto-tuning sequences."""
 
 import numpy as np
-import scipy as sp
+from marge.manager.rawdatamanager import load_mat_data
 from scipy.interpolate import interp1d
 
 
@@ -19,7 +19,7 @@ def AutoTuning(raw_data_path=None):
         tuple: (output_dict, dicom_meta_data) with processed results.
     """
     # load .mat
-    mat_data = sp.io.loadmat(raw_data_path)
+    mat_data = load_mat_data(raw_data_path)
 
     # Create new dictionary to save new outputs
     output_dict = {}
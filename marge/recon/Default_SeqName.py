@@ -13,7 +13,7 @@ Expected .mat fields (customize as needed):
 """
 
 import numpy as np
-import scipy.io as sio
+from marge.manager.rawdatamanager import load_mat_data
 
 
 def Default_SeqName(raw_data_path=None):
@@ -42,7 +42,7 @@ def Default_SeqName(raw_data_path=None):
     # ------------------------------------------------------------------
     # Load raw data
     # ------------------------------------------------------------------
-    mat_data = sio.loadmat(raw_data_path)
+    mat_data = load_mat_data(raw_data_path)
     output_dict = {}  # Store numerical results or metadata here
     dicom_meta_data = {}  # Store tags to be saved in the dicom file
 
@@ -1,7 +1,7 @@
 """Reconstruction module for inversion recovery sequences."""
 
 import numpy as np
-import scipy as sp
+from marge.manager.rawdatamanager import load_mat_data
 from scipy.optimize import curve_fit
 
 
@@ -10,7 +10,7 @@ def InversionRecovery(raw_data_path=None):
         return None
 
     # load .mat
-    mat_data = sp.io.loadmat(raw_data_path)
+    mat_data = load_mat_data(raw_data_path)
     output_dict = {}
     dicom_meta_data = {}
 
@@ -1,7 +1,7 @@
 """Reconstruction module for Larmor frequency estimation sequences."""
 
 import numpy as np
-import scipy as sp
+from marge.manager.rawdatamanager import load_mat_data
 import marge.configs.hw_config as hw
 
 
@@ -34,7 +34,7 @@ def Larmor(raw_data_path=None):
         return None
 
     # load .mat
-    mat_data = sp.io.loadmat(raw_data_path)
+    mat_data = load_mat_data(raw_data_path)
 
     # Create new dictionary to save new outputs
     output_dict = {}
@@ -2,7 +2,7 @@
 
 import marge.configs.hw_config as hw
 import numpy as np
-import scipy as sp
+from marge.manager.rawdatamanager import load_mat_data
 
 
 def Noise(raw_data_path=None):
@@ -22,7 +22,7 @@ def Noise(raw_data_path=None):
         return None
 
     # load .mat
-    mat_data = sp.io.loadmat(raw_data_path)
+    mat_data = load_mat_data(raw_data_path)
     output_dict = {}
     dicom_meta_data = {}
 
@@ -1,6 +1,6 @@
 """Reconstruction module for Rabi flop sequences."""
 
-import scipy as sp
+from marge.manager.rawdatamanager import load_mat_data
 import numpy as np
 import scipy.signal as sig
 from scipy.interpolate import make_interp_spline
@@ -24,7 +24,7 @@ def RabiFlops(raw_data_path=None):
         return None
 
     # load .mat
-    mat_data = sp.io.loadmat(raw_data_path)
+    mat_data = load_mat_data(raw_data_path)
     output_dict = {}
     dicom_meta_data = {}
 
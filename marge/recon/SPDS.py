@@ -3,12 +3,14 @@
 import os
 
 import numpy as np
-import scipy as sp
-from skimage.restoration import unwrap_phase as unwrap
+from marge.manager.rawdatamanager import load_mat_data
 from sklearn.preprocessing import PolynomialFeatures
 
 from marge.configs import hw_config as hw
 from marge.marge_utils.utils import run_ifft
+from marge.marge_utils.lazy import lazy_import
+
+skimage = lazy_import('skimage')  # Imported on first use
 
 
 def SPDS(raw_data_path=None):
@@ -42,7 +44,7 @@ def SPDS(raw_data_path=None):
         return None
 
     # load .mat
-    mat_data = sp.io.loadmat(raw_data_path)
+    mat_data = load_mat_data(raw_data_path)
 
     # Create new dictionary to save new outputs
     output_dict = {}
@@ -154,8 +156,8 @@ def SPDS(raw_data_path=None):
         RawPhase2 = np.angle(i_data_b)
         RawPhase2[mask] = 0
 
-        i_phase_a = unwrap(RawPhase1)
-        i_phase_b = unwrap(RawPhase2)
+        i_phase_a = skimage.restoration.unwrap_phase(RawPhase1)
+        i_phase_b = skimage.restoration.unwrap_phase(RawPhase2)
 
         # Get magnetic field
         b_field = ((i_phase_b - i_phase_a) / (2 * np.pi * hw.gammaB * (dead_time[1] - dead_time[0])))
@@ -284,8 +286,8 @@ def SPDS(raw_data_path=None):
         RawPhase2 = np.angle(i_data_b)
         RawPhase2[mask] = 0
 
-        i_phase_a = unwrap(RawPhase1)
-        i_phase_b = unwrap(RawPhase2)
+        i_phase_a = skimage.restoration.unwrap_phase(RawPhase1)
+        i_phase_b = skimage.restoration.unwrap_phase(RawPhase2)
 
         # Get magnetic field
         b_field = -(i_phase_b - i_phase_a) / (2 * np.pi * hw.gammaB * (dead_time[1] - dead_time[0]))
@@ -1,7 +1,7 @@
 """Reconstruction module for shimming sequences."""
 
 import numpy as np
-import scipy as sp
+from marge.manager.rawdatamanager import load_mat_data
 from marge.configs import units as units
 from marge.configs import hw_config as hw
 
@@ -10,7 +10,7 @@ def Shimming(raw_data_path=None):
         return None
 
     # load .mat
-    mat_data = sp.io.loadmat(raw_data_path)
+    mat_data = load_mat_data(raw_data_path)
     output_dict = {}
     dicom_meta_data = {}
 
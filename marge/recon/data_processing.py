@@ -30,7 +30,7 @@ import os
 from io import BytesIO
 
 import numpy as np
-import scipy as sp
+from marge.manager.rawdatamanager import load_mat_data
 import inspect
 from matplotlib import pyplot as plt
 
@@ -77,7 +77,7 @@ def run_recon(raw_data_path=None, mode=None, printer=None):
       function prints a warning and returns `False`.
     """
     # Load .mat file and get sequence name
-    mat_data = sp.io.loadmat(raw_data_path)
+    mat_data = load_mat_data(raw_data_path)
     seq = mat_data['seqName'].item()  # Use `.item()` if it's a MATLAB cell
 
     # List all .py files in recon (excluding __init__.py)
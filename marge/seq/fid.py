@@ -174,9 +174,7 @@ class FID(blankSeq.MRIBLANKSEQ):
         fwhm=getFWHM(spectrum, fVector, bw)
         dB0=fwhm*1e6/hw.larmorFreq
 
-        for sequence in self.sequence_list.values():
-            if 'larmorFreq' in sequence.mapVals:
-                sequence.mapVals['larmorFreq'] = hw.larmorFreq
+        self.sequence_list.set_parameter('larmorFreq', hw.larmorFreq)
 
         # Get the central frequency
         print('Larmor frequency: %1.5f MHz' % fitedLarmor)
@@ -28,17 +28,19 @@ import marge.configs.hw_config as hw # Import the scanner hardware config
 import marge.seq.mriBlankSeq as blankSeq  # Import the mriBlankSequence for any new sequence.
 import pyqtgraph as pg              
 import marge.configs.units as units
+from marge.marge_utils import fft
 
 from datetime import date
 from datetime import datetime
-import ismrmrd
-import ismrmrd.xsd
+from marge.marge_utils.lazy import lazy_import
+from marge.manager import ismrmrdmanager, outputmanager
 import datetime
-import ctypes
 import matplotlib
 import xml.etree.ElementTree as ET
 from scipy.io import loadmat
 
+ismrmrd = lazy_import('ismrmrd')  # Imported on first use
+
 class GRE3D(blankSeq.MRIBLANKSEQ):
     def __init__(self):
         super(GRE3D, self).__init__()
@@ -75,9 +77,6 @@ class GRE3D(blankSeq.MRIBLANKSEQ):
         #                   tip="0 to not calibrate, 1 to calibrate")
         self.addParameter(key='unlock_orientation', string='Unlock image orientation', val=0, field='OTH',
                           tip='0: Images oriented according to standard. 1: Image raw orientation')
-        self.acq = ismrmrd.Acquisition()
-        self.img = ismrmrd.Image()
-        self.header= ismrmrd.xsd.ismrmrdHeader() 
         
     # ******************************************************************************************************************
     # ******************************************************************************************************************
@@ -447,9 +446,7 @@ class GRE3D(blankSeq.MRIBLANKSEQ):
             # Get individual images
             data_full = np.reshape(data_full, (self.nScans, n_sl, n_ph, n_rd))
             data_full = data_full[:, :, :, indkrd0-int(self.nPoints[0]/2):indkrd0+int(self.nPoints[0]/2)]
-            img_full = data_full*0
-            for scan in range(self.nScans):
-                img_full[scan, :, :, :] = np.fft.ifftshift(np.fft.ifftn(np.fft.ifftshift(data_full[scan, :, :, :])))
+            img_full = fft.centered_ifftn(data_full, axes=(1, 2, 3), shifts=(fft.IFFTSHIFT, fft.IFFTSHIFT))
             self.mapVals['data_full'] = data_full
             self.mapVals['img_full'] = img_full
 
@@ -479,7 +476,7 @@ class GRE3D(blankSeq.MRIBLANKSEQ):
             d_phase = np.exp(-2*np.pi*1j*(self.dfov[0]*k_rd+self.dfov[1]*k_ph+self.dfov[2]*k_sl))
             data = np.reshape(data*d_phase, (self.nPoints[2], self.nPoints[1], self.nPoints[0]))
             self.mapVals['kSpace3D'] = data
-            img=np.fft.ifftshift(np.fft.ifftn(np.fft.ifftshift(data)))
+            img = fft.centered_ifftn(data, shifts=(fft.IFFTSHIFT, fft.IFFTSHIFT))
             self.mapVals['image3D'] = img
             data = np.reshape(data, (1, self.nPoints[0]*self.nPoints[1]*self.nPoints[2]))
 
@@ -527,7 +524,7 @@ class GRE3D(blankSeq.MRIBLANKSEQ):
             t_vector = np.linspace(-self.acq_time/2, self.acq_time/2, self.nPoints[0])*1e-3 # ms
             s_vector = self.mapVals['sampled'][:, 3]
             f_vector = np.linspace(-bw/2, bw/2, self.nPoints[0])
-            i_vector = np.fft.ifftshift(np.fft.ifftn(np.fft.ifftshift(s_vector)))
+            i_vector = fft.centered_ifftn(s_vector, shifts=(fft.IFFTSHIFT, fft.IFFTSHIFT))
             result1 = {'widget': 'curve',
                        'xData': t_vector,
                        'yData': [np.abs(s_vector), np.real(s_vector), np.imag(s_vector)],
@@ -678,13 +675,11 @@ class GRE3D(blankSeq.MRIBLANKSEQ):
 
         Steps performed:
         1. Generate a timestamp-based filename and directory path for the output file.
-        2. Initialize the ISMRMRD dataset with the generated path.
-        3. Populate the header and write the XML header to the dataset. Informations can be added.
-        4. Reshape the raw data matrix and iterate over scans, slices, and phases to write each acquisition. 
-        5. Set acquisition flags and properties.
-        6. Append the acquisition data to the dataset.
-        7. Reshape and save the reconstructed images.
-        8. Close the dataset.
+        2. Populate the header. Informations can be added.
+        3. Reshape the raw data matrix and build the headers of all the acquisitions at once, with their flags and
+           indexes.
+        4. Reshape the reconstructed images and build their headers.
+        5. Write the file in the background with marge.manager.ismrmrdmanager.
 
         Attribute:
         - self.data_full_mat (numpy.array): Full matrix of raw data to be reshaped and saved.
@@ -693,206 +688,42 @@ class GRE3D(blankSeq.MRIBLANKSEQ):
         None. It creates an HDF5 file with the ISMRMRD format.
         """
         
-        directory_rmd = self.directory_rmd
-        name = datetime.datetime.now()
-        name_string = name.strftime("%Y.%m.%d.%H.%M.%S.%f")[:-3]
-        self.mapVals['name_string'] = name_string
-        if hasattr(self, 'raw_data_name'):
-            file_name = "%s.%s" % (self.raw_data_name, name_string)
-        else:
-            self.raw_data_name = self.mapVals['seqName']
-            file_name = "%s.%s" % (self.mapVals['seqName'], name_string)
-            
-        path= "%s/%s.h5" % (directory_rmd, file_name)
-        
-        dset = ismrmrd.Dataset(path, f'/dataset', True) # Create the dataset
-        
-        addRdPoints = hw.addRdPoints
+        path = ismrmrdmanager.output_path(self)
         nScans = self.mapVals['nScans']
-        nPoints = np.array(self.mapVals['nPoints'])
         nRD = self.nPoints[0]
         nPH = self.nPoints[1]
         nSL = self.nPoints[2]
-        nRep=nPH
         bw = self.mapVals['bw']
-        
-        axesOrientation = self.axesOrientation
-        axesOrientation_list = axesOrientation.tolist()
-
-        read_dir = [0, 0, 0]
-        phase_dir = [0, 0, 0]
-        slice_dir = [0, 0, 0]
-
-        read_dir[axesOrientation_list.index(0)] = 1
-        phase_dir[axesOrientation_list.index(1)] = 1
-        slice_dir[axesOrientation_list.index(2)] = 1
-        
-       # Experimental Conditions field
-        exp = ismrmrd.xsd.experimentalConditionsType() 
-        magneticFieldStrength = hw.larmorFreq*1e6/hw.gammaB
-        exp.H1resonanceFrequency_Hz = hw.larmorFreq
-
-        self.header.experimentalConditions = exp 
-
-        # Acquisition System Information field
-        sys = ismrmrd.xsd.acquisitionSystemInformationType() 
-        sys.receiverChannels = 1 
-        self.header.acquisitionSystemInformation = sys
-
-
-        # Encoding field can be filled if needed
-        encoding = ismrmrd.xsd.encodingType()  
-        encoding.trajectory = ismrmrd.xsd.trajectoryType.CARTESIAN
-        
-        # # encoded and recon spaces 
-        # efov = ismrmrd.xsd.fieldOfViewMm()  
-        # efov.x =  
-        # efov.y =
-        # efov.z = 
-
-        # rfov = ismrmrd.xsd.fieldOfViewMm() 
-        # rfov.x = 
-        # rfov.y = 
-        # rfov.z = 
-
-        # ematrix = ismrmrd.xsd.matrixSizeType()
-        # rmatrix = ismrmrd.xsd.matrixSizeType()
-
-        # ematrix.x = 
-        # ematrix.y = 
-        # ematrix.z = 
-        # rmatrix.x = 
-        # rmatrix.y = 
-        # rmatrix.z = 
-
-        # espace = ismrmrd.xsd.encodingSpaceType() 
-        # espace.matrixSize = ematrix
-        # espace.fieldOfView_mm = efov
-        # rspace = ismrmrd.xsd.encodingSpaceType()
-        # rspace.matrixSize = rmatrix
-        # rspace.fieldOfView_mm = rfov
-        
-        # encoding.encodedSpace = espace
-        # encoding.reconSpace = rspace
-
-
-
-        # Encoding limits field can be filled if needed
-        
-        # limits = ismrmrd.xsd.encodingLimitsType()
-        # limits1 = ismrmrd.xsd.limitType()
-        # limits1.minimum = 
-        # limits1.center = 
-        # limits1.maximum = 
-        # limits.kspace_encoding_step_1 = limits1
-
-        # limits_rep = ismrmrd.xsd.limitType()
-        # limits_rep.minimum = 
-        # limits_rep.center = 
-        # limits_rep.maximum = 
-        # limits.repetition = limits_rep
-
-        # limits_rest = ismrmrd.xsd.limitType()
-        # limits_rest.minimum = 
-        # limits_rest.center = 
-        # limits_rest.maximum =
-        # limits.kspace_encoding_step_0 = 
-        # limits.slice = 
-        # limits.average =
-        # limits.contrast =
-        # limits.kspaceEncodingStep2 = 
-        # limits.phase =  
-        # limits.segment = 
-        # limits.set =
-
-        # encoding.encodingLimits = limits
-        # self.header.encoding.append(encoding)
-
-    
-        dset.write_xml_header(self.header.toXML()) 
-                
-        
-        self.data_full_mat = np.reshape(self.data_full_mat, (nScans, nSL, nPH, nRD + 2 * addRdPoints))
-        counter = 0
-        for average in range(nScans):
-            repetition=0  
-            for slice_idx in range(nSL):
-                for phase_idx in range(nPH):
-                        # Extraire la ligne correspondante
-                        line = self.data_full_mat[average, slice_idx, phase_idx, :]
-                                                
-                        # Préparer les données complexes
-                        line2d = np.reshape(line, (1, nRD+2*addRdPoints))
-                        acq = ismrmrd.Acquisition.from_array(line2d, None)
-                        
-                        counter += 1
-                        repetition += 1 ##verifier
-                    
-                        acq.idx.repetition = repetition
-                        acq.idx.kspace_encode_step_1 = phase_idx + 1
-                        acq.idx.slice = slice_idx + 1
-                        acq.idx.average = average + 1
-                        
-                        acq.clearAllFlags()
-                        
-                        if phase_idx == 0:
-                            acq.setFlag(ismrmrd.ACQ_FIRST_IN_PHASE)
-                        elif phase_idx == nPH - 1:
-                            acq.setFlag(ismrmrd.ACQ_LAST_IN_PHASE)
-                        
-                        if slice_idx == 0:
-                            acq.setFlag(ismrmrd.ACQ_FIRST_IN_SLICE)
-                        elif slice_idx == nSL - 1:
-                            acq.setFlag(ismrmrd.ACQ_LAST_IN_SLICE)
-                        
-                        if repetition == 1: 
-                            acq.setFlag(ismrmrd.ACQ_FIRST_IN_AVERAGE)
-                        elif repetition == nPH*nSL:
-                            acq.setFlag(ismrmrd.ACQ_LAST_IN_AVERAGE)
-                        
-                        
-                        acq.scan_counter = counter
-                        acq.discard_pre = hw.addRdPoints
-                        acq.discard_post = hw.addRdPoints
-                        acq.sample_time_us = 1/bw
-                        self.dfov = np.array(self.dfov)
-                        acq.position = (ctypes.c_float * 3)(*self.dfov.flatten())
-                        acq.read_dir = (ctypes.c_float * 3)(*read_dir) 
-                        acq.phase_dir = (ctypes.c_float * 3)(*phase_dir)
-                        acq.slice_dir = (ctypes.c_float * 3)(*slice_dir)
-                        
-                        
-                        # Ajouter l'acquisition au dataset
-                        dset.append_acquisition(acq)
-                        
-                        
-        image=self.mapVals['image3D']
-        image_reshaped = np.reshape(image, (nSL, nPH, nRD))
-        
-        #for scan in range (nScans): ## image3d does not have scan dimension
-        for slice_idx in range (nSL):
-            
-            image_slice = image_reshaped[slice_idx, :, :]
-            img = ismrmrd.Image.from_array(image_slice)
-            
-            
-            img.field_of_view = (ctypes.c_float * 3)(*(self.fov)*10) # mm
-            img.position = (ctypes.c_float * 3)(*self.dfov)
-            img.sample_time_us = 1/bw
-            img.image_type = 5 ## COMPLEX
-            
-            
-            
-            img.read_dir = (ctypes.c_float * 3)(*read_dir)
-            img.phase_dir = (ctypes.c_float * 3)(*phase_dir)
-            img.slice_dir = (ctypes.c_float * 3)(*slice_dir)
-
-
-            
-            dset.append_image(f"image_raw", img)
-            
-        
-        dset.close()    
+        axes_directions = ismrmrdmanager.directions(self.axesOrientation)
+        self.header = ismrmrdmanager.create_header(hw.larmorFreq)
+
+        # Headers of all the readout lines, in acquisition order (average, slice, phase)
+        n_samples = nRD + 2*hw.addRdPoints
+        data = np.reshape(self.data_full_mat, (nScans * nSL * nPH, n_samples))
+        average, slice_idx, phase_idx = [index.ravel() for index in np.indices((nScans, nSL, nPH))]
+        repetition = slice_idx * nPH + phase_idx + 1 ##verifier
+
+        headers = ismrmrdmanager.acquisition_headers(len(data), n_samples,
+                                                     scan_counter=np.arange(1, len(data) + 1),
+                                                     discard_pre=hw.addRdPoints,
+                                                     discard_post=hw.addRdPoints,
+                                                     sample_time_us=1/bw,
+                                                     position=np.array(self.dfov).flatten(),
+                                                     **axes_directions)
+        headers['idx']['repetition'] = repetition
+        headers['idx']['kspace_encode_step_1'] = phase_idx + 1
+        headers['idx']['slice'] = slice_idx + 1
+        headers['idx']['average'] = average + 1
+
+        ismrmrdmanager.set_first_last(headers, ismrmrd.ACQ_FIRST_IN_PHASE, ismrmrd.ACQ_LAST_IN_PHASE,
+                                      phase_idx, nPH - 1)
+        ismrmrdmanager.set_first_last(headers, ismrmrd.ACQ_FIRST_IN_SLICE, ismrmrd.ACQ_LAST_IN_SLICE,
+                                      slice_idx, nSL - 1)
+        ismrmrdmanager.set_first_last(headers, ismrmrd.ACQ_FIRST_IN_AVERAGE, ismrmrd.ACQ_LAST_IN_AVERAGE,
+                                      repetition - 1, nPH*nSL - 1)
+
+        images = np.reshape(self.mapVals['image3D'], (nSL, nPH, nRD))
+        ismrmrdmanager.submit_ismrmrd(path, self.header, data, headers, images, self.fov, self.dfov, axes_directions)
 
         
 if __name__ == '__main__':
@@ -217,9 +217,7 @@ class Larmor(blankSeq.MRIBLANKSEQ):
         super().sequenceAnalysis(mode=mode)
 
         if mode != 'Standalone':
-            for sequence in self.sequence_list.values():
-                if 'larmorFreq' in sequence.mapVals:
-                    sequence.mapVals['larmorFreq'] = hw.larmorFreq
+            self.sequence_list.set_parameter('larmorFreq', hw.larmorFreq)
 
         return self.output
 
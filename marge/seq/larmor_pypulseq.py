@@ -259,9 +259,7 @@ class LarmorPyPulseq(blankSeq.MRIBLANKSEQ):
         self.mapVals['spectrum'] = [fVector, spectrum]
 
         if mode != 'Standalone':
-            for sequence in self.sequence_list.values():
-                if 'larmorFreq' in sequence.mapVals:
-                    sequence.mapVals['larmorFreq'] = hw.larmorFreq
+            self.sequence_list.set_parameter('larmorFreq', hw.larmorFreq)
 
         # Add time signal to the layout
         result1 = {'widget': 'curve',
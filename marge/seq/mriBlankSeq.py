@@ -6,23 +6,51 @@ Created on Thu June 2, 2022
 """
 
 import os
+import threading
+import time
 
-import bm4d
 import numpy as np
 
 import marge.configs.hw_config as hw
+from marge.configs import sys_config
 from datetime import date, datetime
 from scipy.io import savemat
 import marge.controller.experiment_gui as ex
 import scipy.signal as sig
 import csv
-import matplotlib.pyplot as plt
 
 # Import dicom saver
 from marge.marge_utils import utils
+from marge.marge_utils.batch_builder import interpret_batch
+from marge.manager import outputmanager, rawdatamanager
 import shutil
 
 import marge.recon.data_processing as dp
+from marge.marge_utils.lazy import lazy_import
+
+plt = lazy_import('matplotlib.pyplot')  # Imported on first use
+
+# PyPulseq waveform key of each flo_dict channel
+PYPULSEQ_CHANNELS = {'g0': 'grad_vx',
+                     'g1': 'grad_vy',
+                     'g2': 'grad_vz',
+                     'rx0': 'rx0_en',
+                     'rx1': 'rx1_en',
+                     'tx0': 'tx0',
+                     'tx1': 'tx1',
+                     'ttl0': 'tx_gate',
+                     'ttl1': 'rx_gate'}
+
+# flo_dict channel sent to each Experiment key (the rx gate follows rx0)
+EXPERIMENT_CHANNELS = {'grad_vx': 'g0',
+                       'grad_vy': 'g1',
+                       'grad_vz': 'g2',
+                       'rx0_en': 'rx0',
+                       'rx1_en': 'rx1',
+                       'tx0': 'tx0',
+                       'tx1': 'tx1',
+                       'tx_gate': 'ttl0',
+                       'rx_gate': 'rx0'}
 
 class MRIBLANKSEQ:
 
@@ -214,7 +242,7 @@ class MRIBLANKSEQ:
         self.mapVals.update(output_dict)
 
         # Save raw data
-        self.saveRawData()
+        self.saveRawData(updated_keys=output_dict.keys())
 
         # Plot if standalone
         if mode == 'Standalone':
@@ -248,105 +276,35 @@ class MRIBLANKSEQ:
         -------
         dict
             Updated dictionary containing the rotated and reformatted gradient waveforms
-            for 'grad_vx', 'grad_vy', and 'grad_vz'.
+            for 'grad_vx', 'grad_vy', and 'grad_vz'. Each waveform is a list with the time
+            and amplitude numpy arrays; the three axes share the same time points. Earlier
+            versions returned Python lists of values, use `.tolist()` if a list is needed.
         """
         # Get the waveforms
-        gx = waveforms['grad_vx']
-        gy = waveforms['grad_vy']
-        gz = waveforms['grad_vz']
-        is_x = np.zeros_like(gx[0], dtype=int)
-        is_y = np.zeros_like(gy[0], dtype=int) + 1
-        is_z = np.zeros_like(gz[0], dtype=int) + 2
-
-        # Concatenate arrays
-        time = np.concatenate((gx[0], gy[0], gz[0]))
-        ampl = np.concatenate((gx[1] * hw.gFactor[0], gy[1] * hw.gFactor[1], gz[1] * hw.gFactor[2]))  # mT/m
-        is_a = np.concatenate((is_x, is_y, is_z))
-
-        # Sort arrays
-        idx = np.argsort(time)
-        time = time[idx]
-        ampl = ampl[idx]
-        is_a = is_a[idx]
-
-        # Define new gradient waveforms
-        gx_new = [[], []]
-        gy_new = [[], []]
-        gz_new = [[], []]
-        g_new = [[], [], []]
-
-        # Populate new waveform
-        w = []
-        t = []
-        step = 0
-        n_steps = 0
-        while step < len(time):
-            g = [0., 0., 0.]
-
-            # Add time
-            gx_new[0].append(time[step])
-            gy_new[0].append(time[step])
-            gz_new[0].append(time[step])
-
-            next = True
-            while next:
-                try:
-                    # Get amplitude
-                    g_new[is_a[step]].append(ampl[step])
-                    if time[step + 1] != time[step]:
-                        if step == 0:
-                            if len(g_new[0]) == 0:
-                                g_new[0].append(0.)
-                            if len(g_new[0]) == 0:
-                                g_new[1].append(0.)
-                            if len(g_new[0]) == 0:
-                                g_new[2].append(0.)
-                        elif step > 0:
-                            if len(g_new[0]) == n_steps:
-                                g_new[0].append(g_new[0][-1])
-                            if len(g_new[1]) == n_steps:
-                                g_new[1].append(g_new[1][-1])
-                            if len(g_new[2]) == n_steps:
-                                g_new[2].append(g_new[2][-1])
-                        n_steps += 1
-                        next = False
-                        gx_new[1].append(g_new[0][-1])
-                        gy_new[1].append(g_new[1][-1])
-                        gz_new[1].append(g_new[2][-1])
-                except:
-                    if step == 0:
-                        if len(g_new[0]) == 0:
-                            g_new[0].append(0.)
-                        if len(g_new[0]) == 0:
-                            g_new[1].append(0.)
-                        if len(g_new[0]) == 0:
-                            g_new[2].append(0.)
-                    elif step > 0:
-                        if len(g_new[0]) == n_steps:
-                            g_new[0].append(g_new[0][-1])
-                        if len(g_new[1]) == n_steps:
-                            g_new[1].append(g_new[1][-1])
-                        if len(g_new[2]) == n_steps:
-                            g_new[2].append(g_new[2][-1])
-                    n_steps += 1
-                    next = False
-                    gx_new[1].append(g_new[0][-1])
-                    gy_new[1].append(g_new[1][-1])
-                    gz_new[1].append(g_new[2][-1])
-                step += 1
-        g_new = np.array(g_new)
-
-        # Rotate the waveforms
+        axes = [waveforms['grad_vx'], waveforms['grad_vy'], waveforms['grad_vz']]
+
+        # Union of the time points of the three axes
+        time = np.unique(np.concatenate([np.asarray(g[0], dtype=float) for g in axes]))
+
+        # Forward-fill each axis onto the common time grid (mT/m)
+        g_new = np.zeros((3, np.size(time)))
+        for axis, g in enumerate(axes):
+            t_axis = np.asarray(g[0], dtype=float)
+            a_axis = np.asarray(g[1], dtype=float) * hw.gFactor[axis]
+            idx = np.argsort(t_axis, kind='stable')
+            t_axis = t_axis[idx]
+            a_axis = a_axis[idx]
+            # Index of the last event at or before each time point (last one wins for repeated times)
+            pos = np.searchsorted(t_axis, time, side='right') - 1
+            g_new[axis] = np.where(pos >= 0, a_axis[np.clip(pos, 0, None)], 0.)
+
+        # Rotate the waveforms and rescale to hardware units
         rot = self.getRotationMatrix()
-        for step in range(np.size(g_new, axis=1)):
-            g_new[:, step] = np.dot(rot, g_new[:, step])
-        gx_new[1] = list(g_new[0, :] / hw.gFactor[0])
-        gy_new[1] = list(g_new[1, :] / hw.gFactor[1])
-        gz_new[1] = list(g_new[2, :] / hw.gFactor[2])
+        g_new = np.dot(rot, g_new) / np.reshape(hw.gFactor, (3, 1))
 
-        waveforms['grad_vx'] = gx_new
-        waveforms['grad_vy'] = gy_new
-        waveforms['grad_vz'] = gz_new
+        waveforms['grad_vx'] = [time, g_new[0]]
+        waveforms['grad_vy'] = [time.copy(), g_new[1]]
+        waveforms['grad_vz'] = [time.copy(), g_new[2]]
 
         # Delete last rotation/displacement if plot
         if self.plotSeq:
@@ -366,6 +324,13 @@ class MRIBLANKSEQ:
                    hardware=True,
                    output='',
                    channels=[0],
+                   pipeline=False,
+                   memmap=None,
+                   dtype=np.complex128,
+                   per_window=False,
+                   average=False,
+                   keep_scans=False,
+                   max_retries=3,
                    ):
         """
         Execute multiple batches of MRI waveforms, manage data acquisition, and store oversampled data.
@@ -400,6 +365,27 @@ class MRIBLANKSEQ:
             String to add to the output keys saved in the mapVals parameter.
         channels : list, optional
             List of channels used for Rx
+        pipeline : bool, optional
+            If True, the next batch is converted and compiled in a worker thread while the current batch is being
+            acquired. All the batches share the same socket to the server. Ignored when plotting the sequence.
+        memmap : str, optional
+            Path of a file used to back the oversampled data with np.memmap, so that very large raw datasets do not
+            need to fit in RAM. By default the data is kept in memory.
+        dtype : numpy.dtype, optional
+            Data type of the oversampled data buffer, complex128 by default or complex64 to halve the memory.
+        per_window : bool, optional
+            If True, the decimation FIR filter is applied to each ADC window independently instead of running over
+            the continuous stream of windows.
+        average : bool, optional
+            If True, the scans of each batch are averaged as they arrive: a running complex sum per batch is
+            accumulated in a worker thread while the next scan runs, and `data_over` and `data_decimated` contain the
+            mean of the scans instead of every scan. Scans that lose data are retried after the other scans of the
+            batch, and a scan still incomplete after `max_retries` attempts is left out of the mean.
+        keep_scans : bool, optional
+            In averaging mode, also store every scan in `self.mapVals['data_scans']`, in a np.memmap if `memmap` is
+            given.
+        max_retries : int, optional
+            Number of times a scan that lost data is repeated in averaging mode.
 
         Returns:
         --------
@@ -408,104 +394,294 @@ class MRIBLANKSEQ:
 
         Notes:
         ------
-        - Initializes Red Pitaya hardware unless in demo mode.
+        - Initializes Red Pitaya hardware unless in demo mode. The connection to the server is borrowed from the
+          persistent connection pool, so every batch reuses the same socket and only the sequence memory is
+          replaced between batches.
         - Converts PyPulseq waveforms to Red Pitaya-compatible format.
         - If `plotSeq` is True, the sequence is plotted instead of executed.
         - In demo mode, simulated random data replaces hardware acquisition.
         - Oversampled data is stored in `self.mapVals['data_over']`.
-        - Decimated data is stored in `self.mapVals['data_decimated']`.
+        - Decimated data is stored in `self.mapVals['data_decimated']`. Each scan is decimated as soon as it is
+          acquired, with the same result as decimating the full oversampled data at the end.
         - Handles data loss by repeating batches until the expected points are acquired.
+        - In averaging mode, the running mean is available during the acquisition with `self.averager.mean()` and
+          the number of averaged scans of each batch is stored in `self.mapVals['n_averages']`.
+        - In pipelined mode, the preparation and acquisition intervals of each batch are stored in
+          `self.batch_times` and the achieved overlap is printed.
+        - The time spent creating the experiment, converting the waveforms, loading them and compiling the machine
+          code is printed for each batch and stored in `self.stage_times`. The hits and misses of the compiled
+          sequence cache are printed once all the batches have run.
         """
         self.mapVals['n_readouts'] = list(n_readouts.values())
         self.mapVals['n_batches'] = len(n_readouts.values())
-
-        # Initialize a list to hold oversampled data
-        data_over = []
-
-        # Iterate through each batch of waveforms
-        for seq_num in waveforms.keys():
-            # Initialize the experiment if not in demo mode
+        self.stage_times = {}
+
+        # Preallocate the buffer for the oversampled data of every scan and batch
+        n_points = sum(n_readouts.values()) * oversampling_factor * self.nScans if not self.plotSeq else 0
+        self.averager = None
+        if average and n_points > 0:
+            # Keep a single running sum per batch instead
+            self.averager = utils.ScanAverager({seq_num: n * oversampling_factor for seq_num, n in n_readouts.items()},
+                                               self.nScans,
+                                               dtype=dtype,
+                                               keep_scans=keep_scans,
+                                               file_path=memmap)
+            n_points = 0
+            memmap = None  # Used by the individual scans
+        data_over = utils.allocate_acquisition_buffer(n_points, dtype=dtype, file_path=memmap)
+        data_idx = 0
+
+        # Decimate each scan as soon as it is acquired, so the decimated data is ready when the last batch returns
+        decimator = None
+        if n_points > 0 and n_points % n_adc == 0:
+            decimator = utils.StreamingDecimator(n_points // n_adc,
+                                                 option=decimate,
+                                                 remove=False,
+                                                 add_rd_points=add_rd_points,
+                                                 oversampling_factor=oversampling_factor,
+                                                 decimation_factor=decimation_factor,
+                                                 per_window=per_window)
+
+        def prepare_batch(seq_num, prev_socket=None):
+            """
+            Build the experiment and the flo_dict of one batch, convert its waveforms and compile them so the machine
+            code is ready to be sent to the server. Nothing is stored in the sequence, so it can run in a worker
+            thread while another batch is acquired.
+            """
+            t0 = time.time()
+            expt = None
             if not self.demo:
-                self.expt = ex.Experiment(
+                expt = ex.Experiment(
                     lo_freq=frequency,  # Larmor frequency in MHz
                     rx_t=1 / bandwidth,  # Sampling time in us
                     init_gpa=False,  # Whether to initialize GPA board (False for now)
                     gpa_fhdo_offset_time=(1 / 0.2 / 3.1),  # GPA offset time calculation
                     auto_leds=True,  # Automatic control of LEDs
                     oversampling_factor=oversampling_factor,
+                    prev_socket=prev_socket,  # Reuse the socket of the first batch when pipelining
                 )
+            t1 = time.time()
 
             # Convert the PyPulseq waveform to the Red Pitaya compatible format
-            self.pypulseq2mriblankseq(waveforms=waveforms[seq_num],
-                                      shimming=self.shimming,
-                                      sampling_period=1/bandwidth,
-                                      hardware=hardware,
-                                      channels=channels
-                                      )
+            flo_dict = self.pypulseq2flodict(waveforms=waveforms[seq_num],
+                                             shimming=self.shimming,
+                                             sampling_period=1/bandwidth,
+                                             hardware=hardware,
+                                             channels=channels
+                                             )
+            t2 = time.time()
 
             # Load the waveforms into Red Pitaya
-            if not self.floDict2Exp():
-                print("ERROR: Sequence waveforms out of hardware bounds")
-                return False
-            else:
-                print("Sequence waveforms loaded successfully")
-
-            # If not plotting the sequence, start scanning
-            if not self.plotSeq:
-                for scan in range(self.nScans):
+            ready = self.floDict2Exp(expt=expt, flo_dict=flo_dict)
+            t3 = time.time()
+
+            # Compile the machine code in advance
+            if ready and not self.plotSeq and expt is not None:
+                expt.compile()
+            t4 = time.time()
+
+            stages = {'experiment': t1 - t0, 'conversion': t2 - t1, 'loading': t3 - t2, 'compilation': t4 - t3}
+            return {'expt': expt, 'flo_dict': flo_dict, 'ready': ready, 'stages': stages, 'prepare': (t0, time.time())}
+
+        def start_batch(seq_num, batch):
+            """
+            Make the prepared batch the current one of the sequence and report the time spent in each stage.
+            """
+            self.expt = batch['expt']
+            self.flo_dict = batch['flo_dict']
+            stages = batch['stages']
+            self.stage_times[seq_num] = stages
+            print(f"Batch {seq_num.split('_')[-1]} preparation: experiment {stages['experiment']:.3f} s, "
+                  f"conversion {stages['conversion']:.3f} s, loading {stages['loading']:.3f} s, "
+                  f"compilation {stages['compilation']:.3f} s")
+
+        def acquire_batch(seq_num):
+            """
+            Run every scan of the current batch, write the acquired data into the preallocated buffer and feed it
+            to the streaming decimator.
+            """
+            nonlocal data_idx
+            if self.averager is not None:
+                average_batch(seq_num)
+                return
+            for scan in range(self.nScans):
+                print(f"Scan {scan + 1}, batch {seq_num.split('_')[-1]}/{len(n_readouts)} running...")
+                acquired_points = 0
+                expected_points = n_readouts[seq_num] * oversampling_factor  # Expected number of points
+
+                # Continue acquiring points until we reach the expected number
+                while acquired_points != expected_points:
+                    if not self.demo:
+                        rxd, msgs = self.expt.run()  # Run the experiment and collect data
+                    else:
+                        # In demo mode, generate random data as a placeholder
+                        rxd = {'rx0': np.random.randn(expected_points) + 1j * np.random.randn(expected_points)}
+
+                    # Update acquired points
+                    acquired_points = np.size(rxd['rx0'])
+
+                    # Check if acquired points coincide with expected points
+                    if acquired_points != expected_points:
+                        print("WARNING: data points lost!")
+                        print("Repeating batch...")
+
+                # Write acquired data into the oversampled data array
+                data_over[data_idx:data_idx + acquired_points] = rxd['rx0']
+                if decimator is not None:
+                    decimator.push(data_over[data_idx:data_idx + acquired_points])
+                data_idx += acquired_points
+                print(f"Acquired points = {acquired_points}, Expected points = {expected_points}")
+                print(f"Scan {scan + 1}, batch {seq_num.split('_')[-1]}/{len(n_readouts)} ready!")
+
+        def average_batch(seq_num):
+            """
+            Run every scan of the current batch and queue it to the running average. Scans with lost data do not
+            stop the batch: they are repeated once the other scans have been acquired.
+            """
+            expected_points = n_readouts[seq_num] * oversampling_factor  # Expected number of points
+            pending = list(range(self.nScans))
+            for attempt in range(max_retries + 1):
+                lost = []
+                for scan in pending:
                     print(f"Scan {scan + 1}, batch {seq_num.split('_')[-1]}/{len(n_readouts)} running...")
-                    acquired_points = 0
-                    expected_points = n_readouts[seq_num] * oversampling_factor  # Expected number of points
-
-                    # Continue acquiring points until we reach the expected number
-                    while acquired_points != expected_points:
-                        if not self.demo:
-                            rxd, msgs = self.expt.run()  # Run the experiment and collect data
-                        else:
-                            # In demo mode, generate random data as a placeholder
-                            rxd = {'rx0': np.random.randn(expected_points) + 1j * np.random.randn(expected_points)}
-
-                        # Update acquired points
-                        acquired_points = np.size(rxd['rx0'])
-
-                        # Check if acquired points coincide with expected points
-                        if acquired_points != expected_points:
-                            print("WARNING: data points lost!")
-                            print("Repeating batch...")
-
-                    # Concatenate acquired data into the oversampled data array
-                    data_over = np.concatenate((data_over, rxd['rx0']), axis=0)
-                    print(f"Acquired points = {acquired_points}, Expected points = {expected_points}")
-                    print(f"Scan {scan + 1}, batch {seq_num.split('_')[-1]}/{len(n_readouts)} ready!")
-
-            elif self.plotSeq and self.standalone:
-                # Plot the sequence if requested and return immediately
-                self.sequencePlot(standalone=self.standalone)
+                    if not self.demo:
+                        rxd, msgs = self.expt.run()  # Run the experiment and collect data
+                    else:
+                        # In demo mode, generate random data as a placeholder
+                        rxd = {'rx0': np.random.randn(expected_points) + 1j * np.random.randn(expected_points)}
 
-            if not self.demo:
-                self.expt.__del__()
+                    if np.size(rxd['rx0']) != expected_points:
+                        print("WARNING: data points lost!")
+                        lost.append(scan)
+                    else:
+                        # Accumulated in the background while the next scan runs
+                        self.averager.add(seq_num, scan, rxd['rx0'])
+                pending = lost
+                if not pending:
+                    break
+                if attempt < max_retries:
+                    print(f"Repeating {len(pending)} scans...")
+            if pending:
+                print(f"WARNING: {len(pending)} scans of batch {seq_num.split('_')[-1]} left out of the average")
+
+        # Pipelining only makes sense when the batches are acquired
+        pipeline = pipeline and not self.plotSeq and len(waveforms) > 1
+
+        if pipeline:
+            # Prepare the next batch in a worker thread while the current one is acquired
+            seq_nums = list(waveforms.keys())
+            self.batch_times = {'prepare': [], 'acquire': []}
+
+            def worker(seq_num, prev_socket, result):
+                try:
+                    result.update(prepare_batch(seq_num, prev_socket))
+                except Exception as e:
+                    result['error'] = e
+
+            batch = prepare_batch(seq_nums[0])
+            owner = batch['expt']  # Experiment owning the socket shared by all the batches
+            prev_socket = owner._s if owner is not None else None
+            thread = None
+            try:
+                for n, seq_num in enumerate(seq_nums):
+                    start_batch(seq_num, batch)
+                    if not batch['ready']:
+                        print("ERROR: Sequence waveforms out of hardware bounds")
+                        return False
+                    print("Sequence waveforms loaded successfully")
+                    self.batch_times['prepare'].append(batch['prepare'])
+
+                    # Start the preparation of the next batch
+                    if n + 1 < len(seq_nums):
+                        next_batch = {}
+                        thread = threading.Thread(target=worker, args=(seq_nums[n + 1], prev_socket, next_batch))
+                        thread.start()
+
+                    # Acquire the current batch
+                    t0 = time.time()
+                    acquire_batch(seq_num)
+                    self.batch_times['acquire'].append((t0, time.time()))
+
+                    # Wait for the next batch
+                    if thread is not None:
+                        thread.join()
+                        thread = None
+                        if 'error' in next_batch:
+                            raise next_batch['error']
+                        batch = next_batch
+            finally:
+                # Also when the acquisition fails: no worker may keep using the socket once it is returned
+                if thread is not None:
+                    thread.join()
+                if owner is not None:
+                    owner.__del__()
+
+            # Report how much of the preparation was hidden behind the acquisition
+            t_prepare = sum(t1 - t0 for t0, t1 in self.batch_times['prepare'])
+            t_acquire = sum(t1 - t0 for t0, t1 in self.batch_times['acquire'])
+            t_hideable = sum(t1 - t0 for t0, t1 in self.batch_times['prepare'][1:])
+            t_overlap = 0
+            for (p0, p1), (a0, a1) in zip(self.batch_times['prepare'][1:], self.batch_times['acquire'][:-1]):
+                t_overlap += max(0, min(p1, a1) - max(p0, a0))
+            self.batch_times['overlap'] = t_overlap
+            print(f"Batch preparation: {t_prepare:.2f} s, acquisition: {t_acquire:.2f} s, "
+                  f"overlapped: {t_overlap:.2f} s ({100 * t_overlap / max(t_hideable, 1e-9):.0f}% of the "
+                  f"preparation after the first batch)")
+        else:
+            # Iterate through each batch of waveforms
+            for seq_num in waveforms.keys():
+                batch = prepare_batch(seq_num)
+                start_batch(seq_num, batch)
+                if not batch['ready']:
+                    print("ERROR: Sequence waveforms out of hardware bounds")
+                    if not self.demo:
+                        self.expt.__del__()  # Return the connection to the pool
+                    return False
+                else:
+                    print("Sequence waveforms loaded successfully")
+
+                # If not plotting the sequence, start scanning
+                if not self.plotSeq:
+                    acquire_batch(seq_num)
+
+                elif self.plotSeq and self.standalone:
+                    # Plot the sequence if requested and return immediately
+                    self.sequencePlot(standalone=self.standalone)
+
+                if not self.demo:
+                    self.expt.__del__()  # Return the connection to the pool
+
+        # Report the compiled sequence cache once per run
+        if not self.demo and not self.plotSeq:
+            print(ex.compile_cache.stats())
 
         # Decimate the oversampled data and store it
+        if self.averager is not None:
+            # The decimation is linear, so the mean is decimated once
+            data_over = self.averager.finish()
+            self.mapVals['n_averages'] = list(self.averager.counts.values())
+            if keep_scans:
+                self.mapVals['data_scans' if output == '' else f'data_scans_{output}'] = self.averager.scans
+            decimator = None
         if not self.plotSeq:
-            if output == '':
-                self.mapVals[f'data_over'] = data_over
-                data = utils.decimate(data_over,
+            if isinstance(data_over, np.memmap):
+                data_over.flush()
+            if decimator is not None:
+                data = decimator.finish()
+            else:
+                data = utils.decimate(data_over.copy(),
                                       n_adc=n_adc,
                                       option=decimate,
                                       remove=False,
                                       add_rd_points=add_rd_points,
                                       oversampling_factor=oversampling_factor,
-                                      decimation_factor=decimation_factor)
+                                      decimation_factor=decimation_factor,
+                                      per_window=per_window)
+            if output == '':
+                self.mapVals[f'data_over'] = data_over
                 self.mapVals[f'data_decimated'] = data
             else:
                 self.mapVals[f'data_over_{output}'] = data_over
-                data = utils.decimate(data_over,
-                                      n_adc=n_adc,
-                                      option=decimate,
-                                      remove=False,
-                                      add_rd_points=add_rd_points,
-                                      oversampling_factor=oversampling_factor,
-                                      decimation_factor=decimation_factor)
                 self.mapVals[f'data_decimated_{output}'] = data
 
         return True
@@ -550,112 +726,199 @@ class MRIBLANKSEQ:
 
         Workflow:
         ---------
-        1. **Reset flo_dict**:
-            Initializes the flo dictionary, which stores gradient, RF, and TTL signals for MRI hardware execution.
-
-        2. **Fill flo_dict**:
-            Iterates through the input `waveforms` to populate the flo dictionary. Each key corresponds to a signal
-            type, and the waveform data is appended.
+        1. **Fill flo_dict**:
+            Each channel in `PYPULSEQ_CHANNELS` takes the waveform of its key without the last point. Channels
+            without data are set to zero. Every channel is allocated once with room for the two closing points.
 
-        3. **Fill missing keys**:
-            Ensures that all keys in `flo_dict` are populated, even if no data exists for certain signals. Unfilled
-            keys are set to default arrays with zero values.
-
-        4. **Apply shimming**:
+        2. **Apply shimming**:
             Adds the shimming values to the corresponding gradient channels (x, y, z).
 
-        5. **Set sequence end**:
+        3. **Set sequence end**:
             Ensures all signals return to zero at the end of the sequence to finalize waveform execution.
 
-        6. **Add hardware-specific corrections**:
+        4. **Add hardware-specific corrections**:
             - Applies gradient latency adjustments.
             - Accounts for CIC filter delays in the receive (rx) signals.
 
-        7. **Revalidate sequence end**:
+        5. **Revalidate sequence end**:
             Reassesses and ensures all signal channels return to zero with a buffer period.
 
         Notes:
         ------
-        - This method processes and validates input waveform data to ensure compatibility with MRI hardware.
+        - The result is the same as filling the channels point by point and calling `endSequence` twice, with the
+          shimming and delays applied in place.
         - Hardware-specific parameters such as gradient delay (`hw.gradDelay`) and CIC filter delay
           (`hw.cic_delay_points`) are applied.
         - Any signal not specified in `waveforms` is initialized with a default value of zero.
 
         """
-        # Reset flo dictionary
-        self.flo_dict = {'g0': [[], []],
-                         'g1': [[], []],
-                         'g2': [[], []],
-                         'rx0': [[], []],
-                         'rx1': [[], []],
-                         'tx0': [[], []],
-                         'tx1': [[], []],
-                         'ttl0': [[], []],
-                         'ttl1': [[], []],}
-
-        # Fill dictionary
-        for key in waveforms.keys():
-            if key == 'tx0':
-                self.flo_dict['tx0'][0] = np.concatenate((self.flo_dict['tx0'][0], waveforms['tx0'][0][0:-1]), axis=0)
-                self.flo_dict['tx0'][1] = np.concatenate((self.flo_dict['tx0'][1], waveforms['tx0'][1][0:-1]), axis=0)
-            elif key == 'tx1':
-                self.flo_dict['tx1'][0] = np.concatenate((self.flo_dict['tx1'][0], waveforms['tx1'][0][0:-1]), axis=0)
-                self.flo_dict['tx1'][1] = np.concatenate((self.flo_dict['tx1'][1], waveforms['tx1'][1][0:-1]), axis=0)
-            elif key == 'rx0_en':
-                self.flo_dict['rx0'][0] = np.concatenate((self.flo_dict['rx0'][0], waveforms['rx0_en'][0][0:-1]), axis=0)
-                self.flo_dict['rx0'][1] = np.concatenate((self.flo_dict['rx0'][1], waveforms['rx0_en'][1][0:-1]), axis=0)
-            elif key == 'rx1_en':
-                self.flo_dict['rx1'][0] = np.concatenate((self.flo_dict['rx1'][0], waveforms['rx1_en'][0][0:-1]), axis=0)
-                self.flo_dict['rx1'][1] = np.concatenate((self.flo_dict['rx1'][1], waveforms['rx1_en'][1][0:-1]), axis=0)
-            elif key == 'tx_gate':
-                self.flo_dict['ttl0'][0] = np.concatenate((self.flo_dict['ttl0'][0], waveforms['tx_gate'][0][0:-1]), axis=0)
-                self.flo_dict['ttl0'][1] = np.concatenate((self.flo_dict['ttl0'][1], waveforms['tx_gate'][1][0:-1]), axis=0)
-            elif key == 'rx_gate':
-                self.flo_dict['ttl1'][0] = np.concatenate((self.flo_dict['ttl1'][0], waveforms['rx_gate'][0][0:-1]), axis=0)
-                self.flo_dict['ttl1'][1] = np.concatenate((self.flo_dict['ttl1'][1], waveforms['rx_gate'][1][0:-1]), axis=0)
-            elif key == 'grad_vx':
-                self.flo_dict['g0'][0] = np.concatenate((self.flo_dict['g0'][0], waveforms['grad_vx'][0][0:-1]), axis=0)
-                self.flo_dict['g0'][1] = np.concatenate((self.flo_dict['g0'][1], waveforms['grad_vx'][1][0:-1]), axis=0)
-            elif key == 'grad_vy':
-                self.flo_dict['g1'][0] = np.concatenate((self.flo_dict['g1'][0], waveforms['grad_vy'][0][0:-1]), axis=0)
-                self.flo_dict['g1'][1] = np.concatenate((self.flo_dict['g1'][1], waveforms['grad_vy'][1][0:-1]), axis=0)
-            elif key == 'grad_vz':
-                self.flo_dict['g2'][0] = np.concatenate((self.flo_dict['g2'][0], waveforms['grad_vz'][0][0:-1]), axis=0)
-                self.flo_dict['g2'][1] = np.concatenate((self.flo_dict['g2'][1], waveforms['grad_vz'][1][0:-1]), axis=0)
-
-        # Fill missing keys
-        for key in self.flo_dict.keys():
-            try:
-                is_unfilled = all(not sublist for sublist in self.flo_dict[key])
-            except:
-                is_unfilled = False
-            if is_unfilled:
-                self.flo_dict[key] = [np.array([0]), np.array([0])]
-
-        # Add shimming
-        self.flo_dict['g0'][1] = self.flo_dict['g0'][1] + shimming[0]
-        self.flo_dict['g1'][1] = self.flo_dict['g1'][1] + shimming[1]
-        self.flo_dict['g2'][1] = self.flo_dict['g2'][1] + shimming[2]
-
-        # Set everything to zero
-        last_times = np.array([value[0][-1] for value in self.flo_dict.values()])
-        last_time = np.max(last_times)
-        self.endSequence(last_time+10)
-
-        # Add gradient latency and CIC filter delay
+        self.flo_dict = self.pypulseq2flodict(waveforms=waveforms,
+                                              shimming=shimming,
+                                              sampling_period=sampling_period,
+                                              hardware=hardware,
+                                              channels=channels)
+        return True
+
+    def pypulseq2flodict(self, waveforms=None,
+                         shimming=np.array([0.0, 0.0, 0.0]),
+                         sampling_period=0.0,
+                         hardware=True,
+                         channels=[0],
+                         ):
+        """
+        Build the flo_dict of PyPulseq waveforms without storing it, as pypulseq2mriblankseq does.
+
+        It does not modify the sequence, so the flo_dict of a batch can be built in a worker thread while another batch
+        is running.
+
+        Args:
+            waveforms (dict): PyPulseq waveforms, (times, values) per waveform key.
+            shimming (numpy.ndarray, optional): Shimming added to the x, y and z gradients.
+            sampling_period (float, optional): Sampling period, used for the CIC filter delay.
+            hardware (bool, optional): Take into account gradient and ADC delay.
+            channels (list, optional): List of channels used for Rx.
+
+        Returns:
+            dict: [times, values] per flo_dict channel.
+        """
+        # Shimming and delays applied to each channel
+        shims = {'g0': shimming[0], 'g1': shimming[1], 'g2': shimming[2]}
+        delays = {}
         if hardware:
-            self.flo_dict['g0'][0][1::] -= hw.gradDelay
-            self.flo_dict['g1'][0][1::] -= hw.gradDelay
-            self.flo_dict['g2'][0][1::] -= hw.gradDelay
-            self.flo_dict['rx0'][0][1::] += hw.cic_delay_points * sampling_period / hw.oversamplingFactor
-            self.flo_dict['rx1'][0][1::] += hw.cic_delay_points * sampling_period / hw.oversamplingFactor
+            rx_delay = hw.cic_delay_points * sampling_period / hw.oversamplingFactor
+            delays = {'g0': -hw.gradDelay, 'g1': -hw.gradDelay, 'g2': -hw.gradDelay, 'rx0': rx_delay, 'rx1': rx_delay}
+
+        # Fill dictionary, leaving room for the two points that set everything to zero
+        sources = {}
+        for key, waveform_key in PYPULSEQ_CHANNELS.items():
+            if waveform_key in waveforms and len(waveforms[waveform_key][0]) > 1:
+                sources[key] = (waveforms[waveform_key][0][0:-1], waveforms[waveform_key][1][0:-1])
+            else:
+                sources[key] = (np.array([0.0]), np.array([0.0]))
+        t_end = max(times[-1] for times, _ in sources.values()) + 10
+
+        flo_dict = {}
+        for key, (source_times, source_values) in sources.items():
+            n = len(source_times)
+            times = np.empty(n + 2)
+            values = np.zeros(n + 2, dtype=np.result_type(source_values, float))
+            times[0:n] = source_times
+            times[n] = t_end
+            values[0:n] = source_values
+            if key in shims:
+                values[0:n] += shims[key]
+            if key in delays:
+                times[1:n + 1] += delays[key]
+            flo_dict[key] = [times, values]
+
+        # Set everything to zero (again) after the delays
+        t_end = max(times[-2] for times, _ in flo_dict.values()) + 10
+        for times, _ in flo_dict.values():
+            times[-1] = t_end
+
+        return flo_dict
 
-        # Set everything to zero (again)
-        last_times = np.array([value[0][-1] for value in self.flo_dict.values()])
-        last_time = np.max(last_times)
-        self.endSequence(last_time + 10)
+    @staticmethod
+    def interpret_template(interpreter, sequence, echo_blocks=None, scaled=()):
+        """
+        Interpret a PyPulseq sequence once so that its waveforms can be repeated with join_templates().
 
-        return True
+        Typical templates are the first blocks of a batch (noise acquisitions and dummy pulses) and one echo train. The
+        echo train is built with unit phase and slice gradients; join_templates() then scales the updates of each echo
+        to get any phase and slice step without calling PyPulseq or the interpreter again.
+
+        Parameters:
+        -----------
+        interpreter : PSInterpreter
+            Interpreter converting the sequence into waveforms.
+        sequence : pp.Sequence
+            Sequence to interpret. Every channel must be off at the end of the sequence.
+        echo_blocks : list, optional
+            Number of blocks in `sequence` before each echo. Required if `scaled` is not empty.
+        scaled : list, optional
+            Waveform keys (e.g. 'grad_vy') whose updates are scaled per echo.
+
+        Returns:
+        --------
+        dict
+            Template with the 'waveforms' of each key without the end point, the 'duration' of the sequence in us and,
+            for the scaled keys, the 'echo' index of each update (-1 before the first echo).
+
+        Raises:
+        -------
+        ValueError
+            If a channel is still on at the end of the sequence, so the template cannot be concatenated.
+        """
+        waveforms = interpret_batch(interpreter, sequence)
+        duration = max(times[-1] for times, _ in waveforms.values())
+
+        template = {'waveforms': {}, 'duration': duration, 'echo': {}}
+        for key, (times, values) in waveforms.items():
+            times, values = np.asarray(times, dtype=float)[:-1], np.asarray(values)[:-1]
+            if values.size and values[-1] != 0:
+                raise ValueError("Template channel %s must be off at the end of the sequence" % key)
+            template['waveforms'][key] = (times, values)
+
+        if scaled:
+            starts = np.concatenate(([0.0], np.cumsum(list(sequence.block_durations.values())) * 1e6))
+            echo_starts = starts[np.asarray(echo_blocks, dtype=int)]
+            for key in scaled:
+                times = template['waveforms'][key][0]
+                template['echo'][key] = np.searchsorted(echo_starts, times + 1e-6, side='right') - 1
+
+        return template
+
+    @staticmethod
+    def join_templates(parts):
+        """
+        Concatenate repeated templates into the waveforms the interpreter would return for the whole batch.
+
+        Parameters:
+        -----------
+        parts : list
+            (template, repetitions) pairs in sequence order. `repetitions` is the number of copies of the template, or
+            a dictionary with an array of shape (copies, echoes) per scaled key giving the scale of each echo.
+
+        Returns:
+        --------
+        dict
+            (times, values) arrays per waveform key, starting with a zero at time 0 and ending with a zero at the end
+            of the batch, with repeated values removed.
+        """
+        keys = parts[0][0]['waveforms'].keys()
+        pieces = {key: ([], []) for key in keys}
+        start = 0.0
+        for template, repetitions in parts:
+            scales = repetitions if isinstance(repetitions, dict) else {}
+            n = len(next(iter(scales.values()))) if scales else repetitions
+            offsets = start + np.arange(n) * template['duration']
+            for key in keys:
+                times, values = template['waveforms'][key]
+                if times.size and times[0] == 0 and values[0] == 0:
+                    times, values = times[1:], values[1:]  # The channel is already off
+                if key in scales:
+                    echo = template['echo'][key]
+                    if times.size < echo.size:
+                        echo = echo[1:]
+                    scale = np.column_stack((np.ones(n), np.asarray(scales[key], dtype=float)))
+                    values = values * scale[:, echo + 1]
+                else:
+                    values = np.broadcast_to(values, (n, values.size))
+                pieces[key][0].append((times + offsets[:, np.newaxis]).ravel())
+                pieces[key][1].append(values.ravel())
+            start += n * template['duration']
+
+        waveforms = {}
+        for key, (times, values) in pieces.items():
+            times = np.concatenate([[0.0]] + times)
+            values = np.concatenate([np.zeros(1, dtype=np.result_type(*values))] + values)
+            # Updates at the same time keep the last one, then repeated values are removed
+            keep = np.append(np.diff(times) > 1e-6, True)
+            times, values = times[keep], values[keep]
+            keep = np.concatenate(([True], values[1:] != values[:-1]))
+            waveforms[key] = (np.append(times[keep], start), np.append(values[keep], 0))
+
+        return waveforms
 
     def getFovDisplacement(self):
         """
@@ -1671,42 +1934,42 @@ class MRIBLANKSEQ:
         self.flo_dict['g%i' % gAxis][0] = np.concatenate((self.flo_dict['g%i' % gAxis][0], np.array([t0])), axis=0)
         self.flo_dict['g%i' % gAxis][1] = np.concatenate((self.flo_dict['g%i' % gAxis][1], np.array([gAmp])), axis=0)
 
-    def floDict2Exp(self, rewrite=True):
+    def floDict2Exp(self, rewrite=True, expt=None, flo_dict=None):
         """
         Check for errors and add instructions to Red Pitaya if no errors are found.
 
         Args:
             rewrite (bool, optional): Whether to overwrite existing values. Defaults to True.
-            demo: If demo is True it just check for errors. Defaults to False.
+            expt (Experiment, optional): Experiment that receives the instructions. Defaults to `self.expt`.
+            flo_dict (dict, optional): Waveforms to load. Defaults to `self.flo_dict`.
 
         Returns:
             bool: True if no errors were found and instructions were successfully added to Red Pitaya; False otherwise.
 
         """
+        if flo_dict is None:
+            flo_dict = self.flo_dict
+
         # Check errors:
-        for key in self.flo_dict.keys():
-            item = self.flo_dict[key]
-            dt = item[0][1::] - item[0][0:-1]
-            if (dt <= 1).any():
+        for key, (times, values) in flo_dict.items():
+            times = np.asarray(times)
+            values = np.asarray(values)
+            if times.size > 1 and np.min(np.diff(times)) <= 1:
                 print("ERROR: %s timing error" % key)
                 return False
-            if (item[1] > 1).any() or (item[1] < -1).any():
+            if values.size > 0 and (np.max(values) > 1 or np.min(values) < -1):
                 print("ERROR: %s amplitude error" % key)
                 return False
 
         # Add instructions to server
         if not self.demo:
-            self.expt.add_flodict({'grad_vx': (self.flo_dict['g0'][0], self.flo_dict['g0'][1]),
-                                   'grad_vy': (self.flo_dict['g1'][0], self.flo_dict['g1'][1]),
-                                   'grad_vz': (self.flo_dict['g2'][0], self.flo_dict['g2'][1]),
-                                   'rx0_en': (self.flo_dict['rx0'][0], self.flo_dict['rx0'][1]),
-                                   'rx1_en': (self.flo_dict['rx1'][0], self.flo_dict['rx1'][1]),
-                                   'tx0': (self.flo_dict['tx0'][0], self.flo_dict['tx0'][1]),
-                                   'tx1': (self.flo_dict['tx1'][0], self.flo_dict['tx1'][1]),
-                                   'tx_gate': (self.flo_dict['ttl0'][0], self.flo_dict['ttl0'][1]),
-                                #    'rx_gate': (self.flo_dict['ttl1'][0], self.flo_dict['ttl1'][1]),
-                                   'rx_gate': (self.flo_dict['rx0'][0], self.flo_dict['rx0'][1]),
-                                   }, rewrite)
+            if expt is None:
+                expt = self.expt
+            # Convert every channel to the integer dictionary once, the rx gate reuses the rx0 conversion
+            intdict = expt.flo2int({key: tuple(flo_dict[channel]) for key, channel in EXPERIMENT_CHANNELS.items()
+                                    if key != 'rx_gate'})
+            intdict['rx_gate'] = intdict['rx0_en']
+            expt.add_intdict(intdict, rewrite)
         return True
 
     def saveRawDataLite(self):
@@ -1720,6 +1983,13 @@ class MRIBLANKSEQ:
         if not os.path.exists(directory):
             os.makedirs(directory)
 
+        # Save the outputs in the raw data store, without compression as the file is only used for the reconstruction
+        if getattr(sys_config, 'raw_data_format', 'h5') == 'h5':
+            directory_raw = directory + '/raw'
+            os.makedirs(directory_raw, exist_ok=True)
+            rawdatamanager.save_raw_data("%s/temp.h5" % directory_raw, self.mapVals)
+            return "%s/temp.h5" % directory_raw
+
         # generate directories for mat, csv and dcm files
         directory_mat = directory + '/mat'
         if not os.path.exists(directory + '/mat'):
@@ -1731,19 +2001,25 @@ class MRIBLANKSEQ:
 
         return "%s/temp.mat" % directory_mat
 
-    def saveRawData(self):
+    def saveRawData(self, updated_keys=None):
         
         """
         Save the rawData.
 
-        This method saves the rawData to various formats including .mat, .csv, .dcm, .nii and .h5.
+        This method saves the rawData to various formats including the raw data file, .csv, .dcm, .nii and .h5.
+        The files are written in the background by the output writer (marge.manager.outputmanager) from a snapshot of
+        the current values, so the method returns before they are on disk.
 
-        The .mat file contains the rawData.
+        The raw data file contains the rawData: an HDF5 file in the 'raw' folder or a .mat file in the 'mat' folder,
+        depending on `raw_data_format` in sys_config.
         The .csv file contains only the input parameters.
         The .dcm file is the DICOM image.
         The .nii file is the nifti image
         The .h5 file is the ISMRMRD format.
-        
+
+        Args:
+            updated_keys (iterable, optional): Keys of mapVals changed since the last call to saveRawDataLite. If
+                given, the .h5 file saved by saveRawDataLite is reused and only these values are written.
 
         Returns:
             None
@@ -1760,13 +2036,17 @@ class MRIBLANKSEQ:
         if not os.path.exists(directory):
             os.makedirs(directory)
 
-        # generate directories for mat, csv and dcm files
+        # generate directories for raw, mat, csv and dcm files
+        raw_data_format = getattr(sys_config, 'raw_data_format', 'h5')
+        directory_raw = directory + '/raw'
         directory_mat = directory + '/mat'
         directory_csv = directory + '/csv'
         directory_dcm = directory + '/dcm'
         directory_nii = directory + '/nii'
         directory_ismrmrd = directory + '/ismrmrd'
         
+        if raw_data_format == 'h5' and not os.path.exists(directory + '/raw'):
+            os.makedirs(directory_raw)
         if not os.path.exists(directory + '/mat'):
             os.makedirs(directory_mat)
         if not os.path.exists(directory + '/csv'):
@@ -1778,6 +2058,7 @@ class MRIBLANKSEQ:
         if not os.path.exists(directory + '/ismrmrd'):
             os.makedirs(directory_ismrmrd)
 
+        self.directory_raw = directory_raw
         self.directory_mat = directory_mat
         self.directory_rmd=directory_ismrmrd
         
@@ -1790,47 +2071,93 @@ class MRIBLANKSEQ:
         else:
             self.raw_data_name = self.mapVals['seqName']
             file_name = "%s.%s" % (self.mapVals['seqName'], name_string)
-        self.mapVals['fileName'] = "%s.mat" % file_name
+        self.mapVals['fileName'] = "%s.%s" % (file_name, raw_data_format)
         # Generate filename for ismrmrd
         self.mapVals['fileNameIsmrmrd'] = "%s.h5" % file_name
         self.file_name = file_name
-        # Save mat file with the outputs
-        savemat("%s/%s.mat" % (directory_mat, file_name), self.mapVals) # au format savemat(chemin_fichier_mat, {"data" : data}), avec data contient les données brute à sauvegarder
+        writer = outputmanager.get_writer()
+        if raw_data_format == 'h5':
+            # Save the outputs in the raw data store, and a .mat copy if requested
+            raw_path = "%s/%s.h5" % (directory_raw, file_name)
+            temp_path = "%s/temp.h5" % directory_raw
+            compression = getattr(sys_config, 'raw_data_compression', None)
+            if updated_keys is not None and compression is None and os.path.exists(temp_path):
+                # The arrays are already in the file used for the reconstruction
+                os.replace(temp_path, raw_path)
+                keys = list(updated_keys) + ['name_string', 'fileName', 'fileNameIsmrmrd']
+                values = outputmanager.snapshot({key: self.mapVals[key] for key in keys})
+                writer.submit(raw_path, rawdatamanager.update_raw_data, raw_path, values)
+            else:
+                writer.submit(raw_path, rawdatamanager.save_raw_data, raw_path, outputmanager.snapshot(self.mapVals),
+                              compression=compression)
+            if getattr(sys_config, 'raw_data_mat', False):
+                mat_path = "%s/%s.mat" % (directory_mat, file_name)
+                writer.submit(mat_path, rawdatamanager.export_mat, raw_path, mat_path, after=[raw_path])
+        else:
+            # Save mat file with the outputs
+            mat_path = "%s/%s.mat" % (directory_mat, file_name)
+            writer.submit(mat_path, savemat, mat_path, outputmanager.snapshot(self.mapVals))
 
         # Save csv with input parameters
-        with open('%s/%s.csv' % (directory_csv, file_name), 'w') as csvfile: # ouvrir le fichier csv en mode écriture au format with open(chemin_fichier_csv, 'w', newline='') as csvfile:
-            writer = csv.DictWriter(csvfile, fieldnames=self.mapKeys) # mapKeys contient les noms des colonnes du fichier csv que l'on veut sauvegarder 
-            writer.writeheader() # écrire l'entete du csv les noms des colonnes dans le fichier csv
-            mapVals = {} # stockage de valeurs de données à écrire
-            for key in self.mapKeys:  # take only the inputs from mapVals
-                mapVals[key] = self.mapVals[key] # copie les donnée de l'acquisition stockées dans self.mapVals dans mapVals
-            writer.writerows([self.mapNmspc, mapVals]) # écrire les données dans le fichier csv
+        csv_path = '%s/%s.csv' % (directory_csv, file_name)
+        mapVals = {}
+        for key in self.mapKeys:  # take only the inputs from mapVals
+            mapVals[key] = self.mapVals[key]
+        writer.submit(csv_path, self.write_csv, csv_path, list(self.mapKeys),
+                      outputmanager.snapshot([self.mapNmspc, mapVals]))
 
         # Save dcm and nifti with the final image
         if (len(self.output) > 0) and (self.output[0]['widget'] == 'image') and (self.mode is None): ##verify if output is an image
             try:
-                utils.save_dicom(axes_orientation=self.mapVals['axesOrientation'],
-                                 n_points=self.mapVals['nPoints'],
-                                 fov=self.mapVals['fov'],
-                                 dfov=self.mapVals['dfov'],
-                                 image=self.mapVals['image3D'],
-                                 file_path=f"{directory_dcm}/{file_name}.dcm",
-                                 meta_data=self.meta_data,
-                                 session=self.session
-                                 )
-                utils.save_nifti(axes_orientation=self.mapVals['axesOrientation'],
-                                 n_points=self.mapVals['nPoints'],
-                                 fov=self.mapVals['fov'],
-                                 dfov=self.mapVals['dfov'],
-                                 image=self.mapVals['image3D'],
-                                 file_path=f"{directory_nii}/{file_name}.nii"
-                                 )
+                image = outputmanager.snapshot(self.mapVals['image3D'])
+                geometry = outputmanager.snapshot(dict(axes_orientation=self.mapVals['axesOrientation'],
+                                                       n_points=self.mapVals['nPoints'],
+                                                       fov=self.mapVals['fov'],
+                                                       dfov=self.mapVals['dfov']))
+                dcm_path = f"{directory_dcm}/{file_name}.dcm"
+                nii_path = f"{directory_nii}/{file_name}.nii"
+                writer.submit(dcm_path, utils.save_dicom, image=image, file_path=dcm_path,
+                              meta_data=outputmanager.snapshot(self.meta_data),
+                              session=outputmanager.snapshot(self.session), **geometry)
+                writer.submit(nii_path, utils.save_nifti, image=image, file_path=nii_path, **geometry)
             except Exception as e:
                 print(f"WARNING: Dicom or Nifti error: {e}")
 
         # Move seq files
         self.move_batch_files(destination_folder=directory, file_name=file_name)
 
+    def exportRawDataMat(self):
+        """
+        Get the .mat file of the last saved rawData, exporting it from the .h5 raw data file if needed.
+
+        Tools that only read MATLAB files, such as the Tyger pipelines, use this method to get the raw data. It waits
+        for the raw data file if it is still being written.
+
+        Returns:
+            str: Path of the .mat file in the 'mat' folder.
+        """
+        mat_path = "%s/%s.mat" % (self.directory_mat, self.file_name)
+        raw_path = "%s/%s.h5" % (self.directory_raw, self.file_name)
+        outputmanager.flush([raw_path, mat_path])
+        if not os.path.exists(mat_path) and os.path.exists(raw_path):
+            rawdatamanager.export_mat(raw_path, mat_path)
+        return mat_path
+
+    @staticmethod
+    def write_csv(file_path, fieldnames, rows):
+        """
+        Write the input parameters to a .csv file.
+
+        Args:
+            file_path (str): Path of the .csv file.
+            fieldnames (list): Keys of the input parameters, used as columns.
+            rows (list): Rows to write, dictionaries with the names and the values of the parameters.
+        """
+        with open(file_path, 'w') as csvfile:
+            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+            writer.writeheader()
+            writer.writerows(rows)
+
     @staticmethod
     def move_batch_files(destination_folder, file_name):
         """
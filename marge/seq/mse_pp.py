@@ -34,6 +34,7 @@ import marge.marcos.marcos_client.experiment as ex
 import marge.configs.hw_config as hw
 import marge.configs.units as units
 import marge.seq.mriBlankSeq as blankSeq
+from marge.marge_utils.batch_builder import BatchBuilder
 from marga_pulseq.interpreter import PSInterpreter
 
 
@@ -424,7 +425,7 @@ class MSE(blankSeq.MRIBLANKSEQ):
             gradients, adding excitation, refocusing pulses, and gradient blocks. It dynamically
             divides the readout points between batches and ensures that no one exceeds
             the maximum allowable readout points. The batches are checked for timing errors,
-            and the finalized batches are written to files.
+            and the finalized batches are written and interpreted in parallel by a `BatchBuilder`.
 
             Workflow:
             ---------
@@ -432,7 +433,8 @@ class MSE(blankSeq.MRIBLANKSEQ):
             2. Initialize a new sequence when needed based on the readout points limit.
             3. Add excitation, refocusing pulses, gradients (slice, phase, readout), and ADC blocks.
             4. Ensure correct timing of the final sequence and generate a timing error report if needed.
-            5. Write each sequence to a file and interpret the sequence to generate waveforms.
+            5. Submit each complete sequence to the `BatchBuilder`, which writes it to a file (if `write_seq_files`
+               is True in sys_config) and interprets it in a worker process to generate waveforms.
 
             Returns:
             --------
@@ -468,15 +470,15 @@ class MSE(blankSeq.MRIBLANKSEQ):
 
             File Output:
             ------------
-            The sequence files are saved with the `.seq` extension, and the waveforms are
-            interpreted using the `flo_interpreter`.
+            The sequence files are saved with the `.seq` extension unless `write_seq_files` is False in
+            sys_config, and the waveforms are interpreted using the `flo_interpreter`.
             """
 
             n_rd_points = 0
             n_rd_points_dict = {}
             seq_idx = 0
             seq_num = "batch_0"
-            waveforms = {}
+            builder = BatchBuilder(self.flo_interpreter)
 
             # Slice sweep
             for Cz in range(nSL):
@@ -490,9 +492,7 @@ class MSE(blankSeq.MRIBLANKSEQ):
                     if seq_idx == 0 or n_rd_points + n_rd_points_per_train > hw.maxRdPoints:
                         # Write seq file
                         if seq_idx > 0:
-                            batches[seq_num].write(seq_num + ".seq")
-                            waveforms[seq_num], param_dict = self.flo_interpreter.interpret(seq_num + ".seq")
-                            print(seq_num + ".seq ready!")
+                            builder.submit(seq_num, batches[seq_num])
 
                         # Create new batch
                         seq_idx += 1
@@ -528,9 +528,8 @@ class MSE(blankSeq.MRIBLANKSEQ):
             n_rd_points_dict[seq_num] = n_rd_points
 
             # Write the sequence files
-            batches[seq_num].write(seq_num + ".seq")
-            waveforms[seq_num], param_dict = self.flo_interpreter.interpret(seq_num + ".seq")
-            print(seq_num + ".seq ready!")
+            builder.submit(seq_num, batches[seq_num])
+            waveforms = builder.waveforms()
             print("%i batches created." % len(batches))
             print("Sequence ready!")
 
@@ -9,6 +9,9 @@ import numpy as np
 import marge.controller.experiment_gui as ex
 import marge.configs.hw_config as hw # Import the scanner hardware config
 import marge.seq.mriBlankSeq as blankSeq  # Import the mriBlankSequence for any new sequence.
+from marge.marge_utils import art
+from marge.marge_utils import fft
+from marge.marge_utils import utils
 from scipy.interpolate import griddata
 from marge_tyger import tyger_petra
 
@@ -45,7 +48,7 @@ class PETRA(blankSeq.MRIBLANKSEQ):
         self.addParameter(key='txChannel', string='Tx channel', val=0, field='RF')
         self.addParameter(key='rxChannel', string='Rx channel', val=0, field='RF')
         self.addParameter(key='NyquistOS', string='Radial oversampling', val=1, field='SEQ')
-        self.addParameter(key='reco', string='ART->0,  FFT->1', val=1, field='IM')
+        self.addParameter(key='reco', string='ART->0,  FFT->1,  NUFFT->2', val=1, field='IM')
         self.addParameter(key='boolGrid', string='Bool regridding', val=1, field='OTH')
         self.addParameter(key='tyger_recon', string='Tyger ART reconstruction', val=0, field='PRO',
                     tip='To reconstruct with Tyger (0 = Disabled; 1 = Enabled)')
@@ -467,7 +470,7 @@ class PETRA(blankSeq.MRIBLANKSEQ):
                 kSpaceCartesian[:, 4] = valCartesian.real
                 kSpaceCartesian[:, 5] = valCartesian.imag
                 kSpaceArray = np.reshape(valCartesian, (nPoints[2], nPoints[1], nPoints[0]))
-                ImageFFT = np.fft.ifftshift(np.fft.ifftn(np.fft.ifftshift(kSpaceArray)))
+                ImageFFT = fft.centered_ifftn(kSpaceArray, shifts=(fft.IFFTSHIFT, fft.IFFTSHIFT))
                 self.mapVals['kSpaceCartesian'] = kSpaceCartesian
                 self.mapVals['kSpaceArray'] = kSpaceArray
                 self.mapVals['ImageFFT'] = ImageFFT
@@ -490,7 +493,6 @@ class PETRA(blankSeq.MRIBLANKSEQ):
             sampled_Kspace = self.mapVals['kSpaceRaw']
             kS = np.array(sampled_Kspace[:, 0:3].real)
             signal = sampled_Kspace[:, 3]
-            tSTEPS = signal.shape[0]
             FoVx = fov[0]
             FoVy = fov[1]
             FoVz = fov[2]
@@ -500,30 +502,31 @@ class PETRA(blankSeq.MRIBLANKSEQ):
             dx2 = FoVx / NX
             dy2 = FoVy / NY
             dz2 = FoVz / NZ
-            nn = NX * NY * NZ
-            RHO = np.zeros((1, nn))
-            kk = np.arange(NZ)
-            jj = np.arange(NY)
-            ii = np.arange(NX)
-            count = 1
-
-            for n in range(niter):
-                for tt in range(tSTEPS):
-                    Mtk = np.reshape(np.array(np.exp(-1*1j * (2 * np.pi * kS[tt, 2] * (-(NZ - 1) / 2 + kk) * dz2))), [1, NZ])
-                    Mtj = np.reshape(np.array(np.exp(-1*1j * (2 * np.pi * kS[tt, 1] * (-(NY - 1) / 2 + jj) * dy2))), [NY, 1])
-                    Mtjk = np.reshape(np.matmul(Mtj, Mtk), [1, NY*NZ])
-                    aux = np.reshape(np.exp(-1*1j * (2 * np.pi * kS[tt, 0] * (-(NX - 1) / 2 + ii) * dx2)), [NX, 1])
-                    Mt = np.reshape(np.matmul(aux, Mtjk), [1, NX*NY*NZ])
-                    delta_t = (signal[tt] - np.sum(np.matmul(np.reshape(Mt, [NX*NY*NZ, 1]), RHO))) / np.dot(np.squeeze(np.asarray(Mt)), np.squeeze(np.asarray(Mt)))
-                    RHO = (RHO + update * delta_t * np.conj(Mt))
-                    count = count + 1
-                    print(tt, "/", tSTEPS, " ART")
+            x = (-(NX - 1) / 2 + np.arange(NX)) * dx2
+            y = (-(NY - 1) / 2 + np.arange(NY)) * dy2
+            z = (-(NZ - 1) / 2 + np.arange(NZ)) * dz2
+
+            def progress(iteration, percentage):
+                print("ART iteration %i: %i %%" % (iteration, percentage))
+
+            RHO = art.run_art_reconstruction(kS, signal, (x, y, z), n_iter=niter, lbda=update, shuffle=False,
+                                             callback=progress)
+            RHO = np.transpose(RHO, (2, 1, 0))  # [NX, NY, NZ]
 
             if NZ == 1:
                 image = np.reshape(RHO, [NX, NY])
             if NZ > 1:
                 image = np.reshape(RHO, [NX, NY, NZ])
 
+        if reco == 2:
+            fov = np.array(self.mapVals['fov']) * 1e-2
+            dfov = np.array(self.mapVals['dfov']) * 1e-3
+            sampled_Kspace = self.mapVals['kSpaceRaw']
+            kS = np.array(sampled_Kspace[:, 0:3].real)
+            phase = np.exp(-2 * np.pi * 1j * (kS @ dfov))
+            signal = sampled_Kspace[:, 3] * phase
+            image = utils.run_nufft_reconstruction(kS, signal, fov, self.mapVals['nPoints'])
+
         if axes[0] == 0 and axes[1] == 2:
             axislegend = ['Z', 'X']
         if axes[0] == 0 and axes[1] == 1:
@@ -558,7 +561,7 @@ class PETRA(blankSeq.MRIBLANKSEQ):
             result2 = {}
             result2['widget'] = 'curve'
             result2['xData'] = pos
-            result2['yData'] = [np.abs(np.fft.ifftshift(np.fft.ifftn(np.fft.ifftshift(self.valCartesian))))]
+            result2['yData'] = [np.abs(fft.centered_ifftn(self.valCartesian, shifts=(fft.IFFTSHIFT, fft.IFFTSHIFT)))]
             result2['xLabel'] = 'Position (cm)'
             result2['yLabel'] = "Amplitude (a.u.)"
             result2['title'] = "Spectrum"
@@ -636,7 +639,7 @@ class PETRA(blankSeq.MRIBLANKSEQ):
         ## Tyger Reconstruction
         if self.tyger_recon == 1:
             try:
-                rawData_path = self.directory_mat + '/' + self.file_name+'.mat'
+                rawData_path = self.exportRawDataMat()
                 print(rawData_path)
                 output_field = 'imgTygerART'
                 
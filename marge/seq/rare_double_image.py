@@ -28,8 +28,6 @@ import marge.configs.hw_config as hw  # Import the scanner hardware config
 import marge.configs.units as units
 import marge.seq.mriBlankSeq as blankSeq  # Import the mriBlankSequence for any new sequence.
 
-import ismrmrd
-import ismrmrd.xsd
 from marga_pulseq.interpreter import PSInterpreter
 import pypulseq as pp
 from marge.marge_utils import utils
@@ -146,10 +144,6 @@ class RareDoubleImage(blankSeq.MRIBLANKSEQ):
         self.addParameter(key='add_rd_points', string='Add RD points', val=10, field='OTH',
                           tip='Add RD points to avoid CIC and FIR filters issues')
 
-        self.acq = ismrmrd.Acquisition()
-        self.img = ismrmrd.Image()
-        self.header = ismrmrd.xsd.ismrmrdHeader()
-
     def sequenceInfo(self):
         print("3D RARE sequence powered by PyPulseq")
         print("It gets two images, one from even echoes and a second one from odd echoes")
@@ -862,7 +856,7 @@ class RareDoubleImage(blankSeq.MRIBLANKSEQ):
         denoising_ok = False
         if self.mapVals['axes_enable'] == [1, 1, 1] and self.tyger_denoising == 1:
             try:
-                rawData_path = self.directory_mat + '/' + self.file_name + '.mat'
+                rawData_path = self.exportRawDataMat()
                 if tyger_conf.snraware_version == 'TEP':
                     imgTyger = tyger_denoising_double_tep.denoisingTyger_double(rawData_path, out_field, out_field_k,
                                                                         input_echoes)
@@ -905,7 +899,7 @@ class RareDoubleImage(blankSeq.MRIBLANKSEQ):
                 
             if self.full_plot == 'False' or self.full_plot is False:
                 print('Preparing Tyger enviroment...')
-                rawData_path = self.directory_mat + '/' + self.file_name + '.mat'
+                rawData_path = self.exportRawDataMat()
                 sign_rarepp = [-1, -1, -1, 1, 1, 1, 1, 1, tyger_conf.cp_batchsize_RARE]
                 if self.recon_type == 'cp':
                     output_field = 'imgTygerCP'
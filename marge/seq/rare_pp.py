@@ -29,17 +29,19 @@ import marge.configs.hw_config as hw # Import the scanner hardware config
 import marge.configs.units as units
 import marge.seq.mriBlankSeq as blankSeq  # Import the mriBlankSequence for any new sequence.
 from marge.marge_utils import utils
+from marge.marge_utils.batch_builder import BatchBuilder
 
 from datetime import datetime
-import ismrmrd
-import ismrmrd.xsd
+from marge.marge_utils.lazy import lazy_import
+from marge.manager import ismrmrdmanager, outputmanager
 import datetime
-import ctypes
 from marga_pulseq.interpreter import PSInterpreter
 import pypulseq as pp
 from marge.marge_tyger import tyger_denoising_tep, tyger_denoising_local, tyger_rare
 import marge.marge_tyger.tyger_config as tyger_conf
 
+ismrmrd = lazy_import('ismrmrd')  # Imported on first use
+
 #*********************************************************************************
 #*********************************************************************************
 #*********************************************************************************
@@ -136,9 +138,6 @@ class RarePyPulseq(blankSeq.MRIBLANKSEQ):
         self.addParameter(key='add_rd_points', string='Add RD points', val=10, field='OTH',
                           tip='Add RD points to avoid CIC and FIR filters issues')
 
-        self.acq = ismrmrd.Acquisition()
-        self.img = ismrmrd.Image()
-        self.header = ismrmrd.xsd.ismrmrdHeader()
        
     def sequenceInfo(self):
         print("3D RARE sequence powered by PyPulseq")
@@ -774,6 +773,87 @@ class RarePyPulseq(blankSeq.MRIBLANKSEQ):
 
             return batch, n_rd_points, n_adc
 
+        def add_train(batch, ph_scales, sl_scale):
+            """
+            Adds one echo train to a batch.
+
+            Parameters:
+            -----------
+            batch : pp.Sequence
+                Sequence where the train is added.
+            ph_scales : list
+                Phase gradient scale of each echo. The train has one echo per scale.
+            sl_scale : float
+                Slice gradient scale of the train.
+
+            Returns:
+            --------
+            tuple
+                - `n_rd_points` (int): Number of readout points acquired by the train.
+                - `n_adc` (int): Number of ADC acquisitions of the train.
+                - `echo_blocks` (list): Number of blocks in the batch before each echo.
+            """
+            n_rd_points = 0
+            n_adc = 0
+            echo_blocks = []
+
+            # Pre-excitation pulse
+            if self.preExTime > 0:
+                gr_rd_preex = pp.scale_grad(block_gr_rd_preph, scale=+1.0)
+                batch.add_block(block_rf_pre_excitation,
+                                gr_rd_preex,
+                                delay_pre_excitation)
+
+            # Inversion pulse
+            if self.inversionTime > 0:
+                gr_rd_inv = pp.scale_grad(block_gr_rd_preph, scale=-1.0)
+                batch.add_block(block_rf_inversion,
+                                gr_rd_inv,
+                                delay_inversion)
+
+            # Add excitation pulse and readout de-phasing gradient
+            batch.add_block(block_gr_rd_preph,
+                            block_rf_excitation,
+                            delay_preph)
+
+            # Add echo train
+            for echo, ph_scale in enumerate(ph_scales):
+                echo_blocks.append(len(batch.block_durations))
+
+                # Fix the phase and slice amplitude
+                gr_ph_deph = pp.scale_grad(block_gr_ph_deph, ph_scale)
+                gr_sl_deph = pp.scale_grad(block_gr_sl_deph, sl_scale)
+                gr_ph_reph = pp.scale_grad(block_gr_ph_reph, - ph_scale)
+                gr_sl_reph = pp.scale_grad(block_gr_sl_reph, - sl_scale)
+
+                # Add blocks, with the ADC only in the acquired echoes
+                if is_acquired(echo):
+                    batch.add_block(block_rf_refocusing,
+                                    block_gr_rd_reph,
+                                    gr_ph_deph,
+                                    gr_sl_deph,
+                                    block_adc_signal,
+                                    delay_reph)
+                    n_rd_points += n_rd
+                    n_adc += 1
+                else:
+                    batch.add_block(block_rf_refocusing,
+                                    block_gr_rd_reph,
+                                    gr_ph_deph,
+                                    gr_sl_deph,
+                                    delay_reph)
+                batch.add_block(gr_ph_reph,
+                                gr_sl_reph)
+
+            # Add time delay to next repetition
+            batch.add_block(delay_tr)
+
+            return n_rd_points, n_adc, echo_blocks
+
+        def is_acquired(echo):
+            return self.echoMode == 'All' or (self.echoMode == 'Odd' and echo % 2 == 0) or \
+                (self.echoMode == 'Even' and echo % 2 == 1)
+
         '''
         Step 7: Define your createBatches method.
         In this step you will populate the batches adding the blocks previously defined in step 4, and accounting for
@@ -782,7 +862,7 @@ class RarePyPulseq(blankSeq.MRIBLANKSEQ):
 
         def create_batches():
             """
-            Creates and processes multiple batches of MRI sequence blocks for slice and phase encoding sweeps.
+            Creates the batches of the slice and phase encoding sweeps and their waveforms.
 
             Returns:
             --------
@@ -793,46 +873,47 @@ class RarePyPulseq(blankSeq.MRIBLANKSEQ):
 
             Workflow:
             ---------
-            1. **Initialization**:
-                - Initializes dictionaries to store batches (`batches`), waveforms (`waveforms`), and readout points (`n_rd_points_dict`).
-                - Tracks the current readout point count (`n_rd_points`), ADC window count (`n_adc`), and batch index (`seq_idx`).
-
-            2. **Slice and Phase Sweep**:
-                - Iterates over slices (`n_sl`) and phases (`n_ph`) to build and organize sequence blocks:
+            1. **Slice and Phase Sweep**:
+                - Iterates over slices (`n_sl`) and phases (`n_ph`) to assign the echo trains to batches:
                     - **Batch Management**:
-                        - Creates a new batch if no batch exists or the current batch exceeds the hardware limit (`hw.maxRdPoints`).
-                        - Writes the previous batch to disk, interprets it using `flo_interpreter`, and updates dictionaries.
-                        - Initializes the next batch with `initializeBatch()`.
+                        - Creates a new batch if no batch exists or the current batch exceeds the hardware limit
+                          (`hw.maxRdPoints`). Each batch starts with the noise acquisitions and dummy pulses of
+                          `initialize_batch_0()` (first batch) or `initialize_batch()`.
+                    - **Echo Train**:
+                        - Records the phase gradient scale of every echo (`ph_gradients[ph_idx]`) and the slice
+                          gradient scale of the train (`sl_gradients[sl_idx]`). Only the echoes acquired according
+                          to `self.echoMode` advance the phase index.
 
-                    - **Pre-Excitation and Inversion Pulses**:
-                        - Optionally adds a pre-excitation pulse (`block_rf_pre_excitation`) and an inversion pulse (`block_rf_inversion`), if respective times (`self.preExTime`, `self.inversionTime`) are greater than zero.
+            2. **Templates**:
+                - The first blocks of the batches and one echo train with unit phase and slice gradients are
+                  interpreted once with `flo_interpreter` (`interpret_template`). Trains cut short at the end of a
+                  slice get their own template.
 
-                    - **Excitation and Echo Train**:
-                        - Adds an excitation pulse followed by an echo train for phase and slice gradients:
-                            - Gradients are scaled based on the current slice (`sl_idx`) and phase (`ph_idx`) indices.
-                            - Includes ADC acquisition blocks (`block_adc_signal`) and refocusing pulses for each echo.
+            3. **Waveforms**:
+                - The waveforms of each batch are obtained by repeating the templates, scaling the phase and slice
+                  gradients of every echo and shifting the times of every train (`join_templates`), without
+                  PyPulseq or the interpreter in the per-line path.
 
-                    - **Repetition Time Delay**:
-                        - Adds a delay (`delay_tr`) between repetitions.
-
-            3. **Final Batch Processing**:
-                - Writes and interprets the last batch after completing all slices and phases.
-                - Updates the total readout points for the final batch.
+            4. **Sequence Files**:
+                - If `write_seq_files` is True in sys_config, the PyPulseq batches are also built and written to
+                  batch_N.seq files in parallel by a `BatchBuilder`.
 
             Returns:
             --------
-            - `waveforms`: Interpreted waveforms for each batch, generated using the `flo_interpreter`.
+            - `waveforms`: Interpreted waveforms for each batch, generated from the templates.
             - `n_rd_points_dict`: Maps batch names to the total readout points per batch.
             - `n_adc`: Total number of ADC acquisition windows across all batches.
             """
-            batches = {}  # Dictionary to save batches PyPulseq sequences
-            waveforms = {}  # Dictionary to store generated waveforms per each batch
+            trains = {}  # Phase scales of each echo and slice scale of every train, per batch
             n_rd_points_dict = {}  # Dictionary to track readout points for each batch
             n_rd_points = 0  # To account for number of acquired rd points
             seq_idx = 0  # Sequence batch index
             n_adc = 0  # To account for number of adc windows
             batch_num = "batch_0"  # Initial batch name
 
+            # First blocks of the batches
+            first_blocks = {'batch_1': initialize_batch_0(), 'batch': initialize_batch()}
+
             # Slice sweep
             for sl_idx in range(n_sl):
                 ph_idx = 0
@@ -840,122 +921,75 @@ class RarePyPulseq(blankSeq.MRIBLANKSEQ):
                 while ph_idx < n_ph:
                     # Check if a new batch is needed (either first batch or exceeding readout points limit)
                     if seq_idx == 0 or n_rd_points + n_rd_points_per_train > hw.maxRdPoints:
-                        # If a previous batch exists, write and interpret it
-                        if seq_idx > 0:
-                            batches[batch_num].write(batch_num + ".seq")
-                            waveforms[batch_num], param_dict = flo_interpreter.interpret(batch_num + ".seq")
-                            print(f"{batch_num}.seq ready!")
-
                         # Update to the next batch
                         seq_idx += 1
                         n_rd_points_dict[batch_num] = n_rd_points  # Save readout points count
-                        n_rd_points = 0
                         batch_num = f"batch_{seq_idx}"
-                        print(batch_num)
-                        if batch_num == "batch_1":
-                            batches[batch_num], n_rd_points, n_adc_0 = initialize_batch_0()  # Initialize new batch
-                        else:
-                            batches[batch_num], n_rd_points, n_adc_0 = initialize_batch()  # Initialize new batch
+                        print(f"Creating {batch_num}...")
+                        _, n_rd_points, n_adc_0 = first_blocks.get(batch_num, first_blocks['batch'])
                         n_adc += n_adc_0
-                        print(f"Creating {batch_num}.seq...")
-
-                    # Pre-excitation pulse
-                    if self.preExTime > 0:
-                        gr_rd_preex = pp.scale_grad(block_gr_rd_preph, scale=+1.0)
-                        batches[batch_num].add_block(block_rf_pre_excitation,
-                                                     gr_rd_preex,
-                                                     delay_pre_excitation)
-
-                    # Inversion pulse
-                    if self.inversionTime > 0:
-                        gr_rd_inv = pp.scale_grad(block_gr_rd_preph, scale=-1.0)
-                        batches[batch_num].add_block(block_rf_inversion,
-                                                     gr_rd_inv,
-                                                     delay_inversion)
-
-                    # Add excitation pulse and readout de-phasing gradient
-                    batches[batch_num].add_block(block_gr_rd_preph,
-                                                 block_rf_excitation,
-                                                 delay_preph)
-
-                    # Add echo train
+                        trains[batch_num] = []
+
+                    # Phase scale of each echo
+                    ph_scales = []
                     for echo in range(self.etl):
-                        # Fix the phase and slice amplitude
-                        gr_ph_deph = pp.scale_grad(block_gr_ph_deph, ph_gradients[ph_idx])
-                        gr_sl_deph = pp.scale_grad(block_gr_sl_deph, sl_gradients[sl_idx])
-                        gr_ph_reph = pp.scale_grad(block_gr_ph_reph, - ph_gradients[ph_idx])
-                        gr_sl_reph = pp.scale_grad(block_gr_sl_reph, - sl_gradients[sl_idx])
-
-                        # Add blocks
-                        if self.echoMode == 'All':
-                            batches[batch_num].add_block(block_rf_refocusing,
-                                                         block_gr_rd_reph,
-                                                         gr_ph_deph,
-                                                         gr_sl_deph,
-                                                         block_adc_signal,
-                                                         delay_reph)
-                            batches[batch_num].add_block(gr_ph_reph,
-                                                         gr_sl_reph)
-                            n_rd_points += n_rd
-                            n_adc += 1
-                            ph_idx += 1
-                        elif self.echoMode=='Odd' and echo%2==0:
-                            batches[batch_num].add_block(block_rf_refocusing,
-                                                         block_gr_rd_reph,
-                                                         gr_ph_deph,
-                                                         gr_sl_deph,
-                                                         block_adc_signal,
-                                                         delay_reph)
-                            batches[batch_num].add_block(gr_ph_reph,
-                                                         gr_sl_reph)
+                        ph_scales.append(ph_gradients[ph_idx])
+                        if is_acquired(echo):
                             n_rd_points += n_rd
                             n_adc += 1
                             ph_idx += 1
-                        elif self.echoMode=='Odd' and echo%2==1:
-                            batches[batch_num].add_block(block_rf_refocusing,
-                                                         block_gr_rd_reph,
-                                                         gr_ph_deph,
-                                                         gr_sl_deph,
-                                                         delay_reph)
-                            batches[batch_num].add_block(gr_ph_reph,
-                                                         gr_sl_reph)
-                        elif self.echoMode=='Even' and echo%2==1:
-                            batches[batch_num].add_block(block_rf_refocusing,
-                                                         block_gr_rd_reph,
-                                                         gr_ph_deph,
-                                                         gr_sl_deph,
-                                                         block_adc_signal,
-                                                         delay_reph)
-                            batches[batch_num].add_block(gr_ph_reph,
-                                                         gr_sl_reph)
-                            n_rd_points += n_rd
-                            n_adc += 1
-                            ph_idx += 1
-                        elif self.echoMode=='Even' and echo%2==0:
-                            batches[batch_num].add_block(block_rf_refocusing,
-                                                         block_gr_rd_reph,
-                                                         gr_ph_deph,
-                                                         gr_sl_deph,
-                                                         delay_reph)
-                            batches[batch_num].add_block(gr_ph_reph,
-                                                         gr_sl_reph)
-
                         if ph_idx == n_ph:
                             break
-
-                    # Add time delay to next repetition
-                    batches[batch_num].add_block(delay_tr)
-
-            # After final repetition, save and interpret the last batch
-            batches[batch_num].write(batch_num + ".seq")
-            waveforms[batch_num], param_dict = flo_interpreter.interpret(batch_num + ".seq")
-            print(f"{batch_num}.seq ready!")
-            print(f"{len(batches)} batches created. Sequence ready!")
+                    trains[batch_num].append((ph_scales, sl_gradients[sl_idx]))
 
             # Update the number of acquired points in the last batch
             n_rd_points_dict.pop('batch_0')
             n_rd_points_dict[batch_num] = n_rd_points
 
+            # Interpret the first blocks once
+            templates = {key: self.interpret_template(flo_interpreter, batch)
+                         for key, (batch, _, _) in first_blocks.items()}
+
+            # Get the waveforms of each batch from the templates
+            ph_key = 'grad_v' + ph_channel
+            sl_key = 'grad_v' + sl_channel
+            waveforms = {}
+            for batch_num, batch_trains in trains.items():
+                parts = [(templates.get(batch_num, templates['batch']), 1)]
+                train_idx = 0
+                while train_idx < len(batch_trains):
+                    # Group consecutive trains with the same number of echoes
+                    n_echoes = len(batch_trains[train_idx][0])
+                    group = [batch_trains[train_idx]]
+                    train_idx += 1
+                    while train_idx < len(batch_trains) and len(batch_trains[train_idx][0]) == n_echoes:
+                        group.append(batch_trains[train_idx])
+                        train_idx += 1
+
+                    # Interpret one train with unit phase and slice gradients
+                    if n_echoes not in templates:
+                        template = pp.Sequence(system)
+                        _, _, echo_blocks = add_train(template, [1.0] * n_echoes, 1.0)
+                        templates[n_echoes] = self.interpret_template(flo_interpreter, template, echo_blocks,
+                                                                      scaled=(ph_key, sl_key))
+
+                    ph_scales = np.array([train[0] for train in group])
+                    sl_scales = np.repeat([[train[1]] for train in group], n_echoes, axis=1)
+                    parts.append((templates[n_echoes], {ph_key: ph_scales, sl_key: sl_scales}))
+                waveforms[batch_num] = self.join_templates(parts)
+                print(f"{batch_num} ready!")
+
+            # Write the sequence files
+            builder = BatchBuilder(None)
+            if builder.write_seq:
+                for batch_num, batch_trains in trains.items():
+                    batch = initialize_batch_0()[0] if batch_num == 'batch_1' else initialize_batch()[0]
+                    for ph_scales, sl_scale in batch_trains:
+                        add_train(batch, ph_scales, sl_scale)
+                    builder.submit(batch_num, batch)
+                builder.waveforms()
+            print(f"{len(trains)} batches created. Sequence ready!")
+
             return waveforms, n_rd_points_dict, n_adc
 
         ''' 
@@ -1015,7 +1049,7 @@ class RarePyPulseq(blankSeq.MRIBLANKSEQ):
         result_Tyger = None
         if self.mapVals['axes_enable'] == [1,1,1] and self.tyger_denoising == 1:
             try:
-                rawData_path = self.directory_mat + '/' + self.file_name+'.mat'
+                rawData_path = self.exportRawDataMat()
                 if tyger_conf.snraware_version == 'TEP':
                     imgTyger = tyger_denoising_tep.denoisingTyger(rawData_path, out_field, out_field_k)
                     imageTyger = np.abs(imgTyger[0])
@@ -1050,7 +1084,7 @@ class RarePyPulseq(blankSeq.MRIBLANKSEQ):
             else:
                 input_field =''
             print('Preparing Tyger enviroment...')
-            rawData_path = self.directory_mat + '/' + self.file_name + '.mat'
+            rawData_path = self.exportRawDataMat()
             sign_rarepp = [-1, -1, -1, 1, 1, 1, 1, 1, tyger_conf.cp_batchsize_RARE]
             if self.recon_type == 'cp':
                 output_field = 'imgTygerCP'
@@ -1102,13 +1136,11 @@ class RarePyPulseq(blankSeq.MRIBLANKSEQ):
 
         Steps performed:
         1. Generate a timestamp-based filename and directory path for the output file.
-        2. Initialize the ISMRMRD dataset with the generated path.
-        3. Populate the header and write the XML header to the dataset. Informations can be added.
-        4. Reshape the raw data matrix and iterate over scans, slices, and phases to write each acquisition. WARNING : RARE sequence follows ind order to fill the k-space.
-        5. Set acquisition flags and properties.
-        6. Append the acquisition data to the dataset.
-        7. Reshape and save the reconstructed images.
-        8. Close the dataset.
+        2. Populate the header. Informations can be added.
+        3. Reshape the raw data matrix and build the headers of all the acquisitions at once, with their flags and
+           indexes. WARNING : RARE sequence follows ind order to fill the k-space.
+        4. Reshape the reconstructed images and build their headers.
+        5. Write the file in the background with marge.manager.ismrmrdmanager.
 
         Attribute:
         - self.data_full_mat (numpy.array): Full matrix of raw data to be reshaped and saved.
@@ -1117,150 +1149,29 @@ class RarePyPulseq(blankSeq.MRIBLANKSEQ):
         None. It creates an HDF5 file with the ISMRMRD format.
         """
         
-        directory_rmd = self.directory_rmd
-        name = datetime.datetime.now()
-        name_string = name.strftime("%Y.%m.%d.%H.%M.%S.%f")[:-3]
-        self.mapVals['name_string'] = name_string
-        if hasattr(self, 'raw_data_name'):
-            file_name = "%s.%s" % (self.raw_data_name, name_string)
-        else:
-            self.raw_data_name = self.mapVals['seqName']
-            file_name = "%s.%s" % (self.mapVals['seqName'], name_string)
-            
-        path= "%s/%s.h5" % (directory_rmd, file_name)
-        
-        dset = ismrmrd.Dataset(path, f'/dataset', True) # Create the dataset
-
+        path = ismrmrdmanager.output_path(self)
         etl = self.mapVals['etl']
         axes_enable = self.mapVals['axes_enable']
         n_rd = self.nPoints[0]
         n_ph = self.nPoints[1]
         n_sl = (((self.nPoints[2] // 2) + self.mapVals['partialAcquisition']) * axes_enable[2] + (1 - axes_enable[2]))
         ind = self.getIndex(self.etl, n_ph, self.sweepMode)
-        nRep = (n_ph//etl)*n_sl
         bw = self.mapVals['bw_MHz']
-        
-        axesOrientation = self.axesOrientation
-        axesOrientation_list = axesOrientation.tolist()
-
-        read_dir = [0, 0, 0]
-        phase_dir = [0, 0, 0]
-        slice_dir = [0, 0, 0]
-
-        read_dir[axesOrientation_list.index(0)] = 1
-        phase_dir[axesOrientation_list.index(1)] = 1
-        slice_dir[axesOrientation_list.index(2)] = 1
-        
-        # Experimental Conditions field
-        exp = ismrmrd.xsd.experimentalConditionsType() 
-        magneticFieldStrength = hw.larmorFreq * 1e6 / hw.gammaB
-        exp.H1resonanceFrequency_Hz = hw.larmorFreq
-
-        self.header.experimentalConditions = exp 
-
-        # Acquisition System Information field
-        sys = ismrmrd.xsd.acquisitionSystemInformationType() 
-        sys.receiverChannels = 1 
-        self.header.acquisitionSystemInformation = sys
-
-
-        # Encoding field can be filled if needed
-        encoding = ismrmrd.xsd.encodingType()  
-        encoding.trajectory = ismrmrd.xsd.trajectoryType.CARTESIAN
-        #encoding.trajectory =ismrmrd.xsd.trajectoryType[data.processing.trajectory.upper()]
-        
-        dset.write_xml_header(self.header.toXML()) # Write the header to the dataset
-
-        new_data = np.zeros((n_ph * n_sl * self.nScans, n_rd + 2*self.add_rd_points))
-        new_data = np.reshape(self.data_fullmat, (self.nScans, n_sl, n_ph, n_rd+ 2*self.add_rd_points))
-        
-        counter=0  
-        for scan in range(self.nScans):
-            for slice_idx in range(n_sl):
-                for phase_idx in range(n_ph):
-                    
-                    line = new_data[scan, slice_idx, phase_idx, :]
-                    line2d = np.reshape(line, (1, n_rd+2*self.add_rd_points))
-                    acq = ismrmrd.Acquisition.from_array(line2d, None)
-                    
-                    index_in_repetition = phase_idx % etl
-                    current_repetition = (phase_idx // etl) + (slice_idx * (n_ph // etl))
-                    
-                    acq.clearAllFlags()
-                    
-                    if index_in_repetition == 0: 
-                        acq.setFlag(ismrmrd.ACQ_FIRST_IN_CONTRAST)
-                    elif index_in_repetition == etl - 1:
-                        acq.setFlag(ismrmrd.ACQ_LAST_IN_CONTRAST)
-                    
-                    if ind[phase_idx]== 0:
-                        acq.setFlag(ismrmrd.ACQ_FIRST_IN_PHASE)
-                    elif ind[phase_idx] == n_ph - 1:
-                        acq.setFlag(ismrmrd.ACQ_LAST_IN_PHASE)
-                    
-                    if slice_idx == 0:
-                        acq.setFlag(ismrmrd.ACQ_FIRST_IN_SLICE)
-                    elif slice_idx == n_sl - 1:
-                        acq.setFlag(ismrmrd.ACQ_LAST_IN_SLICE)
-                        
-                    if int(current_repetition) == 0:
-                        acq.setFlag(ismrmrd.ACQ_FIRST_IN_REPETITION)
-                    elif int(current_repetition) == nRep - 1:
-                        acq.setFlag(ismrmrd.ACQ_LAST_IN_REPETITION)
-                        
-                    if scan == 0:
-                        acq.setFlag(ismrmrd.ACQ_FIRST_IN_AVERAGE)
-                    elif scan == self.nScans-1:
-                        acq.setFlag(ismrmrd.ACQ_LAST_IN_AVERAGE)
-                    
-                    
-                    counter += 1 
-                    
-                    # +1 to start at 1 instead of 0
-                    acq.idx.repetition = int(current_repetition + 1)
-                    acq.idx.kspace_encode_step_1 = ind[phase_idx]+1 # phase
-                    acq.idx.slice = slice_idx + 1
-                    acq.idx.contrast = index_in_repetition + 1
-                    acq.idx.average = scan + 1 # scan
-                    
-                    acq.scan_counter = counter
-                    acq.discard_pre = self.add_rd_points
-                    acq.discard_post = self.add_rd_points
-                    acq.sample_time_us = 1/bw
-                    self.dfov = np.array(self.dfov)
-                    acq.position = (ctypes.c_float * 3)(*self.dfov.flatten())
-
-                    
-                    acq.read_dir = (ctypes.c_float * 3)(*read_dir)
-                    acq.phase_dir = (ctypes.c_float * 3)(*phase_dir)
-                    acq.slice_dir = (ctypes.c_float * 3)(*slice_dir)
-                    
-                    dset.append_acquisition(acq) # Append the acquisition to the dataset
-                        
-                        
-        image=self.mapVals['image3D']
-        image_reshaped = np.reshape(image, (self.nPoints[::-1]))
-        
-        for slice_idx in range (n_sl): ## image3d does not have scan dimension
-            
-            image_slice = image_reshaped[slice_idx, :, :]
-            img = ismrmrd.Image.from_array(image_slice)
-            img.transpose = False
-            img.field_of_view = (ctypes.c_float * 3)(*(self.fov)*10) # mm
-           
-            img.position = (ctypes.c_float * 3)(*self.dfov)
-            
-            # img.data_type= 8 ## COMPLEX FLOAT
-            img.image_type = 5 ## COMPLEX
-
-            img.read_dir = (ctypes.c_float * 3)(*read_dir)
-            img.phase_dir = (ctypes.c_float * 3)(*phase_dir)
-            img.slice_dir = (ctypes.c_float * 3)(*slice_dir)
-            
-            dset.append_image(f"image_raw", img) # Append the image to the dataset
-                
-        
-        dset.close()    
+        axes_directions = ismrmrdmanager.directions(self.axesOrientation)
+        self.header = ismrmrdmanager.create_header(hw.larmorFreq)
+
+        # Headers of all the readout lines, in acquisition order (scan, slice, phase)
+        n_samples = n_rd + 2*self.add_rd_points
+        data = np.reshape(self.data_fullmat, (self.nScans * n_sl * n_ph, n_samples))
+        headers = ismrmrdmanager.echo_train_headers(self.nScans, n_sl, n_ph, etl, ind, n_samples,
+                                                    discard_pre=self.add_rd_points,
+                                                    discard_post=self.add_rd_points,
+                                                    sample_time_us=1/bw,
+                                                    position=np.array(self.dfov).flatten(),
+                                                    **axes_directions)
+
+        images = np.reshape(self.mapVals['image3D'], (self.nPoints[::-1]))[:n_sl] ## image3d does not have scan dimension
+        ismrmrdmanager.submit_ismrmrd(path, self.header, data, headers, images, self.fov, self.dfov, axes_directions)
 
 
 if __name__ == '__main__':
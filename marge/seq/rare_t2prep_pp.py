@@ -27,15 +27,17 @@ import scipy.signal as sig
 import marge.configs.hw_config as hw # Import the scanner hardware config
 import marge.configs.units as units
 import marge.seq.mriBlankSeq as blankSeq  # Import the mriBlankSequence for any new sequence.
+from marge.marge_utils.batch_builder import BatchBuilder
 
 from datetime import datetime
-import ismrmrd
-import ismrmrd.xsd
+from marge.marge_utils.lazy import lazy_import
+from marge.manager import ismrmrdmanager, outputmanager
 import datetime
-import ctypes
 from marga_pulseq.interpreter import PSInterpreter
 import pypulseq as pp
 
+ismrmrd = lazy_import('ismrmrd')  # Imported on first use
+
 #*********************************************************************************
 #*********************************************************************************
 #*********************************************************************************
@@ -104,9 +106,6 @@ class RARE_T2prep_pp(blankSeq.MRIBLANKSEQ):
         self.addParameter(key='spoiler_amp', string='Spoiler amplitude (mT/m)', val=5.0, units=units.mTm, field='SEQ')
         self.addParameter(key='spoiler_duration', string='Spoiler duration (ms)', val=3.0, units=units.ms, field='SEQ')
         self.addParameter(key='spoiler_delay', string='Spoiler delay (ms)', val=10.0, units=units.ms, field='SEQ')
-        self.acq = ismrmrd.Acquisition()
-        self.img = ismrmrd.Image()
-        self.header = ismrmrd.xsd.ismrmrdHeader()
         
        
     def sequenceInfo(self):
@@ -587,7 +586,7 @@ class RARE_T2prep_pp(blankSeq.MRIBLANKSEQ):
         def createBatches():
             seq_idx = 0  # Sequence batch index
             batch_num = "batch_0"  # Initial batch name
-            waveforms = {}  # Dictionary to store generated waveforms
+            builder = BatchBuilder(self.flo_interpreter)  # Writes and interprets the batches in parallel
 
             # Slice sweep
             for sl_idx in range(nSL):
@@ -598,9 +597,7 @@ class RARE_T2prep_pp(blankSeq.MRIBLANKSEQ):
                     if seq_idx == 0 or self.n_rd_points + n_rd_points_per_train > hw.maxRdPoints:
                         # If a previous batch exists, write and interpret it
                         if seq_idx > 0:
-                            batches[batch_num].write(batch_num + ".seq")
-                            waveforms[batch_num], param_dict = self.flo_interpreter.interpret(batch_num + ".seq")
-                            print(f"{batch_num}.seq ready!")
+                            builder.submit(batch_num, batches[batch_num])
 
                         # Update to the next batch
                         seq_idx += 1
@@ -649,9 +646,8 @@ class RARE_T2prep_pp(blankSeq.MRIBLANKSEQ):
                     batches[batch_num].add_block(delay_tr)
 
             # After final repetition, save and interpret the last batch
-            batches[batch_num].write(batch_num + ".seq")
-            waveforms[batch_num], param_dict = self.flo_interpreter.interpret(batch_num + ".seq")
-            print(f"{batch_num}.seq ready!")
+            builder.submit(batch_num, batches[batch_num])
+            waveforms = builder.waveforms()
             print(f"{len(batches)} batches created. Sequence ready!")
 
             # Update the number of acquired ponits in the last batch
@@ -1030,13 +1026,11 @@ class RARE_T2prep_pp(blankSeq.MRIBLANKSEQ):
 
         Steps performed:
         1. Generate a timestamp-based filename and directory path for the output file.
-        2. Initialize the ISMRMRD dataset with the generated path.
-        3. Populate the header and write the XML header to the dataset. Informations can be added.
-        4. Reshape the raw data matrix and iterate over scans, slices, and phases to write each acquisition. WARNING : RARE sequence follows ind order to fill the k-space.
-        5. Set acquisition flags and properties.
-        6. Append the acquisition data to the dataset.
-        7. Reshape and save the reconstructed images.
-        8. Close the dataset.
+        2. Populate the header. Informations can be added.
+        3. Reshape the raw data matrix and build the headers of all the acquisitions at once, with their flags and
+           indexes. WARNING : RARE sequence follows ind order to fill the k-space.
+        4. Reshape the reconstructed images and build their headers.
+        5. Write the file in the background with marge.manager.ismrmrdmanager.
 
         Attribute:
         - self.data_full_mat (numpy.array): Full matrix of raw data to be reshaped and saved.
@@ -1045,155 +1039,29 @@ class RARE_T2prep_pp(blankSeq.MRIBLANKSEQ):
         None. It creates an HDF5 file with the ISMRMRD format.
         """
         
-        directory_rmd = self.directory_rmd
-        name = datetime.datetime.now()
-        name_string = name.strftime("%Y.%m.%d.%H.%M.%S.%f")[:-3]
-        self.mapVals['name_string'] = name_string
-        if hasattr(self, 'raw_data_name'):
-            file_name = "%s.%s" % (self.raw_data_name, name_string)
-        else:
-            self.raw_data_name = self.mapVals['seqName']
-            file_name = "%s.%s" % (self.mapVals['seqName'], name_string)
-            
-        path= "%s/%s.h5" % (directory_rmd, file_name)
-        
-        dset = ismrmrd.Dataset(path, f'/dataset', True) # Create the dataset
-        
+        path = ismrmrdmanager.output_path(self)
         nScans = self.mapVals['nScans']
-        nPoints = np.array(self.mapVals['nPoints'])
         etl = self.mapVals['etl']
         nRD = self.nPoints[0]
         nPH = self.nPoints[1]
         nSL = self.nPoints[2]
         ind = self.getIndex(self.etl, nPH, 1)
-        nRep = (nPH//etl)*nSL
         bw = self.mapVals['bw_MHz']
-        
-        axesOrientation = self.axesOrientation
-        axesOrientation_list = axesOrientation.tolist()
-
-        read_dir = [0, 0, 0]
-        phase_dir = [0, 0, 0]
-        slice_dir = [0, 0, 0]
-
-        read_dir[axesOrientation_list.index(0)] = 1
-        phase_dir[axesOrientation_list.index(1)] = 1
-        slice_dir[axesOrientation_list.index(2)] = 1
-        
-        # Experimental Conditions field
-        exp = ismrmrd.xsd.experimentalConditionsType() 
-        magneticFieldStrength = hw.larmorFreq*1e6/hw.gammaB
-        exp.H1resonanceFrequency_Hz = hw.larmorFreq
-
-        self.header.experimentalConditions = exp 
-
-        # Acquisition System Information field
-        sys = ismrmrd.xsd.acquisitionSystemInformationType() 
-        sys.receiverChannels = 1 
-        self.header.acquisitionSystemInformation = sys
-
-
-        # Encoding field can be filled if needed
-        encoding = ismrmrd.xsd.encodingType()  
-        encoding.trajectory = ismrmrd.xsd.trajectoryType.CARTESIAN
-        #encoding.trajectory =ismrmrd.xsd.trajectoryType[data.processing.trajectory.upper()]
-        
-        dset.write_xml_header(self.header.toXML()) # Write the header to the dataset
-                
-        
-        
-        new_data = np.zeros((nPH * nSL * nScans, nRD + 2*hw.addRdPoints))
-        new_data = np.reshape(self.data_fullmat, (nScans, nSL, nPH, nRD+ 2*hw.addRdPoints))
-        
-        counter=0  
-        for scan in range(nScans):
-            for slice_idx in range(nSL):
-                for phase_idx in range(nPH):
-                    
-                    line = new_data[scan, slice_idx, phase_idx, :]
-                    line2d = np.reshape(line, (1, nRD+2*hw.addRdPoints))
-                    acq = ismrmrd.Acquisition.from_array(line2d, None)
-                    
-                    index_in_repetition = phase_idx % etl
-                    current_repetition = (phase_idx // etl) + (slice_idx * (nPH // etl))
-                    
-                    acq.clearAllFlags()
-                    
-                    if index_in_repetition == 0: 
-                        acq.setFlag(ismrmrd.ACQ_FIRST_IN_CONTRAST)
-                    elif index_in_repetition == etl - 1:
-                        acq.setFlag(ismrmrd.ACQ_LAST_IN_CONTRAST)
-                    
-                    if ind[phase_idx]== 0:
-                        acq.setFlag(ismrmrd.ACQ_FIRST_IN_PHASE)
-                    elif ind[phase_idx] == nPH - 1:
-                        acq.setFlag(ismrmrd.ACQ_LAST_IN_PHASE)
-                    
-                    if slice_idx == 0:
-                        acq.setFlag(ismrmrd.ACQ_FIRST_IN_SLICE)
-                    elif slice_idx == nSL - 1:
-                        acq.setFlag(ismrmrd.ACQ_LAST_IN_SLICE)
-                        
-                    if int(current_repetition) == 0:
-                        acq.setFlag(ismrmrd.ACQ_FIRST_IN_REPETITION)
-                    elif int(current_repetition) == nRep - 1:
-                        acq.setFlag(ismrmrd.ACQ_LAST_IN_REPETITION)
-                        
-                    if scan == 0:
-                        acq.setFlag(ismrmrd.ACQ_FIRST_IN_AVERAGE)
-                    elif scan == nScans-1:
-                        acq.setFlag(ismrmrd.ACQ_LAST_IN_AVERAGE)
-                    
-                    
-                    counter += 1 
-                    
-                    # +1 to start at 1 instead of 0
-                    acq.idx.repetition = int(current_repetition + 1)
-                    acq.idx.kspace_encode_step_1 = ind[phase_idx]+1 # phase
-                    acq.idx.slice = slice_idx + 1
-                    acq.idx.contrast = index_in_repetition + 1
-                    acq.idx.average = scan + 1 # scan
-                    
-                    acq.scan_counter = counter
-                    acq.discard_pre = hw.addRdPoints
-                    acq.discard_post = hw.addRdPoints
-                    acq.sample_time_us = 1/bw
-                    self.dfov = np.array(self.dfov)
-                    acq.position = (ctypes.c_float * 3)(*self.dfov.flatten())
-
-                    
-                    acq.read_dir = (ctypes.c_float * 3)(*read_dir)
-                    acq.phase_dir = (ctypes.c_float * 3)(*phase_dir)
-                    acq.slice_dir = (ctypes.c_float * 3)(*slice_dir)
-                    
-                    dset.append_acquisition(acq) # Append the acquisition to the dataset
-                        
-                        
-        image=self.mapVals['image3D']
-        image_reshaped = np.reshape(image, (nSL, nPH, nRD))
-        
-        for slice_idx in range (nSL): ## image3d does not have scan dimension
-            
-            image_slice = image_reshaped[slice_idx, :, :]
-            img = ismrmrd.Image.from_array(image_slice)
-            img.transpose = False
-            img.field_of_view = (ctypes.c_float * 3)(*(self.fov)*10) # mm
-           
-            img.position = (ctypes.c_float * 3)(*self.dfov)
-            
-            # img.data_type= 8 ## COMPLEX FLOAT
-            img.image_type = 5 ## COMPLEX
-            
-            
-            
-            img.read_dir = (ctypes.c_float * 3)(*read_dir)
-            img.phase_dir = (ctypes.c_float * 3)(*phase_dir)
-            img.slice_dir = (ctypes.c_float * 3)(*slice_dir)
-            
-            dset.append_image(f"image_raw", img) # Append the image to the dataset
-                
-        
-        dset.close()    
+        axes_directions = ismrmrdmanager.directions(self.axesOrientation)
+        self.header = ismrmrdmanager.create_header(hw.larmorFreq)
+
+        # Headers of all the readout lines, in acquisition order (scan, slice, phase)
+        n_samples = nRD + 2*hw.addRdPoints
+        data = np.reshape(self.data_fullmat, (nScans * nSL * nPH, n_samples))
+        headers = ismrmrdmanager.echo_train_headers(nScans, nSL, nPH, etl, ind, n_samples,
+                                                    discard_pre=hw.addRdPoints,
+                                                    discard_post=hw.addRdPoints,
+                                                    sample_time_us=1/bw,
+                                                    position=np.array(self.dfov).flatten(),
+                                                    **axes_directions)
+
+        images = np.reshape(self.mapVals['image3D'], (nSL, nPH, nRD))[:nSL] ## image3d does not have scan dimension
+        ismrmrdmanager.submit_ismrmrd(path, self.header, data, headers, images, self.fov, self.dfov, axes_directions)
 
 
 if __name__ == '__main__':
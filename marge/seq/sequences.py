@@ -4,9 +4,13 @@ Created on Thu June 2 2022
 @email: josalggui@i3m.upv.es
 @Summary: All sequences on the GUI must be here
 """
+import ast
+import copy
 import inspect
+import json
 import os
 import importlib
+from collections.abc import MutableMapping
 
 """
 Definition of default sequences
@@ -17,18 +21,36 @@ Definition of default sequences
 # self.addParameter(string='toMaRGE', val=True)
 # This file should not be modified anymore.
 
-def instantiate_sequences():
-    # Get the absolute path to this folder (marge/seq)
+# Manifest with the sequences found in marge/seq, valid while the files keep their modification times
+MANIFEST_PATH = 'experiments/cache/sequences.json'
+
+
+def _source_files():
+    # Modification time of every module in this folder (marge/seq), except __init__.py and this file
     folder = os.path.dirname(__file__)
+    files = {}
+    for file in sorted(os.listdir(folder)):
+        if file.endswith('.py') and file not in ('__init__.py', 'sequences.py'):
+            files[file] = os.path.getmtime(os.path.join(folder, file))
+    return files
 
-    # Dictionary to store class sequences
-    defaultsequences = {}
 
-    # List all .py files in the folder, except __init__.py
-    py_files = [f for f in os.listdir(folder) if f.endswith('.py') and f != '__init__.py']
+def scan_sequences(files):
+    """
+    Import the given modules and find the sequences to show in MaRGE.
 
-    # Populate defaultsequences
-    for file in py_files:
+    Each class is instantiated once to read its 'toMaRGE' and 'seqName' parameters.
+
+    Args:
+        files (iterable): Names of the .py files in marge/seq.
+
+    Returns:
+        tuple: ([seqName, module, class name] of every sequence with 'toMaRGE' set to True, modules that could not
+            be imported)
+    """
+    entries = {}
+    failed = []
+    for file in files:
         # Remove the .py extension to get the module name
         module_name = file[:-3]
 
@@ -42,13 +64,194 @@ def instantiate_sequences():
             # Add to defaultsequences only if toMaRGE is True
             for class_name, class_ in classes:
                 try:
-                    if class_().mapVals['toMaRGE']:
-                        defaultsequences[class_().mapVals['seqName']] = class_()
-                        print(f"{class_().mapVals['seqName']} added to MaRGE")
+                    sequence = class_()
+                    if sequence.mapVals['toMaRGE']:
+                        entries[sequence.mapVals['seqName']] = [sequence.mapVals['seqName'], class_.__module__,
+                                                                class_.__name__]
                 except:
                     pass
         except Exception as e:
             print(f"Error importing module {module_name}: {e}")
+            failed.append(module_name)
+
+    return list(entries.values()), failed
+
+
+def inspect_sequences(files):
+    """
+    Find the sequences to show in MaRGE by reading the source of the given modules, without importing them.
+
+    Used for the modules that cannot be imported, e.g. because an optional dependency is missing. A class is listed if
+    its own code sets 'toMaRGE' to True, with addParameter or in mapVals, and also sets 'seqName'. Only literal keys
+    and values are understood, and parameters inherited from a parent class are not seen.
+
+    Args:
+        files (iterable): Names of the .py files in marge/seq.
+
+    Returns:
+        list: [seqName, module, class name] of every sequence with 'toMaRGE' set to True.
+    """
+    folder = os.path.dirname(__file__)
+    entries = []
+    for file in files:
+        try:
+            with open(os.path.join(folder, file), encoding='utf-8') as source:
+                tree = ast.parse(source.read())
+        except (OSError, SyntaxError, ValueError) as e:
+            print(f"Error reading module {file[:-3]}: {e}")
+            continue
+        for node in tree.body:
+            if isinstance(node, ast.ClassDef):
+                parameters = _literal_parameters(node)
+                if parameters.get('toMaRGE') is True and isinstance(parameters.get('seqName'), str):
+                    entries.append([parameters['seqName'], f"marge.seq.{file[:-3]}", node.name])
+    return entries
+
+
+def _literal_parameters(node):
+    # Literal values given in a class definition with addParameter(key=..., val=...) or mapVals[key] = ...
+    parameters = {}
+    for child in ast.walk(node):
+        try:
+            if isinstance(child, ast.Call) and isinstance(child.func, ast.Attribute) and \
+                    child.func.attr == 'addParameter':
+                keywords = {keyword.arg: keyword.value for keyword in child.keywords}
+                parameters[ast.literal_eval(keywords['key'])] = ast.literal_eval(keywords['val'])
+            elif isinstance(child, ast.Assign) and len(child.targets) == 1 and \
+                    isinstance(child.targets[0], ast.Subscript) and \
+                    isinstance(child.targets[0].value, ast.Attribute) and child.targets[0].value.attr == 'mapVals':
+                parameters[ast.literal_eval(child.targets[0].slice)] = ast.literal_eval(child.value)
+        except (KeyError, ValueError, TypeError, SyntaxError):
+            pass
+    return parameters
+
+
+def discover_sequences(manifest_path=MANIFEST_PATH):
+    """
+    Get the sequences available in marge/seq without importing them, if possible.
+
+    The sequences of the modules that keep the modification time recorded in the manifest are read from it. The
+    modules added or modified since it was written are imported and scanned, and those that cannot be imported are
+    inspected from their source instead. The manifest records them as failed with their modification time, so they
+    are only imported again once they change.
+
+    Args:
+        manifest_path (str): Path of the json manifest.
+
+    Returns:
+        list: [seqName, module, class name] of every sequence.
+    """
+    files = _source_files()
+    try:
+        with open(manifest_path) as manifest:
+            manifest = json.load(manifest)
+        known, sequences, failed = manifest['files'], manifest['sequences'], manifest['failed']
+    except (OSError, ValueError, KeyError):
+        known, sequences, failed = {}, [], {}
+
+    unchanged = [file for file in files if known.get(file) == files[file]]
+    if len(unchanged) == len(files) == len(known):
+        return sequences
+
+    # Scan only the modules added or modified, and read from their source those that cannot be imported
+    changed = [file for file in files if file not in unchanged]
+    entries, errors = scan_sequences(changed)
+    entries += inspect_sequences([module + '.py' for module in errors])
+    failed = {file: mtime for file, mtime in failed.items() if file in unchanged}
+    failed.update({module + '.py': files[module + '.py'] for module in errors})
+
+    # Keep the sequences of the unchanged modules, in the order of the files
+    order = {f"marge.seq.{file[:-3]}": n for n, file in enumerate(files)}
+    kept = [entry for entry in sequences if entry[1] in order and entry[1][len('marge.seq.'):] + '.py' in unchanged]
+    entries = sorted(kept + entries, key=lambda entry: order.get(entry[1], len(order)))
+    try:
+        os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+        with open(manifest_path, 'w') as manifest:
+            json.dump({'files': files, 'failed': failed, 'sequences': entries}, manifest, indent=1)
+    except OSError as e:
+        print(f"WARNING: sequence manifest not saved: {e}")
+    return entries
+
+
+class SequenceRegistry(MutableMapping):
+    """
+    Dictionary of the MaRGE sequences by seqName, instantiating every sequence the first time it is used.
+
+    Looking up the names does not import the sequence modules, so the GUI starts without loading pypulseq, bm4d and
+    the other dependencies of the sequences. Changes that must reach every sequence are made with apply(), which
+    updates the sequences already created and records the change for the ones created later.
+    """
+
+    def __init__(self, entries):
+        self._entries = {name: (module, class_name) for name, module, class_name in entries}
+        self._sequences = {}
+        self._hooks = {}
+
+    def __getitem__(self, name):
+        if name not in self._sequences:
+            module, class_name = self._entries[name]
+            sequence = getattr(importlib.import_module(module), class_name)()
+            for hook in self._hooks.values():
+                hook(sequence)
+            self._sequences[name] = sequence
+        return self._sequences[name]
+
+    def __setitem__(self, name, sequence):
+        self._entries.setdefault(name, (type(sequence).__module__, type(sequence).__name__))
+        self._sequences[name] = sequence
+
+    def __delitem__(self, name):
+        del self._entries[name]
+        self._sequences.pop(name, None)
+
+    def __iter__(self):
+        return iter(self._entries)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def loaded(self):
+        """
+        Get the sequences that have been instantiated.
+
+        Returns:
+            dict: Sequences by seqName.
+        """
+        return dict(self._sequences)
+
+    def apply(self, function, key=None):
+        """
+        Call a function on every sequence, now for the instantiated ones and later for the rest.
+
+        Args:
+            function (callable): Function taking the sequence as its only argument.
+            key (str, optional): Name of the change. A later call with the same key replaces the function applied to
+                the sequences created afterwards. Defaults to the function itself.
+        """
+        for sequence in self._sequences.values():
+            function(sequence)
+        self._hooks[function if key is None else key] = function
+
+    def set_parameter(self, key, value):
+        """
+        Set a parameter in every sequence that has it.
+
+        Args:
+            key (str): Parameter key in mapVals.
+            value: New value.
+        """
+        def set_value(sequence):
+            if key in sequence.mapVals:
+                sequence.mapVals[key] = copy.copy(value)
+
+        self.apply(set_value, key='mapVals.' + key)
+
+
+def instantiate_sequences():
+    # Registry of the sequences found in this folder (marge/seq)
+    defaultsequences = SequenceRegistry(discover_sequences())
+    for name in defaultsequences:
+        print(f"{name} added to MaRGE")
 
     return defaultsequences
 
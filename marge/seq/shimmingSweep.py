@@ -26,6 +26,7 @@ import marge.seq.mriBlankSeq as blankSeq  # Import the mriBlankSequence for any
 import scipy.signal as sig
 import marge.configs.hw_config as hw
 import marge.configs.units as units
+from marge.marge_utils import fft
 
 
 class ShimmingSweep(blankSeq.MRIBLANKSEQ):
@@ -128,10 +129,9 @@ class ShimmingSweep(blankSeq.MRIBLANKSEQ):
 
         # Update the shimming in hw_config
         if mode != "Standalone":
-            for seqName in self.sequence_list:
-                self.sequence_list[seqName].mapVals['shimming'] = [float(np.round(self.mapVals['shimming0'][0], decimals=1)),
-                                                                   float(np.round(self.mapVals['shimming0'][1], decimals=1)),
-                                                                   float(np.round(self.mapVals['shimming0'][2], decimals=1))]
+            self.sequence_list.set_parameter('shimming', [float(np.round(self.mapVals['shimming0'][0], decimals=1)),
+                                                          float(np.round(self.mapVals['shimming0'][1], decimals=1)),
+                                                          float(np.round(self.mapVals['shimming0'][2], decimals=1))])
         return self.output
 
     def createSequence(self):
@@ -221,9 +221,7 @@ class ShimmingSweep(blankSeq.MRIBLANKSEQ):
             data = sig.decimate(rxd['rx0'] * hw.adcFactor, hw.oversamplingFactor, ftype='fir', zero_phase=True)
             self.mapVals['data'] = np.concatenate((self.mapVals['data'], data), axis=0)
             data = np.reshape(data, (self.nShimming, -1))
-            dataFFT = np.zeros(self.nShimming)
-            for ii in range(self.nShimming):
-                dataFFT[ii] = np.max(np.abs(np.fft.ifftshift(np.fft.ifftn(np.fft.ifftshift(data[ii, :])))))
+            dataFFT = np.max(np.abs(fft.centered_ifftn(data, axes=(1,), shifts=(fft.IFFTSHIFT, fft.IFFTSHIFT))), axis=1)
             if axis=='x':
                 self.shimming0[0] = sxVector[np.argmax(dataFFT), 0]
             elif axis=='y':
@@ -28,7 +28,6 @@ import marge.configs.units as units
 import marge.seq.mriBlankSeq as blankSeq  # Import the mriBlankSequence for any new sequence.
 from marga_pulseq.interpreter import PSInterpreter  # Import the marga_pulseq interpreter
 import pypulseq as pp  # Import PyPulseq
-from skimage.restoration import unwrap_phase as unwrap
 from sklearn.preprocessing import PolynomialFeatures
 from numpy.linalg import lstsq
 from marge.marge_utils.utils import run_ifft
@@ -496,7 +495,7 @@ class spds(blankSeq.MRIBLANKSEQ):
         # Export in txt the model fitted
         if not os.path.exists('b0_maps/fits'):
             os.makedirs('b0_maps/fits')
-        output_file = "b0_maps/fits/"+self.mapVals['fileName'][:-4]+".txt"
+        output_file = "b0_maps/fits/"+os.path.splitext(self.mapVals['fileName'])[0]+".txt"
         with open(output_file, "w") as f:
             f.write(self.mapVals['polynomial_expression'] + "\n")
         print(f"Fitting exported to '{output_file}'")
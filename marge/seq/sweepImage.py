@@ -23,6 +23,7 @@ for subdir in subdirs:
 #******************************************************************************
 import numpy as np
 import marge.seq.mriBlankSeq as blankSeq
+from marge.marge_utils import fft
 
 class SweepImage(blankSeq.MRIBLANKSEQ):
     def __init__(self):
@@ -133,7 +134,7 @@ class SweepImage(blankSeq.MRIBLANKSEQ):
             for step in range(nSteps[0]*nSteps[1]):
                 data = self.sampled[step][:, 3]
                 data = np.reshape(data, (nPoints[2], nPoints[1], nPoints[0]))
-                image = np.fft.ifftshift(np.fft.ifftn(np.fft.ifftshift(data)))
+                image = fft.centered_ifftn(data, shifts=(fft.IFFTSHIFT, fft.IFFTSHIFT))
                 dataSteps[step, :, :] = data[int(nPoints[2]/2), :, :]
                 imageSteps[step, :, :] = image[int(nPoints[2]/2), :, :]
 
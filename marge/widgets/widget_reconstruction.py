@@ -33,12 +33,16 @@ class ReconstructionTabWidget(QWidget):
         # Labels
         self.niter_label = QLabel('Number of iterations')
         self.lambda_label = QLabel('Lambda')
+        self.block_label = QLabel('Block size')
 
         # Text Fields
         self.niter_text_field = QLineEdit()
         self.niter_text_field.setText('1')
         self.lambda_text_field = QLineEdit()
         self.lambda_text_field.setText('1')
+        self.block_text_field = QLineEdit()
+        self.block_text_field.setText('1')
+        self.block_text_field.setStatusTip('Number of k-space samples processed together. 1 for ART, larger for SART')
 
         # Layouts
         self.order_layout = QHBoxLayout()
@@ -46,6 +50,8 @@ class ReconstructionTabWidget(QWidget):
         self.order_layout.addWidget(self.niter_text_field)
         self.order_layout.addWidget(self.lambda_label)
         self.order_layout.addWidget(self.lambda_text_field)
+        self.order_layout.addWidget(self.block_label)
+        self.order_layout.addWidget(self.block_text_field)
 
         self.art_layout = QVBoxLayout()
         self.art_layout.addLayout(self.order_layout)
@@ -54,6 +60,16 @@ class ReconstructionTabWidget(QWidget):
         self.art_group = QGroupBox('ART')
         self.art_group.setLayout(self.art_layout)
 
+        # NUFFT
+        self.nufft_button = QPushButton('Run NUFFT gridding')
+        self.nufft_button.setStatusTip('Kaiser-Bessel gridding with density compensation of non-Cartesian k-space')
+
+        self.nufft_layout = QVBoxLayout()
+        self.nufft_layout.addWidget(self.nufft_button)
+
+        self.nufft_group = QGroupBox('NUFFT')
+        self.nufft_group.setLayout(self.nufft_layout)
+
         # FFT
         self.ifft_button = QPushButton('k-space -> i-space')
         self.dfft_button = QPushButton('i-space -> k-space')
@@ -147,6 +163,7 @@ class ReconstructionTabWidget(QWidget):
         # Main layout
         self.reconstruction_layout = QVBoxLayout()
         self.reconstruction_layout.addWidget(self.art_group)
+        self.reconstruction_layout.addWidget(self.nufft_group)
         self.reconstruction_layout.addWidget(self.fft_group)
         self.reconstruction_layout.addWidget(self.pocs_group)
         self.reconstruction_layout.addWidget(snr_group)
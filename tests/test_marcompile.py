@@ -0,0 +1,385 @@
+"""
+Machine code of the vectorized dict2bin/cl2bin against the previous instruction loop, on random sequences for both
+gradient boards.
+"""
+
+import unittest
+import warnings
+
+import numpy as np
+
+import marge.configs.hw_config as hw
+from marge.marcos.marcos_client import experiment as exp
+from marge.marcos.marcos_client import marcompile as mc
+from marge.marcos.marcos_client.marcompile import col2buf, debug_print, grad_data_bufs, max_removed_instructions
+from marge.marcos.marcos_client.marmachine import *
+
+
+# Previous implementation of dict2bin and cl2bin, kept as the reference of the machine code
+
+def reference_dict2bin(sd, initial_bufs=np.zeros(MARGA_BUFS, dtype=np.uint16), latencies = np.zeros(MARGA_BUFS, dtype=np.int32)):
+    """sd: sequence dictionary, consisting of something in the form of:
+
+     {'tx0_i': ( np.array([100, 102, 304, 506]), np.array([1, 200, 65535, 20000]) ),
+      'fhdo_vx': ( np.array([3000, 4500, 5900, 7000]), np.array([1, 2, 55555, 33333]) ),
+      'fhdo_vy': ( np.array([10000, 12000, 14000, 16000]), np.array([1, 2, 55555, 33333]) ) }
+
+    etc. Same binary format as in the CSV file.
+
+    latencies: inherent buffer latencies to take into
+    account. Latencies are primarily relevant to the gradients, but
+    can be adjusted to suit various other external hardware effects
+    like slow RF amps, very long cables etc
+    """
+
+    col_arr = ['clock cycles', 'tx0_i', 'tx0_q', 'tx1_i', 'tx1_q', 'fhdo_vx', 'fhdo_vy', 'fhdo_vz', 'fhdo_vz2',
+               'ocra1_vx', 'ocra1_vy', 'ocra1_vz', 'ocra1_vz2', 'rx0_rate', 'rx1_rate',
+               'rx0_rate_valid', 'rx1_rate_valid', 'rx0_rst_n', 'rx1_rst_n', 'rx0_en', 'rx1_en',
+               'tx_gate', 'rx_gate', 'trig_out', 'leds',
+               'lo0_freq', 'lo1_freq', 'lo2_freq', 'lo0_rst', 'lo1_rst', 'lo2_rst',
+               'rx0_lo', 'rx1_lo', ] # TODO: these two rows aren't yet in the CSV and thus aren't tested by test_marga_model.py
+
+    changelist = []
+    changelist_grad = []
+
+    for k, vals in sd.items(): # iterate over dictionary keys
+        col_idx = col_arr.index(k)
+        changelist_grad_local = []
+        buf_idces, values, masks = col2buf(col_idx, vals[1]) # single element or array of values
+        t_corr = vals[0] - latencies[buf_idces[0]]
+        for bi, vv, m in zip(buf_idces, values, masks):
+            for t, v in zip(t_corr, vv):
+                change = t, bi, v, m
+                if bi in grad_data_bufs:
+                    changelist_grad_local.append(change)
+                else:
+                    changelist.append(change)
+
+        # needed to keep coupled LSB/MSB pairs together in case
+        # multiple events occur on different channels simultaneously
+        if len(changelist_grad_local) != 0:
+            changelist_grad_local.sort(key=lambda change: change[0])
+            changelist_grad += changelist_grad_local
+
+    return reference_cl2bin(changelist, changelist_grad, initial_bufs)
+
+def reference_cl2bin(changelist, changelist_grad,
+           initial_bufs=np.zeros(MARGA_BUFS, dtype=np.uint16)):
+
+    """Central compilation function; accept in two changelists,
+    changelist for all the direct-buffer outputs (TX, most configurable
+    parameters, etc) and the other, changelist_grad, for the outputs used
+    to control hardware with non-trivial internal timing behaviour
+    (currently only the gradient boards). Also accepts non-default initial
+    values to program the buffers to."""
+
+    # Process the grad changelist, depending on what GPA is being used etc
+    # Sort in pairs of changes, because otherwise channels can get mixed up
+    changelist_grad_paired = [ [k, m] for k, m in zip(changelist_grad[::2], changelist_grad[1::2]) ]
+    sortfn = lambda change: change[0]
+    # changelist_grad.sort(key=sortfn) # sort by time
+    sortfn_paired = lambda change: change[0][0]
+    changelist_grad_paired.sort(key=sortfn_paired) # sort by time
+    changelist_grad = [k for sl in changelist_grad_paired for k in sl] # https://stackabuse.com/python-how-to-flatten-list-of-lists/
+
+    t_last = [0, 0] # no updates have previously happened; [LSB, MSB]
+    spi_div = (initial_bufs[0] & 0xfc) >> 2
+    changelist_grad_shifted = []
+    num_chgs = [0, 0] # [LSB, MSB]
+    grad_vals = [initial_bufs[1], initial_bufs[2]] # [LSB, MSB] current output data
+    grad_vals_old = [0, 0] # [LSB, MSB] previous output data
+
+    for c in changelist_grad:
+        t = c[0]
+        debug_print("t: ", t, " t_last: ", t_last, "num_chgs: ", num_chgs, " c: ", c)
+        idx = c[1] - 1 # 0 for LSB, 1 for MSB
+        msb = idx == 1
+        data = c[2]
+        # if data == grad_vals[idx]: # no actual change to buffer output
+        #     continue # skip this change
+        # else:
+        #     grad_vals_old[idx] = grad_vals[idx]
+        #     grad_vals[idx] = data # update the last known buffer value
+
+        if t == t_last[idx]:
+            num_chgs[idx] += 1
+            # assume the changes in changelist_grad are paired with LSBs/MSBs matching each other's grad channels stored sequentially,
+            # and that for each event, the MSB update is first
+            if hw.grad_board == "ocra1": # simultaneous with another grad update
+                if msb:
+                    if num_chgs[1]: # MSB buffer and not the first grad event on this timestep
+                        # turn broadcast off if this isn't the first grad event on this timestep
+                        data = data & ~np.uint16(0x0100)
+                        # return LSB back to old values, since this one is now done in the past
+                        grad_vals[:] = grad_vals_old # revert the last known buffer values
+                # else:
+                #     if data == grad_vals[idx]: # no actual change to buffer output compared to earlier LSB at this timestep
+                #         continue # skip this change
+
+                # move non-broadcast events back in time, so that synchronisation will be done in ocra1_iface core
+                changelist_grad_shifted.append( (c[0]-num_chgs[idx], c[1], data, c[3]) )
+                num_chgs[idx] += 1
+            elif hw.grad_board == "gpa-fhdo":
+                # don't do anything; currently will cause an error
+                # later since multiple events can't happen at the same
+                # time for GPA-FHDO
+                changelist_grad_shifted.append(c)
+        else:
+            if t - t_last[idx] < 24 * (1 + spi_div) + 2: #
+                warnings.warn("Gradient updates are too frequent for selected SPI divider. Missed samples are likely!", MarGradWarning)
+
+            # if data == grad_vals[idx]: # no actual change to buffer output
+            #     continue # skip this change
+
+            t_last[idx] = t
+            grad_vals[idx] = data # update the last known buffer value
+            changelist_grad_shifted.append(c)
+            num_chgs = [0, 0]
+
+    changelist += changelist_grad_shifted
+    changelist.sort(key=sortfn) # sort by time
+
+    # Track removed instruction events, but only warn when the number exceeds a minimum
+    removed_instruction_warnings = []
+
+    # Process and combine the change list into discrete sets of operations at each time, i.e. an output list
+    def cl2ol(changelist):
+        current_bufs = initial_bufs.copy()
+        current_time = changelist[0][0]
+        unique_times = []
+        unique_changes = []
+        change_masks = np.zeros(MARGA_BUFS, dtype=np.uint16)
+        changed = np.zeros(MARGA_BUFS, dtype=bool)
+
+        def close_timestep(time):
+            ch_idces = np.where(changed)[0]
+            # buf_time_offsets = np.zeros(MARGA_BUFS, dtype=int32)
+            buf_time_offsets = 0
+            unique_changes.append( [time, ch_idces, current_bufs[ch_idces], buf_time_offsets] )
+            change_masks[:] = np.zeros(MARGA_BUFS, dtype=np.uint16)
+            changed[:] = np.zeros(MARGA_BUFS, dtype=bool)
+
+        for time, buf, val, mask in changelist:
+            if time != current_time:
+                close_timestep(current_time)
+                current_time = time
+            buf_diff = (current_bufs[buf] ^ val) & mask
+            assert buf_diff & change_masks[buf] == 0, "Tried to set a buffer to two values at once"
+            if buf_diff == 0:
+                if buf not in (1, 2):
+                    # gradient buffers will have unneeded instructions
+                    # all the time, so not worth warning the user for
+                    # those
+                    removed_instruction_warnings.append( "Instruction at tick {:d}, buffer {:d}, value 0x{:04x}, mask 0x{:04x} will have no effect. Skipping...".format(time, buf, val, mask) )
+                continue
+            val_masked = val & mask
+            old_val_unmasked = current_bufs[buf] & ~mask
+            new_val = old_val_unmasked | val_masked
+            change_masks[buf] |= mask
+            current_bufs[buf] = new_val
+            changed[buf] = True
+
+        close_timestep(current_time)
+
+        return unique_changes
+
+    changes = cl2ol(changelist)
+
+    # warn about all the removed instructions if there are more than a maximum number
+    if len(removed_instruction_warnings) > max_removed_instructions:
+        for riw in removed_instruction_warnings:
+            warnings.warn(riw, MarRemovedInstructionWarning)
+        warnings.warn("NOTE: Fewer than {:d} removed-instruction warnings will not be printed -- keep this in mind when searching for the root cause.".format(max_removed_instructions))
+
+    # Process time offsets
+    for ch, ch_prev in zip( reversed(changes[1:]), reversed(changes[:-1]) ):
+        # does the current timestep need to output more data than can
+        # fit into the time gap since the previous timestep?
+        timestep = np.int32(ch[0] - ch_prev[0])
+        timediff = np.int32(ch[1].size - timestep)
+        # if timestep < ch[1].size: # not enough time
+
+        if timediff > 0:
+            ch_prev[0] -= timediff # move prev. event into the past
+            ch_prev[3] = timediff # make prev. event's buffers output in its future
+
+    # convert to differential timesteps
+    last_time = 0
+    for ch in changes:
+        ch0 = ch[0]
+        ch[0] = ch0 - last_time
+        last_time = ch0
+
+    # Interpretation of each element of changes list:
+    # [time when all instructions for this change will have completed,
+    #  buffers that need to be changed,
+    #  values to set the buffers to,
+    #  the delay until the buffers will output their values]
+
+    ### Write out instructions
+
+    # Write out initial buffer values
+    bdata = []
+    addr = 0
+    states = initial_bufs
+    # reversed order, so that grad board is enabled last of all (to avoid spurious initial transfer)
+    for k, ib in enumerate(reversed(initial_bufs)):
+        bdata.append(instb(MARGA_BUFS-1-k, k, ib))
+
+    last_buf_time_left = np.zeros(MARGA_BUFS, dtype=np.int32)
+    buf_time_left = np.zeros(MARGA_BUFS, dtype=np.int32)
+    # buf_empty_time = np.zeros(MARGA_BUFS, dtype=np.int32)
+    debug_print("changes:")
+    for k in changes:
+        debug_print(k)
+
+    for event in changes:
+        b_instrs = event[1].size
+        dtime = event[0]
+
+        # soak up any extra time which is in excess of what the instructions need to execute synchronously
+        excess_dtime = dtime - b_instrs
+        excess_dtime_tmp = excess_dtime
+        while excess_dtime_tmp > 2: # delay of 3 or more cycles needed
+            wait_time = min(excess_dtime_tmp, COUNTER_MAX + 3) # delay for the time instruction
+            bdata.append(insta(IWAIT, wait_time - 3))
+            excess_dtime_tmp -= wait_time
+            debug_print("i wait ", wait_time - 3)
+        if excess_dtime_tmp: # final delay of 1 or 2 cycles
+            for k in range(dtime - b_instrs):
+                debug_print("i nop")
+                bdata.append(insta(INOP, 0))
+
+        # time left after delays from nops or waits
+        # dtime_eff could be increased later with a more advanced
+        # compiler, to make the buffers bear more of the internal
+        # delays
+        # dtime_eff = b_instrs
+
+        # count down the times until each channel buffer will be empty
+        buf_time_left -= excess_dtime
+        buf_time_left[buf_time_left < 0] = 0
+        this_time_offset = event[3]
+        debug_print("--- dtime {:2d}, this_time_offset: {:2d}, b_instrs: {:2d}, lbtl: ".format(dtime, this_time_offset, b_instrs), last_buf_time_left[5:9])
+        for m, (ind, dat) in enumerate(zip(event[1], event[2])):
+            execution_delay = b_instrs - m - 1 #+ time - 2
+            btli = buf_time_left[ind]
+            buf_empty = btli <= m
+            if buf_empty: # buffer empty for this instruction; need an appropriate delay only for sync
+                # (check against m since with successive cycles, remaining buffers will empty out)
+                extra_delay = execution_delay + this_time_offset
+                buf_time_left[ind] = this_time_offset + b_instrs
+            else:
+                # buffer already not empty on this cycle
+                extra_delay = this_time_offset - btli + b_instrs - 1
+                buf_time_left[ind] += extra_delay + 1
+
+            debug_print("bti={:d} btli={:d} m={:d} empty={:d} edel={:d} instb i {:d} del {:d} dat {:d}".format(
+                buf_time_left[ind], btli, m, buf_empty, execution_delay, ind, extra_delay, dat))
+            bdata.append(instb(ind, extra_delay, dat))
+
+        buf_time_left -= b_instrs # take into account execution time of this timestep
+
+    # Finish sequence
+    bdata.append(insta(IFINISH, 0))
+    return bdata
+
+
+class _Socket:
+    # Stand-in for the server socket, the sequences are only compiled
+    def close(self):
+        pass
+
+
+def random_flodict(rng, n_events):
+    # Random gradient waveforms on a common raster, with repeated values and simultaneous updates, plus RF pulses,
+    # gates and readout windows at random times
+    t_grad = 100 + np.cumsum(rng.choice([10.0, 10.0, 20.0, 300.0], n_events))
+    flodict = {}
+    for key in ('grad_vx', 'grad_vy', 'grad_vz'):
+        values = np.round(rng.uniform(-0.9, 0.9, n_events), 1)
+        values[rng.random(n_events) < 0.2] = 0
+        flodict[key] = (t_grad, values)
+    t_end = t_grad[-1]
+
+    n_pulses = max(n_events // 20, 1)
+    t_tx = np.sort(rng.choice(np.arange(110, t_end, 7.0), 2 * n_pulses, replace=False))
+    tx = rng.uniform(-1, 1, 2 * n_pulses) + 1j * rng.uniform(-1, 1, 2 * n_pulses)
+    tx[1::2] = 0
+    flodict['tx0'] = (t_tx, 0.9 * tx / np.max(np.abs(tx)))
+    flodict['tx_gate'] = (t_tx - 5, np.tile([1, 0], n_pulses))
+    t_rx = np.sort(rng.choice(np.arange(120, t_end, 13.0), 2 * n_pulses, replace=False))
+    flodict['rx0_en'] = (t_rx, np.tile([1, 0], n_pulses))
+    flodict['rx_gate'] = flodict['rx0_en']
+    return flodict
+
+
+class MarcompileTest(unittest.TestCase):
+
+    def setUp(self):
+        # The gradient board is set in hw_config when the hardware configuration is loaded
+        self.grad_board = getattr(hw, 'grad_board', None)
+        warnings.simplefilter('ignore', MarUserWarning)
+
+    def tearDown(self):
+        if self.grad_board is None:
+            del hw.grad_board
+        else:
+            hw.grad_board = self.grad_board
+        warnings.resetwarnings()
+
+    def compile(self, grad_board, flodict):
+        # Integer sequence dictionary, initial buffers and latencies that Experiment.compile sends to dict2bin
+        hw.grad_board = grad_board
+        expt = exp.Experiment(prev_socket=_Socket(), lo_freq=3.0, rx_t=3.125,
+                              gpa_fhdo_offset_time=1 / 0.2 / 3.1 if grad_board == 'gpa-fhdo' else 0)
+        expt.add_flodict(flodict)
+        expt.compile()
+        return expt._seq, expt.gradb.bin_config['initial_bufs'], expt.gradb.bin_config['latencies']
+
+    def check(self, grad_board, seed, n_events):
+        sd, initial_bufs, latencies = self.compile(grad_board, random_flodict(np.random.default_rng(seed), n_events))
+        expected = np.array(reference_dict2bin(sd, initial_bufs, latencies), dtype=np.uint32)
+        machine_code = mc.dict2bin(sd, initial_bufs, latencies)
+        np.testing.assert_array_equal(machine_code, expected)
+
+    def test_ocra1(self):
+        for seed in range(10):
+            with self.subTest(seed=seed):
+                self.check('ocra1', seed, 200)
+
+    def test_gpa_fhdo(self):
+        for seed in range(10):
+            with self.subTest(seed=seed):
+                self.check('gpa-fhdo', seed, 200)
+
+    def test_simultaneous_gradient_updates(self):
+        # Updates of every gradient channel at the same ticks, which the ocra1 path moves back in time
+        rng = np.random.default_rng(0)
+        t = np.cumsum(rng.choice([400, 500, 1000], 50))
+        for grad_board, prefix in (('ocra1', 'ocra1'), ('gpa-fhdo', 'fhdo')):
+            with self.subTest(grad_board=grad_board):
+                hw.grad_board = grad_board
+                sd = {'%s_%s' % (prefix, axis): (t, rng.integers(0, 1 << 16, t.size)) for axis in ('vx', 'vy', 'vz')}
+                sd['tx_gate'] = (t + 3, np.tile([1, 0], t.size // 2))
+                try:
+                    expected = np.array(reference_dict2bin(sd), dtype=np.uint32)
+                except AssertionError:
+                    # Simultaneous GPA-FHDO updates are rejected
+                    self.assertRaises(AssertionError, mc.dict2bin, sd)
+                    continue
+                np.testing.assert_array_equal(mc.dict2bin(sd), expected)
+
+    def test_long_waits(self):
+        # Gaps longer than the maximum wait of a single instruction
+        t = np.array([100, 100 + COUNTER_MAX + 10, 3 * COUNTER_MAX, 3 * COUNTER_MAX + 1, 3 * COUNTER_MAX + 4])
+        sd = {'tx0_i': (t, np.array([1, 2, 3, 4, 5])), 'leds': (t, np.array([1, 0, 1, 0, 1]))}
+        for grad_board in ('ocra1', 'gpa-fhdo'):
+            with self.subTest(grad_board=grad_board):
+                hw.grad_board = grad_board
+                expected = np.array(reference_dict2bin(sd), dtype=np.uint32)
+                np.testing.assert_array_equal(mc.dict2bin(sd), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
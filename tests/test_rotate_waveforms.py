@@ -0,0 +1,177 @@
+"""
+Vectorized MRIBLANKSEQ.rotate_waveforms against the previous per-event loop.
+"""
+
+import unittest
+
+import numpy as np
+
+import marge.configs.hw_config as hw
+from marge.seq.mriBlankSeq import MRIBLANKSEQ
+
+
+# Previous implementation of rotate_waveforms, kept as the reference, with the rotation matrix as an argument
+
+def reference_rotate_waveforms(waveforms, rot):
+    # Get the waveforms
+    gx = waveforms['grad_vx']
+    gy = waveforms['grad_vy']
+    gz = waveforms['grad_vz']
+    is_x = np.zeros_like(gx[0], dtype=int)
+    is_y = np.zeros_like(gy[0], dtype=int) + 1
+    is_z = np.zeros_like(gz[0], dtype=int) + 2
+
+    # Concatenate arrays
+    time = np.concatenate((gx[0], gy[0], gz[0]))
+    ampl = np.concatenate((gx[1] * hw.gFactor[0], gy[1] * hw.gFactor[1], gz[1] * hw.gFactor[2]))  # mT/m
+    is_a = np.concatenate((is_x, is_y, is_z))
+
+    # Sort arrays
+    idx = np.argsort(time)
+    time = time[idx]
+    ampl = ampl[idx]
+    is_a = is_a[idx]
+
+    # Define new gradient waveforms
+    gx_new = [[], []]
+    gy_new = [[], []]
+    gz_new = [[], []]
+    g_new = [[], [], []]
+
+    # Populate new waveform
+    w = []
+    t = []
+    step = 0
+    n_steps = 0
+    while step < len(time):
+        g = [0., 0., 0.]
+
+        # Add time
+        gx_new[0].append(time[step])
+        gy_new[0].append(time[step])
+        gz_new[0].append(time[step])
+
+        next = True
+        while next:
+            try:
+                # Get amplitude
+                g_new[is_a[step]].append(ampl[step])
+                if time[step + 1] != time[step]:
+                    if step == 0:
+                        if len(g_new[0]) == 0:
+                            g_new[0].append(0.)
+                        if len(g_new[0]) == 0:
+                            g_new[1].append(0.)
+                        if len(g_new[0]) == 0:
+                            g_new[2].append(0.)
+                    elif step > 0:
+                        if len(g_new[0]) == n_steps:
+                            g_new[0].append(g_new[0][-1])
+                        if len(g_new[1]) == n_steps:
+                            g_new[1].append(g_new[1][-1])
+                        if len(g_new[2]) == n_steps:
+                            g_new[2].append(g_new[2][-1])
+                    n_steps += 1
+                    next = False
+                    gx_new[1].append(g_new[0][-1])
+                    gy_new[1].append(g_new[1][-1])
+                    gz_new[1].append(g_new[2][-1])
+            except:
+                if step == 0:
+                    if len(g_new[0]) == 0:
+                        g_new[0].append(0.)
+                    if len(g_new[0]) == 0:
+                        g_new[1].append(0.)
+                    if len(g_new[0]) == 0:
+                        g_new[2].append(0.)
+                elif step > 0:
+                    if len(g_new[0]) == n_steps:
+                        g_new[0].append(g_new[0][-1])
+                    if len(g_new[1]) == n_steps:
+                        g_new[1].append(g_new[1][-1])
+                    if len(g_new[2]) == n_steps:
+                        g_new[2].append(g_new[2][-1])
+                n_steps += 1
+                next = False
+                gx_new[1].append(g_new[0][-1])
+                gy_new[1].append(g_new[1][-1])
+                gz_new[1].append(g_new[2][-1])
+            step += 1
+    g_new = np.array(g_new)
+
+    # Rotate the waveforms
+    for step in range(np.size(g_new, axis=1)):
+        g_new[:, step] = np.dot(rot, g_new[:, step])
+    gx_new[1] = list(g_new[0, :] / hw.gFactor[0])
+    gy_new[1] = list(g_new[1, :] / hw.gFactor[1])
+    gz_new[1] = list(g_new[2, :] / hw.gFactor[2])
+
+    waveforms['grad_vx'] = gx_new
+    waveforms['grad_vy'] = gy_new
+    waveforms['grad_vz'] = gz_new
+
+    return waveforms
+
+
+def random_waveforms(rng, n_events):
+    # Gradient waveforms starting at time 0, as the PyPulseq interpreter returns them, with some time points shared
+    # between axes
+    waveforms = {}
+    shared = np.round(rng.uniform(1, 1e6, n_events // 4))
+    for key in ('grad_vx', 'grad_vy', 'grad_vz'):
+        times = np.round(rng.uniform(1, 1e6, n_events))
+        times = np.unique(np.concatenate([[0.], times, rng.choice(shared, n_events // 8)]))
+        values = rng.uniform(-1, 1, times.size)
+        values[rng.random(times.size) < 0.2] = 0
+        waveforms[key] = [times, values]
+    return waveforms
+
+
+class RotateWaveformsTest(unittest.TestCase):
+
+    def sequence(self, rotations):
+        sequence = MRIBLANKSEQ.__new__(MRIBLANKSEQ)
+        sequence.plotSeq = False
+        sequence.rotations = rotations
+        return sequence
+
+    def check(self, rotations, waveforms):
+        sequence = self.sequence(rotations)
+        copy = {key: [times.copy(), values.copy()] for key, (times, values) in waveforms.items()}
+        expected = reference_rotate_waveforms(copy, sequence.getRotationMatrix())
+        rotated = sequence.rotate_waveforms(waveforms)
+        for key in ('grad_vx', 'grad_vy', 'grad_vz'):
+            np.testing.assert_array_equal(rotated[key][0], np.array(expected[key][0]))
+            np.testing.assert_allclose(rotated[key][1], np.array(expected[key][1]), rtol=1e-12, atol=1e-15)
+
+    def test_oblique(self):
+        rng = np.random.default_rng(0)
+        for n_events in (1, 10, 1000):
+            with self.subTest(n_events=n_events):
+                axis = rng.standard_normal(3)
+                rotation = list(axis / np.linalg.norm(axis)) + [rng.uniform(0, np.pi)]
+                self.check([rotation], random_waveforms(rng, n_events))
+
+    def test_identity(self):
+        self.check([[1, 0, 0, 0]], random_waveforms(np.random.default_rng(1), 500))
+
+    def test_common_times(self):
+        # The three axes updated at the same times
+        rng = np.random.default_rng(2)
+        times = np.concatenate([[0.], np.cumsum(rng.choice([10., 20.], 200))])
+        waveforms = {key: [times.copy(), rng.uniform(-1, 1, times.size)] for key in ('grad_vx', 'grad_vy', 'grad_vz')}
+        self.check([[0, 0, 1, np.pi / 2]], waveforms)
+
+    def test_plot_pops_rotation(self):
+        sequence = self.sequence([[1, 0, 0, 0], [0, 1, 0, 0.3]])
+        sequence.plotSeq = True
+        sequence.fovs = [[1, 1, 1], [2, 2, 2]]
+        sequence.dfovs = [[0, 0, 0], [1, 1, 1]]
+        sequence.rotate_waveforms(random_waveforms(np.random.default_rng(3), 10))
+        self.assertEqual(len(sequence.rotations), 1)
+        self.assertEqual(len(sequence.fovs), 1)
+        self.assertEqual(len(sequence.dfovs), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+"""
+Sequence manifest of marge/seq: modules that cannot be imported are recorded and later starts only scan what changed.
+"""
+
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from marge.seq import sequences
+
+
+class SequenceManifestTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.manifest_path = os.path.join(self.folder.name, 'cache', 'sequences.json')
+        self.files = {'fid.py': 1.0, 'spds.py': 2.0}
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def discover(self, scanned):
+        # Run discover_sequences on self.files, with the import of the modules replaced by the given result
+        with mock.patch.object(sequences, '_source_files', return_value=dict(self.files)), \
+                mock.patch.object(sequences, 'scan_sequences', return_value=scanned) as scan:
+            return sequences.discover_sequences(self.manifest_path), scan
+
+    def test_inspect_source(self):
+        self.assertEqual(sequences.inspect_sequences(['spds.py']), [['SPDS', 'marge.seq.spds', 'spds']])
+        self.assertEqual(sequences.inspect_sequences(['fid.py']), [])
+
+    def test_failed_modules_recorded(self):
+        fid = ['FID', 'marge.seq.fid', 'FID']
+        spds = ['SPDS', 'marge.seq.spds', 'spds']
+        entries, scan = self.discover(([fid], ['spds']))
+        scan.assert_called_once_with(['fid.py', 'spds.py'])
+        self.assertEqual(entries, [fid, spds])
+        with open(self.manifest_path) as manifest:
+            manifest = json.load(manifest)
+        self.assertEqual(manifest['failed'], {'spds.py': 2.0})
+
+        # Nothing changed: no module is imported
+        entries, scan = self.discover(([], []))
+        scan.assert_not_called()
+        self.assertEqual(entries, [fid, spds])
+
+        # Only the modified module is scanned again
+        self.files['spds.py'] = 3.0
+        entries, scan = self.discover(([spds], []))
+        scan.assert_called_once_with(['spds.py'])
+        self.assertEqual(entries, [fid, spds])
+        with open(self.manifest_path) as manifest:
+            self.assertEqual(json.load(manifest)['failed'], {})
+
+        # Removed modules drop their sequences
+        del self.files['fid.py']
+        entries, scan = self.discover(([], []))
+        scan.assert_called_once_with([])
+        self.assertEqual(entries, [spds])
+
+
+if __name__ == '__main__':
+    unittest.main()
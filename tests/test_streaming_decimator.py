@@ -0,0 +1,68 @@
+"""
+Streaming decimation of chunked acquisitions against decimate() on the full oversampled data.
+"""
+
+import unittest
+
+import numpy as np
+
+from marge.marge_utils import utils
+
+
+class StreamingDecimatorTest(unittest.TestCase):
+
+    n_adc = 12
+    n_points = 150  # Oversampled points per ADC window
+    add_rd_points = 5
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        size = self.n_adc * self.n_points
+        self.data_over = rng.standard_normal(size) + 1j * rng.standard_normal(size)
+
+    def stream(self, chunk_sizes, **kwargs):
+        # Push the oversampled data in chunks of the given sizes, cycling through them
+        decimator = utils.StreamingDecimator(self.n_points, add_rd_points=self.add_rd_points, **kwargs)
+        start = 0
+        k = 0
+        while start < self.data_over.size:
+            stop = start + chunk_sizes[k % len(chunk_sizes)]
+            decimator.push(self.data_over[start:stop])
+            start = stop
+            k += 1
+        return decimator.finish()
+
+    def reference(self, **kwargs):
+        return utils.decimate(self.data_over.copy(), self.n_adc, add_rd_points=self.add_rd_points, **kwargs)
+
+    def check(self, **kwargs):
+        expected = self.reference(**kwargs)
+        for chunk_sizes in ([self.n_points], [self.n_points * 3], [7], [1, 200, 33], [self.data_over.size]):
+            with self.subTest(chunk_sizes=chunk_sizes):
+                np.testing.assert_array_equal(self.stream(chunk_sizes, **kwargs), expected)
+
+    def test_petra(self):
+        self.check(option='PETRA', remove=False, oversampling_factor=5, decimation_factor=5)
+
+    def test_normal(self):
+        self.check(option='Normal', remove=False, oversampling_factor=5, decimation_factor=5)
+
+    def test_remove_points(self):
+        for option in ('PETRA', 'Normal'):
+            with self.subTest(option=option):
+                self.check(option=option, remove=True, oversampling_factor=5, decimation_factor=5)
+
+    def test_frequency_domain_downsampling(self):
+        # FIR decimation by 5 followed by a factor 2 in the frequency domain
+        for option in ('PETRA', 'Normal'):
+            with self.subTest(option=option):
+                self.check(option=option, remove=False, oversampling_factor=10, decimation_factor=5)
+
+    def test_per_window(self):
+        for option in ('PETRA', 'Normal'):
+            with self.subTest(option=option):
+                self.check(option=option, remove=False, oversampling_factor=5, decimation_factor=5, per_window=True)
+
+
+if __name__ == '__main__':
+    unittest.main()